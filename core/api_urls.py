@@ -70,6 +70,7 @@ urlpatterns = [
     path('gps/status/<int:trip_id>/', api_views.GPSTripStatusView.as_view(), name='api-gps-status'),
     path('gps/finalize/<int:trip_id>/', api_views.GPSFinalizeView.as_view(), name='api-gps-finalize'),
     path('gps/route/<int:trip_id>/', api_views.GPSTripRouteView.as_view(), name='api-gps-route'),
+    path('gps/cache-stats/', api_views.GPSCacheStatsView.as_view(), name='api-gps-cache-stats'),
     
     # ===== P2P Integration Endpoints =====
     # For external P2P (Procure to Pay) system to fetch SOR data for SIR creation
@@ -9,13 +9,15 @@ from django.db.models import Sum, Count, F
 from datetime import timedelta
 from decimal import Decimal
 import logging
+import math
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 from vehicles.models import Vehicle, VehicleType
 from trips.models import Trip
-from trips.gps_models import TripLocation, GPSTrackingSession
+from trips.gps_models import TripLocation, GPSTrackingSession, TripLivePosition
+from geolocation.geofence import safe_process_positions
 from maintenance.models import Maintenance, MaintenanceType, MaintenanceProvider
 from fuel.models import FuelTransaction, FuelStation
 from documents.models import Document, DocumentType
@@ -701,6 +703,10 @@ class EndTripView(APIView):
             trip.end_odometer_image = serializer.validated_data['end_odometer_image']
         
         trip.save()
+
+        # Close GPS tracking and precompute the route; apps that never call
+        # the GPS finalize endpoint would otherwise leave it open.
+        finalize_trip_route(trip)
         
         # Update SOR status if this trip is linked to a SOR
         from sor.models import SOR
@@ -1216,28 +1222,19 @@ class SORNotificationMarkAllReadView(APIView):
 # GPS Tracking API Views for Mobile App
 # ============================================
 
-# Dedup thresholds: skip a new GPS point if the last point for the same
-# trip is closer than MIN_DISTANCE_M and newer than MIN_INTERVAL_S. Cuts
-# `trips_triplocation` row growth dramatically without losing trip detail.
-GPS_MIN_DISTANCE_M = 10.0
-GPS_MIN_INTERVAL_S = 5.0
-
-
-def _is_duplicate_gps_point(trip, latitude, longitude, point_timestamp):
-    """Return True if a near-identical recent point already exists for the trip."""
-    last = TripLocation.objects.filter(trip=trip).order_by('-timestamp').first()
-    if not last:
-        return False
-    try:
-        gap = (point_timestamp - last.timestamp).total_seconds()
-    except Exception:
-        return False
-    if gap < 0 or gap >= GPS_MIN_INTERVAL_S:
-        return False
-    distance_km = TripLocation.calculate_distance(
-        last.latitude, last.longitude, latitude, longitude
-    )
-    return (distance_km * 1000.0) < GPS_MIN_DISTANCE_M
+# Dedup thresholds are shared with the batch ingest path.
+from trips.gps_ingest import (
+    GPS_GAP_SECONDS, GPS_VALID_ACCURACY_M, ingest_gps_batch, is_near_duplicate_point,
+)
+from trips.gps_cache import forget_last_point, get_last_point, remember_last_point, last_point_cache_stats
+from core import geo, live_feed
+from trips import route_formats
+from trips.route_artifacts import (
+    artifact_rows, build_route_artifact, finalize_trip_route, get_route_artifact, invalidate_route_artifact,
+    load_route_rows, route_is_final,
+)
+from django.http import HttpResponse
+from rest_framework.negotiation import DefaultContentNegotiation
 
 
 class GPSRecordLocationView(APIView):
@@ -1276,8 +1273,13 @@ class GPSRecordLocationView(APIView):
         lat_dec = Decimal(str(latitude))
         lon_dec = Decimal(str(longitude))
 
+        # Previous point comes from the per-trip cache, so dedupe and gap
+        # detection need no SELECT in the steady state.
+        last_point = get_last_point(trip.id)
+        new_point = {'latitude': lat_dec, 'longitude': lon_dec, 'timestamp': now_ts}
+
         # Skip near-duplicate points to keep trips_triplocation small.
-        if _is_duplicate_gps_point(trip, lat_dec, lon_dec, now_ts):
+        if last_point and is_near_duplicate_point(last_point, new_point):
             return Response({
                 'success': True,
                 'skipped': True,
@@ -1296,25 +1298,31 @@ class GPSRecordLocationView(APIView):
             battery_level=int(request.data.get('battery_level')) if request.data.get('battery_level') else None,
             timestamp=now_ts
         )
+        remember_last_point(trip.id, lat_dec, lon_dec, now_ts)
+        TripLivePosition.record(
+            trip.id, lat_dec, lon_dec, now_ts, location.speed, location.accuracy, location.battery_level,
+        )
+        live_feed.publish('trips', [trip.id])
+        safe_process_positions([(trip.vehicle_id, lat_dec, lon_dec, now_ts, trip.id)], 'trip')
         
         # Update session statistics
-        gps_session.total_points += 1
-        if location.accuracy < 50:  # Consider points with accuracy < 50m as valid
-            gps_session.valid_points += 1
+        valid_points = 1 if location.accuracy < GPS_VALID_ACCURACY_M else 0  # Consider points with accuracy < 50m as valid
+        gaps_detected = longest_gap = 0
         
         # Check for gaps (if last point was more than 60 seconds ago)
-        last_location = TripLocation.objects.filter(
-            trip=trip
-        ).exclude(id=location.id).order_by('-timestamp').first()
-        
-        if last_location:
-            gap_seconds = (location.timestamp - last_location.timestamp).total_seconds()
-            if gap_seconds > 60:  # More than 1 minute gap
-                gps_session.gaps_detected += 1
-                if gap_seconds > gps_session.longest_gap_seconds:
-                    gps_session.longest_gap_seconds = int(gap_seconds)
-        
-        gps_session.save()
+        if last_point:
+            gap_seconds = (location.timestamp - last_point['timestamp']).total_seconds()
+            if gap_seconds > GPS_GAP_SECONDS:  # More than 1 minute gap
+                gaps_detected = 1
+                longest_gap = int(gap_seconds)
+        
+        gps_session.add_points(
+            1, valid_points, gaps_detected, longest_gap,
+            GPSTrackingSession.hop_distance(last_point, lat_dec, lon_dec),
+        )
+        if route_is_final(trip, gps_session):
+            # Tracking was already finalized or the trip ended; the precomputed route is stale.
+            invalidate_route_artifact(trip.id)
         
         return Response({
             'success': True,
@@ -1341,6 +1349,9 @@ class GPSBatchRecordView(APIView):
         if not locations:
             return Response({'error': 'locations array is required'}, status=status.HTTP_400_BAD_REQUEST)
         
+        if not isinstance(locations, list):
+            return Response({'error': 'locations must be an array'}, status=status.HTTP_400_BAD_REQUEST)
+        
         # Verify trip exists and belongs to current user
         try:
             trip = Trip.objects.get(id=trip_id, driver=request.user)
@@ -1353,81 +1364,31 @@ class GPSBatchRecordView(APIView):
             defaults={'status': 'active'}
         )
         
-        saved_count = 0
-        skipped_count = 0
-        # Track last accepted point in this batch so we also dedupe within the
-        # incoming list (mobile may buffer many near-identical pings while idle).
-        last_point = TripLocation.objects.filter(trip=trip).order_by('-timestamp').first()
-        last_lat = last_point.latitude if last_point else None
-        last_lon = last_point.longitude if last_point else None
-        last_ts = last_point.timestamp if last_point else None
+        result = ingest_gps_batch(trip, gps_session, locations)
 
-        for loc_data in locations:
-            try:
-                latitude = loc_data.get('latitude')
-                longitude = loc_data.get('longitude')
-                
-                if not latitude or not longitude:
-                    continue
-                
-                # Use client-provided timestamp if available, otherwise fallback to server time
-                client_timestamp = loc_data.get('timestamp')
-                if client_timestamp:
-                    try:
-                        if isinstance(client_timestamp, (int, float)):
-                            point_timestamp = datetime.fromtimestamp(client_timestamp / 1000, tz=timezone.utc)
-                        else:
-                            point_timestamp = timezone.datetime.fromisoformat(str(client_timestamp))
-                    except (ValueError, TypeError, OSError):
-                        point_timestamp = timezone.now()
-                else:
-                    point_timestamp = timezone.now()
-
-                lat_dec = Decimal(str(latitude))
-                lon_dec = Decimal(str(longitude))
-
-                # Dedupe vs last accepted point (DB or earlier in this batch).
-                if last_ts is not None:
-                    try:
-                        gap = (point_timestamp - last_ts).total_seconds()
-                    except Exception:
-                        gap = GPS_MIN_INTERVAL_S  # treat as keep
-                    if 0 <= gap < GPS_MIN_INTERVAL_S:
-                        dist_m = TripLocation.calculate_distance(
-                            last_lat, last_lon, lat_dec, lon_dec
-                        ) * 1000.0
-                        if dist_m < GPS_MIN_DISTANCE_M:
-                            skipped_count += 1
-                            continue
-
-                TripLocation.objects.create(
-                    trip=trip,
-                    latitude=lat_dec,
-                    longitude=lon_dec,
-                    accuracy=float(loc_data.get('accuracy', 0)),
-                    speed=float(loc_data.get('speed')) if loc_data.get('speed') else None,
-                    altitude=float(loc_data.get('altitude')) if loc_data.get('altitude') else None,
-                    heading=float(loc_data.get('heading')) if loc_data.get('heading') else None,
-                    battery_level=int(loc_data.get('battery_level')) if loc_data.get('battery_level') else None,
-                    timestamp=point_timestamp
-                )
-                saved_count += 1
-                gps_session.total_points += 1
-                last_lat, last_lon, last_ts = lat_dec, lon_dec, point_timestamp
-            except Exception as e:
-                logger.warning(f"GPS batch: failed to save point for trip {trip_id}: {e}", exc_info=True)
-                continue
-        
-        gps_session.save()
-        
         return Response({
             'success': True,
-            'saved_count': saved_count,
-            'skipped_count': skipped_count,
-            'total_points': gps_session.total_points,
+            'saved_count': result['saved_count'],
+            'skipped_count': result['skipped_count'],
+            'rejected_count': len(result['rejected']),
+            'rejected': result['rejected'],
+            'total_points': result['total_points'],
         })
 
 
+class GPSCacheStatsView(APIView):
+    """
+    Hit/miss counters of the per-trip last-point cache used by GPS ingest.
+    Accessible by: admin/manager/vehicle_manager
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.user_type not in ['admin', 'manager', 'vehicle_manager']:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(last_point_cache_stats())
+
+
 class GPSTripStatusView(APIView):
     """
     Get GPS tracking status for a trip.
@@ -1453,6 +1414,7 @@ class GPSTripStatusView(APIView):
                     'valid_points': session.valid_points,
                     'gaps_detected': session.gaps_detected,
                     'gps_distance': float(session.gps_distance) if session.gps_distance else None,
+                    'running_distance_km': round(session.running_distance_km, 2),
                 },
                 'recent_locations': [
                     {
@@ -1490,8 +1452,8 @@ class GPSFinalizeView(APIView):
         except GPSTrackingSession.DoesNotExist:
             return Response({'error': 'No GPS session found for this trip'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Calculate GPS distance
-        gps_distance = session.calculate_gps_distance()
+        # GPS distance comes from the running odometer (O(1))
+        gps_distance = session.current_gps_distance()
         session.gps_distance = gps_distance
         
         # Get odometer distance
@@ -1512,6 +1474,13 @@ class GPSFinalizeView(APIView):
         session.status = 'completed'
         session.ended_at = timezone.now()
         session.save()
+        forget_last_point(trip.id)  # No more pings to dedupe
+        
+        # The route is final now; precompute what the map views need.
+        try:
+            build_route_artifact(trip)
+        except Exception:
+            logger.exception("Failed to build route artifact for trip %s", trip.id)
         
         return Response({
             'success': True,
@@ -1522,30 +1491,93 @@ class GPSFinalizeView(APIView):
         })
 
 
+class RouteContentNegotiation(DefaultContentNegotiation):
+    """``?format=`` picks the route encoding on GPSTripRouteView, not a DRF renderer."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        if 'format' in request.query_params:
+            format_suffix = 'json'
+        return super().select_renderer(request, renderers, format_suffix)
+
+
 class GPSTripRouteView(APIView):
     """
     Get all GPS locations for a trip to display on a map.
     Returns the full route with coordinates.
     Accessible by: trip driver OR admin/manager/vehicle_manager
+
+    Optional query params:
+        format    - json (default, one object per point), polyline (Google
+                    encoded), columnar (delta-encoded JSON arrays), binary
+                    (packed little-endian arrays) or msgpack
+        zoom      - map zoom level (0-22); simplify to ~1 screen pixel
+        tolerance - explicit simplification tolerance in metres
+        simplify  - 'rdp' (default) or 'visvalingam'
+
+    Completed/cancelled trips are read from their TripRouteArtifact and
+    carry an ETag; If-None-Match revalidation costs one query.
     """
     permission_classes = [IsAuthenticated]
+    content_negotiation_class = RouteContentNegotiation
     
     def get(self, request, trip_id):
         try:
-            trip = Trip.objects.get(id=trip_id)
+            trip = Trip.objects.select_related('gps_session', 'route_artifact').get(id=trip_id)
             # Check permission: must be driver OR management
             allowed_types = ['admin', 'manager', 'vehicle_manager']
-            if trip.driver != request.user and request.user.user_type not in allowed_types:
+            if trip.driver_id != request.user.id and request.user.user_type not in allowed_types:
                 return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         except Trip.DoesNotExist:
             return Response({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Get all locations ordered by timestamp (values_list for memory efficiency)
-        locations = TripLocation.objects.filter(trip=trip).order_by('timestamp').only(
-            'latitude', 'longitude', 'accuracy', 'speed', 'timestamp'
-        )
+        route_format = request.query_params.get('format', 'json')
+        if route_format not in route_formats.ROUTE_FORMATS:
+            return Response(
+                {'error': f"format must be one of: {', '.join(route_formats.ROUTE_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if route_format == 'msgpack' and not route_formats.MSGPACK_AVAILABLE:
+            return Response({'error': 'msgpack format is not available'}, status=status.HTTP_406_NOT_ACCEPTABLE)
         
-        if not locations.exists():
+        algorithm = request.query_params.get('simplify', 'rdp')
+        if algorithm not in geo.SIMPLIFIERS:
+            return Response(
+                {'error': f"simplify must be one of: {', '.join(sorted(geo.SIMPLIFIERS))}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            zoom = request.query_params.get('zoom')
+            zoom = float(zoom) if zoom not in (None, '') else None
+            tolerance_m = request.query_params.get('tolerance')
+            tolerance_m = float(tolerance_m) if tolerance_m not in (None, '') else None
+            if any(value is not None and not math.isfinite(value) for value in (zoom, tolerance_m)):
+                raise ValueError("nan/inf")
+            if tolerance_m is not None and tolerance_m < 0:
+                raise ValueError("negative tolerance")
+            zoom = min(max(zoom, 0), 22) if zoom is not None else None
+        except ValueError:
+            return Response(
+                {'error': 'zoom and tolerance must be numbers (tolerance not negative)'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        
+        # Finished trips are served from their precomputed route artifact (a
+        # single row); its version lets clients revalidate without any reads.
+        artifact = get_route_artifact(trip)
+        etag = None
+        if artifact is not None:
+            etag = route_formats.route_etag(
+                trip, artifact.point_count, artifact.built_at.isoformat(),
+                route_format, algorithm, zoom, tolerance_m,
+            )
+            if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+                return self._with_cache_headers(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+            rows = artifact_rows(artifact)
+        else:
+            # One pass over plain tuples (values_list for memory efficiency)
+            rows = load_route_rows(trip.id)
+        
+        if not rows:
             return Response({
                 'has_route': False,
                 'message': 'No GPS data available for this trip',
@@ -1560,40 +1592,41 @@ class GPSTripRouteView(APIView):
         
         # Get GPS session for statistics
         try:
-            session = GPSTrackingSession.objects.get(trip=trip)
+            session = trip.gps_session
             gps_distance = float(session.gps_distance) if session.gps_distance else None
             total_points = session.total_points
         except GPSTrackingSession.DoesNotExist:
             gps_distance = None
-            total_points = locations.count()
+            total_points = len(rows)
         
-        # Build route data
-        route = [
-            {
-                'latitude': float(loc.latitude),
-                'longitude': float(loc.longitude),
-                'accuracy': loc.accuracy,
-                'speed': loc.speed,
-                'timestamp': loc.timestamp.isoformat(),
-            }
-            for loc in locations
-        ]
+        lats = geo.as_float_array([row[0] for row in rows])
+        lons = geo.as_float_array([row[1] for row in rows])
+        bbox = geo.bounding_box(lats, lons)
         
-        # Calculate bounding box for map display
-        lats = [loc.latitude for loc in locations]
-        lons = [loc.longitude for loc in locations]
+        if tolerance_m is None and zoom is not None:
+            tolerance_m = geo.tolerance_for_zoom(zoom, (bbox['min_lat'] + bbox['max_lat']) / 2)
+        if tolerance_m:
+            keep = geo.SIMPLIFIERS[algorithm](lats, lons, tolerance_m)
+            rows = [row for row, kept in zip(rows, keep) if kept]
         
-        return Response({
+        if route_format == 'binary':
+            response = HttpResponse(
+                route_formats.encode_binary(rows), content_type=route_formats.BINARY_CONTENT_TYPE,
+            )
+            response['X-Total-Points'] = str(total_points)
+            return self._with_cache_headers(response, etag)
+        
+        data = {
             'has_route': True,
-            'route': route,
+            'format': route_format,
             'total_points': total_points,
+            'returned_points': len(rows),
+            'simplified': {
+                'algorithm': algorithm,
+                'tolerance_m': round(tolerance_m, 2),
+            } if tolerance_m else None,
             'gps_distance': gps_distance,
-            'bounding_box': {
-                'min_lat': float(min(lats)),
-                'max_lat': float(max(lats)),
-                'min_lon': float(min(lons)),
-                'max_lon': float(max(lons)),
-            },
+            'bounding_box': bbox,
             'trip_info': {
                 'id': trip.id,
                 'origin': trip.origin,
@@ -1602,7 +1635,42 @@ class GPSTripRouteView(APIView):
                 'start_time': trip.start_time.isoformat() if trip.start_time else None,
                 'end_time': trip.end_time.isoformat() if trip.end_time else None,
             }
-        })
+        }
+        
+        if route_format == 'polyline':
+            data['polyline'] = route_formats.encode_polyline_rows(rows)
+            data['precision'] = 5
+        elif route_format in ('columnar', 'msgpack'):
+            data['route'] = route_formats.encode_columnar(rows)
+        else:
+            data['route'] = [
+                {
+                    'latitude': float(lat),
+                    'longitude': float(lon),
+                    'accuracy': accuracy,
+                    'speed': speed,
+                    'timestamp': ts.isoformat(),
+                }
+                for lat, lon, accuracy, speed, ts in rows
+            ]
+        
+        if route_format == 'msgpack':
+            response = HttpResponse(
+                route_formats.encode_msgpack(data), content_type=route_formats.MSGPACK_CONTENT_TYPE,
+            )
+            return self._with_cache_headers(response, etag)
+        
+        return self._with_cache_headers(Response(data), etag)
+    
+    @staticmethod
+    def _with_cache_headers(response, etag):
+        if etag:
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, max-age=86400'
+        else:
+            # Ongoing trips keep growing.
+            response['Cache-Control'] = 'no-cache'
+        return response
 
 
 # ==================== P2P Integration APIs ====================
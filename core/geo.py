@@ -0,0 +1,350 @@
+"""
+Vectorised geodesy helpers shared by the GPS/tracking code.
+
+All functions take NumPy arrays (or anything ``np.asarray`` accepts, such
+as the tuples returned by ``values_list``) of decimal degrees and work on
+whole tracks at once instead of looping point by point in Python.
+Distances use the haversine formula on a spherical Earth, matching the
+historic ``TripLocation.calculate_distance``.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def as_float_array(values):
+    """Convert a sequence (Decimals, floats, ...) to a float64 array."""
+    return np.asarray(values, dtype=np.float64)
+
+
+def track_arrays(queryset, *extra_fields):
+    """
+    Pull ``latitude``/``longitude`` (plus ``extra_fields``) from a queryset
+    with ``values_list`` and return them as column arrays.
+
+    Returns ``(lats, lons, *extras)``; extras keep their native dtype
+    (e.g. datetimes come back as an object array).
+    """
+    rows = list(queryset.values_list('latitude', 'longitude', *extra_fields))
+    if not rows:
+        empty = np.empty(0, dtype=np.float64)
+        return (empty, empty) + tuple(np.empty(0, dtype=object) for _ in extra_fields)
+    columns = list(zip(*rows))
+    lats = as_float_array(columns[0])
+    lons = as_float_array(columns[1])
+    extras = tuple(np.asarray(col, dtype=object) for col in columns[2:])
+    return (lats, lons) + extras
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in km between point(s) 1 and point(s) 2.
+    Accepts scalars or broadcastable arrays.
+    """
+    lat1 = np.radians(as_float_array(lat1))
+    lon1 = np.radians(as_float_array(lon1))
+    lat2 = np.radians(as_float_array(lat2))
+    lon2 = np.radians(as_float_array(lon2))
+
+    a = (
+        np.sin((lat2 - lat1) / 2.0) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    )
+    # Clip guards against tiny floating point excursions above 1.
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def segment_distances_km(lats, lons):
+    """Distance of each hop along a track; length ``n - 1``."""
+    lats = as_float_array(lats)
+    lons = as_float_array(lons)
+    if lats.size < 2:
+        return np.empty(0, dtype=np.float64)
+    return haversine_km(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def path_distance_km(lats, lons):
+    """Total length of a track in km."""
+    return float(segment_distances_km(lats, lons).sum())
+
+
+def cumulative_distance_km(lats, lons):
+    """Distance travelled up to each point; length ``n``, starting at 0."""
+    segments = segment_distances_km(lats, lons)
+    return np.concatenate(([0.0], np.cumsum(segments))) if segments.size else np.zeros(len(lats))
+
+
+def bounding_box(lats, lons):
+    """Return ``{'min_lat', 'max_lat', 'min_lon', 'max_lon'}`` or None if empty."""
+    lats = as_float_array(lats)
+    lons = as_float_array(lons)
+    if lats.size == 0:
+        return None
+    return {
+        'min_lat': float(lats.min()),
+        'max_lat': float(lats.max()),
+        'min_lon': float(lons.min()),
+        'max_lon': float(lons.max()),
+    }
+
+
+def epoch_seconds(timestamps):
+    """Convert a sequence of aware datetimes to a float array of epoch seconds."""
+    return np.fromiter((ts.timestamp() for ts in timestamps), dtype=np.float64, count=len(timestamps))
+
+
+def derive_speeds_kmh(lats, lons, seconds):
+    """
+    Speed (km/h) over each hop from positions and epoch ``seconds``.
+    Hops with a non-positive time delta get NaN. Length ``n - 1``.
+    """
+    segments = segment_distances_km(lats, lons)
+    dt = np.diff(as_float_array(seconds))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = segments / (dt / 3600.0)
+    speeds[dt <= 0] = np.nan
+    return speeds
+
+
+def project_xy_m(lats, lons, ref_lat=None):
+    """
+    Project degrees to a local equirectangular plane in metres.
+    ``ref_lat`` (default: mean latitude) sets the longitude scale; accurate
+    for the extent of a single vehicle trip.
+    """
+    lats = as_float_array(lats)
+    lons = as_float_array(lons)
+    if ref_lat is None:
+        ref_lat = float(lats.mean()) if lats.size else 0.0
+    metres_per_deg = np.radians(1.0) * EARTH_RADIUS_KM * 1000.0
+    x = lons * np.cos(np.radians(ref_lat)) * metres_per_deg
+    y = lats * metres_per_deg
+    return x, y
+
+
+def _segment_distance_xy(px, py, ax, ay, bx, by):
+    """Planar distance from point(s) P to segment(s) AB (same units as input)."""
+    dx = bx - ax
+    dy = by - ay
+    seg_len_sq = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(seg_len_sq > 0, ((px - ax) * dx + (py - ay) * dy) / seg_len_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def point_to_segment_distance_m(plat, plon, alat, alon, blat, blon):
+    """
+    Distance in metres from point(s) P to segment(s) AB.
+
+    Uses a local equirectangular projection centred on A, which is accurate
+    for the short segments found in vehicle tracks. All arguments broadcast.
+    """
+    alat = as_float_array(alat)
+    alon = as_float_array(alon)
+    metres_per_deg = np.radians(1.0) * EARTH_RADIUS_KM * 1000.0
+    cos_lat = np.cos(np.radians(alat))
+
+    px = (as_float_array(plon) - alon) * cos_lat * metres_per_deg
+    py = (as_float_array(plat) - alat) * metres_per_deg
+    bx = (as_float_array(blon) - alon) * cos_lat * metres_per_deg
+    by = (as_float_array(blat) - alat) * metres_per_deg
+    return _segment_distance_xy(px, py, 0.0, 0.0, bx, by)
+
+
+def simplify_rdp(lats, lons, tolerance_m):
+    """
+    Douglas-Peucker simplification with a tolerance in metres.
+
+    Keeps the shape of the track (corners survive, redundant points on
+    straight runs go) and always keeps the first and last point. Uses an
+    explicit stack and evaluates every span in one array operation.
+
+    Returns a boolean keep-mask of length ``n``.
+    """
+    x, y = project_xy_m(lats, lons)
+    n = x.size
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = True
+    keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        inner = slice(start + 1, end)
+        dist = _segment_distance_xy(x[inner], y[inner], x[start], y[start], x[end], y[end])
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance_m:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def simplify_visvalingam(lats, lons, tolerance_m):
+    """
+    Visvalingam-Whyatt simplification.
+
+    Repeatedly drops the point forming the smallest triangle with its
+    neighbours until every remaining triangle is at least ``tolerance_m``
+    squared in area. Tends to give smoother results than Douglas-Peucker at
+    the same point count. First and last points are always kept.
+
+    Returns a boolean keep-mask of length ``n``.
+    """
+    import heapq
+
+    x, y = project_xy_m(lats, lons)
+    n = x.size
+    keep = np.ones(n, dtype=bool)
+    if n <= 2:
+        return keep
+
+    min_area = float(tolerance_m) ** 2
+    # Initial triangle areas for all interior points in one pass.
+    areas = np.zeros(n)
+    areas[1:-1] = 0.5 * np.abs(
+        (x[:-2] - x[2:]) * (y[1:-1] - y[:-2]) - (x[:-2] - x[1:-1]) * (y[2:] - y[:-2])
+    )
+    prev_idx = np.arange(-1, n - 1)
+    next_idx = np.arange(1, n + 1)
+
+    heap = [(areas[i], i) for i in range(1, n - 1)]
+    heapq.heapify(heap)
+
+    def triangle(i):
+        a, b = prev_idx[i], next_idx[i]
+        return 0.5 * abs((x[a] - x[b]) * (y[i] - y[a]) - (x[a] - x[i]) * (y[b] - y[a]))
+
+    while heap:
+        area, i = heapq.heappop(heap)
+        if not keep[i] or area != areas[i]:
+            continue  # stale entry
+        if area >= min_area:
+            break
+        keep[i] = False
+        a, b = prev_idx[i], next_idx[i]
+        next_idx[a] = b
+        prev_idx[b] = a
+        for j in (a, b):
+            if 0 < j < n - 1:
+                # An eliminated point's area never drops below the one just
+                # removed, so the process stays monotonic.
+                areas[j] = max(triangle(j), area)
+                heapq.heappush(heap, (areas[j], j))
+    return keep
+
+
+SIMPLIFIERS = {
+    'rdp': simplify_rdp,
+    'visvalingam': simplify_visvalingam,
+}
+
+
+def tolerance_for_zoom(zoom, latitude=0.0, pixels=1.0):
+    """
+    Ground size in metres of ``pixels`` screen pixels at a Web-Mercator
+    ``zoom`` level, suitable as a simplification tolerance for that zoom.
+    """
+    metres_per_pixel = 156543.03392 * np.cos(np.radians(latitude)) / (2 ** float(zoom))
+    return float(metres_per_pixel * pixels)
+
+
+def thin_by_gap(lats, lons, seconds, min_seconds, min_km):
+    """
+    Greedy time/distance thinning used by ``downsample_trip_locations``.
+
+    Walks the track keeping a point when it is at least ``min_seconds`` after
+    OR ``min_km`` away from the previously kept point. The first and last
+    points are always kept.
+
+    Each step is vectorised. The next time-qualified index comes from
+    ``searchsorted`` on the timestamps. Because a straight-line distance can
+    never exceed the distance travelled along the track, no point before
+    ``searchsorted(cumulative, cumulative[last] + min_km)`` can qualify on
+    distance, so only the few points between those two bounds are checked.
+    Distances are compared in haversine "a" space to skip the arcsin/sqrt.
+
+    Returns a boolean keep-mask of length ``n``.
+    """
+    lats = np.radians(as_float_array(lats))
+    lons = np.radians(as_float_array(lons))
+    seconds = as_float_array(seconds)
+    n = lats.size
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = True
+    keep[-1] = True
+    if n <= 2:
+        return keep
+
+    cos_lat = np.cos(lats)
+    cumulative = cumulative_distance_km(np.degrees(lats), np.degrees(lons))
+    # Threshold on haversine "a" equivalent to min_km.
+    a_min = np.sin(min(min_km / EARTH_RADIUS_KM, np.pi) / 2.0) ** 2
+
+    last = 0
+    while last < n - 2:
+        time_idx = max(int(np.searchsorted(seconds, seconds[last] + min_seconds, side='left')), last + 1)
+        dist_idx = max(int(np.searchsorted(cumulative, cumulative[last] + min_km - 1e-9, side='left')), last + 1)
+        window_end = min(time_idx, n - 1)
+
+        nxt = None
+        if dist_idx < window_end:
+            w = slice(dist_idx, window_end)
+            a = (
+                np.sin((lats[w] - lats[last]) / 2.0) ** 2
+                + cos_lat[last] * cos_lat[w] * np.sin((lons[w] - lons[last]) / 2.0) ** 2
+            )
+            far = np.flatnonzero(a >= a_min)
+            if far.size:
+                nxt = dist_idx + int(far[0])
+        if nxt is None:
+            if time_idx >= n - 1:
+                break
+            nxt = time_idx
+        keep[nxt] = True
+        last = nxt
+    return keep
+
+
+def find_stops(lats, lons, seconds, radius_m, min_seconds):
+    """
+    Find stationary periods: runs of consecutive points that stay within
+    ``radius_m`` of the run's first point for at least ``min_seconds``.
+
+    Distances from each anchor are evaluated on growing blocks of the
+    following points, so a long stop costs a handful of array operations
+    rather than one Python step per point.
+
+    Returns a list of ``(first_index, last_index)`` pairs (inclusive).
+    """
+    x, y = project_xy_m(lats, lons)
+    seconds = as_float_array(seconds)
+    n = x.size
+    stops = []
+    i = 0
+    while i < n - 1:
+        end = i + 1
+        block = 8
+        while end < n:
+            block_end = min(end + block, n)
+            outside = np.flatnonzero(np.hypot(x[end:block_end] - x[i], y[end:block_end] - y[i]) > radius_m)
+            if outside.size:
+                end += int(outside[0])
+                break
+            end = block_end
+            block *= 2
+        # Points i .. end - 1 are within the radius of point i.
+        if end - 1 > i and seconds[end - 1] - seconds[i] >= min_seconds:
+            stops.append((i, end - 1))
+            i = end
+        else:
+            i += 1
+    return stops
@@ -0,0 +1,180 @@
+"""
+Geohash cells for indexed viewport and proximity queries.
+
+A geohash interleaves longitude/latitude bits into a base-32 string, so
+points that share a prefix lie in the same cell and a cell's points form
+one contiguous range of the string's sort order. Storing the hash in an
+ordinary indexed column (``GeohashField``) turns "points inside this
+box" into a handful of B-tree range scans on MySQL and SQLite alike:
+
+    cover_bbox(...)    -> cells at the finest precision that still covers
+                          the box with at most ``max_cells`` cells
+    cell_ranges(...)   -> those cells merged into [low, high) string ranges
+    bbox_q(...)        -> Q(field__gte=low, field__lt=high) | ...
+
+Ranges are used instead of ``__startswith`` because SQLite does not use an
+index for ``LIKE ... ESCAPE``. Cells over-cover the box, so callers add an
+exact latitude/longitude filter on top.
+"""
+import math
+
+from django.db import models
+from django.db.models import Q
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: index for index, char in enumerate(BASE32)}
+
+STORED_PRECISION = 9     # ~4.8 m x 4.8 m cells
+MAX_COVER_CELLS = 32
+
+
+def encode(latitude, longitude, precision=STORED_PRECISION):
+    """Geohash of a point."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    latitude = float(latitude)
+    longitude = float(longitude)
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate, starting with longitude
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_lo = mid
+            else:
+                value = value * 2
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_lo = mid
+            else:
+                value = value * 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(latitude, longitude) extent in degrees of a cell at ``precision``."""
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _cell_index_range(low, high, size, origin):
+    return int(math.floor((low - origin) / size)), int(math.floor((high - origin) / size))
+
+
+def cover_bbox(min_lat, min_lon, max_lat, max_lon, max_cells=MAX_COVER_CELLS):
+    """
+    Geohash cells covering the box, at the finest precision (up to
+    STORED_PRECISION) needing no more than ``max_cells`` cells.
+    """
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+    cells = ['']
+    for precision in range(1, STORED_PRECISION + 1):
+        lat_size, lon_size = cell_size(precision)
+        row_lo, row_hi = _cell_index_range(min_lat, min(max_lat, 90.0 - 1e-9), lat_size, -90.0)
+        col_lo, col_hi = _cell_index_range(min_lon, min(max_lon, 180.0 - 1e-9), lon_size, -180.0)
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > max_cells:
+            break
+        cells = [
+            encode(-90.0 + (row + 0.5) * lat_size, -180.0 + (col + 0.5) * lon_size, precision)
+            for row in range(row_lo, row_hi + 1)
+            for col in range(col_lo, col_hi + 1)
+        ]
+    return cells
+
+
+def _to_int(cell):
+    value = 0
+    for char in cell:
+        value = value * 32 + _DECODE[char]
+    return value
+
+
+def _from_int(value, precision):
+    chars = []
+    for _ in range(precision):
+        value, digit = divmod(value, 32)
+        chars.append(BASE32[digit])
+    return ''.join(reversed(chars))
+
+
+def cell_ranges(cells):
+    """
+    Same-precision cells merged into ``(low, high)`` string ranges; a
+    stored hash lies in a cell iff ``low <= hash < high``. ``high`` is None
+    for a range that runs to the end of the keyspace.
+    """
+    if not cells or cells == ['']:
+        return [('', None)]
+    precision = len(cells[0])
+    values = sorted({_to_int(cell) for cell in cells})
+    ranges = []
+    start = previous = values[0]
+    for value in values[1:] + [None]:
+        if value is not None and value == previous + 1:
+            previous = value
+            continue
+        end = previous + 1
+        high = _from_int(end, precision) if end < 32 ** precision else None
+        ranges.append((_from_int(start, precision), high))
+        if value is not None:
+            start = previous = value
+    return ranges
+
+
+def bbox_q(min_lat, min_lon, max_lat, max_lon, field='geohash', max_cells=MAX_COVER_CELLS):
+    """Q object selecting rows whose ``field`` falls in a cell covering the box."""
+    query = Q()
+    for low, high in cell_ranges(cover_bbox(min_lat, min_lon, max_lat, max_lon, max_cells)):
+        condition = Q(**{f'{field}__gte': low})
+        if high is not None:
+            condition &= Q(**{f'{field}__lt': high})
+        query |= condition
+    return query
+
+
+class GeohashField(models.CharField):
+    """
+    Geohash of the instance's ``latitude``/``longitude``, recomputed on
+    every save (including ``bulk_create`` and its conflict updates), the
+    way ``auto_now`` stamps a DateTimeField.
+    """
+
+    def __init__(self, *args, lat_field='latitude', lon_field='longitude', **kwargs):
+        self.lat_field = lat_field
+        self.lon_field = lon_field
+        kwargs.setdefault('max_length', 12)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('default', '')
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.lat_field != 'latitude':
+            kwargs['lat_field'] = self.lat_field
+        if self.lon_field != 'longitude':
+            kwargs['lon_field'] = self.lon_field
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        latitude = getattr(model_instance, self.lat_field)
+        longitude = getattr(model_instance, self.lon_field)
+        value = '' if latitude is None or longitude is None else encode(latitude, longitude)
+        setattr(model_instance, self.attname, value)
+        return value
@@ -0,0 +1,185 @@
+"""
+Change feeds for the live tracking maps.
+
+The live maps used to rebuild every marker on every poll. Writers now
+``publish`` the ids that changed (vehicles after an AiroTrack sync, trips
+on every GPS ping / start / end) to a per-feed version counter in the
+cache, and readers ask for ``changes_since`` their last cursor:
+
+    live_feed:<feed>:version    - monotonically increasing int (INCR)
+    live_feed:<feed>:<version>  - ids changed by that publish (CHANGE_TTL)
+
+A reader that is current costs one cache GET and no DB query; one that is
+behind queries only the changed ids. Whenever the change log cannot
+answer exactly (cursor missing/too old, an entry expired, cache down) the
+reader gets ``None`` and must send a full snapshot — never a silent gap.
+The counter is seeded from the clock so a counter lost with the cache
+restarts above every cursor handed out before.
+
+``build_delta`` caches the rendered delta per (since, version) for a few
+seconds, so 50 browsers at the same cursor share one DB query, and
+``event_stream`` turns a feed into a Server-Sent Events stream.
+
+Deployment: an open stream occupies a worker thread for up to
+LIVE_FEED_STREAM_SECONDS, so the streaming views need a threaded or async
+worker class (gunicorn gthread / gevent); on sync workers the maps should
+use the delta polling endpoints instead. Streams are kept short and
+EventSource reconnects, resuming from its Last-Event-ID.
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CHANGE_TTL = 10 * 60
+MAX_GAP = 500           # more versions behind than this -> full snapshot
+DELTA_CACHE_TTL = 5
+
+
+def _version_key(feed):
+    return f'live_feed:{feed}:version'
+
+
+def _change_key(feed, version):
+    return f'live_feed:{feed}:{version}'
+
+
+def current_version(feed):
+    """Latest version of ``feed`` (0 if nothing was published or the cache is down)."""
+    try:
+        return cache.get(_version_key(feed)) or 0
+    except Exception:
+        return 0
+
+
+def publish(feed, ids):
+    """Record that ``ids`` of ``feed`` changed. Best effort: never raises."""
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return None
+    key = _version_key(feed)
+    try:
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            # First publish, or the counter was evicted: seed from the clock.
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.incr(key)
+        if version is None:
+            return None  # django-redis swallowed a connection error
+        cache.set(_change_key(feed, version), ids, CHANGE_TTL)
+        return version
+    except Exception:
+        logger.debug("Live feed publish failed for %s", feed)
+        return None
+
+
+def parse_cursor(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def changes_since(feed, since):
+    """
+    ``(version, ids)``: the current version and the ids changed after
+    ``since``, or ``ids=None`` when the caller needs a full snapshot.
+    """
+    version = current_version(feed)
+    if since == version:
+        return version, set()
+    if since is None or not version or since > version or version - since > MAX_GAP:
+        return version, None
+    keys = [_change_key(feed, v) for v in range(since + 1, version + 1)]
+    try:
+        entries = cache.get_many(keys)
+    except Exception:
+        return version, None
+    if len(entries) != len(keys):
+        return version, None  # Expired, or a publish still in flight
+    changed = set()
+    for ids in entries.values():
+        changed.update(ids)
+    return version, changed
+
+
+def build_delta(feed, since, render):
+    """
+    Delta payload for a client at cursor ``since``.
+
+    ``render(ids)`` returns ``(items, removed_ids)`` for the given ids, or
+    for the whole feed when ``ids`` is None. Returns a dict with
+    ``cursor``, ``full`` (True for a snapshot), ``items`` and ``removed``.
+    """
+    version, changed = changes_since(feed, since)
+    if changed is not None and not changed:
+        return {'cursor': version, 'full': False, 'items': [], 'removed': []}
+
+    cache_key = f'live_feed:{feed}:delta:{since if changed is not None else "full"}:{version}'
+    if version:
+        try:
+            cached = cache.get(cache_key)
+        except Exception:
+            cached = None
+        if cached is not None:
+            return cached
+
+    items, removed = render(None if changed is None else changed)
+    payload = {
+        'cursor': version,
+        'full': changed is None,
+        'items': items,
+        'removed': sorted(removed),
+    }
+    if version:
+        try:
+            cache.set(cache_key, payload, DELTA_CACHE_TTL)
+        except Exception:
+            pass
+    return payload
+
+
+def _sse(event, payload):
+    return f"id: {payload['cursor']}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def event_stream(feed, since, render, sleep=time.sleep):
+    """
+    Server-Sent Events generator for ``feed``.
+
+    Sends a snapshot (or the delta since ``since``, e.g. the browser's
+    Last-Event-ID) straight away, then a delta event whenever the feed's
+    version moves, checked every LIVE_FEED_POLL_SECONDS with one cache GET.
+    Comments keep idle connections alive. The stream ends after
+    LIVE_FEED_STREAM_SECONDS (25 s by default) so a worker is only briefly
+    held; EventSource reconnects on its own and resumes from the last id.
+    """
+    poll_seconds = getattr(settings, 'LIVE_FEED_POLL_SECONDS', 1.0)
+    stream_seconds = getattr(settings, 'LIVE_FEED_STREAM_SECONDS', 25)
+    keepalive_seconds = 10
+    deadline = time.monotonic() + stream_seconds
+
+    yield 'retry: 3000\n\n'
+    payload = build_delta(feed, since, render)
+    cursor = payload['cursor']
+    if payload['full'] or payload['items'] or payload['removed'] or since is None:
+        yield _sse(feed, payload)
+    last_sent = time.monotonic()
+
+    while time.monotonic() < deadline:
+        sleep(poll_seconds)
+        if current_version(feed) != cursor:
+            payload = build_delta(feed, cursor, render)
+            cursor = payload['cursor']
+            if payload['full'] or payload['items'] or payload['removed']:
+                yield _sse(feed, payload)
+                last_sent = time.monotonic()
+                continue
+        if time.monotonic() - last_sent >= keepalive_seconds:
+            yield ': keep-alive\n\n'
+            last_sent = time.monotonic()
@@ -0,0 +1,114 @@
+"""Micro-benchmark the vectorised ``core.geo`` helpers against pure Python.
+
+Builds a synthetic track (default 100k points, one ping every 5 s) in memory
+and times path distance, cumulative distance, bounding box and the
+downsampling walk with the old per-point loops and with NumPy. No database
+access.
+
+    python manage.py benchmark_geo --points 100000
+"""
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import geo
+
+
+def _py_haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * math.asin(math.sqrt(a)) * 6371
+
+
+def _py_path(lats, lons):
+    total = 0.0
+    for i in range(1, len(lats)):
+        total += _py_haversine(lats[i - 1], lons[i - 1], lats[i], lons[i])
+    return total
+
+
+def _py_cumulative(lats, lons):
+    out = [0.0]
+    for i in range(1, len(lats)):
+        out.append(out[-1] + _py_haversine(lats[i - 1], lons[i - 1], lats[i], lons[i]))
+    return out
+
+
+def _py_bbox(lats, lons):
+    return min(lats), max(lats), min(lons), max(lons)
+
+
+def _py_thin(lats, lons, seconds, min_seconds, min_km):
+    keep = [0]
+    last = 0
+    for i in range(1, len(lats) - 1):
+        if (seconds[i] - seconds[last] >= min_seconds
+                or _py_haversine(lats[last], lons[last], lats[i], lons[i]) >= min_km):
+            keep.append(i)
+            last = i
+    keep.append(len(lats) - 1)
+    return keep
+
+
+def synthetic_track(points, interval_seconds=5, seed=7):
+    """Random-walk track around Chennai as plain Python lists."""
+    rng = random.Random(seed)
+    lat, lon = 13.0827, 80.2707
+    lats, lons, seconds = [], [], []
+    for i in range(points):
+        lat += rng.uniform(-0.0002, 0.0005)
+        lon += rng.uniform(-0.0002, 0.0005)
+        lats.append(lat)
+        lons.append(lon)
+        seconds.append(float(i * interval_seconds))
+    return lats, lons, seconds
+
+
+class Command(BaseCommand):
+    help = "Compare pure-Python vs NumPy geodesy over a synthetic GPS track."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100_000,
+                            help='Synthetic track length (default 100000).')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Take the best of N runs (default 3).')
+
+    def _best(self, fn, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def handle(self, *args, **opts):
+        lats, lons, seconds = synthetic_track(opts['points'])
+        lat_arr = geo.as_float_array(lats)
+        lon_arr = geo.as_float_array(lons)
+        sec_arr = geo.as_float_array(seconds)
+        repeat = opts['repeat']
+
+        cases = [
+            ('path distance', lambda: _py_path(lats, lons),
+             lambda: geo.path_distance_km(lat_arr, lon_arr)),
+            ('cumulative distance', lambda: _py_cumulative(lats, lons),
+             lambda: geo.cumulative_distance_km(lat_arr, lon_arr)),
+            ('bounding box', lambda: _py_bbox(lats, lons),
+             lambda: geo.bounding_box(lat_arr, lon_arr)),
+            ('downsample walk (300s/500m)', lambda: _py_thin(lats, lons, seconds, 300, 0.5),
+             lambda: geo.thin_by_gap(lat_arr, lon_arr, sec_arr, 300, 0.5)),
+        ]
+
+        self.stdout.write(f"Synthetic track: {len(lats):,} points (best of {repeat})")
+        self.stdout.write(f"  {'operation':<30}{'python':>12}{'numpy':>12}{'speed-up':>10}")
+        for name, py_fn, np_fn in cases:
+            py_s = self._best(py_fn, repeat)
+            np_s = self._best(np_fn, repeat)
+            self.stdout.write(
+                f"  {name:<30}{py_s * 1000:>10.1f}ms{np_s * 1000:>10.1f}ms{py_s / np_s:>9.1f}x"
+            )
+
+        drift = abs(_py_path(lats, lons) - geo.path_distance_km(lat_arr, lon_arr))
+        self.stdout.write(self.style.SUCCESS(f"Path distance agreement: |python - numpy| = {drift:.2e} km"))
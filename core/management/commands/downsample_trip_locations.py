@@ -7,10 +7,18 @@ point only if BOTH:
     - it is at least ``--interval-meters`` from the previously kept point.
 
 The very first and very last point of every trip are always kept so the
-route still renders cleanly. Everything else is deleted.
+route still renders cleanly. Everything else is deleted. The walk runs on
+NumPy arrays via ``core.geo.thin_by_gap``.
+
+``--algorithm rdp`` (Douglas-Peucker) or ``--algorithm visvalingam`` switch
+to shape-preserving simplification instead: corners are kept and points on
+straight runs are dropped, within ``--tolerance-meters`` of the original
+track. The interval options are ignored in that mode.
 
 `GPSTrackingSession` totals (gps_distance, total_points, etc.) are NOT
 recomputed — they were captured at trip end and remain authoritative.
+The trip's `TripRouteArtifact` is dropped and rebuilt on the next map view,
+and its cached last point (``trips.gps_cache``) is forgotten.
 """
 from datetime import timedelta
 
@@ -18,6 +26,8 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils import timezone
 
+from core import geo
+
 
 class Command(BaseCommand):
     help = "Thin out old TripLocation rows down to one point per N seconds / M metres."
@@ -29,6 +39,11 @@ class Command(BaseCommand):
                             help='Minimum time gap to keep a point (default 60).')
         parser.add_argument('--interval-meters', type=float, default=100.0,
                             help='Minimum distance gap to keep a point (default 100m).')
+        parser.add_argument('--algorithm', choices=['gap'] + sorted(geo.SIMPLIFIERS), default='gap',
+                            help='gap = time/distance thinning (default); rdp / visvalingam = '
+                                 'shape-preserving simplification.')
+        parser.add_argument('--tolerance-meters', type=float, default=10.0,
+                            help='Max deviation from the original track for rdp/visvalingam (default 10m).')
         parser.add_argument('--max-trips', type=int, default=0,
                             help='Process at most this many trips (0 = no limit).')
         parser.add_argument('--dry-run', action='store_true',
@@ -36,12 +51,16 @@ class Command(BaseCommand):
 
     def handle(self, *args, **opts):
         from trips.models import Trip
+        from trips.gps_cache import forget_last_point
         from trips.gps_models import TripLocation
+        from trips.route_artifacts import invalidate_route_artifact
 
         cutoff = timezone.now() - timedelta(days=opts['older_than_days'])
         min_seconds = opts['interval_seconds']
         min_km = opts['interval_meters'] / 1000.0
         dry_run = opts['dry_run']
+        algorithm = opts['algorithm']
+        tolerance_m = opts['tolerance_meters']
 
         trips_qs = Trip.objects.filter(
             status__in=['completed', 'cancelled'],
@@ -53,10 +72,11 @@ class Command(BaseCommand):
             trips_qs = trips_qs[:opts['max_trips']]
 
         total_trips = trips_qs.count()
-        self.stdout.write(
-            f"Scanning {total_trips} trips ended before {cutoff.date()} "
-            f"(keep 1 point per {min_seconds}s OR {opts['interval_meters']:.0f}m)..."
-        )
+        if algorithm == 'gap':
+            rule = f"keep 1 point per {min_seconds}s OR {opts['interval_meters']:.0f}m"
+        else:
+            rule = f"{algorithm} simplification, tolerance {tolerance_m:g}m"
+        self.stdout.write(f"Scanning {total_trips} trips ended before {cutoff.date()} ({rule})...")
 
         total_kept = 0
         total_deleted = 0
@@ -66,25 +86,21 @@ class Command(BaseCommand):
             points = list(
                 TripLocation.objects.filter(trip_id=trip.id)
                 .order_by('timestamp')
-                .values('id', 'latitude', 'longitude', 'timestamp')
+                .values_list('id', 'latitude', 'longitude', 'timestamp')
             )
             if len(points) <= 2:
                 total_kept += len(points)
                 continue
 
-            keep_ids = {points[0]['id'], points[-1]['id']}
-            last = points[0]
-            for p in points[1:-1]:
-                gap_s = (p['timestamp'] - last['timestamp']).total_seconds()
-                dist_km = TripLocation.calculate_distance(
-                    last['latitude'], last['longitude'],
-                    p['latitude'], p['longitude'],
+            ids, lats, lons, timestamps = zip(*points)
+            if algorithm == 'gap':
+                keep = geo.thin_by_gap(
+                    lats, lons, geo.epoch_seconds(timestamps), min_seconds, min_km,
                 )
-                if gap_s >= min_seconds or dist_km >= min_km:
-                    keep_ids.add(p['id'])
-                    last = p
+            else:
+                keep = geo.SIMPLIFIERS[algorithm](lats, lons, tolerance_m)
 
-            delete_ids = [p['id'] for p in points if p['id'] not in keep_ids]
+            delete_ids = [pid for pid, kept in zip(ids, keep) if not kept]
             if not delete_ids:
                 total_kept += len(points)
                 continue
@@ -100,6 +116,8 @@ class Command(BaseCommand):
                     batch = delete_ids[i:i + 1000]
                     with transaction.atomic():
                         TripLocation.objects.filter(id__in=batch).delete()
+                invalidate_route_artifact(trip.id)
+                forget_last_point(trip.id)
 
             if trips_touched % 100 == 0:
                 self.stdout.write(
@@ -154,3 +154,385 @@ class DashboardAPITests(APITestCase):
         self.client.credentials()
         response = self.client.get('/api/dashboard/stats/')
         self.assertIn(response.status_code, [401, 403])
+
+
+class GeoUtilsTests(TestCase):
+    """Tests for the vectorised geodesy helpers in core.geo."""
+
+    def setUp(self):
+        from core.management.commands.benchmark_geo import synthetic_track
+        self.lats, self.lons, self.seconds = synthetic_track(500)
+
+    def test_haversine_matches_known_distance(self):
+        from core import geo
+        # Chennai Central -> Bangalore City ~ 290 km as the crow flies.
+        d = geo.haversine_km(13.0827, 80.2707, 12.9716, 77.5946)
+        self.assertAlmostEqual(float(d), 290.2, delta=1.0)
+
+    def test_path_and_cumulative_agree_with_scalar_loop(self):
+        from core import geo
+        from trips.gps_models import TripLocation
+        expected = sum(
+            TripLocation.calculate_distance(self.lats[i - 1], self.lons[i - 1], self.lats[i], self.lons[i])
+            for i in range(1, len(self.lats))
+        )
+        self.assertAlmostEqual(geo.path_distance_km(self.lats, self.lons), expected, places=9)
+        cumulative = geo.cumulative_distance_km(self.lats, self.lons)
+        self.assertEqual(len(cumulative), len(self.lats))
+        self.assertEqual(cumulative[0], 0.0)
+        self.assertAlmostEqual(cumulative[-1], expected, places=9)
+
+    def test_empty_and_single_point_tracks(self):
+        from core import geo
+        self.assertEqual(geo.path_distance_km([], []), 0.0)
+        self.assertEqual(geo.path_distance_km([13.0], [80.0]), 0.0)
+        self.assertIsNone(geo.bounding_box([], []))
+
+    def test_bounding_box_and_speeds(self):
+        from core import geo
+        bbox = geo.bounding_box(self.lats, self.lons)
+        self.assertEqual(bbox['min_lat'], min(self.lats))
+        self.assertEqual(bbox['max_lon'], max(self.lons))
+        # 1 km north in 60 s -> 60 km/h; duplicate timestamp -> NaN.
+        speeds = geo.derive_speeds_kmh([13.0, 13.0089932, 13.02], [80.0, 80.0, 80.0], [0, 60, 60])
+        self.assertAlmostEqual(speeds[0], 60.0, delta=0.1)
+        self.assertTrue(speeds[1] != speeds[1])
+
+    def test_point_to_segment_distance(self):
+        from core import geo
+        # Point ~111 m north of the middle of an east-west segment.
+        d = geo.point_to_segment_distance_m(13.001, 80.005, 13.0, 80.0, 13.0, 80.01)
+        self.assertAlmostEqual(float(d), 111.2, delta=0.5)
+        # Beyond the end of the segment the distance is to the endpoint.
+        d = geo.point_to_segment_distance_m(13.0, 80.02, 13.0, 80.0, 13.0, 80.01)
+        self.assertAlmostEqual(float(d), geo.haversine_km(13.0, 80.02, 13.0, 80.01) * 1000, delta=1.0)
+
+    def test_thin_by_gap_matches_greedy_walk(self):
+        from core import geo
+        from core.management.commands.benchmark_geo import _py_thin
+        for min_seconds, min_km in [(300, 0.5), (60, 0.1), (30, 0.02)]:
+            expected = _py_thin(self.lats, self.lons, self.seconds, min_seconds, min_km)
+            keep = geo.thin_by_gap(self.lats, self.lons, self.seconds, min_seconds, min_km)
+            self.assertEqual(list(keep.nonzero()[0]), expected)
+
+    def _l_shaped_track(self):
+        # 50 points east along a street, then 50 north: one real corner.
+        lats = [13.0] * 50 + [13.0 + i * 0.0002 for i in range(1, 51)]
+        lons = [80.0 + i * 0.0002 for i in range(50)] + [80.0098] * 50
+        return lats, lons
+
+    def test_rdp_keeps_corner_and_drops_straight_runs(self):
+        from core import geo
+        lats, lons = self._l_shaped_track()
+        keep = geo.simplify_rdp(lats, lons, 5.0)
+        self.assertEqual(list(keep.nonzero()[0]), [0, 49, 99])
+
+    def test_visvalingam_keeps_corner(self):
+        from core import geo
+        lats, lons = self._l_shaped_track()
+        keep = geo.simplify_visvalingam(lats, lons, 5.0)
+        self.assertEqual(list(keep.nonzero()[0]), [0, 49, 99])
+
+    def test_rdp_deviation_stays_within_tolerance(self):
+        from core import geo
+        tolerance = 15.0
+        keep = geo.simplify_rdp(self.lats, self.lons, tolerance)
+        kept = keep.nonzero()[0]
+        self.assertLess(len(kept), len(self.lats))
+        for a, b in zip(kept[:-1], kept[1:]):
+            inner = range(a + 1, b)
+            if not inner:
+                continue
+            dist = geo.point_to_segment_distance_m(
+                [self.lats[i] for i in inner], [self.lons[i] for i in inner],
+                self.lats[a], self.lons[a], self.lats[b], self.lons[b],
+            )
+            self.assertLessEqual(float(dist.max()), tolerance + 0.5)
+
+    def test_tolerance_for_zoom_halves_per_level(self):
+        from core import geo
+        self.assertAlmostEqual(geo.tolerance_for_zoom(10) / geo.tolerance_for_zoom(11), 2.0)
+
+    def test_find_stops(self):
+        from core import geo
+        # Moving, then 40 pings (~20 min) jittering within a few metres, then moving.
+        lats = [13.0 + i * 0.001 for i in range(10)]
+        lats += [13.01 + (i % 3) * 0.00002 for i in range(40)]
+        lats += [13.01 + i * 0.001 for i in range(1, 11)]
+        lons = [80.0] * len(lats)
+        seconds = [i * 30.0 for i in range(len(lats))]
+        self.assertEqual(geo.find_stops(lats, lons, seconds, 50, 300), [(10, 49)])
+        self.assertEqual(geo.find_stops(lats, lons, seconds, 50, 3600), [])
+
+
+class DownsampleTripLocationsCommandTests(TestCase):
+    def test_downsample_keeps_endpoints_and_gap_points(self):
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from trips.models import Trip
+        from trips.gps_models import TripLocation
+
+        driver = User.objects.create_user(username='dsdriver', password='pass1234', user_type='driver')
+        vtype = VehicleType.objects.create(name='Car', category='personal')
+        vehicle = Vehicle.objects.create(
+            vehicle_type=vtype, make='Toyota', model='Etios', year=2023,
+            license_plate='TN01DS0001', vin='VINCORE00000000DS1',
+            status='available', acquisition_date=date.today(),
+        )
+        ended = timezone.now() - timedelta(days=10)
+        trip = Trip.objects.create(
+            vehicle=vehicle, driver=driver, start_time=ended - timedelta(hours=1),
+            end_time=ended, start_odometer=100, end_odometer=110,
+            origin='A', destination='B', purpose='Test', status='completed', entry_type='manual',
+        )
+        # 61 points, 10 s / ~11 m apart: keep one per 60 s (plus both ends).
+        TripLocation.objects.bulk_create([
+            TripLocation(
+                trip=trip, latitude=13 + i * 0.0001, longitude=80, accuracy=5,
+                timestamp=ended - timedelta(hours=1) + timedelta(seconds=i * 10),
+            )
+            for i in range(61)
+        ])
+        call_command(
+            'downsample_trip_locations', '--interval-seconds', '60',
+            '--interval-meters', '1000', stdout=StringIO(),
+        )
+        self.assertEqual(TripLocation.objects.filter(trip=trip).count(), 11)
+
+    def test_downsample_rdp_drops_straight_line_points(self):
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from trips.models import Trip
+        from trips.gps_models import TripLocation
+
+        driver = User.objects.create_user(username='rdpdriver', password='pass1234', user_type='driver')
+        vtype = VehicleType.objects.create(name='Car', category='personal')
+        vehicle = Vehicle.objects.create(
+            vehicle_type=vtype, make='Toyota', model='Etios', year=2023,
+            license_plate='TN01DS0002', vin='VINCORE00000000DS2',
+            status='available', acquisition_date=date.today(),
+        )
+        ended = timezone.now() - timedelta(days=10)
+        trip = Trip.objects.create(
+            vehicle=vehicle, driver=driver, start_time=ended - timedelta(hours=1),
+            end_time=ended, start_odometer=100, end_odometer=110,
+            origin='A', destination='B', purpose='Test', status='completed', entry_type='manual',
+        )
+        TripLocation.objects.bulk_create([
+            TripLocation(
+                trip=trip, latitude=13 + i * 0.001, longitude=80, accuracy=5,
+                timestamp=ended - timedelta(hours=1) + timedelta(seconds=i * 60),
+            )
+            for i in range(30)
+        ])
+        call_command('downsample_trip_locations', '--algorithm', 'rdp', stdout=StringIO())
+        self.assertEqual(TripLocation.objects.filter(trip=trip).count(), 2)
+
+
+class LiveFeedTests(TestCase):
+    """Tests for the cursor-based change feed in core.live_feed."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.renders = []
+
+    def _render(self, ids):
+        self.renders.append(ids)
+        everything = {1, 2, 3}
+        wanted = everything if ids is None else set(ids)
+        return [{'id': i} for i in sorted(wanted & everything)], wanted - everything
+
+    def test_changes_since_returns_ids_published_after_cursor(self):
+        from core import live_feed
+        first = live_feed.publish('test', [1])
+        live_feed.publish('test', [2, 2])
+        version, changed = live_feed.changes_since('test', first)
+        self.assertEqual(version, first + 1)
+        self.assertEqual(changed, {2})
+        self.assertEqual(live_feed.changes_since('test', version), (version, set()))
+
+    def test_missing_or_unanswerable_cursor_means_snapshot(self):
+        from django.core.cache import cache
+        from core import live_feed
+        first = live_feed.publish('test', [1])
+        live_feed.publish('test', [2])
+        self.assertIsNone(live_feed.changes_since('test', None)[1])
+        self.assertIsNone(live_feed.changes_since('test', first + 10)[1])
+        self.assertIsNone(live_feed.changes_since('test', first - live_feed.MAX_GAP - 1)[1])
+        cache.delete(f'live_feed:test:{first + 1}')
+        self.assertIsNone(live_feed.changes_since('test', first)[1])
+
+    def test_build_delta_renders_only_changed_ids_and_shares_payload(self):
+        from core import live_feed
+        cursor = live_feed.publish('test', [1])
+        live_feed.publish('test', [3, 7])
+
+        payload = live_feed.build_delta('test', cursor, self._render)
+        self.assertFalse(payload['full'])
+        self.assertEqual(payload['items'], [{'id': 3}])
+        self.assertEqual(payload['removed'], [7])
+        self.assertEqual(live_feed.build_delta('test', cursor, self._render), payload)
+        self.assertEqual(self.renders, [{3, 7}])
+
+        current = live_feed.build_delta('test', payload['cursor'], self._render)
+        self.assertEqual(current['items'], [])
+        self.assertEqual(len(self.renders), 1)
+
+        snapshot = live_feed.build_delta('test', None, self._render)
+        self.assertTrue(snapshot['full'])
+        self.assertEqual(len(snapshot['items']), 3)
+
+    def test_event_stream_pushes_a_delta_when_the_feed_moves(self):
+        from django.test import override_settings
+        from core import live_feed
+        cursor = live_feed.publish('test', [1])
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 1:
+                live_feed.publish('test', [2])
+
+        with override_settings(LIVE_FEED_POLL_SECONDS=0, LIVE_FEED_STREAM_SECONDS=0.2):
+            events = list(live_feed.event_stream('test', cursor, self._render, sleep=fake_sleep))
+
+        self.assertEqual(events[0], 'retry: 3000\n\n')
+        data = [e for e in events if e.startswith('id: ')]
+        self.assertEqual(len(data), 1)
+        self.assertIn(f'id: {cursor + 1}\nevent: test\n', data[0])
+        self.assertIn('"items": [{"id": 2}]', data[0])
+
+
+class GeohashTests(TestCase):
+    """Tests for the geohash cell cover in core.geohash."""
+
+    def test_encode_matches_reference(self):
+        from core.geohash import encode
+        self.assertEqual(encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(encode(13.0827, 80.2707, 5), 'tf346')
+
+    def test_cell_ranges_cover_every_point_in_the_box(self):
+        import random
+        from core.geohash import cell_ranges, cover_bbox, encode
+        rng = random.Random(3)
+        box = (12.9, 80.1, 13.2, 80.35)
+        ranges = cell_ranges(cover_bbox(*box))
+        self.assertLessEqual(len(ranges), 32)
+        for _ in range(500):
+            h = encode(rng.uniform(box[0], box[2]), rng.uniform(box[1], box[3]))
+            self.assertTrue(any(low <= h and (high is None or h < high) for low, high in ranges), h)
+        # Bangalore is far outside the Chennai box.
+        far = encode(12.9716, 77.5946)
+        self.assertFalse(any(low <= far and (high is None or far < high) for low, high in ranges))
+
+    def test_whole_world_falls_back_to_one_open_range(self):
+        from core.geohash import cell_ranges, cover_bbox
+        self.assertEqual(cell_ranges(cover_bbox(-90, -180, 90, 180, max_cells=4)), [('', None)])
+
+
+class StreamingExportTests(TestCase):
+    """core.exports streams CSV rows without building the file in memory."""
+
+    def test_200k_rows_stream_in_flat_memory(self):
+        import tracemalloc
+        from datetime import datetime, timedelta
+        from core.exports import streaming_csv_response
+
+        start = datetime(2026, 1, 1, 8, 0)
+        rows = (
+            [i, f'Origin {i}', f'Destination {i}', (start + timedelta(minutes=i)).isoformat(), i * 7 % 500, 'Completed']
+            for i in range(200_000)
+        )
+        response = streaming_csv_response(
+            'synthetic', ['Trip ID', 'Origin', 'Destination', 'Start', 'Distance', 'Status'], rows
+        )
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="synthetic.csv"')
+
+        tracemalloc.start()
+        try:
+            chunks = iter(response.streaming_content)
+            self.assertEqual(next(chunks), b'Trip ID,Origin,Destination,Start,Distance,Status\r\n')
+            total_bytes = lines = 0
+            for chunk in chunks:
+                total_bytes += len(chunk)
+                lines += chunk.count(b'\n')
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(lines, 200_000)
+        self.assertGreater(total_bytes, 10 * 1024 * 1024)
+        # The whole file is >10 MB; streaming keeps only a chunk alive at a time
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+    def test_iter_values_reads_projection_in_chunks(self):
+        from core.exports import iter_values
+
+        vtype = VehicleType.objects.create(name='Export Car', category='personal')
+        for i in range(5):
+            Vehicle.objects.create(
+                vehicle_type=vtype, make='Maruti', model='Swift', year=2022,
+                license_plate=f'TN01EX000{i}', vin=f'VINEXPORT0000000{i}',
+                acquisition_date=date.today(),
+            )
+        rows = list(iter_values(
+            Vehicle.objects.filter(vehicle_type=vtype).order_by('license_plate'),
+            ['license_plate', 'vehicle_type__name'], chunk_size=2,
+        ))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0], {'license_plate': 'TN01EX0000', 'vehicle_type__name': 'Export Car'})
+
+        # Sliced querysets stop at the slice; descending order with ties on the key
+        Vehicle.objects.filter(vehicle_type=vtype).update(year=2020)
+        rows = list(iter_values(
+            Vehicle.objects.filter(vehicle_type=vtype).order_by('-year')[:4], ['license_plate'], chunk_size=3,
+        ))
+        self.assertEqual(len({row['license_plate'] for row in rows}), 4)
+        self.assertEqual(rows[0], {'license_plate': 'TN01EX0004'})
+
+    def test_trip_export_view_pages_through_database(self):
+        from datetime import timedelta
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.urls import reverse
+        from django.utils import timezone
+        from trips.models import Trip
+
+        admin = User.objects.create_user(
+            username='exportadmin', password='pass1234', user_type='admin', approval_status='approved',
+        )
+        vtype = VehicleType.objects.create(name='Export Van', category='commercial')
+        vehicle = Vehicle.objects.create(
+            vehicle_type=vtype, make='Tata', model='Ace', year=2022,
+            license_plate='TN01EXV001', vin='VINEXPORTVAN00001', acquisition_date=date.today(),
+        )
+        base = timezone.now() - timedelta(days=1)
+        for i in range(25):
+            Trip.objects.create(
+                vehicle=vehicle, driver=admin,
+                # pairs of trips share a start time, so pages split on ties
+                start_time=base + timedelta(minutes=i // 2), end_time=base + timedelta(hours=1),
+                start_odometer=1000 + i, end_odometer=1010 + i,
+                origin=f'Origin {i}', destination='Depot', purpose='Export test', status='completed',
+            )
+
+        self.client.force_login(admin)
+        with mock.patch('core.exports.CHUNK_SIZE', 4):
+            response = self.client.get(reverse('export_trips'), {'format': 'csv'})
+            self.assertTrue(response.streaming)
+            with CaptureQueriesContext(connection) as ctx:
+                lines = b''.join(response.streaming_content).decode().splitlines()
+
+        origins = [line.split(',')[1] for line in lines[1:]]
+        self.assertEqual(len(origins), 25)
+        self.assertEqual(len(set(origins)), 25)
+        self.assertEqual(origins[0], 'Origin 24')  # newest first
+        pages = [q['sql'] for q in ctx.captured_queries if 'trips_trip' in q['sql'] and 'LIMIT 4' in q['sql']]
+        self.assertEqual(len(pages), 7)
@@ -0,0 +1,142 @@
+"""
+Versioned cache for the admin/manager dashboard sections.
+
+Each dashboard section (vehicle status, ongoing trips, fuel charts, ...)
+is cached on its own under a key that embeds the version of every model
+it reads. ``dashboard.signals`` bumps a model's version when a row is
+saved or deleted (after commit), so the sections reading that model miss
+on the next load and are recomputed, while the other sections stay
+cached. The daily report rollups are written in bulk, so
+``reports.rollups`` bumps ``reports.DailyVehicleRollup`` itself after each
+refresh or rebuild. The TTL only bounds staleness from other writes that
+bypass signals (bulk ``update()``).
+
+A miss is recomputed by one request at a time: the first takes a lock
+(``cache.add``); the others serve the section's last computed value, or
+wait briefly for the new one when there is none yet, instead of all
+running the same queries at once.
+"""
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SECTION_TTL = 10 * 60        # safety net; writes invalidate through versions
+STALE_TTL = 60 * 60
+LOCK_TIMEOUT = 30
+LOCK_WAIT_SECONDS = 2.0
+LOCK_POLL_SECONDS = 0.05
+
+
+def _version_key(label):
+    return f'dashboard_version:{label}'
+
+
+def _initial_version():
+    # Start from the clock so a version key lost from the cache can never
+    # come back at a number some stale section key was built from.
+    return int(time.time() * 1000)
+
+
+def bump_version(label):
+    """Invalidate every section reading the model ``label`` ('app.Model')."""
+    key = _version_key(label)
+    try:
+        cache.incr(key)
+    except ValueError:
+        try:
+            cache.set(key, _initial_version(), None)
+        except Exception:
+            pass  # Cache backend down
+    except Exception:
+        pass  # Cache backend down
+
+
+def get_versions(labels):
+    """Current version of each model label; missing ones are initialised."""
+    keys = {label: _version_key(label) for label in labels}
+    try:
+        found = cache.get_many(list(keys.values()))
+    except Exception:
+        return None  # Cache backend down
+    versions = {}
+    for label, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = _initial_version()
+            try:
+                if not cache.add(key, version, None):
+                    version = cache.get(key, version)
+            except Exception:
+                return None
+        versions[label] = version
+    return versions
+
+
+def section_key(name, sources, versions, extra=''):
+    parts = [str(versions[label]) for label in sorted(sources)]
+    return f'dashboard:{name}:{extra}:' + '.'.join(parts)
+
+
+def _stale_key(name, extra):
+    return f'dashboard:{name}:{extra}:last'
+
+
+def cached_section(name, sources, compute, extra=''):
+    """
+    The value of dashboard section ``name``, from cache or ``compute()``.
+
+    Args:
+        name: section name, part of the cache key
+        sources: model labels the section reads; their versions are in the key
+        compute: callable returning the (picklable) section value
+        extra: more key text for values that also depend on e.g. the date
+    """
+    versions = get_versions(sources)
+    if versions is None:
+        return compute()  # Cache backend down
+
+    key = section_key(name, sources, versions, extra)
+    stale_key = _stale_key(name, extra)
+    lock_key = f'{key}:lock'
+    try:
+        value = cache.get(key)
+        if value is not None:
+            return value
+        # add() returns None rather than False when django-redis swallows a
+        # connection error; treat that as acquired.
+        acquired = cache.add(lock_key, 1, LOCK_TIMEOUT) is not False
+    except Exception:
+        return compute()
+
+    if not acquired:
+        try:
+            value = cache.get(stale_key)
+            if value is not None:
+                return value
+            deadline = time.monotonic() + LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                value = cache.get(key)
+                if value is not None:
+                    return value
+        except Exception:
+            pass
+        logger.info("Dashboard section %s still locked, computing it here", name)
+        return compute()
+
+    try:
+        value = compute()
+        try:
+            cache.set(key, value, SECTION_TTL)
+            cache.set(stale_key, value, STALE_TTL)
+        except Exception:
+            pass  # Cache backend down — still works, just no caching
+        return value
+    finally:
+        try:
+            cache.delete(lock_key)
+        except Exception:
+            pass
@@ -0,0 +1,174 @@
+"""
+Driving hours and distance charts for the driver dashboard.
+
+Only the chart windows are read: monthly and weekly totals are grouped
+in the database (``TruncMonth`` / ``TruncWeek`` in IST), and the daily
+chart fetches just the start and end times of trips overlapping the last
+14 days, which ``split_hours_by_day`` spreads over the IST days they
+cover in one vectorized step. The result is cached per driver under a
+version bumped whenever one of the driver's trips changes (see
+``dashboard.signals``).
+"""
+from calendar import month_name
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from django.db.models import Count, DurationField, ExpressionWrapper, F, IntegerField, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from trips.models import Trip
+
+from .cache import cached_section
+
+IST = ZoneInfo('Asia/Kolkata')
+MONTHS = 6
+WEEKS = 6
+DAYS = 14
+DAY_SECONDS = 24 * 3600
+
+
+def driver_version_label(driver_id):
+    """Cache version label bumped whenever one of the driver's trips changes."""
+    return f'driver_trips:{driver_id}'
+
+
+def month_starts(today, count=MONTHS):
+    """First day of the current month and the ``count - 1`` before it, oldest first."""
+    starts = []
+    year, month = today.year, today.month
+    for _ in range(count):
+        starts.append(today.replace(year=year, month=month, day=1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return starts[::-1]
+
+
+def split_hours_by_day(starts, ends, first_day, days):
+    """
+    Hours of each interval falling on each of ``days`` consecutive IST days.
+
+    Args:
+        starts, ends: epoch seconds of the intervals
+        first_day: the first IST date of the window
+
+    Returns:
+        float array of length ``days``: hours per day, overlaps summed
+    """
+    window_start = datetime.combine(first_day, time.min, tzinfo=IST).timestamp()
+    # IST has no DST, so day boundaries are a fixed 24 h apart
+    day_starts = window_start + DAY_SECONDS * np.arange(days)
+    starts = np.asarray(starts, dtype=np.float64)[:, None]
+    ends = np.asarray(ends, dtype=np.float64)[:, None]
+    overlap = np.minimum(ends, day_starts + DAY_SECONDS) - np.maximum(starts, day_starts)
+    return np.clip(overlap, 0, None).sum(axis=0) / 3600.0
+
+
+def _completed_trips(driver_id):
+    return Trip.objects.filter(
+        driver_id=driver_id,
+        status='completed',
+        is_deleted=False,
+        end_time__isnull=False,
+    )
+
+
+def _trip_hours():
+    return Sum(ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField()))
+
+
+def _hours(duration):
+    return duration.total_seconds() / 3600 if duration else 0
+
+
+def compute_driver_hours(driver_id, today):
+    """Chart data of ``add_driver_specific_hours_data`` for one driver (four queries)."""
+    trips = _completed_trips(driver_id)
+    months = month_starts(today)
+    window_start = datetime.combine(months[0], time.min, tzinfo=IST)
+
+    # Monthly hours and distance
+    monthly = {
+        item['month'].date(): item
+        for item in trips.filter(start_time__gte=window_start)
+        .annotate(month=TruncMonth('start_time', tzinfo=IST))
+        .values('month')
+        .annotate(
+            duration=_trip_hours(),
+            distance=Sum(F('end_odometer') - F('start_odometer'), output_field=IntegerField()),
+        )
+        .order_by()
+    }
+    driver_hours = []
+    driver_months = []
+    for month_date in months:
+        item = monthly.get(month_date, {})
+        driver_hours.append({
+            'month': month_name[month_date.month],
+            'hours': round(_hours(item.get('duration')), 1),
+        })
+        driver_months.append({
+            'month': month_name[month_date.month],
+            'distance': int(item.get('distance') or 0),
+        })
+
+    # Weekly hours, by the Monday the trips started in
+    this_monday = today - timedelta(days=today.weekday())
+    week_starts = [this_monday - timedelta(weeks=i) for i in range(WEEKS - 1, -1, -1)]
+    weekly = {
+        item['week'].date(): item['duration']
+        for item in trips.filter(start_time__gte=datetime.combine(week_starts[0], time.min, tzinfo=IST))
+        .annotate(week=TruncWeek('start_time', tzinfo=IST))
+        .values('week')
+        .annotate(duration=_trip_hours())
+        .order_by()
+    }
+    driver_weekly_activity = [
+        {'week': f"Week {week_start.isocalendar()[1]}", 'hours': round(_hours(weekly.get(week_start)), 1)}
+        for week_start in week_starts
+    ]
+
+    # Daily hours, multi-day trips split across the IST days they cover
+    first_day = today - timedelta(days=DAYS - 1)
+    daily_start = datetime.combine(first_day, time.min, tzinfo=IST)
+    spans = list(
+        trips.filter(end_time__gt=daily_start).filter(end_time__gt=F('start_time'))
+        .values_list('start_time', 'end_time')
+    )
+    hours_per_day = split_hours_by_day(
+        [start.timestamp() for start, _ in spans],
+        [end.timestamp() for _, end in spans],
+        first_day,
+        DAYS,
+    )
+    driver_daily_activity = [
+        {'date': (first_day + timedelta(days=i)).strftime('%b %d'), 'hours': round(float(hours), 1)}
+        for i, hours in enumerate(hours_per_day)
+    ]
+
+    trip_purposes = (
+        Trip.objects.filter(driver_id=driver_id, status='completed', is_deleted=False)
+        .values('purpose')
+        .annotate(count=Count('id'))
+        .order_by('-count')
+    )
+
+    return {
+        'driver_hours': driver_hours,
+        'driver_daily_activity': driver_daily_activity,
+        'driver_weekly_activity': driver_weekly_activity,
+        'trip_purpose_data': [
+            {'name': item['purpose'] or 'Not specified', 'count': item['count']}
+            for item in trip_purposes
+        ],
+        'driver_months': driver_months,
+    }
+
+
+def driver_hours_data(driver_id, today):
+    """``compute_driver_hours``, cached until one of the driver's trips changes."""
+    return cached_section(
+        f'driver_hours_{driver_id}',
+        [driver_version_label(driver_id)],
+        lambda: compute_driver_hours(driver_id, today),
+        extra=today.isoformat(),
+    )
@@ -0,0 +1,47 @@
+"""
+Bump the dashboard cache version of a model when its rows change, so the
+dashboard sections reading it are recomputed on the next load (see
+``dashboard.cache``). The bump runs after commit, so a request that
+refills a section always reads the committed data. Trip changes also
+bump the trip driver's own version, which keys the driver hours charts;
+the driver a trip had before the save (loaded by ``Trip.save``) is
+bumped too, so reassigning it refreshes the charts of the driver it left.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from trips.signals import old_trip_values
+
+from .cache import bump_version
+from .driver_hours import driver_version_label
+
+WATCHED_MODELS = [
+    'trips.Trip',
+    'accidents.Accident',
+    'maintenance.Maintenance',
+    'documents.Document',
+    'fuel.FuelTransaction',
+    'vehicles.Vehicle',
+    'vehicles.VehicleType',
+]
+
+
+def bump_dashboard_version(sender, instance, **kwargs):
+    labels = [sender._meta.label]
+    if labels[0] == 'trips.Trip':
+        old = old_trip_values(instance)
+        old_driver_id = old['driver_id'] if old else None
+        for driver_id in {instance.driver_id, old_driver_id} - {None}:
+            labels.append(driver_version_label(driver_id))
+
+    def bump():
+        for label in labels:
+            bump_version(label)
+
+    transaction.on_commit(bump)
+
+
+for _label in WATCHED_MODELS:
+    receiver(post_save, sender=_label, dispatch_uid=f'dashboard_save_{_label}')(bump_dashboard_version)
+    receiver(post_delete, sender=_label, dispatch_uid=f'dashboard_delete_{_label}')(bump_dashboard_version)
@@ -2,14 +2,22 @@
 Tests for the dashboard module.
 Run with: python manage.py test dashboard
 """
-from datetime import date
+from datetime import date, datetime, timedelta
+from unittest import mock
 
+from django.core.cache import cache
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
+from trips.models import Trip
 from vehicles.models import Vehicle, VehicleType
 
+from . import cache as dashboard_cache
+from .driver_hours import IST, compute_driver_hours, driver_hours_data, split_hours_by_day
+from .views import DashboardView
+
 User = get_user_model()
 
 
@@ -107,3 +115,182 @@ class OngoingTripsByTypeAPITests(TestCase):
         response = self.client.get(reverse('ongoing_trips_by_type_api'))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class DashboardSectionCacheTests(TestCase):
+    """Admin dashboard sections are cached per section and invalidated by writes."""
+
+    def setUp(self):
+        cache.clear()
+        self.vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=self.vtype, make='Ashok', model='Dost', year=2023,
+            license_plate='TN01DC0001', vin='VINDCACHE00000001',
+            status='available', ownership_type='company',
+            acquisition_date=date.today(),
+        )
+        self.driver = User.objects.create_user(
+            username='cachedriver', password='pass1234',
+            user_type='driver', approval_status='approved',
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def _admin_context(self):
+        context = {}
+        DashboardView().add_admin_manager_data(context)
+        return context
+
+    def test_trip_write_refreshes_only_trip_sections(self):
+        self.assertEqual(self._admin_context()['active_trips'], 0)
+
+        with mock.patch.object(DashboardView, 'get_recent_accidents_section') as accidents, \
+                mock.patch.object(DashboardView, 'get_ongoing_trips_section') as ongoing:
+            self._admin_context()
+        accidents.assert_not_called()
+        ongoing.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Trip.objects.create(
+                vehicle=self.vehicle, driver=self.driver, start_time=timezone.now(),
+                start_odometer=100, origin='Chennai', purpose='Delivery', status='ongoing',
+            )
+
+        with mock.patch.object(DashboardView, 'get_recent_accidents_section') as accidents:
+            context = self._admin_context()
+        accidents.assert_not_called()
+        self.assertEqual(context['active_trips'], 1)
+        self.assertEqual(context['ongoing_trips_summary'], {'Truck': 1})
+
+    def test_vehicle_and_rollup_writes_refresh_fuel_section(self):
+        from reports import rollups
+
+        self._admin_context()
+        with mock.patch.object(DashboardView, 'get_fuel_expenses_section', return_value={}) as fuel:
+            self._admin_context()
+        fuel.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehicle.ownership_type = 'personal'
+            self.vehicle.save()
+        with mock.patch.object(DashboardView, 'get_fuel_expenses_section', return_value={}) as fuel:
+            self._admin_context()
+        fuel.assert_called_once()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rollups.refresh(vehicle_keys=[(date.today(), self.vehicle.pk)])
+        with mock.patch.object(DashboardView, 'get_fuel_expenses_section', return_value={}) as fuel:
+            self._admin_context()
+        fuel.assert_called_once()
+
+    def test_locked_section_serves_last_value(self):
+        compute = mock.Mock(return_value={'value': 1})
+        self.assertEqual(dashboard_cache.cached_section('test', ['trips.Trip'], compute), {'value': 1})
+
+        dashboard_cache.bump_version('trips.Trip')
+        versions = dashboard_cache.get_versions(['trips.Trip'])
+        key = dashboard_cache.section_key('test', ['trips.Trip'], versions)
+        cache.add(f'{key}:lock', 1, 30)  # another request is recomputing
+
+        compute.return_value = {'value': 2}
+        self.assertEqual(dashboard_cache.cached_section('test', ['trips.Trip'], compute), {'value': 1})
+        self.assertEqual(compute.call_count, 1)
+
+        cache.delete(f'{key}:lock')
+        self.assertEqual(dashboard_cache.cached_section('test', ['trips.Trip'], compute), {'value': 2})
+
+    @mock.patch('dashboard.cache.LOCK_WAIT_SECONDS', 0.1)
+    def test_locked_section_without_last_value_computes_after_wait(self):
+        versions = dashboard_cache.get_versions(['trips.Trip'])
+        key = dashboard_cache.section_key('test', ['trips.Trip'], versions)
+        cache.add(f'{key}:lock', 1, 30)
+        compute = mock.Mock(return_value={'value': 3})
+        self.assertEqual(dashboard_cache.cached_section('test', ['trips.Trip'], compute), {'value': 3})
+
+
+class DriverHoursTests(TestCase):
+    """Driver hours charts are aggregated in the database over bounded windows."""
+
+    def setUp(self):
+        cache.clear()
+        self.vtype = VehicleType.objects.create(name='Bus', category='commercial')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=self.vtype, make='Eicher', model='Skyline', year=2021,
+            license_plate='TN01DH0001', vin='VINDHOURS00000001',
+            status='available', ownership_type='company',
+            acquisition_date=date.today(),
+        )
+        self.driver = User.objects.create_user(
+            username='hoursdriver', password='pass1234',
+            user_type='driver', approval_status='approved',
+        )
+        self.today = date(2026, 3, 18)  # a Wednesday
+
+    def tearDown(self):
+        cache.clear()
+
+    def _trip(self, start, end, start_odometer=1000, end_odometer=1050):
+        return Trip.objects.create(
+            vehicle=self.vehicle, driver=self.driver, start_time=start, end_time=end,
+            start_odometer=start_odometer, end_odometer=end_odometer,
+            origin='Chennai', purpose='Route', status='completed', entry_type='manual',
+        )
+
+    def _ist(self, day, hour, minute=0):
+        return datetime(day.year, day.month, day.day, hour, minute, tzinfo=IST)
+
+    def test_split_hours_by_day(self):
+        first_day = date(2026, 3, 1)
+        starts = [self._ist(date(2026, 3, 1), 22).timestamp(), self._ist(date(2026, 3, 3), 9).timestamp()]
+        ends = [self._ist(date(2026, 3, 2), 2).timestamp(), self._ist(date(2026, 3, 3), 10, 30).timestamp()]
+        hours = split_hours_by_day(starts, ends, first_day, 3)
+        self.assertEqual([round(h, 2) for h in hours], [2.0, 2.0, 1.5])
+        self.assertEqual(split_hours_by_day([], [], first_day, 2).tolist(), [0.0, 0.0])
+
+    def test_charts_use_ist_days_and_bounded_windows(self):
+        # Overnight trip across the IST midnight before "today"
+        self._trip(self._ist(self.today - timedelta(days=1), 23), self._ist(self.today, 1, 30))
+        # Early-morning IST trip that is still the previous day in UTC
+        self._trip(self._ist(self.today, 3), self._ist(self.today, 4), 1050, 1080)
+        # Outside every window
+        self._trip(self._ist(date(2025, 1, 5), 9), self._ist(date(2025, 1, 5), 12), 900, 950)
+
+        with self.assertNumQueries(4):
+            data = compute_driver_hours(self.driver.id, self.today)
+
+        self.assertEqual([item['month'] for item in data['driver_hours']],
+                         ['October', 'November', 'December', 'January', 'February', 'March'])
+        self.assertEqual(data['driver_hours'][-1]['hours'], 3.5)
+        self.assertEqual(data['driver_months'][-1]['distance'], 80)
+        self.assertEqual(sum(item['hours'] for item in data['driver_hours']), 3.5)
+        self.assertEqual(data['driver_daily_activity'][-2], {'date': 'Mar 17', 'hours': 1.0})
+        self.assertEqual(data['driver_daily_activity'][-1], {'date': 'Mar 18', 'hours': 2.5})
+        self.assertEqual(len(data['driver_daily_activity']), 14)
+        self.assertEqual(data['driver_weekly_activity'][-1], {'week': 'Week 12', 'hours': 3.5})
+        self.assertEqual(data['trip_purpose_data'], [{'name': 'Route', 'count': 3}])
+
+    def test_cached_until_driver_trip_changes(self):
+        self.assertEqual(driver_hours_data(self.driver.id, self.today)['driver_hours'][-1]['hours'], 0)
+        with self.assertNumQueries(0):
+            driver_hours_data(self.driver.id, self.today)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._trip(self._ist(self.today, 9), self._ist(self.today, 11))
+        self.assertEqual(driver_hours_data(self.driver.id, self.today)['driver_hours'][-1]['hours'], 2.0)
+
+    def test_reassigned_trip_refreshes_both_drivers(self):
+        other = User.objects.create_user(
+            username='otherdriver', password='pass1234',
+            user_type='driver', approval_status='approved',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            trip = self._trip(self._ist(self.today, 9), self._ist(self.today, 11))
+        self.assertEqual(driver_hours_data(self.driver.id, self.today)['driver_hours'][-1]['hours'], 2.0)
+        self.assertEqual(driver_hours_data(other.id, self.today)['driver_hours'][-1]['hours'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            trip.driver = other
+            trip.save()
+        self.assertEqual(driver_hours_data(self.driver.id, self.today)['driver_hours'][-1]['hours'], 0)
+        self.assertEqual(driver_hours_data(other.id, self.today)['driver_hours'][-1]['hours'], 2.0)
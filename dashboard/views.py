@@ -5,8 +5,7 @@ from django.db.models.functions import Extract
 from django.utils import timezone
 from django.core.cache import cache
 from django.db import models
-from datetime import timedelta, date, datetime, time
-from pytz import timezone as pytz_timezone
+from datetime import timedelta
 from calendar import month_name
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
@@ -17,6 +16,9 @@ from maintenance.models import Maintenance
 from fuel.models import FuelTransaction
 from accidents.models import Accident
 from documents.models import Document
+from reports.models import DailyVehicleRollup
+from .cache import cached_section
+from .driver_hours import driver_hours_data
 import json
 import logging
 
@@ -57,52 +59,48 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
             
         return context
     
-    def get_completed_trips_with_duration(self, filter_params=None):
-        """Helper method to get completed trips and safely calculate duration"""
-        # Start with base query for completed trips
-        query = Trip.objects.filter(status='completed', end_time__isnull=False, is_deleted=False)
-        
-        # Apply additional filters if provided
-        if filter_params:
-            query = query.filter(**filter_params)
-            
-        # Fetch the trips
-        trips = list(query)
-        
-        # Calculate duration for each trip
-        for trip in trips:
-            if trip.start_time and trip.end_time:
-                try:
-                    # Calculate duration as timedelta - use calculated_duration instead of duration
-                    trip.calculated_duration = trip.end_time - trip.start_time
-                    # Also calculate hours as float for easier aggregation
-                    trip.duration_hours = trip.calculated_duration.total_seconds() / 3600
-                except Exception as e:
-                    trip.calculated_duration = timedelta(seconds=0)
-                    trip.duration_hours = 0
-            else:
-                trip.calculated_duration = timedelta(seconds=0)
-                trip.duration_hours = 0
-                
-        return trips
-    
     def add_admin_manager_data(self, context):
-        # Try to serve from cache first (2-minute TTL)
-        cache_key = 'admin_dashboard_context'
-        try:
-            cached = cache.get(cache_key)
-            if cached:
-                context.update(cached)
-                return
-        except Exception:
-            pass  # Cache backend down — compute fresh data
+        # Each section is cached on its own and invalidated when the models
+        # it reads change (see dashboard.cache / dashboard.signals)
+        today = timezone.now().date()
+        first_of_month = today.replace(day=1)
 
-        # Vehicle status distribution - company vehicles only
-        context['vehicle_status'] = list(Vehicle.objects.filter(ownership_type='company').values('status').annotate(count=Count('id')))
-        
-        # Vehicles by type - company vehicles only
-        context['vehicle_types'] = list(Vehicle.objects.filter(ownership_type='company').values('vehicle_type__name').annotate(count=Count('id')))
-        
+        context.update(cached_section(
+            'fleet', ['vehicles.Vehicle', 'vehicles.VehicleType'], self.get_fleet_section
+        ))
+        context.update(cached_section(
+            'ongoing_trips', ['trips.Trip', 'vehicles.Vehicle', 'vehicles.VehicleType'],
+            self.get_ongoing_trips_section
+        ))
+        context.update(cached_section(
+            'recent_accidents', ['accidents.Accident'], self.get_recent_accidents_section
+        ))
+        context.update(cached_section(
+            'upcoming_maintenance', ['maintenance.Maintenance'],
+            lambda: self.get_upcoming_maintenance_section(today), extra=today.isoformat()
+        ))
+        context.update(cached_section(
+            'expiring_documents', ['documents.Document'],
+            lambda: self.get_expiring_documents_section(today), extra=today.isoformat()
+        ))
+
+        # Add fuel expenses data
+        self.add_fuel_expenses_data(context)
+
+        context.update(cached_section(
+            'trip_stats', ['trips.Trip'],
+            lambda: self.get_trip_stats_section(first_of_month), extra=first_of_month.isoformat()
+        ))
+
+    def get_fleet_section(self):
+        return {
+            # Vehicle status distribution - company vehicles only
+            'vehicle_status': list(Vehicle.objects.filter(ownership_type='company').values('status').annotate(count=Count('id'))),
+            # Vehicles by type - company vehicles only
+            'vehicle_types': list(Vehicle.objects.filter(ownership_type='company').values('vehicle_type__name').annotate(count=Count('id'))),
+        }
+
+    def get_ongoing_trips_section(self):
         # Single query for ongoing trips — reused for list, grouped view, and count
         ongoing_trips = list(Trip.objects.filter(
             vehicle__ownership_type='company',
@@ -110,9 +108,6 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
             is_deleted=False
         ).select_related('vehicle', 'driver', 'vehicle__vehicle_type'))
         
-        context['ongoing_trips'] = ongoing_trips
-        context['active_trips'] = len(ongoing_trips)
-        
         # Group ongoing trips by vehicle type (using the already-fetched list)
         ongoing_trips_by_type = {}
         ongoing_trips_summary = {}
@@ -128,35 +123,38 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
                 ongoing_trips_summary[vehicle_type] = 0
             ongoing_trips_summary[vehicle_type] += 1
         
-        context['ongoing_trips_by_type'] = ongoing_trips_by_type
-        context['ongoing_trips_summary'] = ongoing_trips_summary
-        
+        return {
+            'ongoing_trips': ongoing_trips,
+            'active_trips': len(ongoing_trips),
+            'ongoing_trips_by_type': ongoing_trips_by_type,
+            'ongoing_trips_summary': ongoing_trips_summary,
+        }
+
+    def get_recent_accidents_section(self):
         # Recent accidents - company vehicles only
-        context['recent_accidents'] = list(Accident.objects.filter(
+        return {'recent_accidents': list(Accident.objects.filter(
             vehicle__ownership_type='company'
-        ).order_by('-date_time')[:5])
-        
+        ).order_by('-date_time')[:5])}
+
+    def get_upcoming_maintenance_section(self, today):
         # Upcoming maintenance - company vehicles only
-        today = timezone.now().date()
-        context['upcoming_maintenance'] = list(Maintenance.objects.filter(
+        return {'upcoming_maintenance': list(Maintenance.objects.filter(
             vehicle__ownership_type='company',
             status='scheduled',
             scheduled_date__gte=today
-        ).order_by('scheduled_date')[:5])
-        
+        ).order_by('scheduled_date')[:5])}
+
+    def get_expiring_documents_section(self, today):
         # Upcoming document renewals - company vehicles only
         next_month = today + timedelta(days=30)
-        context['expiring_documents'] = list(Document.objects.filter(
+        return {'expiring_documents': list(Document.objects.filter(
             vehicle__ownership_type='company',
             expiry_date__range=[today, next_month]
-        ).order_by('expiry_date')[:5])
-        
-        # Add fuel expenses data
-        self.add_fuel_expenses_data(context)
-        
+        ).order_by('expiry_date')[:5])}
+
+    def get_trip_stats_section(self, first_of_month):
         # Vehicle utilization (trips per vehicle this month) - company vehicles only
-        first_of_month = today.replace(day=1)
-        context['vehicle_utilization'] = list(Trip.objects.filter(
+        vehicle_utilization = list(Trip.objects.filter(
             vehicle__ownership_type='company',
             start_time__gte=first_of_month,
             is_deleted=False
@@ -201,51 +199,43 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
                 'formatted_duration': formatted_duration
             })
         
-        context['driver_performance'] = driver_perf_list
-
-        # Cache the computed context for 2 minutes
-        # (exclude non-serializable objects — querysets were already evaluated via list())
-        try:
-            cacheable_keys = [
-                'vehicle_status', 'vehicle_types', 'active_trips',
-                'ongoing_trips_by_type', 'ongoing_trips_summary',
-                'recent_accidents', 'upcoming_maintenance', 'expiring_documents',
-                'vehicle_utilization', 'driver_performance',
-                'monthly_fuel', 'weekly_fuel', 'daily_fuel',
-            ]
-            cache_data = {k: context[k] for k in cacheable_keys if k in context}
-            cache.set(cache_key, cache_data, 120)  # 2 minutes
-        except Exception:
-            pass  # Cache backend down — still works, just no caching
+        return {
+            'vehicle_utilization': vehicle_utilization,
+            'driver_performance': driver_perf_list,
+        }
     
     def add_fuel_expenses_data(self, context):
         """Add fuel expenses data with multiple time granularities.
-        Uses Redis cache (5 min TTL) to avoid recalculating on every dashboard load.
+        Cached until a fuel transaction, a vehicle (company/personal) or the
+        daily rollups it reads change (see dashboard.cache).
         """
-        cache_key = 'dashboard_fuel_expenses_data'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                context.update(cached_data)
-                return
-        except Exception:
-            pass  # Cache backend down — compute fresh data
+        today = timezone.now().date()
+        context.update(cached_section(
+            'fuel_expenses', ['fuel.FuelTransaction', 'vehicles.Vehicle', 'reports.DailyVehicleRollup'],
+            lambda: self.get_fuel_expenses_section(today), extra=today.isoformat()
+        ))
+
+    def get_fuel_expenses_section(self, today):
+        context = {}
         
         # Get date ranges
-        today = timezone.now().date()
         last_six_months = today - timedelta(days=180)
         last_twelve_weeks = today - timedelta(weeks=12)
         last_thirty_days = today - timedelta(days=30)
         
         # Monthly fuel expenses - company vehicles only
-        monthly_fuel = FuelTransaction.objects.filter(
+        # Spend per vehicle and day comes from the daily report rollups
+        company_fuel_days = DailyVehicleRollup.objects.filter(
             vehicle__ownership_type='company',
+            fuel_count__gt=0,
+        )
+        monthly_fuel = company_fuel_days.filter(
             date__gte=last_six_months
         ).annotate(
             month=Extract('date', 'month'),
             year=Extract('date', 'year')
         ).values('month', 'year').annotate(
-            total=Sum('total_cost')
+            total=Sum('fuel_spend')
         ).order_by('year', 'month')
         
         # Convert month numbers to month names
@@ -265,12 +255,11 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
         
         # Weekly fuel expenses - single query with grouping instead of 12 separate queries
         twelve_weeks_ago = today - timedelta(weeks=12)
-        weekly_fuel_qs = FuelTransaction.objects.filter(
-            vehicle__ownership_type='company',
+        weekly_fuel_qs = company_fuel_days.filter(
             date__gte=twelve_weeks_ago,
             date__lte=today
         ).values('date').annotate(
-            total=Sum('total_cost')
+            total=Sum('fuel_spend')
         ).order_by('date')
         
         # Build a dict of date -> total for fast lookup
@@ -296,12 +285,11 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
         
         # Daily fuel expenses - single query instead of 30 separate queries
         thirty_days_ago = today - timedelta(days=29)
-        daily_fuel_qs = FuelTransaction.objects.filter(
-            vehicle__ownership_type='company',
+        daily_fuel_qs = company_fuel_days.filter(
             date__gte=thirty_days_ago,
             date__lte=today
         ).values('date').annotate(
-            total=Sum('total_cost')
+            total=Sum('fuel_spend')
         ).order_by('date')
         
         daily_totals_map = {item['date']: item['total'] for item in daily_fuel_qs}
@@ -318,16 +306,7 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
         if all(item['total'] == 0 for item in context['daily_fuel']):
             context['no_daily_fuel_data'] = True
         
-        # Cache the computed fuel data for 5 minutes
-        try:
-            fuel_cache_data = {
-                'monthly_fuel': context.get('monthly_fuel', []),
-                'weekly_fuel': context.get('weekly_fuel', []),
-                'daily_fuel': context.get('daily_fuel', []),
-            }
-            cache.set(cache_key, fuel_cache_data, 300)  # 5 minutes
-        except Exception:
-            pass  # Cache backend down — still works, just no caching
+        return context
     
     def add_vehicle_manager_data(self, context):
         # Vehicle maintenance summary
@@ -376,37 +355,10 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
             expiry_date__range=[today, next_month]
         ).order_by('expiry_date')[:10]
         
-        # Fuel efficiency by vehicle - single optimized query instead of N+1
-        from django.db.models import Subquery, OuterRef, DecimalField, Value, IntegerField
-        from django.db.models.functions import Coalesce
-        
-        # Annotate vehicles with total distance and total fuel in two subqueries
+        # Fuel efficiency by vehicle - one query over the daily report rollups
         vehicle_efficiency = Vehicle.objects.annotate(
-            total_distance=Coalesce(
-                Subquery(
-                    Trip.objects.filter(
-                        vehicle=OuterRef('pk'),
-                        status='completed',
-                        is_deleted=False
-                    ).values('vehicle').annotate(
-                        dist=Sum(
-                            F('end_odometer') - F('start_odometer'),
-                            output_field=IntegerField()
-                        )
-                    ).values('dist')[:1],
-                    output_field=IntegerField()
-                ), Value(0), output_field=IntegerField()
-            ),
-            total_fuel=Coalesce(
-                Subquery(
-                    FuelTransaction.objects.filter(
-                        vehicle=OuterRef('pk')
-                    ).values('vehicle').annotate(
-                        fuel=Sum('quantity')
-                    ).values('fuel')[:1],
-                    output_field=DecimalField()
-                ), Value(0, output_field=DecimalField()), output_field=DecimalField()
-            )
+            total_distance=Sum('daily_rollups__distance_km'),
+            total_fuel=Sum('daily_rollups__fuel_litres'),
         ).filter(total_fuel__gt=0)
         
         context['fuel_efficiency'] = [
@@ -768,204 +720,8 @@ class DashboardView(CompanyDashboardPermissionMixin, LoginRequiredMixin, Templat
         context['weekly_activity_json'] = json.dumps(weekly_activity_data)
     
     def add_driver_specific_hours_data(self, context, driver):
-        """Add hours tracking data for a specific driver"""
-        # Get date range for analysis - extend to ensure we see something
-        end_date = timezone.now().date()
-        start_date_monthly = end_date - timedelta(days=180)  # Last 6 months for monthly view
-        daily_start = end_date - timedelta(days=14)  # Last 14 days
-        weekly_start = end_date - timedelta(days=42)  # Last 6 weeks
-        
-        # Get all completed trips for this driver with durations - don't filter by date to ensure we get all data
-        monthly_trips = self.get_completed_trips_with_duration({
-            'driver': driver,
-            'status': 'completed'
-        })
-        
-        # Filter trips for different timeframes
-        daily_trips = [trip for trip in monthly_trips if trip.start_time.date() >= daily_start]
-        weekly_trips = [trip for trip in monthly_trips if trip.start_time.date() >= weekly_start]
-        
-        # Get current month for reference
-        current_month = timezone.now().date().month
-        current_year = timezone.now().date().year
-        
-        # Process monthly hours - initialize dictionary with all recent months
-        monthly_hours_dict = {}
-        for i in range(6):  # Past 6 months 
-            # Calculate month and year correctly
-            month_offset = i
-            month_num = ((current_month - month_offset - 1) % 12) + 1  # -1 because we want to start from the previous month
-            year_offset = (current_month - month_offset - 1) // 12
-            year_num = current_year - year_offset
-            
-            # Create actual date object for the first of that month
-            month_date = date(year_num, month_num, 1)
-            monthly_hours_dict[month_date] = 0
-        
-        # Add real trip data hours
-        for trip in monthly_trips:
-            # Get first day of month from the trip date
-            trip_month = trip.start_time.date().replace(day=1)
-            hours = trip.duration_hours
-            
-            if trip_month in monthly_hours_dict:
-                monthly_hours_dict[trip_month] += hours
-            else:
-                # If we have trip data from months beyond our 6-month window, add it too
-                monthly_hours_dict[trip_month] = hours
-        
-        # Convert to list with month names for the chart
-        context['driver_hours'] = []
-        for month_date, hours in sorted(monthly_hours_dict.items()):
-            month_num = month_date.month
-            month_name_str = month_name[month_num]
-            context['driver_hours'].append({
-                'month': month_name_str,
-                'hours': round(hours, 1)
-            })
-        
-        # Process daily activity - initialize all days first
-        daily_activity_dict = {}
-        for i in range(14):  # Last 14 days
-            day_date = end_date - timedelta(days=i)
-            daily_activity_dict[day_date] = 0
-        
-        # Add real trip data for daily view - FIXED CODE HERE
-        for trip in daily_trips:
-            if not trip.start_time or not trip.end_time or not trip.calculated_duration:
-                continue
-                
-            # Get Indian local time dates for both start and end
-            # Using Asia/Kolkata timezone for India
-            ist = pytz_timezone('Asia/Kolkata')
-            
-            # Convert the datetime to IST if it has a timezone, otherwise assume it's already in IST
-            start_time_ist = trip.start_time.astimezone(ist) if trip.start_time.tzinfo else ist.localize(trip.start_time)
-            end_time_ist = trip.end_time.astimezone(ist) if trip.end_time.tzinfo else ist.localize(trip.end_time)
-            
-            start_date = start_time_ist.date()
-            end_date = end_time_ist.date()
-            
-            # If trip is within the same day in IST
-            if start_date == end_date:
-                if start_date in daily_activity_dict:
-                    daily_activity_dict[start_date] += trip.duration_hours
-                else:
-                    daily_activity_dict[start_date] = trip.duration_hours
-            else:
-                # For multi-day trips, we need to calculate hours per day
-                current_date = start_date
-                total_hours_accounted = 0
-                
-                while current_date <= end_date:
-                    # For each day, calculate start and end boundaries
-                    day_start_dt = datetime.combine(current_date, time.min).replace(tzinfo=ist)
-                    day_end_dt = datetime.combine(current_date, time.max).replace(tzinfo=ist)
-                    
-                    # Find overlap with this day
-                    day_trip_start = max(start_time_ist, day_start_dt)
-                    day_trip_end = min(end_time_ist, day_end_dt)
-                    
-                    # Calculate hours for this day (only if trip overlaps with this day)
-                    if day_trip_start <= day_trip_end:
-                        day_hours = (day_trip_end - day_trip_start).total_seconds() / 3600.0
-                        
-                        if current_date in daily_activity_dict:
-                            daily_activity_dict[current_date] += day_hours
-                        else:
-                            daily_activity_dict[current_date] = day_hours
-                            
-                        total_hours_accounted += day_hours
-                    
-                    # Move to next day
-                    current_date += timedelta(days=1)
-        
-        # Convert to list format for chart
-        context['driver_daily_activity'] = [
-            {'date': date_key.strftime('%b %d'), 'hours': round(hours, 1)}
-            for date_key, hours in sorted(daily_activity_dict.items())
-        ]
-        
-        # Process weekly activity - initialize all weeks first
-        weekly_activity_dict = {}
-        for i in range(6):  # Last 6 weeks
-            # Get Monday of each week
-            week_start = end_date - timedelta(days=end_date.weekday()) - timedelta(weeks=i)
-            weekly_activity_dict[week_start] = 0
-        
-        # Add real trip data for weekly view
-        for trip in weekly_trips:
-            # Get the week start date (Monday)
-            week_start = trip.start_time.date() - timedelta(days=trip.start_time.weekday())
-            hours = trip.duration_hours
-            
-            if week_start in weekly_activity_dict:
-                weekly_activity_dict[week_start] += hours
-            else:
-                weekly_activity_dict[week_start] = hours
-        
-        # Convert to list with week numbers for chart
-        context['driver_weekly_activity'] = []
-        for week_start, hours in sorted(weekly_activity_dict.items()):
-            try:
-                week_number = week_start.isocalendar()[1]  # Get ISO week number
-                context['driver_weekly_activity'].append({
-                    'week': f"Week {week_number}",
-                    'hours': round(hours, 1)
-                })
-            except AttributeError:
-                # Fallback for older Python versions
-                context['driver_weekly_activity'].append({
-                    'week': f"Week of {week_start.strftime('%b %d')}",
-                    'hours': round(hours, 1)
-                })
-        
-        # Add trip purpose distribution
-        trip_purposes = Trip.objects.filter(
-            driver=driver,
-            status='completed',
-            is_deleted=False
-        ).values('purpose').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        context['trip_purpose_data'] = [
-            {'name': item['purpose'] or 'Not specified', 'count': item['count']}
-            for item in trip_purposes
-        ]
-        
-        # Process monthly distance data - initialize all months first
-        monthly_distances_dict = {}
-        for i in range(6):  # Past 6 months
-            # Calculate month and year correctly
-            month_offset = i
-            month_num = ((current_month - month_offset - 1) % 12) + 1  # -1 because we want to start from the previous month
-            year_offset = (current_month - month_offset - 1) // 12
-            year_num = current_year - year_offset
-            
-            # Create actual date object for the first of that month
-            month_date = date(year_num, month_num, 1)
-            monthly_distances_dict[month_date] = 0
-        
-        # Calculate real distance by month from trips
-        for trip in monthly_trips:
-            trip_month = trip.start_time.date().replace(day=1)
-            distance = trip.end_odometer - trip.start_odometer if trip.end_odometer and trip.start_odometer else 0
-            
-            if trip_month in monthly_distances_dict:
-                monthly_distances_dict[trip_month] += distance
-            else:
-                monthly_distances_dict[trip_month] = distance
-        
-        # Convert to list format for the chart
-        context['driver_months'] = []
-        for month_date, distance in sorted(monthly_distances_dict.items()):
-            month_num = month_date.month
-            month_name_str = month_name[month_num]
-            context['driver_months'].append({
-                'month': month_name_str,
-                'distance': int(distance)  # Convert to integer
-            })
+        """Add hours tracking data for a specific driver (see dashboard.driver_hours)"""
+        context.update(driver_hours_data(driver.id, timezone.localdate()))
     
     def add_generator_user_data(self, context):
         """Add generator-specific dashboard data for generator users"""
@@ -10,7 +10,7 @@ import csv
 from datetime import timedelta
 import logging
 
-from .models import AiroTrackDevice, VehicleLocation, LocationHistory
+from .models import AiroTrackDevice, VehicleLocation, LocationHistory, Geofence, GeofenceEvent
 from .airotrack_service import AiroTrackAPI
 
 # Configure logging
@@ -588,6 +588,26 @@ class LocationHistoryAdmin(admin.ModelAdmin):
 
 
 # Register models with custom admin classes
+class GeofenceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'kind', 'shape', 'store', 'label', 'radius_m', 'dwell_seconds', 'is_active')
+    list_filter = ('kind', 'shape', 'is_active')
+    search_fields = ('name', 'label', 'store__name')
+
+
+class GeofenceEventAdmin(admin.ModelAdmin):
+    list_display = ('occurred_at', 'event_type', 'geofence', 'vehicle', 'trip', 'source')
+    list_filter = ('event_type', 'source', 'geofence')
+    search_fields = ('vehicle__license_plate', 'geofence__name')
+    list_select_related = ('geofence', 'vehicle', 'trip')
+    raw_id_fields = ('trip',)
+    
+    def has_add_permission(self, request):
+        # Events are produced by geolocation.geofence
+        return False
+
+
 admin.site.register(AiroTrackDevice, AiroTrackDeviceAdmin)
 admin.site.register(VehicleLocation, VehicleLocationAdmin)
 admin.site.register(LocationHistory, LocationHistoryAdmin)
+admin.site.register(Geofence, GeofenceAdmin)
+admin.site.register(GeofenceEvent, GeofenceEventAdmin)
@@ -191,6 +191,8 @@ class TrackingAdminSite(AdminSite):
                 f"{sync_result['devices_updated']} updated, "
                 f"{sync_result['locations_updated']} locations updated."
             )
+            if sync_result.get('locations_skipped'):
+                messages.warning(request, "Locations were not updated: a scheduled poll is already running.")
         except Exception as e:
             logger.error(f"Sync failed: {str(e)}")
             messages.error(request, f"Synchronization failed: {str(e)}")
@@ -0,0 +1,183 @@
+"""
+Concurrent per-device position fetching for the AiroTrack API.
+
+The AiroTrack positions endpoint rejects comma-separated device IDs, so a
+fleet sync needs one HTTP request per device. Done sequentially a sync takes
+N x latency; here the requests run on a bounded thread pool with:
+
+    - a per-request timeout,
+    - retries with full-jitter exponential backoff for transient failures
+      (timeouts, connection errors, HTTP 429/5xx) — other 4xx are final,
+    - a circuit breaker shared by all fetches in the process: after
+      ``failure_threshold`` consecutive failures the remaining devices are
+      skipped until ``reset_timeout`` has passed, then a single trial
+      request decides whether to close it again,
+    - a report with per-device latency and attempts alongside the merged
+      positions.
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    Thread-safe consecutive-failure circuit breaker.
+
+    closed    - requests flow; failures are counted
+    open      - requests are refused until ``reset_timeout`` has elapsed
+    half-open - one trial request is let through; success closes the
+                circuit, failure opens it again
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._clock() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at >= self.reset_timeout and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("AiroTrack circuit breaker opened after %d failures", self._failures)
+                self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+    def reset(self):
+        self.record_success()
+
+
+def is_retryable(exc):
+    """Transient failures worth another attempt."""
+    if isinstance(exc, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank ``fraction`` percentile of an ascending list (None when empty)."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def fetch_concurrently(fetch_one, device_ids, breaker, concurrency=8, max_retries=2,
+                       backoff_base=0.5, backoff_cap=5.0, sleep=time.sleep):
+    """
+    Call ``fetch_one(device_id)`` for every device on a thread pool.
+
+    ``fetch_one`` returns the device's list of positions or raises a
+    ``requests.RequestException``. Returns a report dict::
+
+        {
+            'positions': [...],            # merged, in device order
+            'devices': {device_id: {'ok', 'attempts', 'latency_ms', 'positions', 'error'}},
+            'succeeded': int, 'failed': int, 'skipped': int,
+            'elapsed_ms': float,
+            'latency_ms': {'p50', 'p95', 'max'},   # over devices that were attempted
+        }
+    """
+    device_ids = list(dict.fromkeys(str(dev_id) for dev_id in device_ids))
+    started = time.perf_counter()
+
+    def run(dev_id):
+        attempts = 0
+        device_started = time.perf_counter()
+        error = None
+        positions = None
+        while True:
+            if not breaker.allow_request():
+                error = 'circuit_open'
+                break
+            attempts += 1
+            try:
+                positions = fetch_one(dev_id)
+                breaker.record_success()
+                error = None
+                break
+            except requests.RequestException as exc:
+                breaker.record_failure()
+                error = str(exc)
+                if attempts > max_retries or not is_retryable(exc):
+                    break
+                sleep(backoff_delay(attempts - 1, backoff_base, backoff_cap))
+        if positions is not None and not isinstance(positions, list):
+            logger.debug("Unexpected response type for device %s: %s", dev_id, type(positions).__name__)
+            positions = []
+        return dev_id, {
+            'ok': positions is not None,
+            'attempts': attempts,
+            'latency_ms': round((time.perf_counter() - device_started) * 1000, 1),
+            'positions': len(positions) if positions else 0,
+            'error': error,
+        }, positions or []
+
+    devices = {}
+    merged = []
+    workers = max(1, min(concurrency, len(device_ids)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='airotrack') as pool:
+        for dev_id, stats, positions in pool.map(run, device_ids):
+            devices[dev_id] = stats
+            merged.extend(positions)
+            if not stats['ok']:
+                logger.error("Failed to fetch positions for device %s: %s", dev_id, stats['error'])
+
+    attempted = sorted(s['latency_ms'] for s in devices.values() if s['attempts'])
+    return {
+        'positions': merged,
+        'devices': devices,
+        'succeeded': sum(1 for s in devices.values() if s['ok']),
+        'failed': sum(1 for s in devices.values() if not s['ok'] and s['attempts']),
+        'skipped': sum(1 for s in devices.values() if not s['attempts']),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'latency_ms': {
+            'p50': percentile(attempted, 0.5),
+            'p95': percentile(attempted, 0.95),
+            'max': attempted[-1] if attempted else None,
+        },
+    }
@@ -1,18 +1,55 @@
 import os
 import requests
 import logging
+import threading
 import time
 from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 from django.utils import timezone
-from django.db import transaction
+from django.db import DataError, IntegrityError, connection, transaction
 from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from core import live_feed
+from core.geo import haversine_km
 from .models import AiroTrackDevice, VehicleLocation, LocationHistory
+from .airotrack_fetch import CircuitBreaker, fetch_concurrently
+from .geofence import safe_process_positions
+from .segments import safe_update_segments
 from vehicles.models import Vehicle
 import urllib3
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Shared by every AiroTrackAPI instance in the process so repeated syncs
+# stop hammering the API while it is down.
+AIROTRACK_CIRCUIT = CircuitBreaker(
+    failure_threshold=int(os.environ.get('AIROTRACK_CIRCUIT_FAILURES', '5')),
+    reset_timeout=float(os.environ.get('AIROTRACK_CIRCUIT_RESET_SECONDS', '30')),
+)
+
+# Errors a single bad position can raise while a chunk is written (a value
+# the column rejects, raw_data that cannot be encoded); the chunk is then
+# retried one vehicle at a time so only that device is counted as failed.
+ROW_WRITE_ERRORS = (IntegrityError, DataError, ValueError, TypeError)
+
+
+def _decimal(value, places, limit):
+    """
+    ``value`` quantised to ``places`` decimals, or None if it is missing,
+    not a finite number or its magnitude exceeds ``limit``.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+    if not number.is_finite() or abs(number) > limit:
+        return None
+    return number.quantize(Decimal(1).scaleb(-places))
+
+
 class AiroTrackAPI:
     """
     Service class to interact with the AiroTrack API for vehicle tracking.
@@ -32,6 +69,30 @@ class AiroTrackAPI:
     POSITIONS_ENDPOINT = "/positions"
     DEVICES_ENDPOINT = "/devices"
     
+    # Per-device position fetching (see airotrack_fetch)
+    FETCH_CONCURRENCY = int(os.environ.get('AIROTRACK_FETCH_CONCURRENCY', '8'))
+    FETCH_TIMEOUT = float(os.environ.get('AIROTRACK_FETCH_TIMEOUT', '10'))
+    FETCH_MAX_RETRIES = int(os.environ.get('AIROTRACK_FETCH_RETRIES', '2'))
+    FETCH_BACKOFF_BASE = 0.5
+    FETCH_BACKOFF_CAP = 5.0
+    
+    # Vehicles written per transaction by update_vehicle_locations
+    LOCATION_WRITE_CHUNK = int(os.environ.get('AIROTRACK_WRITE_CHUNK', '200'))
+    VEHICLE_LOCATION_UPDATE_FIELDS = [
+        'device', 'latitude', 'longitude', 'geohash', 'altitude', 'speed', 'course',
+        'device_time', 'server_time', 'fix_time', 'valid', 'address',
+        'ignition', 'battery_level', 'raw_data',
+    ]
+    
+    # LocationHistory change detection: a fix is only appended to history
+    # when it differs meaningfully from the vehicle's previous fix, or when
+    # nothing has been recorded for HISTORY_HEARTBEAT_SECONDS.
+    HISTORY_MIN_DISTANCE_M = float(os.environ.get('AIROTRACK_HISTORY_MIN_DISTANCE_M', '25'))
+    HISTORY_MIN_SPEED_DELTA_KMH = float(os.environ.get('AIROTRACK_HISTORY_MIN_SPEED_DELTA', '5'))
+    HISTORY_MIN_COURSE_DELTA = float(os.environ.get('AIROTRACK_HISTORY_MIN_COURSE_DELTA', '20'))
+    HISTORY_MOVING_SPEED_KMH = 3.0  # course is noise below this speed
+    HISTORY_HEARTBEAT_SECONDS = int(os.environ.get('AIROTRACK_HISTORY_HEARTBEAT', '900'))
+    
     # Request parameters
     DEFAULT_PARAMS = {
         "status": "ALL",
@@ -65,6 +126,68 @@ class AiroTrackAPI:
             "valid CA bundle and removing this override for production."
         )
         self.last_sync_time = None
+        self.last_fetch_report = None
+        self.last_location_report = None
+        self.last_poll_skipped = False
+        self.circuit = AIROTRACK_CIRCUIT
+        self._local = threading.local()
+    
+    def _thread_session(self):
+        """requests.Session per worker thread (Session is not thread-safe)."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.auth = self.session.auth
+            session.verify = self.session.verify
+            self._local.session = session
+        return session
+    
+    def _fetch_device_positions(self, device_id, params_base):
+        """One positions request for one device; raises on any failure."""
+        params = self.DEFAULT_PARAMS.copy()
+        params.update(params_base)
+        params["deviceId"] = str(device_id)
+        response = self._thread_session().get(
+            f"{self.BASE_URL}{self.POSITIONS_ENDPOINT}", params=params, timeout=self.FETCH_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def fetch_positions(self, device_ids, from_time=None, to_time=None):
+        """
+        Fetch positions for many devices concurrently.
+        
+        Args:
+            device_ids (list): Device IDs to fetch (one request each)
+            from_time (datetime, optional): Start time for position data
+            to_time (datetime, optional): End time for position data
+            
+        Returns:
+            dict: Report from ``airotrack_fetch.fetch_concurrently`` with the
+            merged ``positions`` and per-device latency / attempts / errors
+        """
+        params_base = {}
+        if from_time:
+            params_base["from"] = from_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        if to_time:
+            params_base["to"] = to_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        
+        report = fetch_concurrently(
+            lambda dev_id: self._fetch_device_positions(dev_id, params_base),
+            device_ids,
+            self.circuit,
+            concurrency=self.FETCH_CONCURRENCY,
+            max_retries=self.FETCH_MAX_RETRIES,
+            backoff_base=self.FETCH_BACKOFF_BASE,
+            backoff_cap=self.FETCH_BACKOFF_CAP,
+        )
+        self.last_fetch_report = report
+        logger.info(
+            "AiroTrack positions: %d/%d devices in %.0f ms (p50 %s ms, p95 %s ms, %d skipped by circuit breaker)",
+            report['succeeded'], len(report['devices']), report['elapsed_ms'],
+            report['latency_ms']['p50'], report['latency_ms']['p95'], report['skipped'],
+        )
+        return report
     
     def _make_request(self, endpoint, params=None, method="GET", data=None, timeout=10):
         """
@@ -131,6 +254,8 @@ class AiroTrackAPI:
         # This method now:
         #   • Returns a combined list for multiple IDs
         #   • Gracefully degrades on per-device request failure
+        #   • Fetches devices concurrently with retries and a circuit
+        #     breaker (see ``fetch_positions`` / ``airotrack_fetch``)
         params_base = {}
 
         # Time filters are common for all requests
@@ -153,24 +278,8 @@ class AiroTrackAPI:
         if not isinstance(device_ids, (list, tuple, set)):
             device_ids = [device_ids]
 
-        # Fetch each device separately
-        for dev_id in device_ids:
-            try:
-                params = params_base.copy()
-                params["deviceId"] = str(dev_id)
-                positions = self._make_request(self.POSITIONS_ENDPOINT, params)
-                if isinstance(positions, list):
-                    all_positions.extend(positions)
-                else:
-                    logger.debug(
-                        "Unexpected response type for device %s: %s",
-                        dev_id,
-                        type(positions).__name__,
-                    )
-            except requests.RequestException as exc:
-                logger.error("Failed to fetch positions for device %s: %s", dev_id, exc)
-
-        return all_positions
+        # One request per device, run concurrently
+        return self.fetch_positions(device_ids, from_time, to_time)['positions']
     
     def get_devices(self):
         """
@@ -241,14 +350,21 @@ class AiroTrackAPI:
                 logger.warning(f"Position data for device {device_id} missing coordinates")
                 return None
             
+            # Quantised to the model columns so one bad fix cannot fail a whole write chunk
+            latitude = _decimal(latitude, 7, 90)
+            longitude = _decimal(longitude, 7, 180)
+            if latitude is None or longitude is None:
+                logger.warning(f"Position data for device {device_id} has invalid coordinates")
+                return None
+            
             # Create parsed data dictionary with all available fields
             parsed_data = {
                 'device_id': device_id,
                 'latitude': latitude,
                 'longitude': longitude,
-                'altitude': position_data.get('altitude'),
-                'speed': position_data.get('speed'),
-                'course': position_data.get('course'),
+                'altitude': _decimal(position_data.get('altitude'), 2, Decimal('99999999.99')),
+                'speed': _decimal(position_data.get('speed'), 2, Decimal('9999.99')),
+                'course': _decimal(position_data.get('course'), 2, Decimal('9999.99')),
                 'device_time': device_time,
                 'server_time': timezone.now(),
                 'fix_time': datetime.fromisoformat(position_data.get('fixTime').replace('Z', '+00:00')) if position_data.get('fixTime') else None,
@@ -334,99 +450,117 @@ class AiroTrackAPI:
             logger.error(f"Error updating device database: {str(e)}")
             return (created_count, updated_count, error_count + 1)
     
-    @transaction.atomic
-    def update_vehicle_locations(self):
+    def update_vehicle_locations(self, device_ids=None):
         """
         Update current vehicle locations from AiroTrack API.
         
+        Args:
+            device_ids (list, optional): Only poll these AiroTrack device IDs
+                (used by the adaptive poller); defaults to every device.
+        
+        Set-based write path: devices are preloaded once, positions are
+        fetched outside any transaction, then each chunk of
+        ``LOCATION_WRITE_CHUNK`` vehicles is written in its own short
+        transaction (one upsert into VehicleLocation, one bulk insert into
+        LocationHistory). Devices that reported are marked online with a
+        single UPDATE at the end.
+        
+        History rows are only written for fixes that changed meaningfully
+        (see ``_select_history``); the written/suppressed counts are kept
+        in ``self.last_location_report``.
+        
+        Runs under ``geolocation.polling.poll_lock``. While another poll or
+        sync holds it nothing is fetched and ``self.last_poll_skipped`` is
+        set.
+        
         Returns:
             tuple: (updated_count, error_count)
         """
+        from .polling import poll_lock
+        
+        with poll_lock() as acquired:
+            self.last_poll_skipped = not acquired
+            if not acquired:
+                logger.info("AiroTrack location update skipped: another poll is running")
+                self.last_location_report = None
+                return (0, 0)
+            return self._update_vehicle_locations(device_ids)
+    
+    def _update_vehicle_locations(self, device_ids):
         updated_count = 0
         error_count = 0
+        self.last_location_report = None
         
         try:
             # Get all devices from our database
-            devices = AiroTrackDevice.objects.all()
-            device_ids = [device.device_id for device in devices]
+            queryset = AiroTrackDevice.objects.only('id', 'device_id', 'vehicle_id')
+            if device_ids is not None:
+                queryset = queryset.filter(device_id__in=list(device_ids))
+            devices = {device.device_id: device for device in queryset}
             
-            if not device_ids:
+            if not devices:
                 logger.warning("No devices found in database to update locations")
                 return (0, 0)
             
             # Get positions for all devices
-            positions = self.get_positions(device_ids=device_ids)
+            positions = self.get_positions(device_ids=list(devices))
             
             if not positions:
                 logger.warning("No positions returned from AiroTrack API")
                 return (0, 0)
             
+            latest = {}     # vehicle_id -> VehicleLocation (newest fix wins)
+            history = []    # LocationHistory rows, one per fix
             for position_data in positions:
-                try:
-                    parsed_data = self._parse_position_data(position_data)
-                    
-                    if not parsed_data:
-                        error_count += 1
-                        continue
-                    
-                    device_id = parsed_data['device_id']
-                    
-                    try:
-                        device = AiroTrackDevice.objects.get(device_id=device_id)
-                    except AiroTrackDevice.DoesNotExist:
-                        logger.warning(f"Device {device_id} not found in database")
-                        error_count += 1
-                        continue
-                    
-                    if not device.vehicle:
-                        logger.warning(f"Device {device_id} not associated with any vehicle")
-                        error_count += 1
-                        continue
-                    
-                    # Update device status
-                    device.update_status('online')
-                    
-                    # Update or create current location
-                    location, created = VehicleLocation.objects.update_or_create(
-                        vehicle=device.vehicle,
-                        device=device,
-                        defaults={
-                            'latitude': parsed_data['latitude'],
-                            'longitude': parsed_data['longitude'],
-                            'altitude': parsed_data['altitude'],
-                            'speed': parsed_data['speed'],
-                            'course': parsed_data['course'],
-                            'device_time': parsed_data['device_time'],
-                            'server_time': parsed_data['server_time'],
-                            'fix_time': parsed_data['fix_time'],
-                            'valid': parsed_data['valid'],
-                            'address': parsed_data['address'],
-                            'ignition': parsed_data['ignition'],
-                            'battery_level': parsed_data.get('battery_level'),
-                            'raw_data': parsed_data['raw_data']
-                        }
-                    )
-                    
-                    # Also create a history entry
-                    LocationHistory.objects.create(
-                        vehicle=device.vehicle,
-                        device=device,
-                        latitude=parsed_data['latitude'],
-                        longitude=parsed_data['longitude'],
-                        altitude=parsed_data['altitude'],
-                        speed=parsed_data['speed'],
-                        course=parsed_data['course'],
-                        device_time=parsed_data['device_time'],
-                        valid=parsed_data['valid'],
-                        address=parsed_data['address'],
-                        ignition=parsed_data['ignition']
-                    )
-                    
-                    updated_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error processing position for device {position_data.get('deviceId', 'unknown')}: {str(e)}")
+                parsed_data = self._parse_position_data(position_data)
+                
+                if not parsed_data:
                     error_count += 1
+                    continue
+                
+                device_id = parsed_data['device_id']
+                device = devices.get(str(device_id))
+                if device is None:
+                    logger.warning(f"Device {device_id} not found in database")
+                    error_count += 1
+                    continue
+                
+                if not device.vehicle_id:
+                    logger.warning(f"Device {device_id} not associated with any vehicle")
+                    error_count += 1
+                    continue
+                
+                location = self._build_vehicle_location(device, parsed_data)
+                current = latest.get(device.vehicle_id)
+                if current is None or location.device_time >= current.device_time:
+                    latest[device.vehicle_id] = location
+                history.append(self._build_location_history(device, parsed_data))
+            
+            fixes = history
+            history, suppressed = self._select_history(history)
+            history, failed = self._write_locations(list(latest.values()), history)
+            # Each device whose rows could not be written counts as one error
+            error_count += len(failed)
+            # Live map clients only hear about vehicles that actually moved
+            live_feed.publish('vehicles', {row.vehicle_id for row in history})
+            # Geofences see every vehicle's fix, even when its history row was suppressed
+            safe_process_positions(
+                [
+                    (loc.vehicle_id, loc.latitude, loc.longitude, loc.device_time, None)
+                    for loc in latest.values() if loc.vehicle_id not in failed
+                ],
+                'airotrack',
+            )
+            # Extend the drive/idle/stop segments of vehicles with new history
+            safe_update_segments({row.vehicle_id for row in history})
+            updated_count = sum(1 for fix in fixes if fix.vehicle_id not in failed)
+            self.last_location_report = {
+                'fixes': updated_count,
+                'history_written': len(history),
+                'history_suppressed': updated_count - len(history),
+            }
+            if suppressed:
+                logger.info(f"Suppressed {suppressed} unchanged LocationHistory rows")
             
             # Update last sync time
             self.last_sync_time = timezone.now()
@@ -437,6 +571,181 @@ class AiroTrackAPI:
             logger.error(f"Error updating vehicle locations: {str(e)}")
             return (updated_count, error_count + 1)
     
+    @staticmethod
+    def _build_vehicle_location(device, parsed_data):
+        return VehicleLocation(
+            vehicle_id=device.vehicle_id,
+            device_id=device.id,
+            latitude=parsed_data['latitude'],
+            longitude=parsed_data['longitude'],
+            altitude=parsed_data['altitude'],
+            speed=parsed_data['speed'],
+            course=parsed_data['course'],
+            device_time=parsed_data['device_time'],
+            server_time=parsed_data['server_time'],
+            fix_time=parsed_data['fix_time'],
+            valid=parsed_data['valid'],
+            address=parsed_data['address'],
+            ignition=parsed_data['ignition'],
+            battery_level=parsed_data.get('battery_level'),
+            raw_data=parsed_data['raw_data'],
+        )
+    
+    @staticmethod
+    def _build_location_history(device, parsed_data):
+        return LocationHistory(
+            vehicle_id=device.vehicle_id,
+            device_id=device.id,
+            latitude=parsed_data['latitude'],
+            longitude=parsed_data['longitude'],
+            altitude=parsed_data['altitude'],
+            speed=parsed_data['speed'],
+            course=parsed_data['course'],
+            device_time=parsed_data['device_time'],
+            valid=parsed_data['valid'],
+            address=parsed_data['address'],
+            ignition=parsed_data['ignition'],
+        )
+    
+    def _is_meaningful_change(self, previous, fix):
+        """
+        Whether ``fix`` (a LocationHistory instance) is worth recording given
+        the vehicle's last recorded history row. ``previous`` is a dict with
+        latitude, longitude, speed, course, ignition and recorded_at (its
+        device time), or None for a vehicle with no history.
+        """
+        if previous is None:
+            return True
+        if fix.device_time - previous['recorded_at'] >= timedelta(seconds=self.HISTORY_HEARTBEAT_SECONDS):
+            return True
+        if bool(fix.ignition) != bool(previous['ignition']):
+            return True
+        
+        distance_m = float(haversine_km(
+            previous['latitude'], previous['longitude'], fix.latitude, fix.longitude
+        )) * 1000.0
+        if distance_m >= self.HISTORY_MIN_DISTANCE_M:
+            return True
+        
+        speed = float(fix.speed or 0)
+        previous_speed = float(previous['speed'] or 0)
+        if abs(speed - previous_speed) >= self.HISTORY_MIN_SPEED_DELTA_KMH:
+            return True
+        
+        if (max(speed, previous_speed) >= self.HISTORY_MOVING_SPEED_KMH
+                and fix.course is not None and previous['course'] is not None):
+            turn = abs(float(fix.course) - float(previous['course'])) % 360.0
+            if min(turn, 360.0 - turn) >= self.HISTORY_MIN_COURSE_DELTA:
+                return True
+        return False
+    
+    def _select_history(self, history):
+        """
+        Drop history rows for fixes that did not change meaningfully.
+        
+        Each vehicle's fixes are compared in device-time order against the
+        last history row actually recorded (its newest LocationHistory row,
+        then each fix kept here), so a vehicle creeping a few metres per
+        poll is recorded once the creep adds up to a meaningful change.
+        Two queries regardless of fleet size.
+        
+        Returns:
+            tuple: (rows to write, number suppressed)
+        """
+        if not history:
+            return [], 0
+        vehicle_ids = {row.vehicle_id for row in history}
+        
+        newest = (
+            LocationHistory.objects.filter(vehicle_id=OuterRef('pk'))
+            .order_by('-device_time', '-id')
+            .values('id')[:1]
+        )
+        last_ids = (
+            Vehicle.objects.filter(pk__in=vehicle_ids)
+            .annotate(last_id=Subquery(newest))
+            .values_list('last_id', flat=True)
+        )
+        previous = {}
+        for row in LocationHistory.objects.filter(id__in=[pk for pk in last_ids if pk]).values(
+            'vehicle_id', 'latitude', 'longitude', 'speed', 'course', 'ignition', 'device_time'
+        ):
+            row['recorded_at'] = row.pop('device_time')
+            previous[row.pop('vehicle_id')] = row
+        
+        kept = []
+        for fix in sorted(history, key=lambda row: (row.vehicle_id, row.device_time)):
+            if self._is_meaningful_change(previous.get(fix.vehicle_id), fix):
+                kept.append(fix)
+                # Suppressed fixes leave the last recorded row as the reference
+                previous[fix.vehicle_id] = {
+                    'latitude': fix.latitude,
+                    'longitude': fix.longitude,
+                    'speed': fix.speed,
+                    'course': fix.course,
+                    'ignition': fix.ignition,
+                    'recorded_at': fix.device_time,
+                }
+        return kept, len(history) - len(kept)
+    
+    def _write_chunk(self, locations, history):
+        # MySQL's ON DUPLICATE KEY UPDATE matches any unique key and rejects
+        # an explicit conflict target; SQLite/PostgreSQL require one.
+        unique_fields = ['vehicle'] if connection.features.supports_update_conflicts_with_target else None
+        with transaction.atomic():
+            VehicleLocation.objects.bulk_create(
+                locations,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=self.VEHICLE_LOCATION_UPDATE_FIELDS,
+            )
+            LocationHistory.objects.bulk_create(history, batch_size=self.LOCATION_WRITE_CHUNK)
+    
+    def _write_locations(self, locations, history):
+        """
+        Upsert current locations and append history in chunked transactions.
+        
+        A chunk that fails on a bad row is retried one vehicle at a time, so
+        only the vehicles whose rows cannot be written are skipped.
+        
+        Returns:
+            tuple: (history rows written, ids of the vehicles that failed)
+        """
+        chunk = self.LOCATION_WRITE_CHUNK
+        
+        history_by_vehicle = {}
+        for row in history:
+            history_by_vehicle.setdefault(row.vehicle_id, []).append(row)
+        
+        written = []
+        failed = set()
+        for i in range(0, len(locations), chunk):
+            batch = locations[i:i + chunk]
+            batch_history = [row for loc in batch for row in history_by_vehicle.get(loc.vehicle_id, [])]
+            try:
+                self._write_chunk(batch, batch_history)
+                written.extend(batch_history)
+                continue
+            except ROW_WRITE_ERRORS as e:
+                logger.warning(f"AiroTrack location chunk failed ({e}), retrying vehicle by vehicle")
+            for location in batch:
+                rows = history_by_vehicle.get(location.vehicle_id, [])
+                try:
+                    self._write_chunk([location], rows)
+                except ROW_WRITE_ERRORS as e:
+                    logger.error(f"Error writing position for vehicle {location.vehicle_id}: {str(e)}")
+                    failed.add(location.vehicle_id)
+                    continue
+                written.extend(rows)
+        
+        # Mark every device that reported as online in one statement
+        online_ids = {loc.device_id for loc in locations if loc.vehicle_id not in failed}
+        if online_ids:
+            AiroTrackDevice.objects.filter(id__in=online_ids).update(
+                status='online', last_update=timezone.now()
+            )
+        return written, failed
+    
     def sync_all_data(self):
         """
         Synchronize all data from AiroTrack API.
@@ -463,9 +772,25 @@ class AiroTrackAPI:
             'devices_error': devices_error,
             'locations_updated': locations_updated,
             'locations_error': locations_error,
+            'locations_skipped': self.last_poll_skipped,
             'elapsed_time': elapsed_time
         }
         
+        location_report = self.last_location_report
+        if location_report:
+            sync_summary['history_written'] = location_report['history_written']
+            sync_summary['history_suppressed'] = location_report['history_suppressed']
+        
+        report = self.last_fetch_report
+        if report:
+            sync_summary['positions_fetch'] = {
+                'succeeded': report['succeeded'],
+                'failed': report['failed'],
+                'skipped': report['skipped'],
+                'elapsed_ms': report['elapsed_ms'],
+                'latency_ms': report['latency_ms'],
+            }
+        
         logger.info(f"AiroTrack sync completed: {sync_summary}")
         
         return sync_summary
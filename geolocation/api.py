@@ -1,7 +1,7 @@
 from rest_framework import viewsets, permissions, status, throttling
 from rest_framework.decorators import api_view, permission_classes, throttle_classes, action
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework import serializers
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
@@ -9,10 +9,16 @@ from django.db import transaction
 from django.http import JsonResponse
 from datetime import datetime, timedelta
 import logging
+import math
 
-from .models import AiroTrackDevice, VehicleLocation, LocationHistory
+from .models import AiroTrackDevice, VehicleLocation, LocationHistory, MovementSegment
 from vehicles.models import Vehicle
 from .airotrack_service import AiroTrackAPI
+from .archive import archived_history
+from .geocoding import lookup_addresses
+from .polling import poll_metrics
+from .segments import segment_summary
+from .spatial import filter_bbox, nearest_vehicles, parse_bbox
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -245,6 +251,13 @@ class AiroTrackDeviceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+def _bbox_param(request):
+    """Parsed ``?bbox=west,south,east,north`` (None if absent); 400 if malformed."""
+    try:
+        return parse_bbox(request.query_params.get('bbox', None))
+    except ValueError as e:
+        raise ValidationError({"bbox": str(e)})
+
 class VehicleLocationViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for current vehicle locations (read-only)"""
     queryset = VehicleLocation.objects.all()
@@ -260,6 +273,9 @@ class VehicleLocationViewSet(viewsets.ReadOnlyModelViewSet):
         vehicle_id = self.request.query_params.get('vehicle', None)
         if vehicle_id:
             queryset = queryset.filter(vehicle_id=vehicle_id)
+        
+        # Filter by map viewport
+        queryset = filter_bbox(queryset, _bbox_param(self.request))
             
         # Filter by status (ignition)
         status = self.request.query_params.get('status', None)
@@ -309,6 +325,31 @@ class LocationHistoryViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     throttle_classes = [BurstRateThrottle, SustainedRateThrottle]
     
+    def _time_range(self):
+        """Parsed ``from`` / ``to`` query parameters (None if absent or invalid)"""
+        bounds = []
+        for name in ('from', 'to'):
+            value = self.request.query_params.get(name, None)
+            parsed = None
+            if value:
+                try:
+                    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                except ValueError:
+                    pass
+            bounds.append(parsed)
+        return bounds
+    
+    def _limit(self):
+        # Limit number of results to prevent performance issues
+        limit = self.request.query_params.get('limit', 1000)
+        try:
+            limit = int(limit)
+            if limit > 5000:  # Cap at 5000 records
+                limit = 5000
+        except ValueError:
+            limit = 1000
+        return limit
+    
     def get_queryset(self):
         """Filter history based on query parameters"""
         queryset = LocationHistory.objects.all()
@@ -322,34 +363,18 @@ class LocationHistoryViewSet(viewsets.ReadOnlyModelViewSet):
         device_id = self.request.query_params.get('device', None)
         if device_id:
             queryset = queryset.filter(device_id=device_id)
+        
+        # Filter by map viewport
+        queryset = filter_bbox(queryset, _bbox_param(self.request))
             
         # Filter by time range
-        time_from = self.request.query_params.get('from', None)
-        if time_from:
-            try:
-                from_time = datetime.fromisoformat(time_from.replace('Z', '+00:00'))
-                queryset = queryset.filter(device_time__gte=from_time)
-            except ValueError:
-                pass
+        from_time, to_time = self._time_range()
+        if from_time:
+            queryset = queryset.filter(device_time__gte=from_time)
+        if to_time:
+            queryset = queryset.filter(device_time__lte=to_time)
         
-        time_to = self.request.query_params.get('to', None)
-        if time_to:
-            try:
-                to_time = datetime.fromisoformat(time_to.replace('Z', '+00:00'))
-                queryset = queryset.filter(device_time__lte=to_time)
-            except ValueError:
-                pass
-        
-        # Limit number of results to prevent performance issues
-        limit = self.request.query_params.get('limit', 1000)
-        try:
-            limit = int(limit)
-            if limit > 5000:  # Cap at 5000 records
-                limit = 5000
-        except ValueError:
-            limit = 1000
-            
-        return queryset.order_by('-device_time')[:limit]
+        return queryset.order_by('-device_time')[:self._limit()]
     
     @action(detail=False, methods=['get'])
     def geojson(self, request):
@@ -386,9 +411,12 @@ class LocationHistoryViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def route(self, request):
-        """Return location history as a route LineString for map display"""
-        queryset = self.filter_queryset(self.get_queryset())
+        """
+        Return location history as a route LineString for map display.
         
+        When the hot table holds fewer than ``limit`` points for the range,
+        older points are filled in from the cold-storage archive.
+        """
         # Get vehicle ID from query params
         vehicle_id = request.query_params.get('vehicle', None)
         if not vehicle_id:
@@ -397,17 +425,33 @@ class LocationHistoryViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get coordinates for the route
-        coordinates = []
-        for location in queryset.order_by('device_time'):
-            coordinates.append([float(location.longitude), float(location.latitude)])
+        # Newest `limit` points, newest first
+        locations = list(self.filter_queryset(self.get_queryset()))
+        limit = self._limit()
+        if len(locations) < limit:
+            from_time, to_time = self._time_range()
+            archived = archived_history(
+                vehicle_id, from_time, to_time,
+                device_id=request.query_params.get('device', None),
+                newest_first=True, limit=limit - len(locations),
+            )
+            if archived:
+                locations = sorted(
+                    locations + archived, key=lambda location: location.device_time, reverse=True
+                )[:limit]
         
-        if not coordinates:
+        if not locations:
             return Response(
                 {"error": "No location data found for this vehicle"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        # Get coordinates for the route
+        coordinates = [
+            [float(location.longitude), float(location.latitude)]
+            for location in reversed(locations)
+        ]
+        
         # Construct GeoJSON LineString
         geojson = {
             "type": "Feature",
@@ -418,8 +462,8 @@ class LocationHistoryViewSet(viewsets.ReadOnlyModelViewSet):
             "properties": {
                 "vehicle_id": int(vehicle_id),
                 "points": len(coordinates),
-                "start_time": queryset.last().device_time.isoformat() if queryset.exists() else None,
-                "end_time": queryset.first().device_time.isoformat() if queryset.exists() else None
+                "start_time": locations[-1].device_time.isoformat(),
+                "end_time": locations[0].device_time.isoformat()
             }
         }
         
@@ -454,6 +498,18 @@ def sync_data(request):
             "error": str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated, IsAdminOrVehicleManager])
+@throttle_classes([BurstRateThrottle])
+def sync_status(request):
+    """
+    Metrics of the recent adaptive AiroTrack poll cycles.
+    
+    Returns per-cycle duration, devices due per class (moving / parked /
+    offline) and fetch/write results, plus a p50/p95 duration summary.
+    """
+    return Response(poll_metrics())
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 @throttle_classes([BurstRateThrottle])
@@ -505,14 +561,16 @@ def all_vehicles_current_location(request):
     Get the current location of all vehicles.
     
     This endpoint returns the most recent location data for all vehicles,
-    formatted for map display.
+    formatted for map display. ``?bbox=west,south,east,north`` limits the
+    result to the map viewport.
     """
+    bbox = _bbox_param(request)
     try:
         # Get format parameter (default to 'json')
         format_type = request.query_params.get('format', 'json').lower()
         
-        # Get all vehicle locations
-        locations = VehicleLocation.objects.all()
+        # Get vehicle locations (within the viewport, if given)
+        locations = filter_bbox(VehicleLocation.objects.all(), bbox)
         
         if format_type == 'geojson':
             # Return as GeoJSON for map display
@@ -534,3 +592,120 @@ def all_vehicles_current_location(request):
             "error": "Failed to retrieve vehicle locations",
             "details": str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@throttle_classes([BurstRateThrottle])
+def nearest_vehicles_view(request):
+    """
+    Closest vehicles to a point, e.g. the nearest available vehicle to a store.
+    
+    Query parameters: ``lat``, ``lon`` (required), ``k`` (default 5, max 50),
+    ``status`` (vehicle status, e.g. ``available``) and ``max_km``.
+    Returns vehicles nearest first with their distance in km.
+    """
+    try:
+        latitude = float(request.query_params['lat'])
+        longitude = float(request.query_params['lon'])
+        k = min(int(request.query_params.get('k', 5)), 50)
+        max_km = request.query_params.get('max_km', None)
+        max_km = float(max_km) if max_km else None
+    except (KeyError, ValueError):
+        return Response(
+            {"error": "lat and lon are required; k and max_km must be numbers"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or k < 1:
+        return Response(
+            {"error": "lat/lon out of range or k < 1"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if max_km is not None and not (math.isfinite(max_km) and max_km >= 0):
+        return Response(
+            {"error": "max_km must be a finite, non-negative number"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    queryset = VehicleLocation.objects.all()
+    vehicle_status = request.query_params.get('status', None)
+    if vehicle_status:
+        queryset = queryset.filter(vehicle__status=vehicle_status)
+    
+    results = []
+    for distance_km, location in nearest_vehicles(latitude, longitude, k, queryset, max_km):
+        results.append({
+            "vehicle_id": location.vehicle_id,
+            "license_plate": location.vehicle.license_plate,
+            "make": location.vehicle.make,
+            "model": location.vehicle.model,
+            "status": location.vehicle.status,
+            "latitude": float(location.latitude),
+            "longitude": float(location.longitude),
+            "device_time": location.device_time.isoformat(),
+            "distance_km": round(distance_km, 3),
+        })
+    
+    return Response({"origin": {"latitude": latitude, "longitude": longitude}, "results": results})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@throttle_classes([BurstRateThrottle])
+def vehicle_movement_segments(request, vehicle_id):
+    """
+    Drive / idle / stop segments of a vehicle, with totals and the idle
+    fuel estimate.
+    
+    Query parameters: ``from`` / ``to`` (ISO 8601, default the last 24
+    hours), ``kind`` (drive, idle or stop) and ``min_seconds``.
+    """
+    vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
+    try:
+        time_to = request.query_params.get('to', None)
+        time_to = datetime.fromisoformat(time_to.replace('Z', '+00:00')) if time_to else timezone.now()
+        time_from = request.query_params.get('from', None)
+        time_from = (
+            datetime.fromisoformat(time_from.replace('Z', '+00:00')) if time_from
+            else time_to - timedelta(days=1)
+        )
+        min_seconds = int(request.query_params.get('min_seconds', 0))
+    except ValueError:
+        return Response(
+            {"error": "from/to must be ISO 8601 datetimes and min_seconds a number"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    segments = list(MovementSegment.objects.filter(
+        vehicle=vehicle,
+        start_time__lt=time_to,
+        end_time__gt=time_from
+    ))
+    kind = request.query_params.get('kind', None)
+    listed = [
+        segment for segment in segments
+        if (not kind or segment.kind == kind) and segment.duration_seconds >= min_seconds
+    ]
+    
+    addresses = lookup_addresses([
+        (segment.centroid_latitude, segment.centroid_longitude) for segment in listed
+    ])
+    
+    return Response({
+        "vehicle_id": vehicle.id,
+        "from": time_from.isoformat(),
+        "to": time_to.isoformat(),
+        "summary": segment_summary(segments, time_from, time_to),
+        "segments": [
+            {
+                "kind": segment.kind,
+                "start_time": segment.start_time.isoformat(),
+                "end_time": segment.end_time.isoformat(),
+                "duration_seconds": segment.duration_seconds,
+                "latitude": float(segment.centroid_latitude),
+                "longitude": float(segment.centroid_longitude),
+                "distance_km": segment.distance_km,
+                "max_speed_kmh": segment.max_speed_kmh,
+                "address": address,
+            }
+            for segment, address in zip(listed, addresses)
+        ],
+    })
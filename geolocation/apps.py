@@ -6,3 +6,6 @@ class GeolocationConfig(AppConfig):
     name = 'geolocation'
     # Human-friendly name shown in Django admin “Applications” list
     verbose_name = 'GPS Tracking / Geolocation'
+
+    def ready(self):
+        import geolocation.signals  # noqa: F401
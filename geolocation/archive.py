@@ -0,0 +1,258 @@
+"""
+Columnar cold storage for old GPS rows.
+
+``archive_location_history`` moves ``LocationHistory`` and finished-trip
+``TripLocation`` rows older than the retention window out of the hot
+tables. Each vehicle-month becomes one compressed NumPy archive
+(``np.savez_compressed``, one array per column) under
+``settings.LOCATION_ARCHIVE_ROOT``:
+
+    <root>/location_history/<vehicle_id>/<YYYY-MM>.npz
+    <root>/trip_location/<vehicle_id>/<YYYY-MM>.npz
+
+and one ``LocationArchive`` manifest row records the file, its row count,
+checksum and time span. Archiving the same month again (after a shorter
+``--days`` run, or late-arriving rows) merges into the existing file;
+rows are keyed by their original primary key so a retried run never
+duplicates them.
+
+Reads go through ``archived_history`` / ``archived_trip_rows``, which only
+open the files whose time span overlaps the requested range.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import LocationArchive, LocationHistory
+
+SOURCE_HISTORY = 'location_history'
+SOURCE_TRIPS = 'trip_location'
+
+HISTORY_FIELDS = (
+    'id', 'device_id', 'device_time', 'latitude', 'longitude',
+    'altitude', 'speed', 'course', 'valid', 'ignition', 'address',
+)
+TRIP_FIELDS = (
+    'id', 'trip_id', 'timestamp', 'latitude', 'longitude',
+    'accuracy', 'speed', 'altitude', 'heading', 'battery_level',
+)
+
+# Column name -> dtype. Nullable numeric columns are stored as NaN.
+_HISTORY_DTYPES = {
+    'id': np.int64, 'device_id': np.int64, 'epoch_ms': np.int64,
+    'latitude': np.float64, 'longitude': np.float64,
+    'altitude': np.float32, 'speed': np.float32, 'course': np.float32,
+    'valid': np.bool_, 'ignition': np.bool_,
+}
+_TRIP_DTYPES = {
+    'id': np.int64, 'trip_id': np.int64, 'epoch_ms': np.int64,
+    'latitude': np.float64, 'longitude': np.float64,
+    'accuracy': np.float32, 'speed': np.float32, 'altitude': np.float32,
+    'heading': np.float32, 'battery_level': np.float32,
+}
+
+
+def archive_root():
+    return getattr(settings, 'LOCATION_ARCHIVE_ROOT', os.path.join(settings.BASE_DIR, 'archive'))
+
+
+def month_start(moment):
+    """First day of ``moment``'s month in local time."""
+    return timezone.localtime(moment).date().replace(day=1)
+
+
+def month_bounds(month):
+    """Aware [start, end) datetimes of the local month starting at ``month``."""
+    start = timezone.make_aware(datetime(month.year, month.month, 1))
+    if month.month == 12:
+        end = timezone.make_aware(datetime(month.year + 1, 1, 1))
+    else:
+        end = timezone.make_aware(datetime(month.year, month.month + 1, 1))
+    return start, end
+
+
+def _to_epoch_ms(moment):
+    return int(round(moment.timestamp() * 1000))
+
+
+def _from_epoch_ms(ms):
+    return datetime.fromtimestamp(int(ms) / 1000.0, tz=dt_timezone.utc)
+
+
+def _nullable(values, dtype):
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=dtype)
+
+
+def _or_none(value, places):
+    return None if value != value else round(float(value), places)
+
+
+def _decimal_or_none(value, places):
+    return None if value != value else Decimal(f'{value:.{places}f}')
+
+
+def _columns_from_rows(source, rows):
+    """``values_list`` rows in HISTORY_FIELDS / TRIP_FIELDS order -> column dict."""
+    fields = HISTORY_FIELDS if source == SOURCE_HISTORY else TRIP_FIELDS
+    dtypes = _HISTORY_DTYPES if source == SOURCE_HISTORY else _TRIP_DTYPES
+    raw = dict(zip(fields, zip(*rows))) if rows else {name: () for name in fields}
+    time_field = fields[2]
+
+    columns = {'epoch_ms': np.array([_to_epoch_ms(t) for t in raw[time_field]], dtype=np.int64)}
+    for name, dtype in dtypes.items():
+        if name == 'epoch_ms':
+            continue
+        if dtype in (np.int64, np.bool_):
+            columns[name] = np.array(raw[name], dtype=dtype)
+        else:
+            columns[name] = _nullable(raw[name], dtype)
+    if source == SOURCE_HISTORY:
+        # Fixed-width unicode so the file loads without pickle.
+        columns['address'] = np.array([a or '' for a in raw['address']], dtype=np.str_)
+    return columns
+
+
+def _merge_columns(existing, new):
+    """Concatenate, drop rows already archived (by id) and sort by time."""
+    merged = {name: np.concatenate([existing[name], new[name]]) for name in new}
+    _, first = np.unique(merged['id'], return_index=True)
+    order = first[np.argsort(merged['epoch_ms'][first], kind='stable')]
+    return {name: values[order] for name, values in merged.items()}
+
+
+def _write_npz(path, columns):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        np.savez_compressed(handle, **columns)
+    digest = hashlib.sha256()
+    with open(tmp_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    # Atomic swap: readers see either the old or the new file.
+    os.replace(tmp_path, path)
+    return os.path.getsize(path), digest.hexdigest()
+
+
+def read_archive(manifest):
+    """Columns of an archive file as a dict of NumPy arrays."""
+    with np.load(os.path.join(archive_root(), manifest.path), allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def write_archive(source, vehicle_id, month, rows):
+    """
+    Add ``rows`` (``values_list`` tuples in HISTORY_FIELDS / TRIP_FIELDS
+    order) to the vehicle-month archive, merging with any existing file.
+    Returns the updated ``LocationArchive``.
+    """
+    relative = os.path.join(source, str(vehicle_id), f'{month:%Y-%m}.npz')
+    columns = _columns_from_rows(source, rows)
+    manifest = LocationArchive.objects.filter(source=source, vehicle_id=vehicle_id, month=month).first()
+    if manifest is not None and os.path.exists(os.path.join(archive_root(), manifest.path)):
+        columns = _merge_columns(read_archive(manifest), columns)
+    else:
+        order = np.argsort(columns['epoch_ms'], kind='stable')
+        columns = {name: values[order] for name, values in columns.items()}
+
+    size, sha256 = _write_npz(os.path.join(archive_root(), relative), columns)
+    manifest, _ = LocationArchive.objects.update_or_create(
+        source=source, vehicle_id=vehicle_id, month=month,
+        defaults={
+            'path': relative,
+            'row_count': len(columns['id']),
+            'size_bytes': size,
+            'sha256': sha256,
+            'first_time': _from_epoch_ms(columns['epoch_ms'][0]),
+            'last_time': _from_epoch_ms(columns['epoch_ms'][-1]),
+        },
+    )
+    return manifest
+
+
+def _overlapping(source, vehicle_id, start=None, end=None):
+    manifests = LocationArchive.objects.filter(source=source, vehicle_id=vehicle_id)
+    if start is not None:
+        manifests = manifests.filter(last_time__gte=start)
+    if end is not None:
+        manifests = manifests.filter(first_time__lte=end)
+    return manifests
+
+
+def has_archived_history(vehicle_id, start=None, end=None):
+    return _overlapping(SOURCE_HISTORY, vehicle_id, start, end).exists()
+
+
+def archived_history(vehicle_id, start=None, end=None, device_id=None, newest_first=False, limit=None):
+    """
+    Archived ``LocationHistory`` rows of a vehicle within [start, end], as
+    unsaved model instances (``server_time`` is not archived). Oldest
+    first unless ``newest_first``; with ``limit`` only the newest/oldest
+    ``limit`` rows are returned and later months are not opened once it
+    is reached.
+    """
+    manifests = _overlapping(SOURCE_HISTORY, vehicle_id, start, end).order_by(
+        '-month' if newest_first else 'month'
+    )
+    start_ms = _to_epoch_ms(start) if start is not None else None
+    end_ms = _to_epoch_ms(end) if end is not None else None
+
+    history = []
+    for manifest in manifests:
+        columns = read_archive(manifest)
+        mask = np.ones(len(columns['id']), dtype=bool)
+        if start_ms is not None:
+            mask &= columns['epoch_ms'] >= start_ms
+        if end_ms is not None:
+            mask &= columns['epoch_ms'] <= end_ms
+        if device_id is not None:
+            mask &= columns['device_id'] == int(device_id)
+        indexes = np.flatnonzero(mask)
+        if newest_first:
+            indexes = indexes[::-1]
+        for i in indexes.tolist():
+            history.append(LocationHistory(
+                vehicle_id=vehicle_id,
+                device_id=int(columns['device_id'][i]),
+                latitude=_decimal_or_none(columns['latitude'][i], 7),
+                longitude=_decimal_or_none(columns['longitude'][i], 7),
+                altitude=_decimal_or_none(columns['altitude'][i], 2),
+                speed=_decimal_or_none(columns['speed'][i], 2),
+                course=_decimal_or_none(columns['course'][i], 2),
+                device_time=_from_epoch_ms(columns['epoch_ms'][i]),
+                valid=bool(columns['valid'][i]),
+                ignition=bool(columns['ignition'][i]),
+                address=str(columns['address'][i]) or None,
+            ))
+            if limit is not None and len(history) >= limit:
+                return history
+    return history
+
+
+def archived_trip_rows(trip):
+    """
+    Archived route of a trip as ``(latitude, longitude, accuracy, speed,
+    timestamp)`` tuples, oldest first — the shape of
+    ``trips.route_artifacts.load_route_rows``.
+    """
+    # Points can be stamped slightly outside the trip's own times.
+    start = trip.start_time - timedelta(days=1) if trip.start_time else None
+    end = trip.end_time + timedelta(days=1) if trip.end_time else None
+    rows = []
+    for manifest in _overlapping(SOURCE_TRIPS, trip.vehicle_id, start, end).order_by('month'):
+        columns = read_archive(manifest)
+        for i in np.flatnonzero(columns['trip_id'] == trip.id).tolist():
+            rows.append((
+                float(columns['latitude'][i]),
+                float(columns['longitude'][i]),
+                _or_none(columns['accuracy'][i], 2),
+                _or_none(columns['speed'][i], 2),
+                _from_epoch_ms(columns['epoch_ms'][i]),
+            ))
+    rows.sort(key=lambda row: row[4])
+    return rows
@@ -0,0 +1,234 @@
+"""
+Reverse geocoding of vehicle and trip coordinates, cached on a ~100 m grid.
+
+AiroTrack positions are fetched with ``isAddressRequired=false`` to keep
+the sync fast, so stored locations usually have no address. Instead,
+coordinates are snapped to a 0.001° grid (about 110 m) and each cell's
+address is looked up once:
+
+    - ``lookup_addresses`` answers from an in-process LRU, then one query
+      against ``GeocodedPlace`` for the cells it does not hold;
+    - cells found in neither are queued for the ``reverse_geocode_cells``
+      Celery task (once per PENDING_TTL, guarded by a cache key) and come
+      back as None meanwhile, so pages never wait on the provider;
+    - the task resolves the cells' centres with the configured provider
+      and stores them, so the next lookup is a cache hit. Cells whose
+      lookup failed are remembered in the cache for FAILED_TTL and not
+      queued again until it expires.
+
+The provider is the class named by ``settings.REVERSE_GEOCODER``: an
+object with a ``name`` and a ``reverse(latitude, longitude)`` method
+returning the address, '' when there is none, or None when the lookup
+failed and should be retried. ``GoogleReverseGeocoder`` is the default
+when GOOGLE_MAPS_API_KEY is set and ``NullReverseGeocoder`` (geocoding
+off, nothing queued) otherwise; ``StubReverseGeocoder`` answers offline
+for tests and development.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .models import GeocodedPlace
+
+logger = logging.getLogger(__name__)
+
+GRID = 1000          # cells per degree
+LRU_SIZE = 10000
+PENDING_TTL = 10 * 60
+FAILED_TTL = 6 * 60 * 60
+CELLS_PER_TASK = 100
+
+
+class GoogleReverseGeocoder:
+    """Google Geocoding API (needs GOOGLE_MAPS_API_KEY)."""
+    name = 'google'
+
+    def reverse(self, latitude, longitude):
+        if not settings.GOOGLE_MAPS_API_KEY:
+            return None
+        try:
+            response = requests.get(
+                settings.GOOGLE_GEOCODE_URL,
+                params={'latlng': f'{latitude},{longitude}', 'key': settings.GOOGLE_MAPS_API_KEY},
+                timeout=settings.GOOGLE_GEOCODE_TIMEOUT,
+            )
+            data = response.json()
+        except (requests.RequestException, ValueError) as exc:
+            logger.warning("Reverse geocode of %s,%s failed: %s", latitude, longitude, exc)
+            return None
+        if data.get('status') == 'ZERO_RESULTS':
+            return ''
+        if data.get('status') != 'OK':
+            logger.warning("Reverse geocode of %s,%s returned %s", latitude, longitude, data.get('status'))
+            return None
+        return data['results'][0].get('formatted_address', '')
+
+
+class NullReverseGeocoder:
+    """Geocoding switched off: no lookups are queued and addresses stay None."""
+    name = 'null'
+    enabled = False
+
+    def reverse(self, latitude, longitude):
+        return None
+
+
+class StubReverseGeocoder:
+    """Offline provider: the cell's coordinates as its address."""
+    name = 'stub'
+
+    def reverse(self, latitude, longitude):
+        return f"Near {latitude:.3f}, {longitude:.3f}"
+
+
+class _LRU:
+    """Thread-safe bounded mapping, least recently used entries evicted first."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+_lru = _LRU(LRU_SIZE)
+
+
+def get_provider():
+    """Instance of the configured reverse-geocoding provider."""
+    return import_string(settings.REVERSE_GEOCODER)()
+
+
+def cell_of(latitude, longitude):
+    """Grid cell ``(cell_lat, cell_lon)`` containing the point."""
+    return round(float(latitude) * GRID), round(float(longitude) * GRID)
+
+
+def _pending_key(cell):
+    return f'geocode_pending_{cell[0]}_{cell[1]}'
+
+
+def _failed_key(cell):
+    return f'geocode_failed_{cell[0]}_{cell[1]}'
+
+
+def _queue(cells):
+    """
+    Hand unresolved cells to the background task, each at most once per
+    PENDING_TTL and not while a recent lookup of it failed.
+    """
+    from .tasks import reverse_geocode_cells
+
+    if not cells or not getattr(get_provider(), 'enabled', True):
+        return
+    try:
+        failed = cache.get_many([_failed_key(cell) for cell in cells])
+    except Exception:
+        failed = {}  # Cache backend down
+    queued = []
+    for cell in cells:
+        if _failed_key(cell) in failed:
+            continue
+        try:
+            if not cache.add(_pending_key(cell), 1, PENDING_TTL):
+                continue  # Already queued by another request
+        except Exception:
+            pass  # Cache backend down — queue it anyway
+        queued.append(list(cell))
+    for i in range(0, len(queued), CELLS_PER_TASK):
+        try:
+            reverse_geocode_cells.delay(queued[i:i + CELLS_PER_TASK])
+        except Exception as exc:
+            logger.warning("Could not queue reverse geocoding: %s", exc)
+
+
+def lookup_addresses(points):
+    """
+    Cached addresses for ``(latitude, longitude)`` points, in order; None
+    for points whose cell is not resolved yet (queued for the background
+    task) or has no address. At most one query.
+    """
+    cells = [cell_of(lat, lon) for lat, lon in points]
+    found = {}
+    missing = set()
+    for cell in cells:
+        address = _lru.get(cell)
+        if address is None:
+            missing.add(cell)
+        else:
+            found[cell] = address
+
+    if missing:
+        places = GeocodedPlace.objects.filter(
+            cell_lat__in={cell[0] for cell in missing},
+            cell_lon__in={cell[1] for cell in missing},
+        ).values_list('cell_lat', 'cell_lon', 'address')
+        for cell_lat, cell_lon, address in places:
+            cell = (cell_lat, cell_lon)
+            if cell in missing:
+                found[cell] = address
+                _lru.put(cell, address)
+        _queue(sorted(missing - set(found)))
+
+    return [found.get(cell) or None for cell in cells]
+
+
+def address_for(latitude, longitude):
+    """Cached address of a single point, or None (see ``lookup_addresses``)."""
+    return lookup_addresses([(latitude, longitude)])[0]
+
+
+def resolve_cells(cells):
+    """
+    Reverse geocode the centres of ``cells`` not stored yet and store the
+    results. Failed lookups are not stored and are retried after
+    FAILED_TTL. Returns the number of cells stored.
+    """
+    cells = {tuple(cell) for cell in cells}
+    stored = set(
+        GeocodedPlace.objects.filter(
+            cell_lat__in={cell[0] for cell in cells},
+            cell_lon__in={cell[1] for cell in cells},
+        ).values_list('cell_lat', 'cell_lon')
+    )
+    provider = get_provider()
+    places = []
+    failed = {}
+    for cell in sorted(cells - stored):
+        address = provider.reverse(cell[0] / GRID, cell[1] / GRID)
+        if address is None:
+            failed[_failed_key(cell)] = 1
+            continue
+        places.append(GeocodedPlace(
+            cell_lat=cell[0], cell_lon=cell[1], address=address, provider=provider.name,
+        ))
+        _lru.put(cell, address)
+    GeocodedPlace.objects.bulk_create(places, ignore_conflicts=True)
+    if failed:
+        try:
+            cache.set_many(failed, FAILED_TTL)
+        except Exception:
+            pass  # Cache backend down — retried once the pending key expires
+    return len(places)
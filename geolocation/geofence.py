@@ -0,0 +1,271 @@
+"""
+Geofence matching and enter/exit/dwell events, computed as positions are
+ingested.
+
+Active geofences are loaded once per process into a ``GeofenceIndex``:
+circle centres/radii and polygon vertices as NumPy arrays, so a batch of
+positions is matched against every fence at once (haversine distance for
+circles, a bounding-box prefilter plus even-odd ray casting for polygons).
+Saving or deleting a Geofence bumps a version key in the cache (see
+``geolocation.signals``), and every process rebuilds its index on the
+next batch (or after INDEX_MAX_AGE if the cache is down).
+
+``process_positions`` is called by the AiroTrack sync and the TripLocation
+ingest APIs. It reads the vehicles' open visits for that source
+(``GeofenceState``, one row per vehicle and source inside a fence) in one
+query, walks the new positions in time order and writes only the
+transitions:
+
+    enter  - first position inside a fence
+    dwell  - inside for the fence's dwell_seconds (once per visit)
+    exit   - first position outside again
+
+Positions older than the last one seen inside a vehicle's open visits are
+ignored, so a late batch cannot close or reopen a visit. Two ingest paths
+can read the same visits at once, so a transition's events are kept only
+if this call's write claimed it: the new state row was inserted, the old
+one was still there to delete, or ``dwell_recorded`` was still False. The
+``backfill_geofence_events`` command replays stored history through the
+same function.
+"""
+import logging
+import time
+import uuid
+
+import numpy as np
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from core.geo import as_float_array, haversine_km
+
+from .models import Geofence, GeofenceEvent, GeofenceState
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION_KEY = 'geofence_index_version'
+INDEX_MAX_AGE = 5 * 60
+
+_index_cache = {}
+
+
+class GeofenceIndex:
+    """Vectorised point-in-fence matcher over a snapshot of active geofences."""
+
+    def __init__(self, geofences):
+        circles = [g for g in geofences if g.shape == 'circle' and g.radius_m and g.center_latitude is not None]
+        polygons = [g for g in geofences if g.shape == 'polygon' and g.polygon and len(g.polygon) >= 3]
+
+        self.fence_ids = np.array([g.id for g in circles + polygons], dtype=np.int64)
+        self.dwell_seconds = {g.id: g.dwell_seconds for g in circles + polygons}
+
+        self.circle_lats = as_float_array([g.center_latitude for g in circles])
+        self.circle_lons = as_float_array([g.center_longitude for g in circles])
+        self.circle_radius_km = as_float_array([g.radius_m for g in circles]) / 1000.0
+
+        self.polygons = []
+        for g in polygons:
+            vertices = as_float_array(g.polygon)
+            lats, lons = vertices[:, 0], vertices[:, 1]
+            self.polygons.append((lats, lons, lats.min(), lats.max(), lons.min(), lons.max()))
+
+    def __len__(self):
+        return len(self.fence_ids)
+
+    def match(self, lats, lons):
+        """Boolean matrix (points x fences, in ``fence_ids`` order): point inside fence."""
+        lats = as_float_array(lats)
+        lons = as_float_array(lons)
+        inside = np.zeros((len(lats), len(self.fence_ids)), dtype=bool)
+        n_circles = len(self.circle_lats)
+        if n_circles:
+            distance = haversine_km(lats[:, None], lons[:, None], self.circle_lats[None, :], self.circle_lons[None, :])
+            inside[:, :n_circles] = distance <= self.circle_radius_km[None, :]
+        for column, polygon in enumerate(self.polygons, start=n_circles):
+            inside[:, column] = _points_in_polygon(lats, lons, *polygon)
+        return inside
+
+
+def _points_in_polygon(lats, lons, poly_lats, poly_lons, min_lat, max_lat, min_lon, max_lon):
+    """Even-odd ray casting for many points against one polygon."""
+    result = np.zeros(len(lats), dtype=bool)
+    candidates = np.flatnonzero(
+        (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+    )
+    if not len(candidates):
+        return result
+    y = lats[candidates]
+    x = lons[candidates]
+    inside = np.zeros(len(candidates), dtype=bool)
+    count = len(poly_lats)
+    for i in range(count):
+        y1, x1 = poly_lats[i], poly_lons[i]
+        y2, x2 = poly_lats[i - 1], poly_lons[i - 1]
+        if y1 == y2:
+            continue  # Horizontal edges never cross a horizontal ray
+        crosses = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+        inside ^= crosses
+    result[candidates] = inside
+    return result
+
+
+def invalidate_index():
+    """Make every process rebuild its geofence index on its next batch."""
+    _index_cache.clear()
+    try:
+        cache.set(INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+    except Exception:
+        pass  # Cache backend down — other processes rebuild after INDEX_MAX_AGE
+
+
+def get_index():
+    """This process's GeofenceIndex, rebuilt when the fences changed."""
+    try:
+        version = cache.get(INDEX_VERSION_KEY)
+    except Exception:
+        version = None
+    cached = _index_cache.get('index')
+    if (
+        cached is not None
+        and cached['version'] == version
+        and time.monotonic() - cached['built'] < INDEX_MAX_AGE
+    ):
+        return cached['index']
+    index = GeofenceIndex(list(Geofence.objects.filter(is_active=True)))
+    _index_cache['index'] = {'index': index, 'version': version, 'built': time.monotonic()}
+    return index
+
+
+def _open_visits(vehicle_ids, source):
+    """``{vehicle_id: {geofence_id: GeofenceState}}`` for one source."""
+    open_visits = {}
+    for state in GeofenceState.objects.filter(vehicle_id__in=vehicle_ids, source=source):
+        open_visits.setdefault(state.vehicle_id, {})[state.geofence_id] = state
+    return open_visits
+
+
+def _insert_states(states):
+    """Insert new visits; returns the keys another ingest already opened."""
+    try:
+        with transaction.atomic():
+            GeofenceState.objects.bulk_create(states)
+        return set()
+    except IntegrityError:
+        pass
+    lost = set()
+    for state in states:
+        state.pk = None
+        try:
+            with transaction.atomic():
+                state.save(force_insert=True)
+        except IntegrityError:
+            lost.add((state.vehicle_id, state.geofence_id))
+    return lost
+
+
+def process_positions(positions, source):
+    """
+    Turn new positions into geofence events.
+
+    Args:
+        positions: iterable of ``(vehicle_id, latitude, longitude, timestamp,
+            trip_id)`` tuples (``trip_id`` may be None)
+        source: 'airotrack' or 'trip'
+
+    Returns:
+        list: the GeofenceEvents written
+    """
+    index = get_index()
+    positions = sorted(positions, key=lambda p: (p[0], p[3]))
+    if not len(index) or not positions:
+        return []
+
+    inside = index.match([p[1] for p in positions], [p[2] for p in positions])
+    vehicle_ids = {p[0] for p in positions}
+    open_visits = _open_visits(vehicle_ids, source)
+    last_seen = {
+        vehicle_id: max(state.last_seen_at for state in visits.values())
+        for vehicle_id, visits in open_visits.items()
+    }
+
+    events = []
+    closed = {}
+    touched = {}
+    dwelled = set()
+
+    def event(kind, geofence_id, position):
+        vehicle_id, latitude, longitude, timestamp, trip_id = position
+        events.append(GeofenceEvent(
+            geofence_id=geofence_id, vehicle_id=vehicle_id, trip_id=trip_id,
+            event_type=kind, source=source, occurred_at=timestamp,
+            latitude=latitude, longitude=longitude,
+        ))
+
+    for row, position in enumerate(positions):
+        vehicle_id, timestamp = position[0], position[3]
+        if vehicle_id in last_seen and timestamp < last_seen[vehicle_id]:
+            continue  # Older than what was already processed for this vehicle
+        last_seen[vehicle_id] = timestamp
+        visits = open_visits.setdefault(vehicle_id, {})
+        current = set(index.fence_ids[inside[row]].tolist())
+
+        for geofence_id in current - set(visits):
+            visits[geofence_id] = GeofenceState(
+                geofence_id=geofence_id, vehicle_id=vehicle_id, source=source,
+                entered_at=timestamp, last_seen_at=timestamp,
+            )
+            event('enter', geofence_id, position)
+        for geofence_id in set(visits) - current:
+            state = visits.pop(geofence_id)
+            if state.pk:
+                closed[state.pk] = (vehicle_id, geofence_id)
+            touched.pop((vehicle_id, geofence_id), None)
+            event('exit', geofence_id, position)
+        for geofence_id in current:
+            state = visits[geofence_id]
+            state.last_seen_at = timestamp
+            if (
+                not state.dwell_recorded
+                and (timestamp - state.entered_at).total_seconds() >= index.dwell_seconds[geofence_id]
+            ):
+                state.dwell_recorded = True
+                event('dwell', geofence_id, position)
+                if state.pk:
+                    dwelled.add(state.pk)
+            touched[(vehicle_id, geofence_id)] = state
+
+    new_states = [state for state in touched.values() if not state.pk]
+    changed_states = [state for state in touched.values() if state.pk and state.pk not in dwelled]
+    lost = set()
+    with transaction.atomic():
+        if closed:
+            # Lock the visits being closed; one another ingest already closed is its exit, not ours
+            still_open = set(
+                GeofenceState.objects.select_for_update().filter(pk__in=closed).values_list('pk', flat=True)
+            )
+            lost.update(key for pk, key in closed.items() if pk not in still_open)
+            GeofenceState.objects.filter(pk__in=still_open).delete()
+        if new_states:
+            lost.update(_insert_states(new_states))
+        for state in touched.values():
+            if state.pk in dwelled:
+                claimed = GeofenceState.objects.filter(pk=state.pk, dwell_recorded=False).update(
+                    last_seen_at=state.last_seen_at, dwell_recorded=True,
+                )
+                if not claimed:
+                    lost.add((state.vehicle_id, state.geofence_id))
+        if changed_states:
+            GeofenceState.objects.bulk_update(changed_states, ['last_seen_at', 'dwell_recorded'])
+        if lost:
+            events = [e for e in events if (e.vehicle_id, e.geofence_id) not in lost]
+        if events:
+            GeofenceEvent.objects.bulk_create(events)
+    return events
+
+
+def safe_process_positions(positions, source):
+    """``process_positions`` for ingest paths: a geofence failure never fails the ingest."""
+    try:
+        return process_positions(positions, source)
+    except Exception:
+        logger.exception("Geofence processing failed for %s positions", source)
+        return []
@@ -1,29 +1,45 @@
 """
-Management command to archive old LocationHistory records.
+Management command to archive old LocationHistory and TripLocation records.
 
-Moves records older than --days (default 90) to keep the main table fast.
-Deletes archived records to free disk space.
+Moves records older than --days (default 90) out of the hot tables to keep
+them fast. Each vehicle-month is first exported to a compressed columnar
+file under settings.LOCATION_ARCHIVE_ROOT (see geolocation.archive) and
+recorded in the LocationArchive manifest; only then are the rows deleted.
+Archived history is still served by the tracking history page and the
+location-history route API, and archived trips keep their maps through
+their route artifacts.
+
+TripLocation rows are archived per finished (completed/cancelled) trip
+that ended before the cutoff; the trip's route artifact is built first if
+it does not exist yet.
 
 Usage:
     python manage.py archive_location_history              # dry-run (default)
-    python manage.py archive_location_history --execute     # actually delete
+    python manage.py archive_location_history --execute     # export + delete
     python manage.py archive_location_history --days 60     # custom threshold
+    python manage.py archive_location_history --source history --execute
 """
+from itertools import groupby
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
+from geolocation.archive import (
+    HISTORY_FIELDS, SOURCE_HISTORY, SOURCE_TRIPS, TRIP_FIELDS,
+    month_bounds, month_start, write_archive,
+)
 from geolocation.models import LocationHistory
 
 
 class Command(BaseCommand):
-    help = 'Archive (delete) LocationHistory records older than N days'
+    help = 'Archive LocationHistory / TripLocation records older than N days to columnar files, then delete them'
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--days',
             type=int,
             default=90,
-            help='Delete records older than this many days (default: 90)',
+            help='Archive records older than this many days (default: 90)',
         )
         parser.add_argument(
             '--batch-size',
@@ -31,39 +47,113 @@ class Command(BaseCommand):
             default=10000,
             help='Number of records to delete per batch (default: 10000)',
         )
+        parser.add_argument(
+            '--source',
+            choices=['all', 'history', 'trips'],
+            default='all',
+            help='Which table to archive (default: all)',
+        )
         parser.add_argument(
             '--execute',
             action='store_true',
-            help='Actually delete records. Without this flag, only shows what would be deleted.',
+            help='Actually archive and delete records. Without this flag, only shows what would be archived.',
         )
 
     def handle(self, *args, **options):
         days = options['days']
-        batch_size = options['batch_size']
         execute = options['execute']
         cutoff = timezone.now() - timedelta(days=days)
 
-        total = LocationHistory.objects.filter(device_time__lt=cutoff).count()
-        self.stdout.write(f"Found {total:,} LocationHistory records older than {days} days (before {cutoff.date()})")
+        if options['source'] in ('all', 'history'):
+            self._archive_history(cutoff, days, options['batch_size'], execute)
+        if options['source'] in ('all', 'trips'):
+            self._archive_trips(cutoff, days, options['batch_size'], execute)
 
         if not execute:
             self.stdout.write(self.style.WARNING(
-                "Dry run — no records deleted. Use --execute to actually delete."
+                "Dry run — nothing archived or deleted. Use --execute to actually archive."
             ))
+
+    def _delete(self, model, ids, batch_size):
+        # Delete in batches to avoid locking the table for too long
+        deleted = 0
+        for i in range(0, len(ids), batch_size):
+            count, _ = model.objects.filter(id__in=ids[i:i + batch_size]).delete()
+            deleted += count
+        return deleted
+
+    def _archive_history(self, cutoff, days, batch_size, execute):
+        old = LocationHistory.objects.filter(device_time__lt=cutoff)
+        total = old.count()
+        self.stdout.write(f"Found {total:,} LocationHistory records older than {days} days (before {cutoff.date()})")
+        if not execute or not total:
             return
 
-        deleted_total = 0
+        archived_total = 0
+        files = 0
+        month = month_start(old.order_by('device_time').values_list('device_time', flat=True).first())
         while True:
-            # Delete in batches to avoid locking the table for too long
-            ids = list(
-                LocationHistory.objects
-                .filter(device_time__lt=cutoff)
-                .values_list('id', flat=True)[:batch_size]
-            )
-            if not ids:
+            start, end = month_bounds(month)
+            if start >= cutoff:
                 break
-            count, _ = LocationHistory.objects.filter(id__in=ids).delete()
-            deleted_total += count
-            self.stdout.write(f"  Deleted batch: {count:,} (total so far: {deleted_total:,})")
+            in_month = old.filter(device_time__gte=start, device_time__lt=end)
+            vehicle_ids = in_month.order_by('vehicle_id').values_list('vehicle_id', flat=True).distinct()
+            for vehicle_id in list(vehicle_ids):
+                rows = list(
+                    in_month.filter(vehicle_id=vehicle_id)
+                    .order_by('device_time', 'id')
+                    .values_list(*HISTORY_FIELDS)
+                )
+                manifest = write_archive(SOURCE_HISTORY, vehicle_id, month, rows)
+                archived_total += self._delete(LocationHistory, [row[0] for row in rows], batch_size)
+                files += 1
+                self.stdout.write(f"  {manifest.path}: +{len(rows):,} rows ({manifest.row_count:,} in file)")
+            month = end.date()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Archived {archived_total:,} LocationHistory records into {files} vehicle-month files."
+        ))
+
+    def _archive_trips(self, cutoff, days, batch_size, execute):
+        from trips.gps_cache import forget_last_point
+        from trips.models import Trip, TripLocation
+        from trips.route_artifacts import ARTIFACT_TRIP_STATUSES, build_route_artifact
+
+        trips = (
+            Trip.objects.filter(status__in=ARTIFACT_TRIP_STATUSES, end_time__lt=cutoff)
+            .filter(gps_locations__isnull=False)
+            .distinct()
+        )
+        total = TripLocation.objects.filter(trip__in=trips.values('id')).count()
+        self.stdout.write(
+            f"Found {total:,} TripLocation records of trips finished more than {days} days ago"
+        )
+        if not execute or not total:
+            return
+
+        # Maps of archived trips are served from their route artifacts.
+        for trip in list(trips.filter(route_artifact__isnull=True)):
+            build_route_artifact(trip)
+
+        archived_total = 0
+        files = 0
+        # Materialised up front: the loop deletes rows this query joins on.
+        trip_list = list(trips.order_by('vehicle_id', 'start_time').values_list('id', 'vehicle_id', 'start_time'))
+        groups = groupby(trip_list, key=lambda trip: (trip[1], month_start(trip[2])))
+        for (vehicle_id, month), group in groups:
+            trip_ids = [trip[0] for trip in group]
+            rows = list(
+                TripLocation.objects.filter(trip_id__in=trip_ids)
+                .order_by('timestamp', 'id')
+                .values_list(*TRIP_FIELDS)
+            )
+            manifest = write_archive(SOURCE_TRIPS, vehicle_id, month, rows)
+            archived_total += self._delete(TripLocation, [row[0] for row in rows], batch_size)
+            for trip_id in trip_ids:
+                forget_last_point(trip_id)
+            files += 1
+            self.stdout.write(f"  {manifest.path}: +{len(rows):,} rows ({manifest.row_count:,} in file)")
 
-        self.stdout.write(self.style.SUCCESS(f"Done. Deleted {deleted_total:,} records."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Archived {archived_total:,} TripLocation records into {files} vehicle-month files."
+        ))
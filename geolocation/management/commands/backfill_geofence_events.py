@@ -0,0 +1,124 @@
+"""
+Management command to replay stored positions through the geofence engine.
+
+Use it after adding or moving geofences, or to build events for the
+period before geofences existed. Positions are read in (time, id) chunks
+across all vehicles and fed to ``geolocation.geofence.process_positions``,
+the same code the ingest paths call, so open visits carry over from one
+chunk to the next.
+
+--reset deletes the replayed source's events from --since on and its
+open visits first, giving a clean replay; run it while that source's
+ingest is quiet, since live positions would interleave with the replay.
+The other source's events and visits are left alone.
+
+Usage:
+    python manage.py backfill_geofence_events                          # AiroTrack history
+    python manage.py backfill_geofence_events --source trips --since 2026-01-01
+    python manage.py backfill_geofence_events --reset --chunk-size 20000
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from geolocation.geofence import get_index, process_positions
+from geolocation.models import GeofenceEvent, GeofenceState, LocationHistory
+
+
+class Command(BaseCommand):
+    help = 'Replay LocationHistory / TripLocation through the geofence engine in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['history', 'trips'],
+            default='history',
+            help='AiroTrack LocationHistory or trip GPS points (default: history)',
+        )
+        parser.add_argument(
+            '--since',
+            help='Only replay positions from this date on (YYYY-MM-DD, local time)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Positions per chunk (default: 5000)',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Delete existing events (from --since on) and open visits of this source first',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.strptime(options['since'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+
+        if not len(get_index()):
+            self.stdout.write(self.style.WARNING("No active geofences — nothing to do."))
+            return
+
+        if options['source'] == 'history':
+            from_rows = self._history_rows
+            source = 'airotrack'
+        else:
+            from_rows = self._trip_rows
+            source = 'trip'
+
+        if options['reset']:
+            events = GeofenceEvent.objects.filter(source=source)
+            if since is not None:
+                events = events.filter(occurred_at__gte=since)
+            deleted, _ = events.delete()
+            visits, _ = GeofenceState.objects.filter(source=source).delete()
+            self.stdout.write(f"Deleted {deleted:,} {source} events and {visits:,} open visits")
+
+        positions = 0
+        written = 0
+        cursor = None
+        while True:
+            rows = from_rows(since, cursor, options['chunk_size'])
+            if not rows:
+                break
+            events = process_positions([row[:5] for row in rows], source)
+            positions += len(rows)
+            written += len(events)
+            cursor = (rows[-1][3], rows[-1][5])
+            self.stdout.write(f"  {positions:,} positions replayed, {written:,} events (up to {cursor[0]:%Y-%m-%d %H:%M})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Replayed {positions:,} positions into {written:,} geofence events."
+        ))
+
+    def _page(self, queryset, time_field, since, cursor, size):
+        if since is not None:
+            queryset = queryset.filter(**{f'{time_field}__gte': since})
+        if cursor is not None:
+            queryset = queryset.filter(
+                Q(**{f'{time_field}__gt': cursor[0]}) | Q(**{time_field: cursor[0], 'id__gt': cursor[1]})
+            )
+        return queryset.order_by(time_field, 'id')
+
+    def _history_rows(self, since, cursor, size):
+        """(vehicle_id, latitude, longitude, time, trip_id, id) tuples."""
+        queryset = self._page(LocationHistory.objects.all(), 'device_time', since, cursor, size)
+        return [
+            (vehicle_id, latitude, longitude, device_time, None, pk)
+            for vehicle_id, latitude, longitude, device_time, pk in queryset.values_list(
+                'vehicle_id', 'latitude', 'longitude', 'device_time', 'id'
+            )[:size]
+        ]
+
+    def _trip_rows(self, since, cursor, size):
+        from trips.gps_models import TripLocation
+        queryset = self._page(TripLocation.objects.all(), 'timestamp', since, cursor, size)
+        return list(queryset.values_list(
+            'trip__vehicle_id', 'latitude', 'longitude', 'timestamp', 'trip_id', 'id'
+        )[:size])
@@ -0,0 +1,52 @@
+"""
+Management command to fill the geohash column of rows written before it
+existed.
+
+New rows get their geohash on save (core.geohash.GeohashField); rows with
+an empty geohash are invisible to ``?bbox=`` and nearest-vehicle queries
+until this has run. Current locations are backfilled by the migration;
+this walks LocationHistory (and any stragglers in VehicleLocation) in
+primary-key batches, so it can be stopped and resumed.
+
+Usage:
+    python manage.py backfill_geohash
+    python manage.py backfill_geohash --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+
+from core.geohash import encode
+from geolocation.models import LocationHistory, VehicleLocation
+
+
+class Command(BaseCommand):
+    help = 'Compute the geohash of VehicleLocation / LocationHistory rows that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Rows updated per batch (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        for model in (VehicleLocation, LocationHistory):
+            updated = self._backfill(model, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"{model.__name__}: {updated:,} rows backfilled"))
+
+    def _backfill(self, model, batch_size):
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(
+                model.objects.filter(geohash='', id__gt=last_id)
+                .order_by('id')
+                .only('id', 'latitude', 'longitude')[:batch_size]
+            )
+            if not batch:
+                return updated
+            for row in batch:
+                row.geohash = encode(row.latitude, row.longitude)
+            model.objects.bulk_update(batch, ['geohash'])
+            updated += len(batch)
+            last_id = batch[-1].id
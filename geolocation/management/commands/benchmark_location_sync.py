@@ -0,0 +1,167 @@
+"""Benchmark AiroTrackAPI.update_vehicle_locations against the old per-row loop.
+
+Creates ``--devices`` synthetic vehicles with AiroTrack devices and feeds
+both write paths the same fake positions (no HTTP): the legacy loop
+(``AiroTrackDevice.objects.get`` + ``update_status`` +
+``VehicleLocation.update_or_create`` + ``LocationHistory.create`` per
+position) and the bulk pipeline. Each path runs two syncs, the first
+creating current locations and the second updating them, and reports
+wall time and query counts.
+
+Everything runs inside a transaction that is rolled back:
+
+    python manage.py benchmark_location_sync --devices 1000
+"""
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+class _Rollback(Exception):
+    pass
+
+
+def synthetic_positions(device_ids, when, seed=11):
+    """One AiroTrack-style position dict per device around Chennai."""
+    rng = random.Random(seed)
+    return [
+        {
+            'deviceId': device_id,
+            'latitude': round(13.0827 + rng.uniform(-0.2, 0.2), 7),
+            'longitude': round(80.2707 + rng.uniform(-0.2, 0.2), 7),
+            'speed': round(rng.uniform(0, 60), 2),
+            'course': round(rng.uniform(0, 359), 2),
+            'deviceTime': when.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'ignition': rng.random() < 0.5,
+        }
+        for device_id in device_ids
+    ]
+
+
+def legacy_update(api, positions):
+    """The pre-bulk per-position write loop, kept for comparison."""
+    from geolocation.models import AiroTrackDevice, VehicleLocation, LocationHistory
+
+    updated = 0
+    with transaction.atomic():
+        for position_data in positions:
+            parsed = api._parse_position_data(position_data)
+            device = AiroTrackDevice.objects.get(device_id=parsed['device_id'])
+            device.update_status('online')
+            VehicleLocation.objects.update_or_create(
+                vehicle=device.vehicle,
+                device=device,
+                defaults={
+                    'latitude': parsed['latitude'],
+                    'longitude': parsed['longitude'],
+                    'altitude': parsed['altitude'],
+                    'speed': parsed['speed'],
+                    'course': parsed['course'],
+                    'device_time': parsed['device_time'],
+                    'server_time': parsed['server_time'],
+                    'fix_time': parsed['fix_time'],
+                    'valid': parsed['valid'],
+                    'address': parsed['address'],
+                    'ignition': parsed['ignition'],
+                    'battery_level': parsed.get('battery_level'),
+                    'raw_data': parsed['raw_data'],
+                },
+            )
+            LocationHistory.objects.create(
+                vehicle=device.vehicle,
+                device=device,
+                latitude=parsed['latitude'],
+                longitude=parsed['longitude'],
+                altitude=parsed['altitude'],
+                speed=parsed['speed'],
+                course=parsed['course'],
+                device_time=parsed['device_time'],
+                valid=parsed['valid'],
+                address=parsed['address'],
+                ignition=parsed['ignition'],
+            )
+            updated += 1
+    return updated
+
+
+class Command(BaseCommand):
+    help = "Compare the per-row vs bulk AiroTrack location write path (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=1000,
+                            help='Number of synthetic vehicles/devices (default 1000).')
+
+    def _create_fleet(self, count):
+        from vehicles.models import Vehicle, VehicleType
+        from geolocation.models import AiroTrackDevice
+
+        vtype, _ = VehicleType.objects.get_or_create(name='Benchmark')
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(
+                vehicle_type=vtype, make='Bench', model='Mark', year=2024,
+                license_plate=f'BENCH{i:06d}', vin=f'BENCHVIN{i:09d}',
+                acquisition_date=date.today(),
+            )
+            for i in range(count)
+        ])
+        if vehicles and vehicles[0].pk is None:
+            # Backends without RETURNING on bulk insert (MySQL).
+            vehicles = list(Vehicle.objects.filter(license_plate__startswith='BENCH').order_by('license_plate'))
+        AiroTrackDevice.objects.bulk_create([
+            AiroTrackDevice(device_id=f'BENCH-{i:06d}', vehicle=vehicle)
+            for i, vehicle in enumerate(vehicles)
+        ])
+        return [f'BENCH-{i:06d}' for i in range(count)]
+
+    def _timed(self, fn):
+        # execute_wrapper rather than CaptureQueriesContext: the per-row
+        # path exceeds Django's 9000-entry query log.
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+        return elapsed, queries[0]
+
+    def _run(self, label, sync, device_ids):
+        now = timezone.now()
+        first = synthetic_positions(device_ids, now - timedelta(minutes=1))
+        second = synthetic_positions(device_ids, now, seed=12)
+        try:
+            with transaction.atomic():
+                self._create_fleet(len(device_ids))
+                results = [self._timed(lambda: sync(first)), self._timed(lambda: sync(second))]
+                raise _Rollback()
+        except _Rollback:
+            pass
+        for name, (elapsed, queries) in zip(('insert', 'update'), results):
+            self.stdout.write(
+                f"  {label:<10} {name:<7}{elapsed:8.3f}s {len(device_ids) / elapsed:9.0f} devices/s "
+                f"{queries:7d} queries"
+            )
+        return results[1][0]
+
+    def handle(self, *args, **opts):
+        from geolocation.airotrack_service import AiroTrackAPI
+
+        api = AiroTrackAPI()
+        device_ids = [f'BENCH-{i:06d}' for i in range(opts['devices'])]
+        self.stdout.write(f"Benchmarking location sync for {len(device_ids)} devices...")
+
+        legacy_s = self._run('per-row', lambda positions: legacy_update(api, positions), device_ids)
+
+        def bulk(positions):
+            api.get_positions = lambda device_ids=None, **kwargs: positions
+            api.update_vehicle_locations()
+
+        bulk_s = self._run('bulk', bulk, device_ids)
+        self.stdout.write(self.style.SUCCESS(f"Steady-state speed-up: {legacy_s / bulk_s:.1f}x"))
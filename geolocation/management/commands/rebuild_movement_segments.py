@@ -0,0 +1,62 @@
+"""
+Management command to rebuild drive/idle/stop movement segments from
+LocationHistory.
+
+The AiroTrack sync extends segments incrementally; run this after
+changing the segmenter's thresholds, after importing history, or to
+build segments for the period before they existed. The selected
+vehicles' segments are deleted and rebuilt from --days back, a few
+vehicles at a time so a long range never loads the whole fleet's points.
+
+Usage:
+    python manage.py rebuild_movement_segments                 # last 7 days, all vehicles
+    python manage.py rebuild_movement_segments --days 30
+    python manage.py rebuild_movement_segments --vehicle 12 --days 90
+"""
+from django.core.management.base import BaseCommand
+
+from geolocation.models import LocationHistory, MovementSegment
+from geolocation.segments import BOOTSTRAP_DAYS, update_segments
+
+
+class Command(BaseCommand):
+    help = 'Delete and rebuild the movement segments of vehicles from their LocationHistory'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=BOOTSTRAP_DAYS,
+            help=f'How far back to rebuild (default: {BOOTSTRAP_DAYS})',
+        )
+        parser.add_argument(
+            '--vehicle',
+            type=int,
+            action='append',
+            help='Only this vehicle id (repeatable)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=20,
+            help='Vehicles segmented per batch (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        vehicle_ids = options['vehicle']
+        if not vehicle_ids:
+            vehicle_ids = list(
+                LocationHistory.objects.order_by().values_list('vehicle_id', flat=True).distinct()
+            )
+
+        total = 0
+        chunk_size = options['chunk_size']
+        for i in range(0, len(vehicle_ids), chunk_size):
+            chunk = vehicle_ids[i:i + chunk_size]
+            MovementSegment.objects.filter(vehicle_id__in=chunk).delete()
+            total += update_segments(chunk, bootstrap_days=options['days'], chunk_size=chunk_size)
+            self.stdout.write(f"  {min(i + chunk_size, len(vehicle_ids)):,}/{len(vehicle_ids):,} vehicles")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Wrote {total:,} segments for {len(vehicle_ids):,} vehicles."
+        ))
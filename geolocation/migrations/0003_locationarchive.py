@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolocation', '0002_airotrackdevice_locationhistory_vehiclelocation_and_more'),
+        ('vehicles', '0010_vehicle_vehicles_ve_ownersh_be1823_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('location_history', 'Location history'), ('trip_location', 'Trip locations')], max_length=20)),
+                ('month', models.DateField(help_text='First day of the archived month (local time)')),
+                ('path', models.CharField(max_length=255)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('sha256', models.CharField(max_length=64)),
+                ('first_time', models.DateTimeField()),
+                ('last_time', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_archives', to='vehicles.vehicle')),
+            ],
+            options={
+                'ordering': ['vehicle', 'source', 'month'],
+                'constraints': [models.UniqueConstraint(fields=('source', 'vehicle', 'month'), name='unique_location_archive_month')],
+            },
+        ),
+    ]
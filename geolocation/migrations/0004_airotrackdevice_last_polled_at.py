@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolocation', '0003_locationarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airotrackdevice',
+            name='last_polled_at',
+            field=models.DateTimeField(blank=True, help_text="Last time the adaptive poller requested this device's position", null=True),
+        ),
+    ]
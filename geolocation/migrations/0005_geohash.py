@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:41
+
+import core.geohash
+from django.db import migrations, models
+
+
+def backfill_current_locations(apps, schema_editor):
+    """Current locations are one row per vehicle; history is backfilled by the backfill_geohash command."""
+    from core.geohash import encode
+    VehicleLocation = apps.get_model('geolocation', 'VehicleLocation')
+    locations = list(VehicleLocation.objects.only('id', 'latitude', 'longitude'))
+    for location in locations:
+        location.geohash = encode(location.latitude, location.longitude)
+    VehicleLocation.objects.bulk_update(locations, ['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolocation', '0004_airotrackdevice_last_polled_at'),
+        ('vehicles', '0010_vehicle_vehicles_ve_ownersh_be1823_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationhistory',
+            name='geohash',
+            field=core.geohash.GeohashField(blank=True, default='', editable=False, help_text='Maintained from latitude/longitude for viewport queries', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='vehiclelocation',
+            name='geohash',
+            field=core.geohash.GeohashField(blank=True, db_index=True, default='', editable=False, help_text='Maintained from latitude/longitude for viewport queries', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='locationhistory',
+            index=models.Index(fields=['geohash', 'device_time'], name='geolocation_geohash_5216e1_idx'),
+        ),
+        migrations.RunPython(backfill_current_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generators', '0001_initial'),
+        ('geolocation', '0005_geohash'),
+        ('trips', '0021_tripliveposition'),
+        ('vehicles', '0010_vehicle_vehicles_ve_ownersh_be1823_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Geofence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('store', 'Store'), ('sor_location', 'SOR location'), ('custom', 'Custom')], default='custom', max_length=20)),
+                ('label', models.CharField(blank=True, help_text='Location text this fence stands for, e.g. an SOR from/to location', max_length=255)),
+                ('shape', models.CharField(choices=[('circle', 'Circle'), ('polygon', 'Polygon')], default='circle', max_length=10)),
+                ('center_latitude', models.DecimalField(blank=True, decimal_places=7, max_digits=10, null=True)),
+                ('center_longitude', models.DecimalField(blank=True, decimal_places=7, max_digits=10, null=True)),
+                ('radius_m', models.PositiveIntegerField(blank=True, help_text='Radius of a circular fence in metres', null=True)),
+                ('polygon', models.JSONField(blank=True, help_text='Vertices of a polygon fence as [[latitude, longitude], ...]', null=True)),
+                ('dwell_seconds', models.PositiveIntegerField(default=300, help_text='Inside this long records a dwell event (once per visit)')),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('store', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='geofences', to='generators.store')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='GeofenceEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('enter', 'Enter'), ('exit', 'Exit'), ('dwell', 'Dwell')], max_length=10)),
+                ('source', models.CharField(choices=[('airotrack', 'AiroTrack'), ('trip', 'Trip GPS')], max_length=10)),
+                ('occurred_at', models.DateTimeField(help_text='Time of the position that triggered the event')),
+                ('latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('geofence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='geolocation.geofence')),
+                ('trip', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='geofence_events', to='trips.trip')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofence_events', to='vehicles.vehicle')),
+            ],
+            options={
+                'ordering': ['-occurred_at'],
+                'indexes': [models.Index(fields=['vehicle', 'occurred_at'], name='geolocation_vehicle_87003a_idx'), models.Index(fields=['geofence', 'occurred_at'], name='geolocation_geofenc_578577_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GeofenceState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entered_at', models.DateTimeField()),
+                ('last_seen_at', models.DateTimeField()),
+                ('dwell_recorded', models.BooleanField(default=False)),
+                ('geofence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='states', to='geolocation.geofence')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofence_states', to='vehicles.vehicle')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'geofence'), name='unique_geofence_state')],
+            },
+        ),
+    ]
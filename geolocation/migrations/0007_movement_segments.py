@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolocation', '0006_geofences'),
+        ('vehicles', '0010_vehicle_vehicles_ve_ownersh_be1823_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovementSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('drive', 'Driving'), ('idle', 'Idling'), ('stop', 'Stopped')], max_length=5)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('duration_seconds', models.PositiveIntegerField()),
+                ('point_count', models.PositiveIntegerField()),
+                ('centroid_latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('centroid_longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('end_latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('end_longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('distance_km', models.FloatField(default=0)),
+                ('max_speed_kmh', models.FloatField(default=0)),
+                ('is_open', models.BooleanField(default=False, help_text="One of the vehicle's last two segments, rebuilt on the next sync")),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movement_segments', to='vehicles.vehicle')),
+            ],
+            options={
+                'ordering': ['vehicle', 'start_time'],
+                'indexes': [models.Index(fields=['vehicle', 'start_time'], name='geolocation_vehicle_b53bbe_idx'), models.Index(fields=['kind', 'start_time'], name='geolocation_kind_38e733_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolocation', '0007_movement_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodedPlace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_lat', models.IntegerField(help_text='Latitude of the cell in thousandths of a degree')),
+                ('cell_lon', models.IntegerField(help_text='Longitude of the cell in thousandths of a degree')),
+                ('address', models.TextField(blank=True, help_text='Empty when the provider knows no address here')),
+                ('provider', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cell_lat', 'cell_lon'), name='unique_geocoded_cell')],
+            },
+        ),
+    ]
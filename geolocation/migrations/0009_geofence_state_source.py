@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolocation', '0008_geocodedplace'),
+        ('vehicles', '0010_vehicle_vehicles_ve_ownersh_be1823_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='geofencestate',
+            name='unique_geofence_state',
+        ),
+        migrations.AddField(
+            model_name='geofencestate',
+            name='source',
+            field=models.CharField(choices=[('airotrack', 'AiroTrack'), ('trip', 'Trip GPS')], default='airotrack', max_length=10),
+        ),
+        migrations.AddConstraint(
+            model_name='geofencestate',
+            constraint=models.UniqueConstraint(fields=('vehicle', 'geofence', 'source'), name='unique_geofence_state'),
+        ),
+    ]
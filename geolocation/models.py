@@ -1,6 +1,9 @@
+import math
+from datetime import timedelta
 from django.db import models
 from django.utils import timezone
 from vehicles.models import Vehicle
+from core.geohash import GeohashField
 
 class AiroTrackDevice(models.Model):
     """
@@ -24,6 +27,7 @@ class AiroTrackDevice(models.Model):
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='unknown')
     last_update = models.DateTimeField(null=True, blank=True)
+    last_polled_at = models.DateTimeField(null=True, blank=True, help_text="Last time the adaptive poller requested this device's position")
     
     def __str__(self):
         return f"{self.name or self.device_id} ({self.get_status_display()})"
@@ -57,6 +61,7 @@ class VehicleLocation(models.Model):
     # Location data
     latitude = models.DecimalField(max_digits=10, decimal_places=7)
     longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    geohash = GeohashField(db_index=True, help_text="Maintained from latitude/longitude for viewport queries")
     altitude = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     speed = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, help_text="Speed in km/h")
     course = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, help_text="Direction in degrees")
@@ -122,6 +127,7 @@ class LocationHistory(models.Model):
     # Location data
     latitude = models.DecimalField(max_digits=10, decimal_places=7)
     longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    geohash = GeohashField(help_text="Maintained from latitude/longitude for viewport queries")
     altitude = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     speed = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     course = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
@@ -142,6 +148,7 @@ class LocationHistory(models.Model):
         indexes = [
             models.Index(fields=['vehicle', 'device_time']),
             models.Index(fields=['device', 'device_time']),
+            models.Index(fields=['geohash', 'device_time']),
         ]
         verbose_name_plural = "Location histories"
     
@@ -151,3 +158,240 @@ class LocationHistory(models.Model):
     def coordinates(self):
         """Return coordinates as a tuple."""
         return (float(self.latitude), float(self.longitude))
+
+class LocationArchive(models.Model):
+    """
+    Manifest of cold-storage files written by archive_location_history.
+    One compressed columnar file per source table, vehicle and month;
+    the rows it holds have been deleted from the hot table.
+    """
+    SOURCE_CHOICES = (
+        ('location_history', 'Location history'),
+        ('trip_location', 'Trip locations'),
+    )
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    vehicle = models.ForeignKey(
+        Vehicle,
+        on_delete=models.CASCADE,
+        related_name='location_archives'
+    )
+    month = models.DateField(help_text="First day of the archived month (local time)")
+    
+    # File, relative to settings.LOCATION_ARCHIVE_ROOT
+    path = models.CharField(max_length=255)
+    row_count = models.PositiveIntegerField(default=0)
+    size_bytes = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64)
+    
+    # Time span of the archived rows, used to decide which files a query needs
+    first_time = models.DateTimeField()
+    last_time = models.DateTimeField()
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['vehicle', 'source', 'month']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source', 'vehicle', 'month'], name='unique_location_archive_month'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_source_display()} archive: {self.vehicle_id} {self.month:%Y-%m} ({self.row_count} rows)"
+
+class Geofence(models.Model):
+    """
+    A circle or polygon whose entries, exits and dwells are recorded as
+    GeofenceEvents while positions are ingested (see geolocation.geofence).
+    Stores have no coordinates of their own, so a store's fence links to it;
+    SOR from/to locations are free text and are matched by ``label``.
+    """
+    SHAPE_CHOICES = (
+        ('circle', 'Circle'),
+        ('polygon', 'Polygon'),
+    )
+    KIND_CHOICES = (
+        ('store', 'Store'),
+        ('sor_location', 'SOR location'),
+        ('custom', 'Custom'),
+    )
+    name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='custom')
+    store = models.ForeignKey(
+        'generators.Store',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='geofences'
+    )
+    label = models.CharField(
+        max_length=255, blank=True,
+        help_text="Location text this fence stands for, e.g. an SOR from/to location"
+    )
+    
+    shape = models.CharField(max_length=10, choices=SHAPE_CHOICES, default='circle')
+    center_latitude = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True)
+    center_longitude = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True)
+    radius_m = models.PositiveIntegerField(null=True, blank=True, help_text="Radius of a circular fence in metres")
+    polygon = models.JSONField(
+        null=True, blank=True,
+        help_text="Vertices of a polygon fence as [[latitude, longitude], ...]"
+    )
+    
+    dwell_seconds = models.PositiveIntegerField(
+        default=300, help_text="Inside this long records a dwell event (once per visit)"
+    )
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_shape_display()})"
+    
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if self.shape == 'circle':
+            if self.center_latitude is None or self.center_longitude is None or not self.radius_m:
+                raise ValidationError("A circular geofence needs a centre and a radius.")
+            return
+        if not isinstance(self.polygon, list) or len(self.polygon) < 3:
+            raise ValidationError("A polygon geofence needs at least three [latitude, longitude] vertices.")
+        for vertex in self.polygon:
+            if (
+                not isinstance(vertex, (list, tuple))
+                or len(vertex) != 2
+                or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in vertex)
+                or not all(math.isfinite(value) for value in vertex)
+            ):
+                raise ValidationError(f"Polygon vertex {vertex!r} is not a numeric [latitude, longitude] pair.")
+            if not (-90 <= vertex[0] <= 90 and -180 <= vertex[1] <= 180):
+                raise ValidationError(f"Polygon vertex {vertex!r} is outside the valid latitude/longitude range.")
+
+class GeofenceEvent(models.Model):
+    """A vehicle entering, leaving or dwelling in a geofence."""
+    EVENT_CHOICES = (
+        ('enter', 'Enter'),
+        ('exit', 'Exit'),
+        ('dwell', 'Dwell'),
+    )
+    SOURCE_CHOICES = (
+        ('airotrack', 'AiroTrack'),
+        ('trip', 'Trip GPS'),
+    )
+    geofence = models.ForeignKey(Geofence, on_delete=models.CASCADE, related_name='events')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='geofence_events')
+    trip = models.ForeignKey(
+        'trips.Trip',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='geofence_events'
+    )
+    event_type = models.CharField(max_length=10, choices=EVENT_CHOICES)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    occurred_at = models.DateTimeField(help_text="Time of the position that triggered the event")
+    latitude = models.DecimalField(max_digits=10, decimal_places=7)
+    longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-occurred_at']
+        indexes = [
+            models.Index(fields=['vehicle', 'occurred_at']),
+            models.Index(fields=['geofence', 'occurred_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.vehicle_id} {self.event_type} {self.geofence_id} at {self.occurred_at}"
+
+class GeofenceState(models.Model):
+    """
+    Open visit of a vehicle to a geofence, as seen by one position source:
+    the row exists while the vehicle is inside. Lets ingest emit
+    enter/exit/dwell incrementally without looking back at history. The
+    AiroTrack device and the driver's phone report independently, so each
+    source keeps its own visits.
+    """
+    geofence = models.ForeignKey(Geofence, on_delete=models.CASCADE, related_name='states')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='geofence_states')
+    source = models.CharField(max_length=10, choices=GeofenceEvent.SOURCE_CHOICES, default='airotrack')
+    entered_at = models.DateTimeField()
+    last_seen_at = models.DateTimeField()
+    dwell_recorded = models.BooleanField(default=False)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'geofence', 'source'], name='unique_geofence_state'),
+        ]
+    
+    def __str__(self):
+        return f"{self.vehicle_id} inside {self.geofence_id} ({self.source}) since {self.entered_at}"
+
+class MovementSegment(models.Model):
+    """
+    A stretch of a vehicle's LocationHistory spent driving, idling (engine
+    on, not moving) or stopped (engine off), built by
+    ``geolocation.segments``. Stop reports and idle-fuel estimates read
+    these instead of raw points.
+    """
+    KIND_CHOICES = [
+        ('drive', 'Driving'),
+        ('idle', 'Idling'),
+        ('stop', 'Stopped'),
+    ]
+    
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='movement_segments')
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    duration_seconds = models.PositiveIntegerField()
+    point_count = models.PositiveIntegerField()
+    centroid_latitude = models.DecimalField(max_digits=10, decimal_places=7)
+    centroid_longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    end_latitude = models.DecimalField(max_digits=10, decimal_places=7)
+    end_longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    distance_km = models.FloatField(default=0)
+    max_speed_kmh = models.FloatField(default=0)
+    is_open = models.BooleanField(
+        default=False,
+        help_text="One of the vehicle's last two segments, rebuilt on the next sync"
+    )
+    
+    class Meta:
+        ordering = ['vehicle', 'start_time']
+        indexes = [
+            models.Index(fields=['vehicle', 'start_time']),
+            models.Index(fields=['kind', 'start_time']),
+        ]
+    
+    def __str__(self):
+        return f"{self.vehicle_id} {self.kind} {self.start_time} ({self.duration_seconds}s)"
+    
+    @property
+    def duration(self):
+        return timedelta(seconds=self.duration_seconds)
+
+class GeocodedPlace(models.Model):
+    """
+    Reverse-geocoded address of a ~100 m grid cell, filled in the
+    background by ``geolocation.geocoding`` so repeated depots and stores
+    resolve without calling the provider again.
+    """
+    cell_lat = models.IntegerField(help_text="Latitude of the cell in thousandths of a degree")
+    cell_lon = models.IntegerField(help_text="Longitude of the cell in thousandths of a degree")
+    address = models.TextField(blank=True, help_text="Empty when the provider knows no address here")
+    provider = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cell_lat', 'cell_lon'], name='unique_geocoded_cell'),
+        ]
+    
+    def __str__(self):
+        return self.address or f"({self.cell_lat}, {self.cell_lon})"
@@ -0,0 +1,244 @@
+"""
+Adaptive AiroTrack polling, run by Celery beat every
+``AIROTRACK_POLL_SECONDS`` (see ``geolocation.tasks``).
+
+Each cycle only polls the devices that are due, by their last known state:
+
+    moving   - speed > MOVING_SPEED_KMH or ignition on: every cycle
+               (AIROTRACK_POLL_SECONDS)
+    parked   - recent fix, stationary, ignition off:
+               AIROTRACK_POLL_PARKED_SECONDS
+    offline  - device offline/inactive, no fix, or fix older than
+               OFFLINE_AFTER_SECONDS: AIROTRACK_POLL_OFFLINE_SECONDS
+
+``AiroTrackDevice.last_polled_at`` records when each device was last asked
+for. ``poll_lock`` keeps location updates from overlapping: the beat cycle
+holds it for the whole cycle, and ``AiroTrackAPI.update_vehicle_locations``
+takes it too, so manual syncs (admin, API, tracking dashboard) never run
+alongside a poll. The device list itself is refreshed at most once per
+AIROTRACK_DEVICE_REFRESH_SECONDS. Per-cycle metrics (duration, devices due
+per class, fetch/write results) are kept in the cache for
+``poll_metrics`` and the ``api/sync/status/`` endpoint.
+"""
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .airotrack_fetch import percentile
+from .models import AiroTrackDevice, VehicleLocation
+
+logger = logging.getLogger(__name__)
+
+MOVING_SPEED_KMH = 5
+OFFLINE_AFTER_SECONDS = 30 * 60
+
+LOCK_KEY = 'airotrack_poll_lock'
+LOCK_TIMEOUT = 5 * 60
+DEVICE_REFRESH_KEY = 'airotrack_device_refresh'
+METRICS_KEY = 'airotrack_poll_metrics'
+METRICS_KEEP = 120
+METRICS_TTL = 24 * 60 * 60
+
+# Deletes the lock only if it still holds our token, in one Redis round trip
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_held = threading.local()
+
+
+def poll_intervals():
+    """Seconds between polls for each device class."""
+    return {
+        'moving': getattr(settings, 'AIROTRACK_POLL_SECONDS', 30),
+        'parked': getattr(settings, 'AIROTRACK_POLL_PARKED_SECONDS', 300),
+        'offline': getattr(settings, 'AIROTRACK_POLL_OFFLINE_SECONDS', 900),
+    }
+
+
+def classify(device_status, location, now):
+    """'moving', 'parked' or 'offline' from the device status and its current location values."""
+    if device_status in ('offline', 'inactive') or location is None:
+        return 'offline'
+    if (now - location['device_time']).total_seconds() > OFFLINE_AFTER_SECONDS:
+        return 'offline'
+    if location['ignition'] or float(location['speed'] or 0) > MOVING_SPEED_KMH:
+        return 'moving'
+    return 'parked'
+
+
+def due_devices(now=None):
+    """
+    Devices to poll this cycle.
+
+    Returns:
+        tuple: (list of (pk, device_id) due, {class: due count}, total devices)
+    """
+    now = now or timezone.now()
+    intervals = poll_intervals()
+    locations = {
+        row['device_id']: row
+        for row in VehicleLocation.objects.values('device_id', 'speed', 'ignition', 'device_time')
+    }
+    due = []
+    counts = {'moving': 0, 'parked': 0, 'offline': 0}
+    total = 0
+    devices = AiroTrackDevice.objects.filter(vehicle__isnull=False).values_list(
+        'id', 'device_id', 'status', 'last_polled_at'
+    )
+    for pk, device_id, status, last_polled_at in devices:
+        total += 1
+        state = classify(status, locations.get(pk), now)
+        # Half a tick of slack so beat jitter does not push a device to the next cycle.
+        interval = intervals[state] - intervals['moving'] / 2
+        if last_polled_at is None or (now - last_polled_at).total_seconds() >= interval:
+            due.append((pk, device_id))
+            counts[state] += 1
+    return due, counts, total
+
+
+def _acquire_lock():
+    token = uuid.uuid4().hex
+    try:
+        # add() returns None when django-redis swallows a connection error;
+        # without Redis the broker is down too, so just run.
+        acquired = cache.add(LOCK_KEY, token, LOCK_TIMEOUT) is not False
+    except Exception:
+        acquired = True  # Cache backend down
+    return token if acquired else None
+
+
+def _release_lock(token):
+    try:
+        client = getattr(cache, 'client', None)
+        if client is not None and hasattr(client, 'get_client') and hasattr(client, 'encode'):
+            # django-redis: compare-and-delete atomically, so a lock that
+            # expired and was taken by another worker is never released here.
+            client.get_client(write=True).eval(
+                RELEASE_SCRIPT, 1, cache.make_key(LOCK_KEY), client.encode(token),
+            )
+        elif cache.get(LOCK_KEY) == token:
+            # Local-memory / dummy caches are per process, nothing to race with.
+            cache.delete(LOCK_KEY)
+    except Exception:
+        pass  # Cache backend down — the lock expires on its own
+
+
+@contextmanager
+def poll_lock():
+    """
+    Hold the AiroTrack location-poll lock; yields False if another worker
+    holds it. Re-entrant within a thread, so the beat cycle can hold it
+    while calling ``update_vehicle_locations``, which takes it as well.
+    """
+    if getattr(_held, 'depth', 0):
+        _held.depth += 1
+        try:
+            yield True
+        finally:
+            _held.depth -= 1
+        return
+
+    token = _acquire_lock()
+    if token is None:
+        yield False
+        return
+    _held.depth = 1
+    try:
+        yield True
+    finally:
+        _held.depth = 0
+        _release_lock(token)
+
+
+def _record_metrics(metrics):
+    try:
+        history = cache.get(METRICS_KEY) or []
+        history.append(metrics)
+        cache.set(METRICS_KEY, history[-METRICS_KEEP:], METRICS_TTL)
+    except Exception:
+        pass  # Cache backend down
+
+
+def poll_metrics():
+    """Recent cycle metrics (newest last) plus a duration summary."""
+    try:
+        cycles = cache.get(METRICS_KEY) or []
+    except Exception:
+        cycles = []
+    ran = sorted(c['duration_ms'] for c in cycles if not c.get('skipped'))
+    return {
+        'cycles': cycles,
+        'summary': {
+            'cycles': len(ran),
+            'skipped': sum(1 for c in cycles if c.get('skipped')),
+            'duration_ms': {
+                'p50': percentile(ran, 0.5),
+                'p95': percentile(ran, 0.95),
+                'max': ran[-1] if ran else None,
+            },
+        },
+        'intervals': poll_intervals(),
+    }
+
+
+def run_poll_cycle(api=None):
+    """
+    One polling cycle. Returns the cycle's metrics dict (``skipped`` is set
+    when another cycle still holds the lock).
+    """
+    started_at = timezone.now()
+    started = time.perf_counter()
+    with poll_lock() as acquired:
+        if not acquired:
+            logger.info("AiroTrack poll skipped: previous cycle still running")
+            metrics = {'started_at': started_at.isoformat(), 'skipped': True, 'duration_ms': 0.0}
+            _record_metrics(metrics)
+            return metrics
+
+        if api is None:
+            from .airotrack_service import AiroTrackAPI
+            api = AiroTrackAPI()
+
+        refresh_every = getattr(settings, 'AIROTRACK_DEVICE_REFRESH_SECONDS', 3600)
+        try:
+            refresh_devices = cache.add(DEVICE_REFRESH_KEY, 1, refresh_every) is True
+        except Exception:
+            refresh_devices = False
+        if refresh_devices:
+            api.update_device_database()
+
+        due, counts, total = due_devices(started_at)
+        metrics = {
+            'started_at': started_at.isoformat(),
+            'devices': total,
+            'due': counts,
+            'polled': len(due),
+        }
+        if due:
+            updated, errors = api.update_vehicle_locations(device_ids=[device_id for _, device_id in due])
+            AiroTrackDevice.objects.filter(id__in=[pk for pk, _ in due]).update(last_polled_at=started_at)
+            metrics.update({'updated': updated, 'errors': errors})
+            if api.last_location_report:
+                metrics['history_suppressed'] = api.last_location_report['history_suppressed']
+            report = api.last_fetch_report
+            if report:
+                metrics['fetch'] = {
+                    'failed': report['failed'],
+                    'skipped': report['skipped'],
+                    'elapsed_ms': report['elapsed_ms'],
+                    'p95_ms': report['latency_ms']['p95'],
+                }
+        metrics['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        _record_metrics(metrics)
+        logger.info("AiroTrack poll cycle: %s", metrics)
+        return metrics
@@ -0,0 +1,271 @@
+"""
+Drive / idle / stop segments extracted from LocationHistory.
+
+Each fix is classified from the ignition and speed AiroTrack reports:
+
+    drive  - moving faster than MOVING_SPEED_KMH
+    idle   - ignition on, not moving (engine running, burning fuel)
+    stop   - ignition off, not moving
+
+``Segmenter`` streams a vehicle's fixes in time order and merges
+consecutive fixes of the same kind into segments with duration, centroid,
+distance and top speed. A segment runs until the next segment's first fix,
+so a vehicle's segments tile its timeline; a gap longer than
+GAP_SECONDS ends a segment at its last fix instead. A blip shorter than
+MIN_BLIP_SECONDS between two segments of the same kind (a few seconds
+at a signal while driving, a brief engine start while parked) is folded
+into them.
+
+``update_segments`` keeps the ``MovementSegment`` table current after each
+sync without re-reading whole histories: a vehicle's last two segments
+are stored with ``is_open`` (the last may still grow, and the one before
+may still absorb it as a blip), so each run deletes those, re-segments
+the vehicle's fixes from the start of the older one, and writes the
+result. The ``rebuild_movement_segments`` command does the same from
+scratch for a time range.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from core.geo import haversine_km
+
+from .models import LocationHistory, MovementSegment
+
+logger = logging.getLogger(__name__)
+
+MOVING_SPEED_KMH = 3.0
+GAP_SECONDS = 30 * 60
+MIN_BLIP_SECONDS = 120
+BOOTSTRAP_DAYS = 7
+VEHICLE_CHUNK = 200
+
+POINT_FIELDS = ('device_time', 'latitude', 'longitude', 'speed', 'ignition')
+
+
+def classify(speed, ignition):
+    """'drive', 'idle' or 'stop' for one fix."""
+    if float(speed or 0) > MOVING_SPEED_KMH:
+        return 'drive'
+    return 'idle' if ignition else 'stop'
+
+
+def idle_fuel_litres(idle_seconds):
+    """Estimated fuel burnt while idling, at settings.IDLE_FUEL_LITRES_PER_HOUR."""
+    rate = getattr(settings, 'IDLE_FUEL_LITRES_PER_HOUR', 0.8)
+    return round(idle_seconds / 3600.0 * rate, 2)
+
+
+class _Segment:
+    __slots__ = (
+        'kind', 'start_time', 'end_time', 'points', 'lat_sum', 'lon_sum',
+        'last_lat', 'last_lon', 'distance_km', 'max_speed',
+    )
+
+    def __init__(self, kind, time, lat, lon, speed):
+        self.kind = kind
+        self.start_time = self.end_time = time
+        self.points = 1
+        self.lat_sum = self.last_lat = lat
+        self.lon_sum = self.last_lon = lon
+        self.distance_km = 0.0
+        self.max_speed = speed
+
+    def add(self, time, lat, lon, speed):
+        self.distance_km += float(haversine_km(self.last_lat, self.last_lon, lat, lon))
+        self.end_time = time
+        self.points += 1
+        self.lat_sum += lat
+        self.lon_sum += lon
+        self.last_lat, self.last_lon = lat, lon
+        self.max_speed = max(self.max_speed, speed)
+
+    def absorb(self, other):
+        """Append a later segment (its points and distance) to this one."""
+        self.distance_km += other.distance_km
+        self.end_time = other.end_time
+        self.points += other.points
+        self.lat_sum += other.lat_sum
+        self.lon_sum += other.lon_sum
+        self.last_lat, self.last_lon = other.last_lat, other.last_lon
+        self.max_speed = max(self.max_speed, other.max_speed)
+
+    @property
+    def duration_seconds(self):
+        return (self.end_time - self.start_time).total_seconds()
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration_seconds': int(self.duration_seconds),
+            'point_count': self.points,
+            'centroid_latitude': round(self.lat_sum / self.points, 7),
+            'centroid_longitude': round(self.lon_sum / self.points, 7),
+            'end_latitude': round(self.last_lat, 7),
+            'end_longitude': round(self.last_lon, 7),
+            'distance_km': round(self.distance_km, 3),
+            'max_speed_kmh': round(self.max_speed, 2),
+        }
+
+
+class Segmenter:
+    """
+    Streaming segmenter for one vehicle. ``feed`` fixes in time order and
+    collect the finished segments it returns; ``finish`` returns the rest.
+    Holds at most two segments in memory.
+    """
+
+    def __init__(self):
+        self.previous = None
+        self.current = None
+
+    def feed(self, time, latitude, longitude, speed, ignition):
+        lat, lon, speed = float(latitude), float(longitude), float(speed or 0)
+        kind = classify(speed, ignition)
+        done = []
+        current = self.current
+        if current is not None and (time - current.end_time).total_seconds() > GAP_SECONDS:
+            # No data for a long time: end both segments at their last fix.
+            done.extend(self.finish())
+            current = None
+        if current is None:
+            self.current = _Segment(kind, time, lat, lon, speed)
+            return done
+        if kind == current.kind:
+            current.add(time, lat, lon, speed)
+            return done
+
+        # Kind changes: the current segment lasts until this fix.
+        current.distance_km += float(haversine_km(current.last_lat, current.last_lon, lat, lon))
+        current.end_time = time
+        current.last_lat, current.last_lon = lat, lon
+        previous = self.previous
+        if previous is not None and previous.kind == kind and current.duration_seconds < MIN_BLIP_SECONDS:
+            previous.absorb(current)
+            previous.add(time, lat, lon, speed)
+            self.previous, self.current = None, previous
+            return done
+        if previous is not None:
+            done.append(previous)
+        self.previous = current
+        self.current = _Segment(kind, time, lat, lon, speed)
+        return done
+
+    def finish(self):
+        done = [segment for segment in (self.previous, self.current) if segment is not None]
+        self.previous = self.current = None
+        return done
+
+
+def segment_points(points):
+    """Segment dicts for ``(time, latitude, longitude, speed, ignition)`` fixes in time order."""
+    segmenter = Segmenter()
+    segments = []
+    for point in points:
+        segments.extend(segmenter.feed(*point))
+    segments.extend(segmenter.finish())
+    return [segment.as_dict() for segment in segments]
+
+
+def _resegment(vehicle_starts, bootstrap_from):
+    """
+    Re-segment each vehicle from its start time (None: from
+    ``bootstrap_from``) and replace its open segments. Returns the number
+    of segments written.
+    """
+    tail = Q()
+    for vehicle_id, start in vehicle_starts.items():
+        tail |= Q(vehicle_id=vehicle_id, device_time__gte=start or bootstrap_from)
+    points = {}
+    for vehicle_id, *point in (
+        LocationHistory.objects.filter(tail)
+        .order_by('vehicle_id', 'device_time', 'id')
+        .values_list('vehicle_id', *POINT_FIELDS)
+        .iterator(chunk_size=5000)
+    ):
+        points.setdefault(vehicle_id, []).append(point)
+
+    rows = []
+    for vehicle_id, vehicle_points in points.items():
+        segments = segment_points(vehicle_points)
+        for position, segment in enumerate(segments):
+            rows.append(MovementSegment(
+                vehicle_id=vehicle_id,
+                is_open=position >= len(segments) - 2,
+                **segment
+            ))
+
+    with transaction.atomic():
+        MovementSegment.objects.filter(vehicle_id__in=list(vehicle_starts), is_open=True).delete()
+        MovementSegment.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def update_segments(vehicle_ids, bootstrap_days=BOOTSTRAP_DAYS, chunk_size=VEHICLE_CHUNK):
+    """
+    Bring the segments of ``vehicle_ids`` up to date with their history.
+    Vehicles without segments yet start ``bootstrap_days`` back. A few
+    queries per ``chunk_size`` vehicles. Returns the number of segments written.
+    """
+    vehicle_ids = sorted(set(vehicle_ids))
+    bootstrap_from = timezone.now() - timedelta(days=bootstrap_days)
+    written = 0
+    for i in range(0, len(vehicle_ids), chunk_size):
+        chunk = vehicle_ids[i:i + chunk_size]
+        starts = dict.fromkeys(chunk)
+        starts.update(
+            MovementSegment.objects.filter(vehicle_id__in=chunk, is_open=True)
+            .values('vehicle_id')
+            .annotate(start=Min('start_time'))
+            .values_list('vehicle_id', 'start')
+        )
+        # Vehicles that only have closed segments continue after the last one.
+        missing = [vehicle_id for vehicle_id, start in starts.items() if start is None]
+        if missing:
+            starts.update(
+                MovementSegment.objects.filter(vehicle_id__in=missing)
+                .values('vehicle_id')
+                .annotate(start=Max('end_time'))
+                .values_list('vehicle_id', 'start')
+            )
+        written += _resegment(starts, bootstrap_from)
+    return written
+
+
+def safe_update_segments(vehicle_ids):
+    """``update_segments`` for the sync path: a failure never fails the sync."""
+    try:
+        return update_segments(vehicle_ids)
+    except Exception:
+        logger.exception("Movement segment update failed")
+        return 0
+
+
+def segment_summary(segments, time_from=None, time_to=None):
+    """
+    Totals per kind plus the idle fuel estimate for a list of
+    MovementSegments. Segments reaching outside ``time_from`` / ``time_to``
+    only count the part inside the window, their distance pro rata.
+    """
+    totals = {'drive': 0, 'idle': 0, 'stop': 0}
+    distance = 0.0
+    for segment in segments:
+        start = max(segment.start_time, time_from) if time_from else segment.start_time
+        end = min(segment.end_time, time_to) if time_to else segment.end_time
+        span = (segment.end_time - segment.start_time).total_seconds()
+        share = max((end - start).total_seconds(), 0) / span if span > 0 else 1.0
+        totals[segment.kind] += round(segment.duration_seconds * min(share, 1.0))
+        distance += segment.distance_km * min(share, 1.0)
+    return {
+        'drive_seconds': totals['drive'],
+        'idle_seconds': totals['idle'],
+        'stop_seconds': totals['stop'],
+        'distance_km': round(distance, 2),
+        'idle_fuel_litres': idle_fuel_litres(totals['idle']),
+    }
@@ -0,0 +1,16 @@
+"""
+Rebuild the geofence index (``geolocation.geofence``) in every process
+when a Geofence is saved or deleted, including the cascade delete of a
+store's fences, which never calls ``Geofence.delete()``.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Geofence
+
+
+@receiver(post_save, sender=Geofence)
+@receiver(post_delete, sender=Geofence)
+def geofence_changed(sender, **kwargs):
+    from .geofence import invalidate_index
+    invalidate_index()
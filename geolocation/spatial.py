@@ -0,0 +1,116 @@
+"""
+Viewport and proximity queries over the geohash-indexed location tables.
+
+``?bbox=west,south,east,north`` (decimal degrees, the GeoJSON order) is
+accepted by the map endpoints and applied with ``filter_bbox``: an indexed
+geohash range scan (``core.geohash.bbox_q``) narrowed by an exact
+latitude/longitude check. ``nearest_vehicles`` answers "closest vehicles
+to this point" by searching growing boxes around it until k vehicles are
+inside the searched radius, so a dense city never scans the whole fleet.
+"""
+import math
+
+from core import geohash
+from core.geo import EARTH_RADIUS_KM, as_float_array, haversine_km
+
+from .models import VehicleLocation
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+NEAREST_RADII_KM = (2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def parse_bbox(value):
+    """
+    ``(min_lat, min_lon, max_lat, max_lon)`` from a ``west,south,east,north``
+    string, or None when ``value`` is empty.
+
+    Raises:
+        ValueError: malformed, out of range, or crossing the antimeridian
+    """
+    if not value:
+        return None
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValueError("bbox must be four numbers: west,south,east,north")
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= 90 and -90 <= north <= 90):
+        raise ValueError("bbox coordinates are out of range")
+    if west > east or south > north:
+        raise ValueError("bbox must have west <= east and south <= north")
+    return south, west, north, east
+
+
+def filter_bbox(queryset, bbox, prefix=''):
+    """
+    Rows of ``queryset`` inside ``bbox`` (as returned by ``parse_bbox``).
+    ``prefix`` reaches the location through a relation, e.g.
+    ``'current_location__'`` on a Vehicle queryset.
+    """
+    if bbox is None:
+        return queryset
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return queryset.filter(
+        geohash.bbox_q(min_lat, min_lon, max_lat, max_lon, field=f'{prefix}geohash'),
+        **{
+            f'{prefix}latitude__gte': min_lat,
+            f'{prefix}latitude__lte': max_lat,
+            f'{prefix}longitude__gte': min_lon,
+            f'{prefix}longitude__lte': max_lon,
+        }
+    )
+
+
+def in_bbox(bbox, latitude, longitude):
+    """Whether the point lies inside ``bbox`` (always True for no bbox)."""
+    if bbox is None:
+        return True
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return min_lat <= float(latitude) <= max_lat and min_lon <= float(longitude) <= max_lon
+
+
+def bbox_around(latitude, longitude, radius_km):
+    """Smallest lat/lon box containing the circle of ``radius_km`` around the point."""
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    dlon = min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    return (
+        max(latitude - dlat, -90.0), max(longitude - dlon, -180.0),
+        min(latitude + dlat, 90.0), min(longitude + dlon, 180.0),
+    )
+
+
+def nearest_vehicles(latitude, longitude, k=5, queryset=None, max_km=None):
+    """
+    The ``k`` current vehicle locations closest to the point, nearest
+    first, as ``(distance_km, VehicleLocation)`` pairs.
+
+    Searches boxes of NEAREST_RADII_KM (up to ``max_km``, 1000 km by
+    default) and stops at the first radius that holds ``k`` vehicles within
+    it, so only the cells around the point are read. ``queryset`` narrows
+    the candidates, e.g. to available vehicles.
+    """
+    if queryset is None:
+        queryset = VehicleLocation.objects.all()
+    queryset = queryset.select_related('vehicle')
+    radii = [r for r in NEAREST_RADII_KM if max_km is None or r < max_km]
+    if max_km is not None:
+        radii.append(max_km)
+
+    found = []
+    for radius in radii:
+        candidates = list(filter_bbox(queryset, bbox_around(latitude, longitude, radius)))
+        if not candidates:
+            continue
+        distances = haversine_km(
+            latitude, longitude,
+            as_float_array([c.latitude for c in candidates]),
+            as_float_array([c.longitude for c in candidates]),
+        )
+        found = sorted(
+            ((float(d), c) for d, c in zip(distances, candidates) if d <= radius),
+            key=lambda pair: pair[0],
+        )
+        if len(found) >= k:
+            break
+    return found[:k]
+
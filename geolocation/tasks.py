@@ -0,0 +1,29 @@
+"""Celery tasks for the geolocation app."""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def poll_airotrack_locations():
+    """Adaptive AiroTrack poll, scheduled by Celery Beat (see geolocation.polling)."""
+    from geolocation.polling import run_poll_cycle
+
+    try:
+        return run_poll_cycle()
+    except Exception as exc:
+        # No retry: the next beat tick is the retry.
+        logger.error("AiroTrack poll cycle failed: %s", exc)
+
+
+@shared_task(ignore_result=True)
+def reverse_geocode_cells(cells):
+    """Resolve and store grid-cell addresses queued by geolocation.geocoding lookups."""
+    from geolocation.geocoding import resolve_cells
+
+    try:
+        return resolve_cells(cells)
+    except Exception as exc:
+        # No retry: the cells are queued again once their pending key expires.
+        logger.error("Reverse geocoding of %s cells failed: %s", len(cells), exc)
@@ -4,8 +4,14 @@ Run with: python manage.py test geolocation
 """
 from decimal import Decimal
 from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import threading
+import time
+from unittest import mock
 
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -152,3 +158,1195 @@ class GeolocationViewTests(TestCase):
     def test_tracking_dashboard(self):
         response = self.client.get(reverse('tracking_dashboard'))
         self.assertEqual(response.status_code, 200)
+
+
+class FakeAiroTrackHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the AiroTrack positions endpoint.
+
+    ``behaviour`` maps a deviceId to ``{'latency': seconds, 'fail': [status, ...]}``;
+    queued failure statuses are returned first, then a one-position list.
+    """
+    behaviour = {}
+    calls = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        device_id = query.get('deviceId', [''])[0]
+        spec = type(self).behaviour.get(device_id, {})
+        with type(self).lock:
+            type(self).calls.append(device_id)
+            failures = spec.get('fail', [])
+            status = failures.pop(0) if failures else 200
+        time.sleep(spec.get('latency', 0))
+        body = json.dumps([{
+            'deviceId': device_id, 'latitude': 13.08, 'longitude': 80.27,
+            'deviceTime': '2026-01-08T10:30:00Z',
+        }] if status == 200 else {'error': status}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class AiroTrackConcurrentFetchTests(TestCase):
+    """AiroTrackAPI.fetch_positions against a local fake AiroTrack server."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAiroTrackHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        from .airotrack_fetch import CircuitBreaker
+        from .airotrack_service import AiroTrackAPI
+        FakeAiroTrackHandler.behaviour = {}
+        FakeAiroTrackHandler.calls = []
+        self.api = AiroTrackAPI()
+        self.api.BASE_URL = f'http://127.0.0.1:{self.server.server_port}/api'
+        self.api.FETCH_BACKOFF_BASE = 0.001
+        self.api.circuit = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+
+    def test_devices_are_fetched_concurrently(self):
+        devices = [f'D{i}' for i in range(6)]
+        FakeAiroTrackHandler.behaviour = {d: {'latency': 0.2} for d in devices}
+        self.api.FETCH_CONCURRENCY = 6
+
+        report = self.api.fetch_positions(devices)
+        self.assertEqual(report['succeeded'], 6)
+        self.assertEqual([p['deviceId'] for p in report['positions']], devices)
+        # Sequential fetching would take at least 6 x 0.2 s.
+        self.assertLess(report['elapsed_ms'], 900)
+        self.assertGreaterEqual(report['devices']['D0']['latency_ms'], 200)
+        self.assertGreaterEqual(report['latency_ms']['p95'], 200)
+        # get_positions keeps returning the merged list.
+        self.assertEqual(len(self.api.get_positions(device_ids=devices)), 6)
+
+    def test_transient_errors_are_retried(self):
+        FakeAiroTrackHandler.behaviour = {'FLAKY': {'fail': [503, 502]}}
+        report = self.api.fetch_positions(['FLAKY', 'OK'])
+        self.assertTrue(report['devices']['FLAKY']['ok'])
+        self.assertEqual(report['devices']['FLAKY']['attempts'], 3)
+        self.assertEqual(report['devices']['OK']['attempts'], 1)
+        self.assertEqual(len(report['positions']), 2)
+
+    def test_client_errors_are_not_retried(self):
+        FakeAiroTrackHandler.behaviour = {'GONE': {'fail': [404, 404]}}
+        report = self.api.fetch_positions(['GONE'])
+        self.assertFalse(report['devices']['GONE']['ok'])
+        self.assertEqual(report['devices']['GONE']['attempts'], 1)
+        self.assertEqual(report['failed'], 1)
+
+    def test_circuit_breaker_skips_devices_while_open(self):
+        devices = [f'DOWN{i}' for i in range(6)]
+        FakeAiroTrackHandler.behaviour = {d: {'fail': [500] * 5} for d in devices}
+        self.api.FETCH_CONCURRENCY = 1
+        self.api.FETCH_MAX_RETRIES = 0
+
+        report = self.api.fetch_positions(devices)
+        self.assertEqual(report['failed'], 3)
+        self.assertEqual(report['skipped'], 3)
+        self.assertEqual(report['devices']['DOWN5']['error'], 'circuit_open')
+        self.assertEqual(len(FakeAiroTrackHandler.calls), 3)
+        self.assertEqual(self.api.circuit.state, 'open')
+
+    def test_circuit_breaker_half_open_trial(self):
+        from .airotrack_fetch import CircuitBreaker
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+
+        now[0] = 10.0
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())  # only one trial at a time
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+        now[0] = 20.0
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+class UpdateVehicleLocationsTests(TestCase):
+    """Bulk write path of AiroTrackAPI.update_vehicle_locations."""
+
+    def setUp(self):
+        from .airotrack_service import AiroTrackAPI
+        self.vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.api = AiroTrackAPI()
+        self.positions = []
+        self.api.get_positions = lambda device_ids=None, **kwargs: self.positions
+
+    def _fleet(self, count, start=0):
+        devices = []
+        for i in range(start, start + count):
+            vehicle = Vehicle.objects.create(
+                vehicle_type=self.vtype, make='Tata', model='Ace', year=2023,
+                license_plate=f'TN01UV{i:04d}', vin=f'VINUPD{i:011d}',
+                acquisition_date=date.today(),
+            )
+            devices.append(AiroTrackDevice.objects.create(device_id=f'UPD{i}', vehicle=vehicle))
+        return devices
+
+    def _position(self, device_id, lat=13.08, lon=80.27, when='2025-06-01T10:00:00Z', speed=30):
+        return {'deviceId': device_id, 'latitude': lat, 'longitude': lon,
+                'deviceTime': when, 'speed': speed, 'course': 90, 'ignition': True}
+
+    def test_creates_locations_history_and_marks_online(self):
+        devices = self._fleet(3)
+        self.positions = [self._position(d.device_id) for d in devices]
+
+        self.assertEqual(self.api.update_vehicle_locations(), (3, 0))
+        self.assertEqual(VehicleLocation.objects.count(), 3)
+        self.assertEqual(LocationHistory.objects.count(), 3)
+        self.assertEqual(AiroTrackDevice.objects.filter(status='online').count(), 3)
+
+    def test_upsert_updates_existing_location(self):
+        device = self._fleet(1)[0]
+        self.positions = [self._position(device.device_id)]
+        self.api.update_vehicle_locations()
+
+        self.positions = [
+            self._position(device.device_id, lat=13.2, when='2025-06-01T10:05:00Z'),
+            self._position(device.device_id, lat=13.1, when='2025-06-01T10:01:00Z'),
+        ]
+        self.assertEqual(self.api.update_vehicle_locations(), (2, 0))
+        location = VehicleLocation.objects.get(vehicle=device.vehicle)
+        self.assertEqual(location.latitude, Decimal('13.2000000'))
+        self.assertEqual(VehicleLocation.objects.count(), 1)
+        self.assertEqual(LocationHistory.objects.count(), 3)
+
+    def test_unknown_and_unassigned_devices_are_errors(self):
+        device = self._fleet(1)[0]
+        AiroTrackDevice.objects.create(device_id='SPARE')
+        self.positions = [
+            self._position(device.device_id),
+            self._position('SPARE'),
+            self._position('NOT-REGISTERED'),
+        ]
+        self.assertEqual(self.api.update_vehicle_locations(), (1, 2))
+        self.assertEqual(VehicleLocation.objects.count(), 1)
+
+    def test_bad_row_only_fails_its_device(self):
+        devices = self._fleet(4)
+        self.positions = [self._position(d.device_id) for d in devices]
+        self.positions[1]['latitude'] = 'nan'
+        self.positions[2]['attributes'] = {'unserialisable'}  # raw_data cannot be JSON-encoded
+        self.positions[3]['latitude'] = 13.081234567891
+
+        self.assertEqual(self.api.update_vehicle_locations(), (2, 2))
+        self.assertEqual(
+            set(VehicleLocation.objects.values_list('vehicle_id', flat=True)),
+            {devices[0].vehicle_id, devices[3].vehicle_id},
+        )
+        self.assertEqual(LocationHistory.objects.count(), 2)
+        self.assertEqual(
+            VehicleLocation.objects.get(vehicle=devices[3].vehicle).latitude, Decimal('13.0812346'),
+        )
+        self.assertEqual(
+            set(AiroTrackDevice.objects.filter(status='online').values_list('pk', flat=True)),
+            {devices[0].pk, devices[3].pk},
+        )
+        self.assertIsNotNone(self.api.last_sync_time)
+
+    def test_manual_update_waits_for_running_poll(self):
+        from django.core.cache import cache
+        from .polling import LOCK_KEY
+        devices = self._fleet(1)
+        self.positions = [self._position(devices[0].device_id)]
+        cache.set(LOCK_KEY, 'beat-worker', 60)
+        self.addCleanup(cache.delete, LOCK_KEY)
+
+        self.assertEqual(self.api.update_vehicle_locations(), (0, 0))
+        self.assertTrue(self.api.last_poll_skipped)
+        self.assertFalse(VehicleLocation.objects.exists())
+        self.assertEqual(cache.get(LOCK_KEY), 'beat-worker')
+
+        cache.delete(LOCK_KEY)
+        self.assertEqual(self.api.update_vehicle_locations(), (1, 0))
+        self.assertFalse(self.api.last_poll_skipped)
+        self.assertIsNone(cache.get(LOCK_KEY))
+
+    def test_query_count_does_not_grow_with_devices(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def queries_for(devices):
+            self.positions = [self._position(d.device_id) for d in devices]
+            with CaptureQueriesContext(connection) as ctx:
+                self.api.update_vehicle_locations()
+            return len(ctx.captured_queries)
+
+        few = queries_for(self._fleet(2))
+        VehicleLocation.objects.all().delete()
+        many = queries_for(AiroTrackDevice.objects.filter(pk__in=[d.pk for d in self._fleet(25, start=2)]))
+        self.assertEqual(few, many)
+
+    def _sync_at(self, device, when, **fields):
+        self.positions = [dict(self._position(device.device_id, when=when), **fields)]
+        self.api.update_vehicle_locations()
+        return self.api.last_location_report
+
+    def test_parked_vehicle_history_is_suppressed(self):
+        device = self._fleet(1)[0]
+        self._sync_at(device, '2025-06-01T10:00:00Z', speed=0, ignition=False)
+        # GPS jitter of a few metres while parked.
+        report = self._sync_at(device, '2025-06-01T10:01:00Z', speed=0, ignition=False, latitude=13.08005)
+        self.assertEqual(report, {'fixes': 1, 'history_written': 0, 'history_suppressed': 1})
+        self.assertEqual(LocationHistory.objects.count(), 1)
+        # The current location still follows every fix.
+        self.assertEqual(VehicleLocation.objects.get().device_time.minute, 1)
+
+        # Ignition on is recorded even without movement.
+        report = self._sync_at(device, '2025-06-01T10:02:00Z', speed=0, ignition=True)
+        self.assertEqual(report['history_written'], 1)
+
+    def test_slow_creep_is_measured_from_last_recorded_row(self):
+        device = self._fleet(1)[0]
+        self.api.HISTORY_MIN_DISTANCE_M = 25
+        self._sync_at(device, '2025-06-01T10:00:00Z', speed=2, ignition=True)
+        written = 0
+        # ~11 m per poll: no single hop crosses the threshold, but the creep
+        # does every third poll (33 m and 67 m from the start).
+        for minute in range(1, 7):
+            report = self._sync_at(device, f'2025-06-01T10:0{minute}:00Z', speed=2, ignition=True,
+                                   latitude=13.08 + minute * 0.0001)
+            written += report['history_written']
+        self.assertEqual(written, 2)
+        self.assertEqual(LocationHistory.objects.count(), 3)
+
+    def test_heartbeat_records_unchanged_fix(self):
+        device = self._fleet(1)[0]
+        self.api.HISTORY_HEARTBEAT_SECONDS = 600
+        self._sync_at(device, '2025-06-01T10:00:00Z', speed=0, ignition=False)
+        self.assertEqual(self._sync_at(device, '2025-06-01T10:09:00Z', speed=0, ignition=False)['history_written'], 0)
+        self.assertEqual(self._sync_at(device, '2025-06-01T10:10:00Z', speed=0, ignition=False)['history_written'], 1)
+
+    def test_speed_and_course_changes_are_recorded(self):
+        device = self._fleet(1)[0]
+        self._sync_at(device, '2025-06-01T10:00:00Z', speed=20, course=90)
+        self.assertEqual(self._sync_at(device, '2025-06-01T10:00:05Z', speed=40, course=90)['history_written'], 1)
+        self.assertEqual(self._sync_at(device, '2025-06-01T10:00:10Z', speed=40, course=180)['history_written'], 1)
+        self.assertEqual(self._sync_at(device, '2025-06-01T10:00:15Z', speed=41, course=185)['history_written'], 0)
+
+
+class LocationArchiveTests(TestCase):
+    """archive_location_history export + transparent archive reads."""
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(LOCATION_ARCHIVE_ROOT=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=self.vtype, make='Tata', model='Ace', year=2023,
+            license_plate='TN01AR0001', vin='VINARCH0000000001',
+            acquisition_date=date.today(),
+        )
+        self.device = AiroTrackDevice.objects.create(device_id='ARC1', vehicle=self.vehicle)
+        self.old_start = timezone.now() - timezone.timedelta(days=120)
+        for i in range(5):
+            LocationHistory.objects.create(
+                vehicle=self.vehicle, device=self.device,
+                latitude=Decimal('13.0800000') + Decimal(i) / 1000, longitude=Decimal('80.2700000'),
+                speed=Decimal('12.50') if i else None, course=Decimal('90.00'),
+                device_time=self.old_start + timezone.timedelta(minutes=i),
+                ignition=bool(i % 2), address='Guindy' if i == 2 else None,
+            )
+        LocationHistory.objects.create(
+            vehicle=self.vehicle, device=self.device,
+            latitude=Decimal('13.1000000'), longitude=Decimal('80.3000000'),
+            device_time=timezone.now() - timezone.timedelta(hours=1),
+        )
+
+    def _archive(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        call_command('archive_location_history', '--execute', *args, stdout=StringIO())
+
+    def test_history_is_exported_then_deleted(self):
+        from .archive import archived_history
+        from .models import LocationArchive
+
+        self._archive('--source', 'history')
+        self.assertEqual(LocationHistory.objects.count(), 1)
+        manifest = LocationArchive.objects.get()
+        self.assertEqual((manifest.source, manifest.row_count), ('location_history', 5))
+        self.assertEqual(len(manifest.sha256), 64)
+
+        rows = archived_history(self.vehicle.id)
+        self.assertEqual([r.latitude for r in rows], [Decimal('13.0800000') + Decimal(i) / 1000 for i in range(5)])
+        self.assertIsNone(rows[0].speed)
+        self.assertEqual(rows[1].speed, Decimal('12.50'))
+        self.assertEqual(rows[2].address, 'Guindy')
+        self.assertEqual([r.ignition for r in rows], [False, True, False, True, False])
+        self.assertEqual(rows[0].device_id, self.device.id)
+
+        # Re-running merges into the same vehicle-month file.
+        LocationHistory.objects.create(
+            vehicle=self.vehicle, device=self.device,
+            latitude=Decimal('13.0900000'), longitude=Decimal('80.2700000'),
+            device_time=self.old_start + timezone.timedelta(minutes=30),
+        )
+        self._archive('--source', 'history')
+        manifest = LocationArchive.objects.get()
+        self.assertEqual(manifest.row_count, 6)
+        window = archived_history(
+            self.vehicle.id, self.old_start + timezone.timedelta(minutes=3), self.old_start + timezone.timedelta(hours=1)
+        )
+        self.assertEqual(len(window), 3)
+
+    def test_route_api_and_history_page_read_the_archive(self):
+        self._archive('--source', 'history')
+        user = User.objects.create_user(
+            username='archadmin', password='pass1234', user_type='admin', approval_status='approved',
+        )
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('locationhistory-route'), {'vehicle': self.vehicle.id})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['properties']['points'], 6)
+        self.assertEqual(data['geometry']['coordinates'][0], [80.27, 13.08])
+        self.assertEqual(data['geometry']['coordinates'][-1], [80.3, 13.1])
+
+        response = self.client.get(reverse('locationhistory-route'), {'vehicle': self.vehicle.id, 'limit': 2})
+        self.assertEqual(response.json()['properties']['points'], 2)
+
+        # The history template uses an undefined `div` filter, so check the
+        # context handed to render() rather than the rendered page.
+        from django.http import HttpResponse
+        day = timezone.localtime(self.old_start).strftime('%Y-%m-%d')
+        with mock.patch('geolocation.views.render', return_value=HttpResponse()) as render:
+            self.client.get(
+                reverse('vehicle_tracking_history', args=[self.vehicle.id]),
+                {'start_date': day, 'end_date': day},
+            )
+        context = render.call_args[0][2]
+        self.assertEqual(context['history_count'], 5)
+        self.assertEqual(context['max_speed'], Decimal('12.50'))
+
+    def test_trip_locations_are_archived_with_artifact(self):
+        from trips.models import Trip, TripLocation, TripRouteArtifact
+        from trips.route_artifacts import build_route_artifact, invalidate_route_artifact
+
+        driver = User.objects.create_user(username='archdriver', password='pass1234', user_type='driver')
+        trip = Trip.objects.create(
+            vehicle=self.vehicle, driver=driver, start_time=self.old_start,
+            start_odometer=1000, origin='Chennai', purpose='Archive', status='ongoing',
+        )
+        for i in range(4):
+            TripLocation.objects.create(
+                trip=trip, latitude=Decimal('13.0800000') + Decimal(i) / 100, longitude=Decimal('80.2700000'),
+                accuracy=5.0, speed=20.0, timestamp=self.old_start + timezone.timedelta(minutes=i),
+            )
+        Trip.objects.filter(pk=trip.pk).update(
+            status='completed', end_time=self.old_start + timezone.timedelta(minutes=5),
+        )
+        trip.refresh_from_db()
+
+        self._archive('--source', 'trips')
+        self.assertFalse(TripLocation.objects.filter(trip=trip).exists())
+        self.assertEqual(TripRouteArtifact.objects.get(trip=trip).point_count, 4)
+
+        # A rebuild after archiving reads the points back from cold storage.
+        invalidate_route_artifact(trip.id)
+        artifact = build_route_artifact(trip)
+        self.assertEqual(artifact.point_count, 4)
+        self.assertAlmostEqual(float(artifact.max_lat), 13.11)
+
+
+class _RecordingAiroTrackAPI:
+    """Stands in for AiroTrackAPI in poll-cycle tests."""
+
+    def __init__(self):
+        self.polled = []
+        self.device_refreshes = 0
+        self.last_location_report = None
+        self.last_fetch_report = None
+
+    def update_device_database(self):
+        self.device_refreshes += 1
+        return (0, 0, 0)
+
+    def update_vehicle_locations(self, device_ids=None):
+        self.polled.append(sorted(device_ids))
+        self.last_location_report = {'fixes': len(device_ids), 'history_written': 0,
+                                     'history_suppressed': len(device_ids)}
+        return (len(device_ids), 0)
+
+
+class AdaptivePollingTests(TestCase):
+    """geolocation.polling: which devices each beat tick polls."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.now = timezone.now()
+        self.moving = self._device('MOV', speed=40, ignition=True)
+        self.idling = self._device('IDL', speed=0, ignition=True)
+        self.parked = self._device('PRK', speed=0, ignition=False)
+        self.stale = self._device('OLD', speed=0, ignition=False, age=timezone.timedelta(hours=2))
+        self.unseen = self._device('NEW')
+
+    def _device(self, device_id, speed=None, ignition=False, age=timezone.timedelta(seconds=10)):
+        vehicle = Vehicle.objects.create(
+            vehicle_type=self.vtype, make='Tata', model='Ace', year=2023,
+            license_plate=f'TN01PL{device_id}', vin=f'VINPOLL{device_id}0000000',
+            acquisition_date=date.today(),
+        )
+        device = AiroTrackDevice.objects.create(device_id=device_id, vehicle=vehicle, status='online')
+        if speed is not None:
+            VehicleLocation.objects.create(
+                vehicle=vehicle, device=device, latitude=Decimal('13.08'), longitude=Decimal('80.27'),
+                speed=Decimal(speed), ignition=ignition,
+                device_time=self.now - age, server_time=self.now - age,
+            )
+        return device
+
+    def _poll(self, at):
+        from .polling import run_poll_cycle
+        api = _RecordingAiroTrackAPI()
+        with mock.patch('geolocation.polling.timezone.now', return_value=at):
+            metrics = run_poll_cycle(api)
+        return api, metrics
+
+    def test_moving_vehicles_are_polled_every_cycle(self):
+        api, metrics = self._poll(self.now)
+        self.assertEqual(api.polled, [['IDL', 'MOV', 'NEW', 'OLD', 'PRK']])
+        self.assertEqual(metrics['due'], {'moving': 2, 'parked': 1, 'offline': 2})
+        self.assertEqual(metrics['history_suppressed'], 5)
+        self.assertEqual(AiroTrackDevice.objects.filter(last_polled_at=self.now).count(), 5)
+
+        api, metrics = self._poll(self.now + timezone.timedelta(seconds=30))
+        self.assertEqual(api.polled, [['IDL', 'MOV']])
+        self.assertEqual(api.device_refreshes, 0)  # refreshed on the first cycle only
+
+        api, _ = self._poll(self.now + timezone.timedelta(seconds=300))
+        self.assertEqual(api.polled, [['IDL', 'MOV', 'PRK']])
+
+        api, _ = self._poll(self.now + timezone.timedelta(seconds=900))
+        self.assertEqual(api.polled, [['IDL', 'MOV', 'NEW', 'OLD', 'PRK']])
+
+    def test_overlapping_cycle_is_skipped(self):
+        from django.core.cache import cache
+        from .polling import LOCK_KEY, poll_metrics
+        cache.set(LOCK_KEY, 'other-worker', 60)
+        api, metrics = self._poll(self.now)
+        self.assertTrue(metrics['skipped'])
+        self.assertEqual(api.polled, [])
+        self.assertEqual(cache.get(LOCK_KEY), 'other-worker')
+
+        cache.delete(LOCK_KEY)
+        self._poll(self.now)
+        summary = poll_metrics()['summary']
+        self.assertEqual((summary['cycles'], summary['skipped']), (1, 1))
+        self.assertIsNotNone(summary['duration_ms']['p95'])
+        self.assertIsNone(cache.get(LOCK_KEY))
+
+    def test_redis_lock_is_released_with_compare_and_delete(self):
+        from .polling import LOCK_KEY, RELEASE_SCRIPT, _release_lock
+        redis = mock.Mock()
+        client = mock.Mock(encode=lambda value: f'encoded:{value}')
+        client.get_client.return_value = redis
+        with mock.patch('geolocation.polling.cache') as fake_cache:
+            fake_cache.client = client
+            fake_cache.make_key.side_effect = lambda key: f':1:{key}'
+            _release_lock('token-1')
+        redis.eval.assert_called_once_with(RELEASE_SCRIPT, 1, f':1:{LOCK_KEY}', 'encoded:token-1')
+        fake_cache.get.assert_not_called()
+        fake_cache.delete.assert_not_called()
+
+    def test_sync_status_endpoint(self):
+        self._poll(self.now)
+        admin = User.objects.create_user(
+            username='polladmin', password='pass1234', user_type='admin', approval_status='approved',
+        )
+        self.client.force_login(admin)
+        response = self.client.get(reverse('api_sync_status'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cycles'][0]['polled'], 5)
+        self.assertEqual(response.json()['intervals']['moving'], 30)
+
+
+class VehicleLocationDeltaTests(TestCase):
+    """ajax/locations/delta/: only vehicles published by a sync are re-sent."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from .airotrack_service import AiroTrackAPI
+        cache.clear()
+        self.addCleanup(cache.clear)
+        vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.devices = []
+        for i in range(3):
+            vehicle = Vehicle.objects.create(
+                vehicle_type=vtype, make='Tata', model='Ace', year=2023,
+                license_plate=f'TN01LF{i:04d}', vin=f'VINLIVE{i:010d}',
+                acquisition_date=date.today(),
+            )
+            self.devices.append(AiroTrackDevice.objects.create(device_id=f'LIVE{i}', vehicle=vehicle))
+        self.api = AiroTrackAPI()
+        self.positions = []
+        self.api.get_positions = lambda device_ids=None, **kwargs: self.positions
+        self.client.force_login(User.objects.create_user(
+            username='livemanager', password='pass1234', user_type='vehicle_manager',
+            approval_status='approved',
+        ))
+
+    def _sync(self, devices, when, lat=13.08):
+        self.positions = [
+            {'deviceId': d.device_id, 'latitude': lat, 'longitude': 80.27, 'deviceTime': when,
+             'speed': 30, 'course': 90, 'ignition': True}
+            for d in devices
+        ]
+        self.api.update_vehicle_locations()
+
+    def _delta(self, since=None):
+        params = {} if since is None else {'since': since}
+        return self.client.get(reverse('ajax_vehicle_locations_delta'), params).json()
+
+    def test_snapshot_then_only_changed_vehicle(self):
+        self._sync(self.devices, '2025-06-01T10:00:00Z')
+        snapshot = self._delta()
+        self.assertTrue(snapshot['full'])
+        self.assertEqual(len(snapshot['items']), 3)
+
+        self.assertEqual(self._delta(snapshot['cursor'])['items'], [])
+
+        self._sync(self.devices[:1], '2025-06-01T10:01:00Z', lat=13.10)
+        delta = self._delta(snapshot['cursor'])
+        self.assertFalse(delta['full'])
+        self.assertEqual(
+            [item['properties']['id'] for item in delta['items']],
+            [self.devices[0].vehicle_id],
+        )
+        self.assertGreater(delta['cursor'], snapshot['cursor'])
+
+    def test_stream_sends_snapshot_event(self):
+        from django.test import override_settings
+        self._sync(self.devices, '2025-06-01T10:00:00Z')
+        with override_settings(LIVE_FEED_STREAM_SECONDS=0):
+            response = self.client.get(reverse('ajax_vehicle_locations_stream'))
+            body = b''.join(response.streaming_content).decode()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: vehicles', body)
+        self.assertIn('"full": true', body)
+
+
+class SpatialIndexTests(TestCase):
+    """Geohash-indexed ?bbox= filtering and nearest-vehicle lookups."""
+
+    CITIES = {
+        'chennai': (13.0827, 80.2707),
+        'chennai_north': (13.1500, 80.2900),
+        'bangalore': (12.9716, 77.5946),
+        'mumbai': (19.0760, 72.8777),
+    }
+    CHENNAI_BBOX = '80.1,12.9,80.4,13.3'
+
+    def setUp(self):
+        vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.vehicles = {}
+        for i, (name, (lat, lon)) in enumerate(self.CITIES.items()):
+            vehicle = Vehicle.objects.create(
+                vehicle_type=vtype, make='Tata', model='Ace', year=2023,
+                license_plate=f'TN01GH{i:04d}', vin=f'VINGEOHASH{i:07d}',
+                acquisition_date=date.today(), status='in_use' if name == 'chennai' else 'available',
+            )
+            device = AiroTrackDevice.objects.create(device_id=f'GH{i}', vehicle=vehicle)
+            VehicleLocation.objects.create(
+                vehicle=vehicle, device=device, latitude=Decimal(str(lat)), longitude=Decimal(str(lon)),
+                speed=Decimal('0'), device_time=timezone.now(), server_time=timezone.now(),
+            )
+            self.vehicles[name] = vehicle
+        self.client.force_login(User.objects.create_user(
+            username='geohashadmin', password='pass1234', user_type='admin', approval_status='approved',
+        ))
+
+    def test_geohash_maintained_on_save_and_bulk_sync(self):
+        from core.geohash import encode
+        from .airotrack_service import AiroTrackAPI
+        location = VehicleLocation.objects.get(vehicle=self.vehicles['mumbai'])
+        self.assertEqual(location.geohash, encode(19.0760, 72.8777))
+
+        api = AiroTrackAPI()
+        api.get_positions = lambda device_ids=None, **kwargs: [{
+            'deviceId': 'GH3', 'latitude': 13.05, 'longitude': 80.25,
+            'deviceTime': '2025-06-01T10:00:00Z', 'speed': 30, 'ignition': True,
+        }]
+        api.update_vehicle_locations()
+        location.refresh_from_db()
+        self.assertEqual(location.geohash, encode(13.05, 80.25))
+        self.assertEqual(LocationHistory.objects.get().geohash, encode(13.05, 80.25))
+
+    def test_bbox_filters_map_endpoints(self):
+        response = self.client.get(reverse('ajax_vehicle_locations'), {'bbox': self.CHENNAI_BBOX})
+        ids = {f['properties']['id'] for f in response.json()['features']}
+        self.assertEqual(ids, {self.vehicles['chennai'].id, self.vehicles['chennai_north'].id})
+
+        response = self.client.get(reverse('api_all_vehicles_current_location'), {'bbox': self.CHENNAI_BBOX})
+        self.assertEqual(len(response.json()), 2)
+
+        response = self.client.get('/geolocation/api/locations/geojson/', {'bbox': '72,18,78,20'})
+        self.assertEqual(len(response.json()['features']), 1)
+
+    def test_bbox_uses_geohash_ranges(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .spatial import filter_bbox, parse_bbox
+        with CaptureQueriesContext(connection) as ctx:
+            list(filter_bbox(VehicleLocation.objects.all(), parse_bbox(self.CHENNAI_BBOX)))
+        self.assertIn('"geohash" >=', ctx.captured_queries[0]['sql'])
+
+    def test_invalid_bbox_is_rejected(self):
+        response = self.client.get(reverse('ajax_vehicle_locations'), {'bbox': '80,13,79,14'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('api_all_vehicles_current_location'), {'bbox': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_nearest_available_vehicles(self):
+        response = self.client.get(reverse('api_nearest_vehicles'), {
+            'lat': 13.0827, 'lon': 80.2707, 'k': 2, 'status': 'available',
+        })
+        results = response.json()['results']
+        self.assertEqual(
+            [r['vehicle_id'] for r in results],
+            [self.vehicles['chennai_north'].id, self.vehicles['bangalore'].id],
+        )
+        self.assertLess(results[0]['distance_km'], results[1]['distance_km'])
+        self.assertEqual(self.client.get(reverse('api_nearest_vehicles')).status_code, 400)
+        for max_km in ('nan', 'inf', '-1'):
+            response = self.client.get(reverse('api_nearest_vehicles'), {'lat': 13.08, 'lon': 80.27, 'max_km': max_km})
+            self.assertEqual(response.status_code, 400, max_km)
+
+    def test_backfill_command_fills_missing_geohash(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from core.geohash import encode
+        VehicleLocation.objects.update(geohash='')
+        call_command('backfill_geohash', stdout=StringIO())
+        location = VehicleLocation.objects.get(vehicle=self.vehicles['bangalore'])
+        self.assertEqual(location.geohash, encode(12.9716, 77.5946))
+
+    def test_driver_locations_bbox(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from trips.models import Trip
+        from trips.gps_models import TripLivePosition
+        driver = User.objects.create_user(username='ghdriver', password='pass1234', user_type='driver')
+        for name in ('chennai', 'mumbai'):
+            trip = Trip.objects.create(
+                vehicle=self.vehicles[name], driver=driver, start_time=timezone.now(),
+                start_odometer=100, origin='A', purpose='Test', status='ongoing',
+            )
+            lat, lon = self.CITIES[name]
+            TripLivePosition.record(
+                trip.id, Decimal(str(lat)), Decimal(str(lon)), timezone.now(), accuracy=5, battery_level=80,
+            )
+        response = self.client.get(reverse('ajax_driver_locations'), {'bbox': self.CHENNAI_BBOX})
+        features = response.json()['features']
+        self.assertEqual([f['properties']['vehicle_plate'] for f in features], [self.vehicles['chennai'].license_plate])
+        self.assertEqual((features[0]['properties']['accuracy'], features[0]['properties']['battery']), (5.0, 80))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('ajax_driver_locations'))
+        self.assertEqual(len(response.json()['features']), 2)
+        self.assertEqual(len([q for q in ctx.captured_queries if 'trips_trip' in q['sql']]), 1)
+
+
+class GeofenceTests(TestCase):
+    """geolocation.geofence: matching and incremental enter/dwell/exit events."""
+
+    STORE = (13.0827, 80.2707)
+
+    def setUp(self):
+        from django.core.cache import cache
+        from generators.models import Store
+        from .geofence import invalidate_index
+        from .models import Geofence
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(invalidate_index)
+        vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=vtype, make='Tata', model='Ace', year=2023,
+            license_plate='TN01GF0001', vin='VINGEOFENCE000001', acquisition_date=date.today(),
+        )
+        self.device = AiroTrackDevice.objects.create(device_id='GF1', vehicle=self.vehicle)
+        store = Store.objects.create(name='Store 7', location='Anna Nagar')
+        self.store_fence = Geofence.objects.create(
+            name='Store 7', kind='store', store=store, shape='circle',
+            center_latitude=Decimal('13.0827'), center_longitude=Decimal('80.2707'),
+            radius_m=200, dwell_seconds=300,
+        )
+        # L-shaped depot, so a point in the notch is inside the bbox but outside the fence.
+        self.depot = Geofence.objects.create(
+            name='Depot', kind='sor_location', label='Ambattur depot', shape='polygon',
+            polygon=[[13.10, 80.10], [13.10, 80.12], [13.11, 80.12], [13.11, 80.11], [13.12, 80.11], [13.12, 80.10]],
+        )
+        self.t0 = timezone.now() - timezone.timedelta(hours=1)
+
+    def _at(self, minutes, lat, lon):
+        return (self.vehicle.id, Decimal(str(lat)), Decimal(str(lon)), self.t0 + timezone.timedelta(minutes=minutes), None)
+
+    def test_index_matches_circles_and_polygons(self):
+        from .geofence import get_index
+        index = get_index()
+        inside = index.match(
+            [13.0827, 13.0850, 13.105, 13.115, 13.115],
+            [80.2707, 80.2707, 80.11, 80.105, 80.115],
+        )
+        by_fence = {fence_id: inside[:, col].tolist() for col, fence_id in enumerate(index.fence_ids)}
+        self.assertEqual(by_fence[self.store_fence.id], [True, False, False, False, False])
+        self.assertEqual(by_fence[self.depot.id], [False, False, True, True, False])
+
+    def test_enter_dwell_exit_sequence(self):
+        from .geofence import process_positions
+        from .models import GeofenceEvent, GeofenceState
+        events = process_positions([self._at(0, 13.09, 80.27), self._at(1, *self.STORE)], 'airotrack')
+        self.assertEqual([e.event_type for e in events], ['enter'])
+        self.assertEqual(GeofenceState.objects.get().geofence_id, self.store_fence.id)
+
+        self.assertEqual(process_positions([self._at(3, *self.STORE)], 'airotrack'), [])
+        events = process_positions([self._at(7, *self.STORE), self._at(8, *self.STORE)], 'airotrack')
+        self.assertEqual([e.event_type for e in events], ['dwell'])
+
+        events = process_positions([self._at(10, 13.09, 80.27)], 'airotrack')
+        self.assertEqual([e.event_type for e in events], ['exit'])
+        self.assertFalse(GeofenceState.objects.exists())
+        self.assertEqual(
+            list(GeofenceEvent.objects.order_by('occurred_at').values_list('event_type', flat=True)),
+            ['enter', 'dwell', 'exit'],
+        )
+
+    def test_late_positions_do_not_close_a_visit(self):
+        from .geofence import process_positions
+        process_positions([self._at(5, *self.STORE)], 'airotrack')
+        self.assertEqual(process_positions([self._at(2, 13.09, 80.27)], 'airotrack'), [])
+
+    def test_concurrent_ingest_emits_each_transition_once(self):
+        from .geofence import _open_visits, process_positions
+        from .models import GeofenceEvent
+        # A second ingest that read the visits before the first one wrote sees them as still open/closed
+        with mock.patch('geolocation.geofence._open_visits', return_value={}):
+            process_positions([self._at(0, *self.STORE)], 'airotrack')
+            self.assertEqual(process_positions([self._at(0, *self.STORE)], 'airotrack'), [])
+        from copy import deepcopy
+        stale = _open_visits([self.vehicle.id], 'airotrack')
+        with mock.patch('geolocation.geofence._open_visits', side_effect=lambda *args: deepcopy(stale)):
+            self.assertEqual([e.event_type for e in process_positions([self._at(6, *self.STORE)], 'airotrack')], ['dwell'])
+            self.assertEqual(process_positions([self._at(6, *self.STORE)], 'airotrack'), [])
+            self.assertEqual([e.event_type for e in process_positions([self._at(9, 13.09, 80.27)], 'airotrack')], ['exit'])
+            self.assertEqual(process_positions([self._at(9, 13.09, 80.27)], 'airotrack'), [])
+        self.assertEqual(
+            list(GeofenceEvent.objects.order_by('occurred_at').values_list('event_type', flat=True)),
+            ['enter', 'dwell', 'exit'],
+        )
+
+    def test_airotrack_sync_and_trip_ingest_produce_events(self):
+        from .airotrack_service import AiroTrackAPI
+        from .models import GeofenceEvent
+        from trips.models import Trip
+        api = AiroTrackAPI()
+        api.get_positions = lambda device_ids=None, **kwargs: [{
+            'deviceId': 'GF1', 'latitude': 13.0827, 'longitude': 80.2707,
+            'deviceTime': '2025-06-01T10:00:00Z', 'speed': 0, 'ignition': False,
+        }]
+        api.update_vehicle_locations()
+        event = GeofenceEvent.objects.get()
+        self.assertEqual((event.event_type, event.source), ('enter', 'airotrack'))
+
+        driver = User.objects.create_user(username='gfdriver', password='pass1234', user_type='driver',
+                                          approval_status='approved')
+        trip = Trip.objects.create(vehicle=self.vehicle, driver=driver, start_time=timezone.now(),
+                                   start_odometer=100, origin='A', purpose='Test', status='ongoing')
+        self.client.force_login(driver)
+        self.client.post(reverse('record_gps_location'), json.dumps({
+            'trip_id': trip.id, 'latitude': 13.105, 'longitude': 80.11, 'accuracy': 5,
+        }), content_type='application/json')
+        # The phone's visits are its own: the AiroTrack visit to the store stays open
+        events = GeofenceEvent.objects.filter(source='trip')
+        self.assertEqual(
+            [(e.event_type, e.geofence_id, e.trip_id) for e in events],
+            [('enter', self.depot.id, trip.id)],
+        )
+        from .models import GeofenceState
+        self.assertEqual(
+            sorted(GeofenceState.objects.values_list('source', 'geofence_id')),
+            [('airotrack', self.store_fence.id), ('trip', self.depot.id)],
+        )
+
+    def test_saving_a_geofence_rebuilds_the_index(self):
+        from .geofence import get_index
+        self.assertEqual(len(get_index()), 2)
+        self.depot.is_active = False
+        self.depot.save()
+        self.assertEqual(len(get_index()), 1)
+        # Deleting the store cascades to its fence without calling Geofence.delete()
+        self.store_fence.store.delete()
+        self.assertEqual(len(get_index()), 0)
+
+    def test_polygon_vertices_must_be_numeric_pairs(self):
+        from django.core.exceptions import ValidationError
+        self.depot.full_clean()
+        for polygon in (
+            [[13.10, 80.10], [13.10], [13.11, 80.12]],
+            [[13.10, 80.10], ['13.10', 80.12], [13.11, 80.12]],
+            [[13.10, 80.10], [13.10, 80.12], [13.11, None]],
+            [[13.10, 80.10], [13.10, 80.12], [95.0, 80.12]],
+            [[13.10, 80.10], [13.10, 80.12], 13.11],
+        ):
+            self.depot.polygon = polygon
+            with self.assertRaises(ValidationError, msg=polygon):
+                self.depot.full_clean()
+
+    def test_backfill_replays_history_in_chunks(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import GeofenceEvent
+        for minutes, (lat, lon) in enumerate([(13.09, 80.27), self.STORE, self.STORE, (13.09, 80.27)] * 2):
+            LocationHistory.objects.create(
+                vehicle=self.vehicle, device=self.device, latitude=Decimal(str(lat)), longitude=Decimal(str(lon)),
+                device_time=self.t0 + timezone.timedelta(minutes=minutes),
+            )
+        call_command('backfill_geofence_events', '--chunk-size', '3', stdout=StringIO())
+        self.assertEqual(
+            list(GeofenceEvent.objects.order_by('occurred_at').values_list('event_type', flat=True)),
+            ['enter', 'exit', 'enter', 'exit'],
+        )
+        call_command('backfill_geofence_events', '--reset', stdout=StringIO())
+        self.assertEqual(GeofenceEvent.objects.count(), 4)
+
+    def test_backfill_reset_keeps_the_other_sources_visits(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .geofence import process_positions
+        from .models import GeofenceEvent, GeofenceState
+        process_positions([self._at(0, *self.STORE)], 'trip')
+        LocationHistory.objects.create(
+            vehicle=self.vehicle, device=self.device, latitude=Decimal('13.105'), longitude=Decimal('80.11'),
+            device_time=self.t0 + timezone.timedelta(minutes=1),
+        )
+        call_command('backfill_geofence_events', '--reset', stdout=StringIO())
+        self.assertEqual(
+            sorted(GeofenceState.objects.values_list('source', 'geofence_id')),
+            [('airotrack', self.depot.id), ('trip', self.store_fence.id)],
+        )
+        self.assertEqual(GeofenceEvent.objects.filter(source='trip').count(), 1)
+
+
+class MovementSegmentTests(TestCase):
+    """geolocation.segments: drive/idle/stop segmentation and incremental updates."""
+
+    def setUp(self):
+        vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=vtype, make='Tata', model='Ace', year=2023,
+            license_plate='TN01MS0001', vin='VINSEGMENTS000001', acquisition_date=date.today(),
+        )
+        self.device = AiroTrackDevice.objects.create(device_id='MS1', vehicle=self.vehicle)
+        self.t0 = timezone.now() - timezone.timedelta(hours=3)
+        self.lat = 13.0
+
+    def _fix(self, minute, speed, ignition=True, moved=True):
+        """Fix ``minute`` minutes after t0; moving fixes step north ~1.1 km per minute."""
+        if moved and speed > 3:
+            self.lat += 0.01
+        return (self.t0 + timezone.timedelta(minutes=minute), Decimal(str(round(self.lat, 7))),
+                Decimal('80.27'), Decimal(str(speed)), ignition)
+
+    def _store(self, fixes):
+        LocationHistory.objects.bulk_create([
+            LocationHistory(
+                vehicle=self.vehicle, device=self.device, device_time=time,
+                latitude=lat, longitude=lon, speed=speed, ignition=ignition,
+            )
+            for time, lat, lon, speed, ignition in fixes
+        ])
+
+    def test_classifies_and_tiles_timeline(self):
+        from .segments import segment_points
+        fixes = (
+            [self._fix(m, 40) for m in range(0, 10)]
+            + [self._fix(m, 0, ignition=True) for m in range(10, 16)]
+            + [self._fix(m, 0, ignition=False) for m in range(16, 40)]
+            + [self._fix(m, 35) for m in range(40, 45)]
+        )
+        segments = segment_points(fixes)
+        self.assertEqual([s['kind'] for s in segments], ['drive', 'idle', 'stop', 'drive'])
+        self.assertEqual([s['duration_seconds'] for s in segments], [600, 360, 1440, 240])
+        for before, after in zip(segments, segments[1:]):
+            self.assertEqual(before['end_time'], after['start_time'])
+        self.assertAlmostEqual(segments[0]['distance_km'], 10.0, delta=0.1)
+        self.assertEqual(segments[1]['distance_km'], 0)
+
+    def test_short_blip_is_folded_into_surrounding_segment(self):
+        from .segments import segment_points
+        fixes = (
+            [self._fix(m, 40) for m in range(0, 5)]
+            + [self._fix(5, 0)]                        # one fix at a signal
+            + [self._fix(m, 40) for m in range(6, 10)]
+        )
+        segments = segment_points(fixes)
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0]['kind'], 'drive')
+        self.assertEqual(segments[0]['point_count'], 10)
+
+    def test_gap_ends_segment_at_last_fix(self):
+        from .segments import segment_points
+        fixes = [self._fix(m, 0, ignition=False) for m in range(0, 5)] + [self._fix(m, 0, ignition=False) for m in range(90, 95)]
+        segments = segment_points(fixes)
+        self.assertEqual([s['duration_seconds'] for s in segments], [240, 240])
+
+    def test_incremental_update_matches_full_rebuild(self):
+        from .models import MovementSegment
+        from .segments import update_segments
+        fixes = (
+            [self._fix(m, 40) for m in range(0, 10)]
+            + [self._fix(m, 0, ignition=False) for m in range(10, 30)]
+            + [self._fix(m, 0, ignition=True) for m in range(30, 40)]
+            + [self._fix(m, 50) for m in range(40, 60)]
+        )
+        for start in range(0, len(fixes), 7):
+            self._store(fixes[start:start + 7])
+            update_segments([self.vehicle.id])
+        incremental = list(MovementSegment.objects.values_list('kind', 'start_time', 'end_time', 'point_count'))
+
+        MovementSegment.objects.all().delete()
+        update_segments([self.vehicle.id])
+        rebuilt = list(MovementSegment.objects.values_list('kind', 'start_time', 'end_time', 'point_count'))
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual([row[0] for row in rebuilt], ['drive', 'stop', 'idle', 'drive'])
+        self.assertEqual(MovementSegment.objects.filter(is_open=True).count(), 2)
+
+    def test_sync_updates_segments(self):
+        from .airotrack_service import AiroTrackAPI
+        from .models import MovementSegment
+        api = AiroTrackAPI()
+        now = timezone.now()
+        api.get_positions = lambda device_ids=None, **kwargs: [
+            {'deviceId': 'MS1', 'latitude': 13.08 + i * 0.01, 'longitude': 80.27,
+             'deviceTime': (now - timezone.timedelta(minutes=10 - i)).isoformat(),
+             'speed': 40, 'course': 90, 'ignition': True}
+            for i in range(5)
+        ]
+        api.update_vehicle_locations()
+        self.assertEqual(list(MovementSegment.objects.values_list('kind', flat=True)), ['drive'])
+
+    def test_api_reports_idle_fuel(self):
+        from django.test import override_settings
+        from .segments import update_segments
+        self._store(
+            [self._fix(m, 40) for m in range(0, 10)]
+            + [self._fix(m, 0, ignition=True) for m in range(10, 40)]
+            + [self._fix(m, 40) for m in range(40, 45)]
+        )
+        update_segments([self.vehicle.id])
+        self.client.force_login(User.objects.create_user(
+            username='segadmin', password='pass1234', user_type='admin', approval_status='approved',
+        ))
+        with override_settings(IDLE_FUEL_LITRES_PER_HOUR=2.0):
+            response = self.client.get(
+                reverse('api_vehicle_movement_segments', args=[self.vehicle.id]),
+                {'kind': 'idle'}
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['summary']['idle_seconds'], 1800)
+        self.assertEqual(data['summary']['idle_fuel_litres'], 1.0)
+        self.assertEqual([s['kind'] for s in data['segments']], ['idle'])
+
+    def test_summary_clips_segments_to_the_window(self):
+        from .models import MovementSegment
+        from .segments import segment_summary, update_segments
+        self._store(
+            [self._fix(m, 40) for m in range(0, 10)]
+            + [self._fix(m, 0, ignition=True) for m in range(10, 40)]
+            + [self._fix(m, 40) for m in range(40, 45)]
+        )
+        update_segments([self.vehicle.id])
+        segments = list(MovementSegment.objects.order_by('start_time'))
+        # From the middle of the first drive to the middle of the idle
+        window = (self.t0 + timezone.timedelta(minutes=5), self.t0 + timezone.timedelta(minutes=25))
+        summary = segment_summary(segments, *window)
+        self.assertEqual((summary['drive_seconds'], summary['idle_seconds'], summary['stop_seconds']), (300, 900, 0))
+        self.assertAlmostEqual(
+            summary['distance_km'], (segments[0].distance_km + segments[1].distance_km) / 2, delta=0.01
+        )
+        self.assertEqual(segment_summary(segments)['idle_seconds'], 1800)
+
+        self.client.force_login(User.objects.create_user(
+            username='segclip', password='pass1234', user_type='admin', approval_status='approved',
+        ))
+        response = self.client.get(
+            reverse('api_vehicle_movement_segments', args=[self.vehicle.id]),
+            {'from': window[0].isoformat(), 'to': window[1].isoformat()}
+        )
+        self.assertEqual(response.json()['summary']['idle_seconds'], 900)
+
+    def test_history_page_scans_points_outside_the_segments(self):
+        from .segments import update_segments
+        self._store(
+            [self._fix(m, 40) for m in range(0, 10)]
+            + [self._fix(m, 0, ignition=False) for m in range(10, 40)]
+            + [self._fix(m, 40) for m in range(40, 45)]
+        )
+        update_segments([self.vehicle.id])
+        # Newer points not segmented yet: a 20 minute stop
+        self._store([self._fix(m, 0, ignition=False) for m in range(45, 66)] + [self._fix(66, 40)])
+        self.client.force_login(User.objects.create_user(
+            username='segpartial', password='pass1234', user_type='admin', approval_status='approved',
+        ))
+        from django.http import HttpResponse
+        with mock.patch('geolocation.views.render', return_value=HttpResponse()) as render, \
+                self.assertLogs('geolocation.views', 'INFO'):
+            self.client.get(reverse('vehicle_tracking_history', args=[self.vehicle.id]))
+        stops = render.call_args[0][2]['stops']
+        self.assertEqual([stop['duration'].total_seconds() for stop in stops], [1800, 1200])
+        self.assertEqual(stops[0]['kind'], 'stop')
+
+    def test_history_page_uses_stored_stops(self):
+        from .segments import update_segments
+        self._store(
+            [self._fix(m, 40) for m in range(0, 10)]
+            + [self._fix(m, 0, ignition=False) for m in range(10, 40)]
+            + [self._fix(m, 40) for m in range(40, 45)]
+        )
+        update_segments([self.vehicle.id])
+        self.client.force_login(User.objects.create_user(
+            username='segadmin', password='pass1234', user_type='admin', approval_status='approved',
+        ))
+        from django.http import HttpResponse
+        with mock.patch('geolocation.views.render', return_value=HttpResponse()) as render:
+            self.client.get(reverse('vehicle_tracking_history', args=[self.vehicle.id]))
+        stops = render.call_args[0][2]['stops']
+        self.assertEqual(len(stops), 1)
+        self.assertEqual(stops[0]['kind'], 'stop')
+        self.assertEqual(stops[0]['duration'].total_seconds(), 1800)
+
+
+class _FailingGeocoder:
+    name = 'failing'
+    calls = 0
+
+    def reverse(self, latitude, longitude):
+        _FailingGeocoder.calls += 1
+        return None
+
+
+@override_settings(REVERSE_GEOCODER='geolocation.geocoding.StubReverseGeocoder')
+class ReverseGeocodeCacheTests(TestCase):
+    """geolocation.geocoding: grid cache, LRU and background resolution."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from .geocoding import _lru
+        cache.clear()
+        _lru.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(_lru.clear)
+
+    def test_miss_is_resolved_in_background_then_served_from_lru(self):
+        from .geocoding import lookup_addresses
+        from .models import GeocodedPlace
+        # Celery runs eagerly here, so the queued task has resolved the cell on return;
+        # the first lookup still answers from what it had.
+        self.assertEqual(lookup_addresses([(13.08271, 80.27071)]), [None])
+        place = GeocodedPlace.objects.get()
+        self.assertEqual((place.cell_lat, place.cell_lon, place.provider), (13083, 80271, 'stub'))
+
+        # ~30 m away: same cell, answered in process.
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_addresses([(13.0829, 80.2709)]), ['Near 13.083, 80.271'])
+
+    def test_database_hit_without_lru(self):
+        from .geocoding import _lru, lookup_addresses
+        from .models import GeocodedPlace
+        GeocodedPlace.objects.create(cell_lat=13083, cell_lon=80271, address='Store 7, Anna Nagar', provider='stub')
+        GeocodedPlace.objects.create(cell_lat=13100, cell_lon=80100, address='', provider='stub')
+        with mock.patch('geolocation.tasks.reverse_geocode_cells.delay') as delay, self.assertNumQueries(1):
+            addresses = lookup_addresses([(13.0827, 80.2707), (13.1, 80.1), (13.1, 80.2707)])
+        self.assertEqual(addresses, ['Store 7, Anna Nagar', None, None])
+        delay.assert_called_once_with([[13100, 80271]])
+        self.assertEqual(_lru.get((13083, 80271)), 'Store 7, Anna Nagar')
+
+    @override_settings(REVERSE_GEOCODER='geolocation.tests._FailingGeocoder')
+    def test_failed_cells_are_not_requeued_while_pending(self):
+        from .geocoding import lookup_addresses
+        from .models import GeocodedPlace
+        _FailingGeocoder.calls = 0
+        lookup_addresses([(12.9716, 77.5946)])
+        lookup_addresses([(12.9716, 77.5946)])
+        self.assertEqual(_FailingGeocoder.calls, 1)
+        self.assertFalse(GeocodedPlace.objects.exists())
+
+        # Still not retried once the pending key has expired, until FAILED_TTL has
+        from django.core.cache import cache
+        from .geocoding import _failed_key, _pending_key, cell_of
+        cell = cell_of(12.9716, 77.5946)
+        cache.delete(_pending_key(cell))
+        lookup_addresses([(12.9716, 77.5946)])
+        self.assertEqual(_FailingGeocoder.calls, 1)
+        cache.delete(_failed_key(cell))
+        lookup_addresses([(12.9716, 77.5946)])
+        self.assertEqual(_FailingGeocoder.calls, 2)
+
+    @override_settings(REVERSE_GEOCODER='geolocation.geocoding.NullReverseGeocoder')
+    def test_null_provider_queues_nothing(self):
+        from .geocoding import lookup_addresses
+        with mock.patch('geolocation.tasks.reverse_geocode_cells.delay') as delay:
+            self.assertEqual(lookup_addresses([(12.9716, 77.5946)]), [None])
+        delay.assert_not_called()
+
+    def test_google_provider_parses_response(self):
+        from .geocoding import GoogleReverseGeocoder
+        provider = GoogleReverseGeocoder()
+        ok = mock.Mock(json=lambda: {'status': 'OK', 'results': [{'formatted_address': 'Anna Nagar, Chennai'}]})
+        empty = mock.Mock(json=lambda: {'status': 'ZERO_RESULTS', 'results': []})
+        denied = mock.Mock(json=lambda: {'status': 'REQUEST_DENIED'})
+        with override_settings(GOOGLE_MAPS_API_KEY='key'), \
+                mock.patch('geolocation.geocoding.requests.get', side_effect=[ok, empty, denied]):
+            self.assertEqual(provider.reverse(13.083, 80.271), 'Anna Nagar, Chennai')
+            self.assertEqual(provider.reverse(0, 0), '')
+            self.assertIsNone(provider.reverse(0, 0))
+        self.assertIsNone(provider.reverse(13.083, 80.271))  # No API key
+
+    def test_map_features_use_cached_address(self):
+        from .models import GeocodedPlace
+        from .views import _vehicle_location_features
+        vtype = VehicleType.objects.create(name='Truck', category='commercial')
+        vehicle = Vehicle.objects.create(
+            vehicle_type=vtype, make='Tata', model='Ace', year=2023,
+            license_plate='TN01RG0001', vin='VINREVGEOCODE0001', acquisition_date=date.today(),
+        )
+        device = AiroTrackDevice.objects.create(device_id='RG1', vehicle=vehicle)
+        VehicleLocation.objects.create(
+            vehicle=vehicle, device=device, latitude=Decimal('13.0827'), longitude=Decimal('80.2707'),
+            speed=Decimal('0'), device_time=timezone.now(), server_time=timezone.now(),
+        )
+        GeocodedPlace.objects.create(cell_lat=13083, cell_lon=80271, address='Store 7, Anna Nagar', provider='stub')
+        features, _ = _vehicle_location_features()
+        self.assertEqual(features[0]['properties']['address'], 'Store 7, Anna Nagar')
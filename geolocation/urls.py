@@ -41,11 +41,16 @@ urlpatterns = [
     # API endpoints
     path('api/', include(router.urls)),
     path('api/sync/', api.sync_data, name='api_sync_data'),
+    path('api/sync/status/', api.sync_status, name='api_sync_status'),
     path('api/vehicle/<int:vehicle_id>/current/', api.vehicle_current_location, name='api_vehicle_current_location'),
+    path('api/vehicle/<int:vehicle_id>/segments/', api.vehicle_movement_segments, name='api_vehicle_movement_segments'),
     path('api/vehicles/current/', api.all_vehicles_current_location, name='api_all_vehicles_current_location'),
+    path('api/vehicles/nearest/', api.nearest_vehicles_view, name='api_nearest_vehicles'),
     
     # AJAX endpoints for real-time updates
     path('ajax/locations/', views.ajax_vehicle_locations, name='ajax_vehicle_locations'),
+    path('ajax/locations/delta/', views.ajax_vehicle_locations_delta, name='ajax_vehicle_locations_delta'),
+    path('ajax/locations/stream/', views.ajax_vehicle_locations_stream, name='ajax_vehicle_locations_stream'),
     path('ajax/vehicle/<int:vehicle_id>/', views.ajax_vehicle_detail, name='ajax_vehicle_detail'),
     
     # Driver Tracking (mobile app GPS)
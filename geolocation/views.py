@@ -1,24 +1,30 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponseForbidden, HttpResponse
+from django.http import JsonResponse, HttpResponseForbidden, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.views.decorators.http import require_POST, require_GET
 from django.db import transaction
 from django.core.paginator import Paginator
 from django.conf import settings
 from datetime import datetime, timedelta
+import bisect
 import json
 import logging
 import csv
 
-from .models import AiroTrackDevice, VehicleLocation, LocationHistory
+from .models import AiroTrackDevice, VehicleLocation, LocationHistory, MovementSegment
 from vehicles.models import Vehicle
 from .airotrack_service import AiroTrackAPI
+from .archive import archived_history
+from .geocoding import address_for, lookup_addresses
+from .segments import segment_summary
+from .spatial import filter_bbox, in_bbox, parse_bbox
 from .forms import AiroTrackDeviceForm, VehicleAssignmentForm, DateRangeForm, AiroTrackSettingsForm
 from trips.models import Trip
 from trips.gps_models import TripLocation, GPSTrackingSession
 from accounts.models import CustomUser
+from core import live_feed
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -110,6 +116,10 @@ def tracking_dashboard(request):
         loc.vehicle_id: loc
         for loc in VehicleLocation.objects.filter(vehicle_id__in=vehicle_ids)
     }
+    # Locations without an AiroTrack address use the reverse-geocode cache
+    unaddressed = [loc for loc in locations_map.values() if not loc.address]
+    for loc, address in zip(unaddressed, lookup_addresses([(loc.latitude, loc.longitude) for loc in unaddressed])):
+        loc.address = address
     
     # Build vehicle data using the prefetched locations
     vehicles_data = []
@@ -212,7 +222,7 @@ def vehicle_tracking_detail(request, vehicle_id):
             "course": float(location.course) if location.course else 0,
             "altitude": float(location.altitude) if location.altitude else 0,
             "last_update": location.device_time,
-            "address": location.address or "Unknown location",
+            "address": location.address or address_for(location.latitude, location.longitude) or "Unknown location",
             "ignition": location.ignition,
             "battery_level": float(location.battery_level) if location.battery_level else None,
             "signal_strength": location.signal_strength
@@ -317,76 +327,78 @@ def vehicle_tracking_history(request, vehicle_id):
         start_time = end_time - timedelta(days=1)
     
     # Get history data for the selected period
-    history = LocationHistory.objects.filter(
+    history = list(LocationHistory.objects.filter(
         vehicle=vehicle,
         device_time__gte=start_time,
         device_time__lte=end_time
-    ).order_by('device_time')
+    ).order_by('device_time'))
+    
+    # Ranges older than the hot table are served from the cold-storage archive
+    archived = archived_history(vehicle.id, start_time, end_time)
+    if archived:
+        history = sorted(archived + history, key=lambda point: point.device_time)
     
     # If no data in database, try to fetch from API
-    if history.count() < 10:
+    elif len(history) < 10:
         try:
             api_service = AiroTrackAPI()
             api_service.get_vehicle_history(vehicle, start_time, end_time)
             
             # Refresh query after API fetch
-            history = LocationHistory.objects.filter(
+            history = list(LocationHistory.objects.filter(
                 vehicle=vehicle,
                 device_time__gte=start_time,
                 device_time__lte=end_time
-            ).order_by('device_time')
+            ).order_by('device_time'))
         except Exception as e:
             logger.error(f"Error fetching history from API: {str(e)}")
             messages.warning(request, "Could not fetch additional history data from AiroTrack API.")
     
     # Calculate stats
-    if history.exists():
-        max_speed = history.order_by('-speed').first().speed
-        avg_speed = sum(h.speed or 0 for h in history) / history.count() if history.count() > 0 else 0
-        
-        # Identify stops (periods of no movement)
-        stops = []
-        current_stop = None
-        
-        for point in history:
-            if point.speed is None or float(point.speed) < 2:  # Less than 2 km/h considered stopped
-                if current_stop is None:
-                    current_stop = {
-                        'start_time': point.device_time,
-                        'end_time': point.device_time,
-                        'latitude': point.latitude,
-                        'longitude': point.longitude,
-                        'address': point.address or "Unknown location"
-                    }
-                else:
-                    current_stop['end_time'] = point.device_time
-            else:
-                if current_stop is not None:
-                    # Only count stops longer than 5 minutes
-                    duration = current_stop['end_time'] - current_stop['start_time']
-                    if duration.total_seconds() > 300:
-                        current_stop['duration'] = duration
-                        stops.append(current_stop)
-                    current_stop = None
+    if history:
+        speeds = [h.speed for h in history if h.speed is not None]
+        max_speed = max(speeds) if speeds else None
+        avg_speed = sum(h.speed or 0 for h in history) / len(history)
         
-        # Add the last stop if there is one
-        if current_stop is not None:
-            duration = current_stop['end_time'] - current_stop['start_time']
-            if duration.total_seconds() > 300:
-                current_stop['duration'] = duration
-                stops.append(current_stop)
+        # Stops come from the stored movement segments where they cover the
+        # range; raw points before or after them (not segmented yet, or
+        # older than the segments) are scanned instead
+        segments = sorted(MovementSegment.objects.filter(
+            vehicle=vehicle,
+            start_time__lt=end_time,
+            end_time__gt=start_time
+        ), key=lambda segment: segment.start_time)
+        if segments:
+            covered_from = segments[0].start_time
+            covered_to = segments[-1].end_time
+            before = [point for point in history if point.device_time < covered_from]
+            after = [point for point in history if point.device_time > covered_to]
+            if before or after:
+                logger.info(
+                    "Movement segments of vehicle %s cover %s to %s only; scanning %d raw points outside",
+                    vehicle.id, covered_from, covered_to, len(before) + len(after)
+                )
+            stops = _scan_stops(before) + _segment_stops(segments, history) + _scan_stops(after)
+            movement_summary = segment_summary(segments, start_time, end_time)
+        else:
+            logger.debug("No movement segments for vehicle %s in range; scanning raw points", vehicle.id)
+            stops = _scan_stops(history)
+            movement_summary = None
+        _fill_stop_addresses(stops)
     else:
         max_speed = avg_speed = 0
         stops = []
+        movement_summary = None
     
     context = {
         'vehicle': vehicle,
         'device': device,
         'history': history,
-        'history_count': history.count(),
+        'history_count': len(history),
         'max_speed': max_speed,
         'avg_speed': avg_speed,
         'stops': stops,
+        'movement_summary': movement_summary,
         'start_time': start_time,
         'end_time': end_time,
         'start_date': start_time.strftime('%Y-%m-%d'),
@@ -397,6 +409,68 @@ def vehicle_tracking_history(request, vehicle_id):
     
     return render(request, 'geolocation/vehicle_tracking_history.html', context)
 
+def _segment_stops(segments, history):
+    """Stop dicts for the history page from stored idle/stop segments over 5 minutes."""
+    times = [point.device_time for point in history]
+    stops = []
+    for segment in segments:
+        if segment.kind == 'drive' or segment.duration_seconds <= 300:
+            continue
+        # Address of the first history point in the stop, if the page loaded one
+        position = bisect.bisect_left(times, segment.start_time)
+        address = history[position].address if position < len(history) else None
+        stops.append({
+            'start_time': segment.start_time,
+            'end_time': segment.end_time,
+            'latitude': segment.centroid_latitude,
+            'longitude': segment.centroid_longitude,
+            'address': address or "Unknown location",
+            'duration': segment.duration,
+            'kind': segment.kind,
+        })
+    return stops
+
+def _fill_stop_addresses(stops):
+    """Reverse-geocode cache addresses for stops without one."""
+    unknown = [stop for stop in stops if stop['address'] == "Unknown location"]
+    addresses = lookup_addresses([(stop['latitude'], stop['longitude']) for stop in unknown])
+    for stop, address in zip(unknown, addresses):
+        stop['address'] = address or "Unknown location"
+
+def _scan_stops(history):
+    """Stops found by scanning raw points, for ranges without movement segments."""
+    stops = []
+    current_stop = None
+    
+    for point in history:
+        if point.speed is None or float(point.speed) < 2:  # Less than 2 km/h considered stopped
+            if current_stop is None:
+                current_stop = {
+                    'start_time': point.device_time,
+                    'end_time': point.device_time,
+                    'latitude': point.latitude,
+                    'longitude': point.longitude,
+                    'address': point.address or "Unknown location"
+                }
+            else:
+                current_stop['end_time'] = point.device_time
+        else:
+            if current_stop is not None:
+                # Only count stops longer than 5 minutes
+                duration = current_stop['end_time'] - current_stop['start_time']
+                if duration.total_seconds() > 300:
+                    current_stop['duration'] = duration
+                    stops.append(current_stop)
+                current_stop = None
+    
+    # Add the last stop if there is one
+    if current_stop is not None:
+        duration = current_stop['end_time'] - current_stop['start_time']
+        if duration.total_seconds() > 300:
+            current_stop['duration'] = duration
+            stops.append(current_stop)
+    return stops
+
 @login_required
 def map_view(request):
     """
@@ -672,6 +746,8 @@ def sync_airotrack(request):
             f"{sync_result['devices_updated']} updated, "
             f"{sync_result['locations_updated']} locations updated."
         )
+        if sync_result.get('locations_skipped'):
+            messages.warning(request, "Locations were not updated: a scheduled poll is already running.")
     except Exception as e:
         logger.error(f"Sync failed: {str(e)}")
         messages.error(request, f"Synchronization failed: {str(e)}")
@@ -716,29 +792,38 @@ def airotrack_settings(request):
 
 # ===== AJAX Endpoints =====
 
-@login_required
-@require_GET
-def ajax_vehicle_locations(request):
+def _vehicle_location_features(vehicle_ids=None, bbox=None):
     """
-    AJAX endpoint to get current locations of all vehicles.
-    
-    Returns GeoJSON format for map display.
+    GeoJSON features for the current vehicle locations, limited to
+    ``vehicle_ids`` and to the ``bbox`` viewport if given. Returns
+    ``(features, removed_ids)`` where removed_ids are requested vehicles
+    that no longer have a location.
     """
-    if not has_tracking_permission(request.user):
-        return HttpResponseForbidden("Permission denied")
-    
-    # Get all current locations
-    locations = VehicleLocation.objects.select_related('vehicle', 'device').all()
-    
-    # Convert to GeoJSON
+    locations = filter_bbox(VehicleLocation.objects.select_related('vehicle'), bbox)
+    if vehicle_ids is not None:
+        locations = locations.filter(vehicle_id__in=vehicle_ids)
+    
+    locations = list(locations)
+    unaddressed = [
+        location for location in locations
+        if not location.address and location.latitude and location.longitude
+    ]
+    for location, address in zip(
+        unaddressed, lookup_addresses([(loc.latitude, loc.longitude) for loc in unaddressed])
+    ):
+        location.address = address
+    
+    now = timezone.now()
     features = []
+    seen = set()
     for location in locations:
         # Skip if no valid coordinates
         if not location.latitude or not location.longitude:
             continue
+        seen.add(location.vehicle_id)
             
         # Get vehicle status - Updated with new logic including idle status
-        if (timezone.now() - location.device_time) > timedelta(minutes=60):
+        if (now - location.device_time) > timedelta(minutes=60):
             status = "unknown"
         else:
             # Get speed as float, defaulting to 0 if None or invalid
@@ -776,6 +861,28 @@ def ajax_vehicle_locations(request):
         }
         features.append(feature)
     
+    removed = set(vehicle_ids) - seen if vehicle_ids is not None else set()
+    return features, removed
+
+@login_required
+@require_GET
+def ajax_vehicle_locations(request):
+    """
+    AJAX endpoint to get current locations of all vehicles.
+    
+    Returns GeoJSON format for map display. ``?bbox=west,south,east,north``
+    limits the result to the map viewport.
+    """
+    if not has_tracking_permission(request.user):
+        return HttpResponseForbidden("Permission denied")
+    
+    try:
+        bbox = parse_bbox(request.GET.get('bbox'))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    
+    features, _ = _vehicle_location_features(bbox=bbox)
+    
     # Create GeoJSON feature collection
     geojson = {
         "type": "FeatureCollection",
@@ -785,6 +892,48 @@ def ajax_vehicle_locations(request):
     
     return JsonResponse(geojson)
 
+@login_required
+@require_GET
+def ajax_vehicle_locations_delta(request):
+    """
+    Vehicles whose position changed since the client's cursor.
+    
+    ``?since=<cursor>`` is the ``cursor`` of the previous response; without
+    it (or when it is too old) the response is a full snapshot
+    (``full: true``). ``items`` are GeoJSON features as returned by
+    ``ajax_vehicle_locations``; ``removed`` lists vehicle ids to drop.
+    Only meaningful position changes are published (see
+    ``AiroTrackAPI._select_history``), so clients should age markers from
+    each feature's ``time``.
+    """
+    if not has_tracking_permission(request.user):
+        return HttpResponseForbidden("Permission denied")
+    
+    since = live_feed.parse_cursor(request.GET.get('since'))
+    return JsonResponse(live_feed.build_delta('vehicles', since, _vehicle_location_features))
+
+@login_required
+@require_GET
+def ajax_vehicle_locations_stream(request):
+    """
+    Server-Sent Events variant of ``ajax_vehicle_locations_delta``: pushes a
+    ``vehicles`` event with the same payload whenever a sync lands.
+    Resumes from ``Last-Event-ID`` (or ``?since=``) after a reconnect.
+    """
+    if not has_tracking_permission(request.user):
+        return HttpResponseForbidden("Permission denied")
+    
+    since = live_feed.parse_cursor(
+        request.headers.get('Last-Event-ID') or request.GET.get('since')
+    )
+    response = StreamingHttpResponse(
+        live_feed.event_stream('vehicles', since, _vehicle_location_features),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
 @login_required
 @require_GET
 def ajax_vehicle_detail(request, vehicle_id):
@@ -1309,21 +1458,31 @@ def driver_tracking_dashboard(request):
 @require_GET
 def ajax_driver_locations(request):
     """
-    AJAX endpoint returning real-time driver locations from TripLocation (mobile app GPS).
-    Returns GeoJSON for map display.
+    AJAX endpoint returning real-time driver locations from TripLivePosition
+    (latest mobile app GPS fix per trip). Returns GeoJSON for map display. ``?bbox=west,south,east,north``
+    limits the result to the map viewport.
     """
     if not has_tracking_permission(request.user):
         return HttpResponseForbidden("Permission denied")
 
+    try:
+        bbox = parse_bbox(request.GET.get('bbox'))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # Latest point of every ongoing trip from its live position, in one query
     active_trips = Trip.objects.filter(
         status='ongoing',
         is_deleted=False,
-    ).select_related('driver', 'vehicle')
+        live_position__isnull=False,
+    ).select_related('driver', 'vehicle', 'live_position')
 
     features = []
     for trip in active_trips:
-        latest = TripLocation.objects.filter(trip=trip).order_by('-timestamp').first()
-        if not latest or not latest.latitude or not latest.longitude:
+        latest = trip.live_position
+        if not latest.latitude or not latest.longitude:
+            continue
+        if not in_bbox(bbox, latest.latitude, latest.longitude):
             continue
 
         age = timezone.now() - latest.timestamp
@@ -0,0 +1,110 @@
+"""
+JSON endpoints for background report jobs (see ``reports.jobs``).
+
+    POST jobs/                   submit: report_type, format and the report's filters
+    GET  jobs/                   the user's recent jobs
+    GET  jobs/<id>/              status and progress, for polling
+    GET  jobs/<id>/download/     the rendered file once completed
+"""
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import require_GET, require_http_methods
+
+from .jobs import REPORT_TYPES, can_access, submit_job, user_scope
+from .models import ReportJob
+
+RECENT_JOBS_LIMIT = 20
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def job_payload(job):
+    """The JSON view of a job."""
+    downloadable = job.status == ReportJob.STATUS_COMPLETED and job.expires_at and job.expires_at > timezone.now()
+    return {
+        'id': job.pk,
+        'report_type': job.report_type,
+        'label': REPORT_TYPES.get(job.report_type, {}).get('label', job.report_type),
+        'format': job.export_format,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'error': job.error if job.status == ReportJob.STATUS_FAILED else '',
+        'filename': job.filename,
+        'size': job.size,
+        'created_at': _iso(job.created_at),
+        'completed_at': _iso(job.completed_at),
+        'expires_at': _iso(job.expires_at),
+        'status_url': reverse('report_job_status', args=[job.pk]),
+        'download_url': reverse('report_job_download', args=[job.pk]) if downloadable else None,
+    }
+
+
+def _visible_job(request, job_id):
+    """
+    The job if the user could have requested the same export: jobs are
+    shared between users with the same access and data scope.
+    """
+    job = ReportJob.objects.filter(pk=job_id).first()
+    if job is None or not can_access(request.user, job.report_type):
+        return None
+    if job.requested_by_id != request.user.pk and job.scope != user_scope(request.user, job.report_type):
+        return None
+    return job
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def report_jobs(request):
+    """Submit a report job (POST) or list the user's recent jobs (GET)."""
+    if request.method == 'GET':
+        jobs = ReportJob.objects.filter(requested_by=request.user)[:RECENT_JOBS_LIMIT]
+        return JsonResponse({'success': True, 'jobs': [job_payload(job) for job in jobs]})
+
+    report_type = request.POST.get('report_type', '')
+    export_format = request.POST.get('format', '')
+    if report_type not in REPORT_TYPES:
+        return JsonResponse({'success': False, 'error': 'Unknown report type'}, status=400)
+    if export_format not in REPORT_TYPES[report_type]['formats']:
+        return JsonResponse({'success': False, 'error': 'Unsupported export format'}, status=400)
+    if not can_access(request.user, report_type):
+        return JsonResponse({'success': False, 'error': 'You do not have permission to export this report'}, status=403)
+
+    job, created = submit_job(request.user, report_type, export_format, request.POST)
+    return JsonResponse({'success': True, 'created': created, 'job': job_payload(job)}, status=202)
+
+
+@login_required
+@require_GET
+def report_job_status(request, job_id):
+    """Status and progress of a job."""
+    job = _visible_job(request, job_id)
+    if job is None:
+        return JsonResponse({'success': False, 'error': 'Report job not found'}, status=404)
+    return JsonResponse({'success': True, 'job': job_payload(job)})
+
+
+@login_required
+@require_GET
+def report_job_download(request, job_id):
+    """The rendered file of a completed, unexpired job."""
+    job = _visible_job(request, job_id)
+    if job is None:
+        return JsonResponse({'success': False, 'error': 'Report job not found'}, status=404)
+    if job.status != ReportJob.STATUS_COMPLETED:
+        return JsonResponse({'success': False, 'error': 'Report is not ready yet'}, status=409)
+    if not job.expires_at or job.expires_at <= timezone.now() or not job.file.storage.exists(job.file.name):
+        return JsonResponse({'success': False, 'error': 'Report has expired, please request it again'}, status=410)
+
+    response = FileResponse(
+        job.file.open('rb'),
+        as_attachment=True,
+        filename=job.filename,
+        content_type=job.content_type or 'application/octet-stream',
+    )
+    response['X-Accel-Buffering'] = 'no'
+    return response
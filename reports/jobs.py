@@ -0,0 +1,395 @@
+"""
+Background report jobs.
+
+Excel and PDF exports of a year of data take longer than a request
+should. Instead of rendering in the request, the page submits a job
+(``submit_job``); ``reports.tasks.generate_report_task`` renders it by
+calling the existing export view with the same query parameters and the
+requesting user, writes the attachment under ``REPORT_JOBS_ROOT`` and
+records progress on the ``ReportJob`` row, which the page polls until the
+file can be downloaded.
+
+Query parameters are normalized (paging / UI-only keys and empty values
+dropped, keys and values sorted) and hashed with the report type, format
+and the user's data scope, so identical requests share one job: while a
+matching job is queued or running, or finished less than
+``REUSE_SECONDS`` ago, it is returned instead of starting another render.
+Files expire after ``REPORT_JOB_TTL_HOURS`` and are deleted by the
+``cleanup_report_jobs`` command.
+
+Usage:
+    job, created = submit_job(request.user, 'fuel_report', 'excel', request.POST)
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ReportJob
+
+logger = logging.getLogger(__name__)
+
+REUSE_SECONDS = 5 * 60                 # finished jobs shared with identical requests
+ACTIVE_JOB_MAX_AGE = timedelta(hours=1)  # older queued/running jobs are treated as lost
+SUBMIT_LOCK_TIMEOUT = 30
+SUBMIT_WAIT_SECONDS = 2.0
+SUBMIT_POLL_SECONDS = 0.05
+PROGRESS_INTERVAL_SECONDS = 1.0
+WRITE_CHUNK_SIZE = 64 * 1024
+
+# Parameters that do not change the exported data
+IGNORED_PARAMS = {'export', 'format', 'report_type', 'page', 'ajax', 'csrfmiddlewaretoken', '_'}
+
+MANAGEMENT_USER_TYPES = ('admin', 'manager', 'vehicle_manager')
+
+
+def _is_management(user):
+    return user.user_type in MANAGEMENT_USER_TYPES
+
+
+def _all_scope(user):
+    return 'all'
+
+
+def _trips_scope(user):
+    # export_trips limits drivers to their own trips
+    return 'all' if _is_management(user) else f'user:{user.pk}'
+
+
+def _sor_scope(user):
+    # sor_export limits drivers to their SORs and other users to the ones they created
+    return 'all' if user.user_type in MANAGEMENT_USER_TYPES + ('sor_head',) else f'user:{user.pk}'
+
+
+def _report_spec(view, label):
+    return {
+        'view': view,
+        'label': label,
+        'formats': ('csv', 'excel'),
+        'format_param': 'export',
+        'can_access': _is_management,
+        'scope': _all_scope,
+    }
+
+
+# Exports that can run as jobs: the view rendering them, the formats it
+# accepts and the query parameter selecting one, who may request it, and
+# whose data it returns.
+REPORT_TYPES = {
+    'vehicle_report': _report_spec('reports.views.VehicleReportView', 'Vehicle report'),
+    'driver_report': _report_spec('reports.views.DriverReportView', 'Driver report'),
+    'maintenance_report': _report_spec('reports.views.MaintenanceReportView', 'Maintenance report'),
+    'fuel_report': _report_spec('reports.views.FuelReportView', 'Fuel report'),
+    'consultant_report': _report_spec('reports.consultant_views.ConsultantReportView', 'Consultant report'),
+    'daily_usage_cost': _report_spec('reports.views.DailyUsageCostView', 'Daily usage cost report'),
+    'staff_report': _report_spec('reports.views.StaffReportView', 'Staff report'),
+    'department_report': _report_spec('reports.views.DepartmentReportView', 'Department report'),
+    'trips': {
+        'view': 'trips.views.export_trips',
+        'label': 'Trips export',
+        'formats': ('csv', 'excel', 'pdf'),
+        'format_param': 'format',
+        'can_access': lambda user: user.user_type in MANAGEMENT_USER_TYPES + ('driver',),
+        'scope': _trips_scope,
+    },
+    'manual_trips': {
+        'view': 'trips.views.export_manual_trips',
+        'label': 'Manual trips export',
+        'formats': ('csv', 'excel', 'pdf'),
+        'format_param': 'format',
+        'can_access': _is_management,
+        'scope': _all_scope,
+    },
+    'sor': {
+        'view': 'sor.views.sor_export',
+        'label': 'SOR export',
+        'formats': ('csv', 'excel', 'pdf'),
+        'format_param': 'format',
+        'can_access': lambda user: True,
+        'scope': _sor_scope,
+    },
+}
+
+
+def can_access(user, report_type):
+    """Whether ``user`` may run and download ``report_type`` jobs."""
+    spec = REPORT_TYPES.get(report_type)
+    return bool(spec and user.is_authenticated and spec['can_access'](user))
+
+
+def user_scope(user, report_type):
+    """Whose data a ``report_type`` export by ``user`` contains: 'all' or 'user:<id>'."""
+    return REPORT_TYPES[report_type]['scope'](user)
+
+
+def normalize_params(query):
+    """
+    Filter parameters of ``query`` (a QueryDict or dict) as a sorted dict
+    of sorted value lists, without UI-only keys and empty values.
+    """
+    if hasattr(query, 'lists'):
+        items = query.lists()
+    else:
+        items = ((key, value if isinstance(value, (list, tuple)) else [value]) for key, value in query.items())
+    params = {}
+    for key, values in items:
+        if key in IGNORED_PARAMS:
+            continue
+        values = sorted(str(value).strip() for value in values if value is not None and str(value).strip())
+        if values:
+            params[key] = values
+    return dict(sorted(params.items()))
+
+
+def params_hash(report_type, export_format, scope, params):
+    """Hash identifying the export a job produces."""
+    payload = {
+        'report_type': report_type,
+        'format': export_format,
+        'scope': scope,
+        'params': params,
+        # Reports default to today when no dates are given
+        'date': timezone.localdate().isoformat(),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _shared_job(hash_):
+    now = timezone.now()
+    return (
+        ReportJob.objects.filter(params_hash=hash_)
+        .filter(
+            Q(status__in=ReportJob.ACTIVE_STATUSES, created_at__gte=now - ACTIVE_JOB_MAX_AGE)
+            | Q(
+                status=ReportJob.STATUS_COMPLETED,
+                completed_at__gte=now - timedelta(seconds=REUSE_SECONDS),
+                expires_at__gt=now,
+            )
+        )
+        .order_by('-created_at')
+        .first()
+    )
+
+
+def _enqueue(job_id):
+    from .tasks import generate_report_task
+
+    try:
+        generate_report_task.delay(job_id)
+    except Exception as exc:
+        logger.warning("Could not queue report job %s: %s", job_id, exc)
+        ReportJob.objects.filter(pk=job_id).update(
+            status=ReportJob.STATUS_FAILED,
+            message='Could not queue the report',
+            error=str(exc),
+            completed_at=timezone.now(),
+        )
+
+
+def submit_job(user, report_type, export_format, query):
+    """
+    Queue an export of ``report_type`` in ``export_format`` for ``user``
+    with the filters in ``query``, or return the identical job already
+    queued, running or just finished.
+
+    The caller checks ``can_access`` and the format first.
+
+    Returns:
+        tuple: (ReportJob, created)
+    """
+    params = normalize_params(query)
+    scope = user_scope(user, report_type)
+    hash_ = params_hash(report_type, export_format, scope, params)
+
+    job = _shared_job(hash_)
+    if job is not None:
+        return job, False
+
+    # One request creates the job; identical requests arriving meanwhile
+    # wait briefly for it instead of queueing a second render.
+    lock_key = f'report_job_submit:{hash_}'
+    try:
+        acquired = cache.add(lock_key, 1, SUBMIT_LOCK_TIMEOUT) is not False
+    except Exception:
+        acquired = True  # Cache backend down
+    if not acquired:
+        deadline = time.monotonic() + SUBMIT_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(SUBMIT_POLL_SECONDS)
+            job = _shared_job(hash_)
+            if job is not None:
+                return job, False
+        logger.info("Report job submission %s still locked, creating it here", hash_)
+
+    try:
+        job = _shared_job(hash_)
+        if job is not None:
+            return job, False
+        job = ReportJob.objects.create(
+            requested_by=user,
+            report_type=report_type,
+            export_format=export_format,
+            params=params,
+            scope=scope,
+            params_hash=hash_,
+            message='Queued',
+        )
+    finally:
+        if acquired:
+            try:
+                cache.delete(lock_key)
+            except Exception:
+                pass
+    transaction.on_commit(lambda: _enqueue(job.pk))
+    return job, True
+
+
+def set_progress(job_id, progress, message):
+    ReportJob.objects.filter(pk=job_id).update(progress=progress, message=message[:255])
+
+
+def _build_request(job, user):
+    spec = REPORT_TYPES[job.report_type]
+    query = QueryDict(mutable=True)
+    for key, values in job.params.items():
+        query.setlist(key, values)
+    query[spec['format_param']] = job.export_format
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = query
+    request.user = user
+    return request
+
+
+def _call_view(job, user):
+    view = import_string(REPORT_TYPES[job.report_type]['view'])
+    if hasattr(view, 'as_view'):
+        view = view.as_view()
+    return view(_build_request(job, user))
+
+
+def _attachment_name(response, job):
+    match = re.search(r'filename="?([^";]+)"?', response.get('Content-Disposition', ''))
+    if match:
+        return match.group(1)
+    return f'{job.report_type}_{timezone.localdate():%Y%m%d}'
+
+
+def _response_chunks(response):
+    if response.streaming:
+        for chunk in response.streaming_content:
+            yield chunk if isinstance(chunk, bytes) else chunk.encode()
+    else:
+        content = response.content
+        for start in range(0, len(content), WRITE_CHUNK_SIZE):
+            yield content[start:start + WRITE_CHUNK_SIZE]
+
+
+def _write_file(job, response, filename):
+    """Save the response body under the job's storage name; returns (name, size)."""
+    field = ReportJob._meta.get_field('file')
+    storage = field.storage
+    name = storage.get_available_name(field.generate_filename(job, f'{job.pk}_{filename}'))
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    partial = f'{path}.part'
+    size = 0
+    last_update = time.monotonic()
+    try:
+        with open(partial, 'wb') as handle:
+            for chunk in _response_chunks(response):
+                handle.write(chunk)
+                size += len(chunk)
+                if time.monotonic() - last_update >= PROGRESS_INTERVAL_SECONDS:
+                    set_progress(job.pk, 60, f'Writing file ({size // 1024} KB)')
+                    last_update = time.monotonic()
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+        close = getattr(response, 'close', None)
+        if close:
+            close()
+    return name, size
+
+
+def run_job(job_id):
+    """
+    Render a queued job to its file. Jobs no longer pending (already
+    picked up by another worker, or finished) are left alone.
+    """
+    now = timezone.now()
+    claimed = ReportJob.objects.filter(pk=job_id, status=ReportJob.STATUS_PENDING).update(
+        status=ReportJob.STATUS_RUNNING, started_at=now, progress=5, message='Starting',
+    )
+    if not claimed:
+        logger.info("Report job %s is not pending, skipping", job_id)
+        return
+    job = ReportJob.objects.select_related('requested_by').get(pk=job_id)
+
+    try:
+        if job.requested_by is None or not can_access(job.requested_by, job.report_type):
+            raise PermissionError("The requesting user can no longer run this report")
+
+        set_progress(job.pk, 20, 'Querying data')
+        response = _call_view(job, job.requested_by)
+        disposition = response.get('Content-Disposition', '')
+        if response.status_code != 200 or 'attachment' not in disposition:
+            raise ValueError(f"Export view returned status {response.status_code} without a file")
+
+        # Streamed responses query as they are written, so most of the
+        # work happens here.
+        set_progress(job.pk, 40, 'Writing file')
+        filename = _attachment_name(response, job)
+        name, size = _write_file(job, response, filename)
+    except Exception as exc:
+        logger.exception("Report job %s (%s) failed", job.pk, job.report_type)
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=ReportJob.STATUS_FAILED,
+            message='Report generation failed',
+            error=str(exc)[:2000],
+            completed_at=timezone.now(),
+        )
+        return
+
+    completed_at = timezone.now()
+    ReportJob.objects.filter(pk=job.pk).update(
+        status=ReportJob.STATUS_COMPLETED,
+        progress=100,
+        message='Ready to download',
+        file=name,
+        filename=filename,
+        content_type=response.get('Content-Type', 'application/octet-stream'),
+        size=size,
+        completed_at=completed_at,
+        expires_at=completed_at + timedelta(hours=settings.REPORT_JOB_TTL_HOURS),
+    )
+    logger.info("Report job %s (%s) written: %s, %d bytes", job.pk, job.report_type, name, size)
+
+
+def delete_job_file(job):
+    """Remove a job's file, and its date directory once empty."""
+    if not job.file:
+        return
+    storage = job.file.storage
+    try:
+        path = storage.path(job.file.name)
+        storage.delete(job.file.name)
+        directory = os.path.dirname(path)
+        while directory.startswith(storage.location + os.sep) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+    except OSError as exc:
+        logger.warning("Could not delete report file %s: %s", job.file.name, exc)
@@ -0,0 +1,59 @@
+"""Delete expired background report jobs and their files.
+
+Completed jobs are kept until `expires_at` (REPORT_JOB_TTL_HOURS after they
+finished); failed jobs for the same time after they were created, so users
+can still see why. Jobs queued or running for longer than a worker could
+take were lost (worker restart, broker purge) and are marked failed.
+Scheduled hourly in CELERY_BEAT_SCHEDULE.
+
+Usage:
+    python manage.py cleanup_report_jobs
+    python manage.py cleanup_report_jobs --dry-run
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Delete expired report jobs and their files, and fail lost ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+
+    def handle(self, *args, **opts):
+        from reports.jobs import ACTIVE_JOB_MAX_AGE, delete_job_file
+        from reports.models import ReportJob
+
+        now = timezone.now()
+        lost = ReportJob.objects.filter(
+            status__in=ReportJob.ACTIVE_STATUSES,
+            created_at__lt=now - ACTIVE_JOB_MAX_AGE,
+        )
+        expired = ReportJob.objects.filter(
+            Q(status=ReportJob.STATUS_COMPLETED, expires_at__lte=now)
+            | Q(status=ReportJob.STATUS_FAILED, created_at__lt=now - timedelta(hours=settings.REPORT_JOB_TTL_HOURS))
+        )
+
+        if opts['dry_run']:
+            self.stdout.write(f"Would fail {lost.count()} lost and delete {expired.count()} expired report jobs.")
+            return
+
+        lost_count = lost.update(
+            status=ReportJob.STATUS_FAILED,
+            message='Report generation did not finish',
+            error='The job was not completed in time and was abandoned.',
+            completed_at=now,
+        )
+        deleted = 0
+        for job in expired.iterator(chunk_size=500):
+            delete_job_file(job)
+            job.delete()
+            deleted += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Failed {lost_count} lost and deleted {deleted} expired report jobs."
+        ))
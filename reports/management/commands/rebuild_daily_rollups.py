@@ -0,0 +1,65 @@
+"""Recompute the daily report rollups from trips, fuel and maintenance.
+
+Rollup rows are kept current by signals as records are saved or deleted.
+Bulk `QuerySet.update()` / `delete()` calls and raw SQL bypass signals, so
+this command recomputes whole days from the source tables: nightly over
+the last few days as a safety net, and with `--all` to rebuild everything
+(migration `reports.0003_backfill_daily_rollups` does this once when the
+rollup tables are deployed). Long ranges are rebuilt a month at a time.
+
+Usage:
+    python manage.py rebuild_daily_rollups                   # the last 3 days
+    python manage.py rebuild_daily_rollups --days 30
+    python manage.py rebuild_daily_rollups --since 2024-01-01 --until 2026-01-31
+    python manage.py rebuild_daily_rollups --all             # backfill every date with data
+"""
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-day vehicle and driver report rollups for a date range."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=3,
+                            help='Rebuild the last N days including today (default 3).')
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD); overrides --days.')
+        parser.add_argument('--until', help='Last day to rebuild, inclusive (YYYY-MM-DD, default today).')
+        parser.add_argument('--all', action='store_true',
+                            help='Start from the earliest trip, fuel or maintenance date; overrides --since/--days.')
+
+    def handle(self, *args, **opts):
+        from reports.rollups import first_day, rebuild_by_month
+
+        until = self._date(opts['until'], '--until') or timezone.localdate()
+        if opts['all']:
+            since = first_day()
+            if since is None:
+                self.stdout.write("No trips, fuel or maintenance records to roll up.")
+                return
+        else:
+            since = self._date(opts['since'], '--since') or until - timedelta(days=opts['days'] - 1)
+        if since > until:
+            raise CommandError("--since must not be after --until")
+
+        vehicle_rows = driver_rows = 0
+        # One month per transaction keeps each rebuild's working set small
+        for start, end, vehicles, drivers in rebuild_by_month(since, until):
+            vehicle_rows += vehicles
+            driver_rows += drivers
+            if opts['verbosity'] > 1:
+                self.stdout.write(f"  {start} to {end}: {vehicles} vehicle / {drivers} driver rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Rebuilt {vehicle_rows} vehicle and {driver_rows} driver day rows "
+            f"from {since} to {until}."
+        ))
+
+    def _date(self, value, option):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"{option} must be YYYY-MM-DD")
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('vehicles', '0010_vehicle_vehicles_ve_ownersh_be1823_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDriverRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('trip_count', models.PositiveIntegerField(default=0)),
+                ('completed_trip_count', models.PositiveIntegerField(default=0)),
+                ('ongoing_trip_count', models.PositiveIntegerField(default=0)),
+                ('cancelled_trip_count', models.PositiveIntegerField(default=0)),
+                ('distance_km', models.PositiveIntegerField(default=0, help_text='Odometer km of completed trips')),
+                ('distance_trip_count', models.PositiveIntegerField(default=0, help_text='Completed trips that covered distance')),
+                ('duration_seconds', models.PositiveBigIntegerField(default=0, help_text='Duration of completed trips')),
+                ('fuel_count', models.PositiveIntegerField(default=0)),
+                ('fuel_litres', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fuel_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('energy_count', models.PositiveIntegerField(default=0)),
+                ('energy_kwh', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('energy_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['date', 'driver'],
+                'indexes': [models.Index(fields=['driver', 'date'], name='reports_dai_driver__bd6464_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'driver'), name='unique_daily_driver_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyVehicleRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('trip_count', models.PositiveIntegerField(default=0)),
+                ('completed_trip_count', models.PositiveIntegerField(default=0)),
+                ('ongoing_trip_count', models.PositiveIntegerField(default=0)),
+                ('cancelled_trip_count', models.PositiveIntegerField(default=0)),
+                ('distance_km', models.PositiveIntegerField(default=0, help_text='Odometer km of completed trips')),
+                ('distance_trip_count', models.PositiveIntegerField(default=0, help_text='Completed trips with an end odometer')),
+                ('approved_trip_count', models.PositiveIntegerField(default=0, help_text='Completed trips not awaiting/refused approval')),
+                ('approved_distance_km', models.PositiveIntegerField(default=0)),
+                ('duration_seconds', models.PositiveBigIntegerField(default=0, help_text='Duration of completed trips')),
+                ('first_trip_start', models.DateTimeField(blank=True, null=True)),
+                ('last_trip_end', models.DateTimeField(blank=True, null=True)),
+                ('fuel_count', models.PositiveIntegerField(default=0)),
+                ('fuel_litres', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('energy_kwh', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fuel_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('maintenance_count', models.PositiveIntegerField(default=0)),
+                ('maintenance_cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='vehicles.vehicle')),
+            ],
+            options={
+                'ordering': ['date', 'vehicle'],
+                'indexes': [models.Index(fields=['vehicle', 'date'], name='reports_dai_vehicle_6aeedc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'vehicle'), name='unique_daily_vehicle_rollup')],
+            },
+        ),
+    ]
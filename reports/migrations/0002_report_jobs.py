@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:11
+
+import django.db.models.deletion
+import reports.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_daily_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_type', models.CharField(max_length=50)),
+                ('export_format', models.CharField(max_length=10)),
+                ('params', models.JSONField(blank=True, default=dict, help_text='Normalized query parameters')),
+                ('scope', models.CharField(help_text="'all', or 'user:<id>' for exports limited to one user", max_length=50)),
+                ('params_hash', models.CharField(db_index=True, max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('progress', models.PositiveSmallIntegerField(default=0, help_text='Percent complete')),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('file', models.FileField(blank=True, max_length=255, storage=reports.models.ReportJobStorage(), upload_to='%Y/%m/%d')),
+                ('filename', models.CharField(blank=True, help_text='Download file name', max_length=255)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='report_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['params_hash', 'status'], name='reports_rep_params__6f28c7_idx'), models.Index(fields=['status', 'expires_at'], name='reports_rep_status_7c3798_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def backfill_daily_rollups(apps, schema_editor):
+    """Rollup rows for the trips, fuel and maintenance recorded before the tables existed."""
+    # The reports read only the rollups, so history must be filled in before they go live.
+    # Uses the live rollup code (it only reads source columns that exist at this point).
+    from reports.rollups import first_day, rebuild_by_month
+    since = first_day()
+    if since is None:
+        return
+    for _ in rebuild_by_month(since, timezone.localdate()):
+        pass
+
+
+class Migration(migrations.Migration):
+    # Each month commits on its own, so a long backfill holds no single huge transaction
+    atomic = False
+
+    dependencies = [
+        ('reports', '0002_report_jobs'),
+        ('trips', '0024_tripliveposition_accuracy_battery'),
+        ('fuel', '0009_add_missing_indexes'),
+        ('maintenance', '0002_alter_maintenance_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_rollups, migrations.RunPython.noop),
+    ]
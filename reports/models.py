@@ -1,3 +1,167 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.db import models
 
-# Create your models here.
+
+class DailyVehicleRollup(models.Model):
+    """
+    One vehicle's trips, fuel and maintenance for one local day, kept up
+    to date by ``reports.signals`` (see ``reports.rollups``). Trips count
+    on the day they started. Department figures are summed from these
+    rows through the vehicle's current department.
+    """
+    date = models.DateField()
+    vehicle = models.ForeignKey('vehicles.Vehicle', on_delete=models.CASCADE, related_name='daily_rollups')
+
+    # Trips (not deleted) started on this day
+    trip_count = models.PositiveIntegerField(default=0)
+    completed_trip_count = models.PositiveIntegerField(default=0)
+    ongoing_trip_count = models.PositiveIntegerField(default=0)
+    cancelled_trip_count = models.PositiveIntegerField(default=0)
+    distance_km = models.PositiveIntegerField(default=0, help_text="Odometer km of completed trips")
+    distance_trip_count = models.PositiveIntegerField(default=0, help_text="Completed trips with an end odometer")
+    approved_trip_count = models.PositiveIntegerField(default=0, help_text="Completed trips not awaiting/refused approval")
+    approved_distance_km = models.PositiveIntegerField(default=0)
+    duration_seconds = models.PositiveBigIntegerField(default=0, help_text="Duration of completed trips")
+    first_trip_start = models.DateTimeField(null=True, blank=True)
+    last_trip_end = models.DateTimeField(null=True, blank=True)
+
+    # Fuel / charging transactions dated this day
+    fuel_count = models.PositiveIntegerField(default=0)
+    fuel_litres = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    energy_kwh = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fuel_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    # Maintenance reported this day
+    maintenance_count = models.PositiveIntegerField(default=0)
+    maintenance_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date', 'vehicle']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'vehicle'], name='unique_daily_vehicle_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['vehicle', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle_id} on {self.date}"
+
+
+class DailyDriverRollup(models.Model):
+    """
+    One driver's trips and fuel for one local day, kept up to date by
+    ``reports.signals``. Fuel and electric charging are kept apart as the
+    driver report shows them separately.
+    """
+    date = models.DateField()
+    driver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_rollups')
+
+    trip_count = models.PositiveIntegerField(default=0)
+    completed_trip_count = models.PositiveIntegerField(default=0)
+    ongoing_trip_count = models.PositiveIntegerField(default=0)
+    cancelled_trip_count = models.PositiveIntegerField(default=0)
+    distance_km = models.PositiveIntegerField(default=0, help_text="Odometer km of completed trips")
+    distance_trip_count = models.PositiveIntegerField(default=0, help_text="Completed trips that covered distance")
+    duration_seconds = models.PositiveBigIntegerField(default=0, help_text="Duration of completed trips")
+
+    fuel_count = models.PositiveIntegerField(default=0)
+    fuel_litres = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fuel_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    energy_count = models.PositiveIntegerField(default=0)
+    energy_kwh = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    energy_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date', 'driver']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'driver'], name='unique_daily_driver_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['driver', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.driver_id} on {self.date}"
+
+
+class ReportJobStorage(FileSystemStorage):
+    """
+    Local storage for rendered report files under ``REPORT_JOBS_ROOT``.
+
+    Kept outside MEDIA_ROOT so files are only reachable through the
+    permission-checked download view. The root is read on every access so
+    tests can point it at a temporary directory.
+    """
+
+    @property
+    def base_location(self):
+        return settings.REPORT_JOBS_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+class ReportJob(models.Model):
+    """
+    An export rendered in the background (see ``reports.jobs``).
+
+    Jobs with the same report type, format, normalized filters and user
+    scope share ``params_hash``; a request matching a queued, running or
+    just-finished job gets that job instead of a new render. The file is
+    deleted by ``cleanup_report_jobs`` once ``expires_at`` has passed.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='report_jobs',
+    )
+    report_type = models.CharField(max_length=50)
+    export_format = models.CharField(max_length=10)
+    params = models.JSONField(default=dict, blank=True, help_text="Normalized query parameters")
+    scope = models.CharField(max_length=50, help_text="'all', or 'user:<id>' for exports limited to one user")
+    params_hash = models.CharField(max_length=64, db_index=True)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percent complete")
+    message = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+
+    file = models.FileField(upload_to='%Y/%m/%d', storage=ReportJobStorage(), max_length=255, blank=True)
+    filename = models.CharField(max_length=255, blank=True, help_text="Download file name")
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveBigIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['params_hash', 'status']),
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.report_type} ({self.export_format}) #{self.pk} - {self.status}"
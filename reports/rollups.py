@@ -0,0 +1,310 @@
+"""
+Per-day rollups of trips, fuel and maintenance for the reports and the
+dashboard.
+
+``DailyVehicleRollup`` and ``DailyDriverRollup`` hold one row per local
+day and vehicle / driver. Reports sum the rows of their date range, so a
+month costs the same few queries as a day, instead of re-aggregating (or
+looping over) every raw Trip and FuelTransaction.
+
+Rows are computed here with grouped queries over a date range
+(``compute_*``). ``reports.signals`` calls ``refresh`` for the days a
+saved or deleted Trip, FuelTransaction or Maintenance touches (old and
+new values), and the ``rebuild_daily_rollups`` command recomputes whole
+ranges, e.g. after bulk updates that bypass signals. Migration
+``reports.0003_backfill_daily_rollups`` fills in the history recorded
+before the tables existed.
+
+The rows follow the reports' existing rules: trips count on the local
+day they started and deleted trips are ignored; vehicle distance counts
+completed trips with an end odometer, driver distance only those that
+moved; electric charging is kept apart for drivers.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, IntegerField, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from dashboard.cache import bump_version
+from fuel.models import FuelTransaction
+from maintenance.models import Maintenance
+from trips.models import Trip
+
+from .models import DailyDriverRollup, DailyVehicleRollup
+
+APPROVED_STATUSES = ('not_required', 'approved')
+
+VEHICLE_TRIP_FIELDS = [
+    'trip_count', 'completed_trip_count', 'ongoing_trip_count', 'cancelled_trip_count',
+    'distance_km', 'distance_trip_count', 'approved_trip_count', 'approved_distance_km',
+    'duration_seconds', 'first_trip_start', 'last_trip_end',
+]
+VEHICLE_FUEL_FIELDS = ['fuel_count', 'fuel_litres', 'energy_kwh', 'fuel_spend']
+VEHICLE_MAINTENANCE_FIELDS = ['maintenance_count', 'maintenance_cost']
+VEHICLE_FIELDS = VEHICLE_TRIP_FIELDS + VEHICLE_FUEL_FIELDS + VEHICLE_MAINTENANCE_FIELDS
+
+DRIVER_TRIP_FIELDS = [
+    'trip_count', 'completed_trip_count', 'ongoing_trip_count', 'cancelled_trip_count',
+    'distance_km', 'distance_trip_count', 'duration_seconds',
+]
+DRIVER_FUEL_FIELDS = ['fuel_count', 'fuel_litres', 'fuel_spend', 'energy_count', 'energy_kwh', 'energy_spend']
+DRIVER_FIELDS = DRIVER_TRIP_FIELDS + DRIVER_FUEL_FIELDS
+
+TRIP_DISTANCE = F('end_odometer') - F('start_odometer')
+
+
+def local_day(value):
+    """Local calendar day of an aware datetime."""
+    return timezone.localdate(value)
+
+
+def day_bounds(start_day, end_day):
+    """Aware ``[start, end)`` datetimes covering the local days start_day..end_day."""
+    start = timezone.make_aware(datetime.combine(start_day, time.min))
+    end = timezone.make_aware(datetime.combine(end_day + timedelta(days=1), time.min))
+    return start, end
+
+
+def _trips(start_day, end_day):
+    start, end = day_bounds(start_day, end_day)
+    return (
+        Trip.objects.filter(is_deleted=False, start_time__gte=start, start_time__lt=end)
+        .annotate(day=TruncDate('start_time'))
+    )
+
+
+def _trip_counts():
+    return {
+        'trip_count': Count('id'),
+        'completed_trip_count': Count('id', filter=Q(status='completed')),
+        'ongoing_trip_count': Count('id', filter=Q(status='ongoing')),
+        'cancelled_trip_count': Count('id', filter=Q(status='cancelled')),
+        'duration': Sum(
+            F('end_time') - F('start_time'),
+            filter=Q(status='completed', end_time__gt=F('start_time')),
+        ),
+    }
+
+
+def _seconds(duration):
+    return int(duration.total_seconds()) if duration else 0
+
+
+def compute_vehicle_rollups(start_day, end_day, vehicle_ids=None):
+    """
+    Rollup field values per ``(day, vehicle_id)`` with any activity in the
+    range. Three grouped queries.
+    """
+    with_distance = Q(status='completed', end_odometer__isnull=False, end_odometer__gte=F('start_odometer'))
+    approved = Q(status='completed', approval_status__in=APPROVED_STATUSES)
+    trips = _trips(start_day, end_day)
+    fuel = FuelTransaction.objects.filter(date__gte=start_day, date__lte=end_day)
+    maintenance = Maintenance.objects.filter(date_reported__gte=start_day, date_reported__lte=end_day)
+    if vehicle_ids is not None:
+        trips = trips.filter(vehicle_id__in=vehicle_ids)
+        fuel = fuel.filter(vehicle_id__in=vehicle_ids)
+        maintenance = maintenance.filter(vehicle_id__in=vehicle_ids)
+
+    rows = {}
+
+    def row(day, vehicle_id):
+        return rows.setdefault((day, vehicle_id), {})
+
+    for item in trips.order_by().values('day', 'vehicle_id').annotate(
+        distance=Coalesce(Sum(TRIP_DISTANCE, filter=with_distance, output_field=IntegerField()), 0),
+        distance_trips=Count('id', filter=with_distance),
+        approved_trips=Count('id', filter=approved),
+        approved_distance=Coalesce(Sum(
+            TRIP_DISTANCE, filter=approved & Q(end_odometer__gt=F('start_odometer')), output_field=IntegerField()
+        ), 0),
+        first_start=Min('start_time', filter=Q(status='completed')),
+        last_end=Max('end_time', filter=Q(status='completed')),
+        **_trip_counts()
+    ):
+        row(item['day'], item['vehicle_id']).update({
+            'trip_count': item['trip_count'],
+            'completed_trip_count': item['completed_trip_count'],
+            'ongoing_trip_count': item['ongoing_trip_count'],
+            'cancelled_trip_count': item['cancelled_trip_count'],
+            'distance_km': item['distance'],
+            'distance_trip_count': item['distance_trips'],
+            'approved_trip_count': item['approved_trips'],
+            'approved_distance_km': item['approved_distance'],
+            'duration_seconds': _seconds(item['duration']),
+            'first_trip_start': item['first_start'],
+            'last_trip_end': item['last_end'],
+        })
+
+    for item in fuel.order_by().values('date', 'vehicle_id').annotate(
+        fuel_count=Count('id'),
+        fuel_litres=Sum('quantity'),
+        energy_kwh=Sum('energy_consumed'),
+        fuel_spend=Sum('total_cost'),
+    ):
+        row(item['date'], item['vehicle_id']).update({
+            field: item[field] or 0 for field in VEHICLE_FUEL_FIELDS
+        })
+
+    for item in maintenance.order_by().values('date_reported', 'vehicle_id').annotate(
+        maintenance_count=Count('id'),
+        maintenance_cost=Sum('cost'),
+    ):
+        row(item['date_reported'], item['vehicle_id']).update({
+            field: item[field] or 0 for field in VEHICLE_MAINTENANCE_FIELDS
+        })
+
+    return rows
+
+
+def compute_driver_rollups(start_day, end_day, driver_ids=None):
+    """Rollup field values per ``(day, driver_id)`` with any activity in the range. Two grouped queries."""
+    moved = Q(status='completed', end_odometer__isnull=False, end_odometer__gt=F('start_odometer'))
+    electric = Q(fuel_type='Electric')
+    trips = _trips(start_day, end_day)
+    fuel = FuelTransaction.objects.filter(date__gte=start_day, date__lte=end_day)
+    if driver_ids is not None:
+        trips = trips.filter(driver_id__in=driver_ids)
+        fuel = fuel.filter(driver_id__in=driver_ids)
+
+    rows = {}
+    for item in trips.order_by().values('day', 'driver_id').annotate(
+        distance=Coalesce(Sum(TRIP_DISTANCE, filter=moved, output_field=IntegerField()), 0),
+        distance_trips=Count('id', filter=moved),
+        **_trip_counts()
+    ):
+        rows.setdefault((item['day'], item['driver_id']), {}).update({
+            'trip_count': item['trip_count'],
+            'completed_trip_count': item['completed_trip_count'],
+            'ongoing_trip_count': item['ongoing_trip_count'],
+            'cancelled_trip_count': item['cancelled_trip_count'],
+            'distance_km': item['distance'],
+            'distance_trip_count': item['distance_trips'],
+            'duration_seconds': _seconds(item['duration']),
+        })
+
+    for item in fuel.order_by().values('date', 'driver_id').annotate(
+        fuel_count=Count('id', filter=~electric),
+        fuel_litres=Sum('quantity', filter=~electric),
+        fuel_spend=Sum('total_cost', filter=~electric),
+        energy_count=Count('id', filter=electric),
+        energy_kwh=Sum('energy_consumed', filter=electric),
+        energy_spend=Sum('total_cost', filter=electric),
+    ):
+        rows.setdefault((item['date'], item['driver_id']), {}).update({
+            field: item[field] or 0 for field in DRIVER_FUEL_FIELDS
+        })
+
+    return rows
+
+
+def _upsert(model, key_field, rows, fields):
+    unique_fields = ['date', key_field] if connection.features.supports_update_conflicts_with_target else None
+    model.objects.bulk_create(
+        [model(date=day, **{f'{key_field}_id': key}, **values) for (day, key), values in rows.items()],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=fields + ['updated_at'],
+    )
+
+
+def _refresh(model, key_field, compute, fields, keys):
+    by_day = {}
+    for day, key in keys:
+        if day is not None and key is not None:
+            by_day.setdefault(day, set()).add(key)
+    for day, ids in by_day.items():
+        rows = compute(day, day, list(ids))
+        if rows:
+            # Fields a source no longer contributes to go back to their defaults
+            _upsert(model, key_field, {
+                key: {field: values.get(field, model._meta.get_field(field).get_default()) for field in fields}
+                for key, values in rows.items()
+            }, fields)
+        idle = ids - {key for _, key in rows}
+        if idle:
+            model.objects.filter(date=day, **{f'{key_field}_id__in': idle}).delete()
+
+
+def _rollups_changed():
+    # Dashboard sections reading the rollups are recomputed once the rows are committed
+    transaction.on_commit(lambda: bump_version(DailyVehicleRollup._meta.label))
+
+
+def refresh(vehicle_keys=(), driver_keys=()):
+    """Recompute the rollup rows of the given ``(day, id)`` keys (a few queries per day)."""
+    with transaction.atomic():
+        _refresh(DailyVehicleRollup, 'vehicle', compute_vehicle_rollups, VEHICLE_FIELDS, vehicle_keys)
+        _refresh(DailyDriverRollup, 'driver', compute_driver_rollups, DRIVER_FIELDS, driver_keys)
+        _rollups_changed()
+
+
+def rebuild(start_day, end_day):
+    """Replace every rollup row in the range. Returns ``(vehicle_rows, driver_rows)``."""
+    counts = []
+    with transaction.atomic():
+        for model, key_field, compute, fields in (
+            (DailyVehicleRollup, 'vehicle', compute_vehicle_rollups, VEHICLE_FIELDS),
+            (DailyDriverRollup, 'driver', compute_driver_rollups, DRIVER_FIELDS),
+        ):
+            model.objects.filter(date__gte=start_day, date__lte=end_day).delete()
+            rows = compute(start_day, end_day)
+            model.objects.bulk_create(
+                [model(date=day, **{f'{key_field}_id': key}, **values) for (day, key), values in rows.items()],
+                batch_size=1000,
+            )
+            counts.append(len(rows))
+        _rollups_changed()
+    return tuple(counts)
+
+
+def rebuild_by_month(since, until):
+    """``rebuild`` since..until one month per transaction; yields ``(start, end, vehicle_rows, driver_rows)``."""
+    start = since
+    while start <= until:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        end = min(until, next_month - timedelta(days=1))
+        yield (start, end) + rebuild(start, end)
+        start = end + timedelta(days=1)
+
+
+def first_day():
+    """Earliest local day with a trip, fuel transaction or maintenance record (None if none)."""
+    first_trip = Trip.objects.aggregate(first=Min('start_time'))['first']
+    days = [
+        local_day(first_trip) if first_trip else None,
+        FuelTransaction.objects.aggregate(first=Min('date'))['first'],
+        Maintenance.objects.aggregate(first=Min('date_reported'))['first'],
+    ]
+    days = [day for day in days if day is not None]
+    return min(days) if days else None
+
+
+def _totals(queryset, key, fields):
+    totals = {}
+    for item in queryset.order_by().values(key).annotate(**{field: Sum(field) for field in fields}):
+        totals[item[key]] = {field: item[field] or 0 for field in fields}
+    return totals
+
+
+def vehicle_totals(start_day, end_day, queryset=None):
+    """Summed vehicle rollup fields for the range, by vehicle id. One query."""
+    if queryset is None:
+        queryset = DailyVehicleRollup.objects.all()
+    fields = [f for f in VEHICLE_FIELDS if f not in ('first_trip_start', 'last_trip_end')]
+    return _totals(queryset.filter(date__gte=start_day, date__lte=end_day), 'vehicle_id', fields)
+
+
+def driver_totals(start_day, end_day, queryset=None):
+    """Summed driver rollup fields for the range, by driver id. One query."""
+    if queryset is None:
+        queryset = DailyDriverRollup.objects.all()
+    return _totals(queryset.filter(date__gte=start_day, date__lte=end_day), 'driver_id', DRIVER_FIELDS)
+
+
+def as_float(value):
+    """Rollup sums (Decimal / int) as float for the report arithmetic."""
+    return float(value) if isinstance(value, Decimal) else float(value or 0)
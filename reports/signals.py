@@ -0,0 +1,125 @@
+"""
+Keep the daily rollups (``reports.rollups``) current as trips, fuel
+transactions and maintenance records are saved or deleted.
+
+``pre_save`` notes the day / vehicle / driver the row had before the save
+(for trips, from the old row ``Trip.save`` already loads) so that
+moving a record to another day or vehicle also refreshes the row it left. Saves limited by ``update_fields`` to fields the rollups do not
+read are ignored. The affected days are recomputed by
+``reports.tasks.refresh_rollups_task`` once the saving transaction has
+committed, off the request path; if the task cannot be queued they are
+recomputed in place. With the broker up but no Celery worker running, the
+tasks wait in the queue and report and dashboard figures lag the saved
+records until a worker drains it. Failures are logged and never break the save; the
+nightly ``rebuild_daily_rollups`` run repairs anything missed.
+"""
+import logging
+from types import SimpleNamespace
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+TRIP_FIELDS = {
+    'vehicle', 'driver', 'start_time', 'end_time', 'start_odometer', 'end_odometer',
+    'status', 'is_deleted', 'approval_status',
+}
+FUEL_FIELDS = {'vehicle', 'driver', 'date', 'fuel_type', 'quantity', 'energy_consumed', 'total_cost'}
+MAINTENANCE_FIELDS = {'vehicle', 'date_reported', 'cost'}
+
+
+def _trip_keys(trip):
+    from .rollups import local_day
+
+    day = local_day(trip.start_time) if trip.start_time else None
+    return [(day, trip.vehicle_id)], [(day, trip.driver_id)]
+
+
+def _fuel_keys(transaction_):
+    return [(transaction_.date, transaction_.vehicle_id)], [(transaction_.date, transaction_.driver_id)]
+
+
+def _maintenance_keys(record):
+    return [(record.date_reported, record.vehicle_id)], []
+
+
+KEYS = {
+    'trips.Trip': (_trip_keys, TRIP_FIELDS),
+    'fuel.FuelTransaction': (_fuel_keys, FUEL_FIELDS),
+    'maintenance.Maintenance': (_maintenance_keys, MAINTENANCE_FIELDS),
+}
+
+
+def _label(sender):
+    return sender._meta.label
+
+
+def _relevant(sender, update_fields):
+    return update_fields is None or bool(set(update_fields) & KEYS[_label(sender)][1])
+
+
+def refresh_now(vehicle_keys, driver_keys):
+    from .rollups import refresh
+
+    try:
+        with transaction.atomic():
+            refresh(vehicle_keys, driver_keys)
+    except Exception:
+        logger.exception("Daily rollup refresh failed for %s / %s", vehicle_keys, driver_keys)
+
+
+def _serialize(keys):
+    return [[day.isoformat(), key] for day, key in keys if day is not None and key is not None]
+
+
+def _queue_refresh(vehicle_keys, driver_keys):
+    from .tasks import refresh_rollups_task
+
+    try:
+        refresh_rollups_task.delay(_serialize(vehicle_keys), _serialize(driver_keys))
+    except Exception as exc:
+        logger.warning("Could not queue daily rollup refresh, refreshing in place: %s", exc)
+        refresh_now(vehicle_keys, driver_keys)
+
+
+def _refresh(vehicle_keys, driver_keys):
+    vehicle_keys, driver_keys = set(vehicle_keys), set(driver_keys)
+    transaction.on_commit(lambda: _queue_refresh(vehicle_keys, driver_keys))
+
+
+def remember_old_keys(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or not instance.pk or not _relevant(sender, update_fields):
+        return
+    old = sender.objects.filter(pk=instance.pk).first()
+    if old is not None:
+        instance._rollup_old_keys = KEYS[_label(sender)][0](old)
+
+
+def _old_keys(sender, instance):
+    if _label(sender) == 'trips.Trip':
+        from trips.signals import old_trip_values
+
+        old = old_trip_values(instance)
+        return _trip_keys(SimpleNamespace(**old)) if old else ([], [])
+    return instance.__dict__.pop('_rollup_old_keys', ([], []))
+
+
+def refresh_on_save(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or not _relevant(sender, update_fields):
+        return
+    vehicle_keys, driver_keys = KEYS[_label(sender)][0](instance)
+    old_vehicle_keys, old_driver_keys = _old_keys(sender, instance)
+    _refresh(set(vehicle_keys + old_vehicle_keys), set(driver_keys + old_driver_keys))
+
+
+def refresh_on_delete(sender, instance, **kwargs):
+    _refresh(*KEYS[_label(sender)][0](instance))
+
+
+for _sender in KEYS:
+    if _sender != 'trips.Trip':  # Trips reuse the old row loaded by Trip.save
+        receiver(pre_save, sender=_sender, dispatch_uid=f'rollup_old_keys_{_sender}')(remember_old_keys)
+    receiver(post_save, sender=_sender, dispatch_uid=f'rollup_save_{_sender}')(refresh_on_save)
+    receiver(post_delete, sender=_sender, dispatch_uid=f'rollup_delete_{_sender}')(refresh_on_delete)
@@ -3,7 +3,7 @@ Celery tasks for report generation and other background operations.
 
 Usage:
     from reports.tasks import generate_report_task
-    result = generate_report_task.delay(user_id, report_type, filters)
+    generate_report_task.delay(job.id)   # normally queued by reports.jobs.submit_job
 """
 from celery import shared_task
 from django.core.mail import EmailMessage
@@ -31,3 +31,24 @@ def send_email_task(self, subject, body, recipient_list, from_email=None, html_b
     except Exception as exc:
         logger.error("Failed to send email to %s: %s", recipient_list, exc)
         raise self.retry(exc=exc)
+
+
+@shared_task(bind=True, soft_time_limit=30 * 60, time_limit=35 * 60)
+def generate_report_task(self, job_id):
+    """Render a background report job (``reports.jobs``) to its file."""
+    from .jobs import run_job
+
+    run_job(job_id)
+
+
+@shared_task
+def refresh_rollups_task(vehicle_keys, driver_keys):
+    """Recompute daily rollup rows for ``[iso_date, id]`` keys (queued by ``reports.signals``)."""
+    from datetime import date
+
+    from .signals import refresh_now
+
+    refresh_now(
+        [(date.fromisoformat(day), key) for day, key in vehicle_keys],
+        [(date.fromisoformat(day), key) for day, key in driver_keys],
+    )
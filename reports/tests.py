@@ -2,14 +2,29 @@
 Tests for the reports module.
 Run with: python manage.py test reports
 """
-from datetime import date, timedelta
+import re
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-from django.test import TestCase, Client
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
+from fuel.models import FuelTransaction
+from trips.models import Trip
 from vehicles.models import Vehicle, VehicleType
 
+from .jobs import REPORT_TYPES
+from .models import DailyDriverRollup, DailyVehicleRollup, ReportJob
+from .rollups import refresh
+
 User = get_user_model()
 
 
@@ -79,6 +94,18 @@ class ReportViewTests(TestCase):
         })
         self.assertIn(response.status_code, [200, 302])
 
+    def test_fuel_report_export_csv_streams(self):
+        FuelTransaction.objects.create(
+            vehicle=self.vehicle, driver=self.admin, date=date.today(), fuel_type='Diesel',
+            quantity=Decimal('30.00'), cost_per_liter=Decimal('90.00'),
+            total_cost=Decimal('2700.00'), odometer_reading=5000,
+        )
+        response = self.client.get(reverse('fuel_report'), {'export': 'csv'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('TN01RP0001 (Toyota Camry),Car,rptadmin,N/A,Diesel,30.00', lines[1])
+
 
 class ReportAccessControlTests(TestCase):
     """Test that non-admin users get appropriate access."""
@@ -95,3 +122,365 @@ class ReportAccessControlTests(TestCase):
         response = self.client.get(reverse('vehicle_report'))
         # Should redirect or return 403
         self.assertIn(response.status_code, [302, 403])
+
+
+class DailyRollupTests(TestCase):
+    """Daily rollups are kept current by signals and match a rebuild."""
+
+    def setUp(self):
+        self.driver = User.objects.create_user(
+            username='rollupdriver', password='pass1234',
+            user_type='driver', approval_status='approved',
+        )
+        self.vtype = VehicleType.objects.create(name='Van', category='commercial')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=self.vtype, make='Tata', model='Ace', year=2022,
+            license_plate='TN01RU0001', vin='VINRLP00000000001',
+            status='available', ownership_type='company',
+            acquisition_date=date.today(), rate_per_km=Decimal('10.00'),
+        )
+        self.day = date(2026, 3, 10)
+
+    def _at(self, day, hour):
+        return timezone.make_aware(datetime(day.year, day.month, day.day, hour))
+
+    def _committed(self, action, *args, **kwargs):
+        """Run ``action`` and the rollup refresh it queues on commit."""
+        with self.captureOnCommitCallbacks(execute=True):
+            return action(*args, **kwargs)
+
+    def _trip(self, day=None, start=1000, end=1040, **kwargs):
+        day = day or self.day
+        return self._committed(
+            Trip.objects.create,
+            vehicle=self.vehicle, driver=self.driver,
+            start_time=self._at(day, 9), end_time=self._at(day, 11),
+            start_odometer=start, end_odometer=end,
+            origin='Chennai', destination='Vellore', purpose='Delivery',
+            status='completed', entry_type='manual', **kwargs
+        )
+
+    def _fuel(self, **kwargs):
+        values = dict(
+            vehicle=self.vehicle, driver=self.driver, date=self.day, fuel_type='Diesel',
+            quantity=Decimal('20.00'), cost_per_liter=Decimal('90.00'),
+            total_cost=Decimal('1800.00'), odometer_reading=1040,
+        )
+        values.update(kwargs)
+        return self._committed(FuelTransaction.objects.create, **values)
+
+    def _snapshot(self):
+        vehicles = list(DailyVehicleRollup.objects.order_by('date', 'vehicle').values(
+            'date', 'vehicle', 'trip_count', 'distance_km', 'duration_seconds', 'fuel_litres', 'fuel_spend',
+        ))
+        drivers = list(DailyDriverRollup.objects.order_by('date', 'driver').values(
+            'date', 'driver', 'trip_count', 'distance_km', 'fuel_litres', 'energy_kwh',
+        ))
+        return vehicles, drivers
+
+    def test_trip_and_fuel_saves_update_rollups(self):
+        self._trip()
+        self._trip(start=1040, end=1100)
+        self._fuel()
+        self._fuel(fuel_type='Electric', quantity=None, energy_consumed=Decimal('12.50'),
+                   total_cost=Decimal('150.00'))
+
+        row = DailyVehicleRollup.objects.get(date=self.day, vehicle=self.vehicle)
+        self.assertEqual(row.trip_count, 2)
+        self.assertEqual(row.distance_km, 100)
+        self.assertEqual(row.distance_trip_count, 2)
+        self.assertEqual(row.duration_seconds, 4 * 3600)
+        self.assertEqual(row.fuel_count, 2)
+        self.assertEqual(row.fuel_litres, Decimal('20.00'))
+        self.assertEqual(row.energy_kwh, Decimal('12.50'))
+        self.assertEqual(row.fuel_spend, Decimal('1950.00'))
+
+        driver_row = DailyDriverRollup.objects.get(date=self.day, driver=self.driver)
+        self.assertEqual(driver_row.distance_km, 100)
+        self.assertEqual(driver_row.fuel_count, 1)
+        self.assertEqual(driver_row.energy_count, 1)
+        self.assertEqual(driver_row.energy_spend, Decimal('150.00'))
+
+    def test_moving_and_deleting_records_refreshes_old_days(self):
+        trip = self._trip()
+        fuel = self._fuel()
+        next_day = self.day + timedelta(days=1)
+
+        trip.start_time = self._at(next_day, 9)
+        trip.end_time = self._at(next_day, 10)
+        self._committed(trip.save)
+        old = DailyVehicleRollup.objects.get(date=self.day, vehicle=self.vehicle)
+        self.assertEqual(old.trip_count, 0)
+        self.assertEqual(old.distance_km, 0)
+        self.assertEqual(old.fuel_count, 1)
+        new = DailyVehicleRollup.objects.get(date=next_day, vehicle=self.vehicle)
+        self.assertEqual((new.trip_count, new.distance_km), (1, 40))
+
+        self._committed(fuel.delete)
+        self.assertFalse(DailyVehicleRollup.objects.filter(date=self.day).exists())
+        self.assertFalse(DailyDriverRollup.objects.filter(date=self.day).exists())
+
+        trip.is_deleted = True
+        self._committed(trip.save, update_fields=['is_deleted'])
+        self.assertFalse(DailyVehicleRollup.objects.exists())
+
+    def test_unrelated_update_fields_skip_refresh(self):
+        trip = self._trip()
+        DailyVehicleRollup.objects.all().delete()
+        trip.notes = 'checked'
+        self._committed(trip.save, update_fields=['notes'])
+        self.assertFalse(DailyVehicleRollup.objects.exists())
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self._trip()
+        self._trip(day=self.day + timedelta(days=2), start=1040, end=1075)
+        self._fuel()
+        incremental = self._snapshot()
+
+        # Bulk updates bypass signals; the rebuild restores the rows
+        DailyVehicleRollup.objects.all().delete()
+        DailyDriverRollup.objects.update(distance_km=0)
+        call_command('rebuild_daily_rollups', '--since', '2026-03-01', '--until', '2026-03-31', stdout=StringIO())
+        self.assertEqual(self._snapshot(), incremental)
+
+        refresh([(self.day, self.vehicle.id)], [(self.day, self.driver.id)])
+        self.assertEqual(self._snapshot(), incremental)
+
+    def test_refresh_waits_for_commit_and_all_backfills_history(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            Trip.objects.create(
+                vehicle=self.vehicle, driver=self.driver,
+                start_time=self._at(self.day, 9), end_time=self._at(self.day, 11),
+                start_odometer=1000, end_odometer=1040,
+                origin='Chennai', destination='Vellore', purpose='Delivery',
+                status='completed', entry_type='manual',
+            )
+        self.assertFalse(DailyVehicleRollup.objects.exists())
+
+        # Records written before the rollup tables existed
+        call_command('rebuild_daily_rollups', '--all', stdout=StringIO())
+        row = DailyVehicleRollup.objects.get(date=self.day, vehicle=self.vehicle)
+        self.assertEqual((row.trip_count, row.distance_km), (1, 40))
+        self.assertEqual(DailyDriverRollup.objects.get(date=self.day, driver=self.driver).distance_km, 40)
+
+    def test_migration_backfills_existing_history(self):
+        from importlib import import_module
+        from django.apps import apps
+
+        self._trip()
+        self._trip(day=self.day - timedelta(days=40), start=900, end=950)
+        # Records written before the rollup tables existed
+        DailyVehicleRollup.objects.all().delete()
+        DailyDriverRollup.objects.all().delete()
+
+        import_module('reports.migrations.0003_backfill_daily_rollups').backfill_daily_rollups(apps, None)
+        self.assertEqual(
+            sorted(DailyVehicleRollup.objects.values_list('date', 'distance_km')),
+            [(self.day - timedelta(days=40), 50), (self.day, 40)],
+        )
+
+    def test_reports_read_rollups(self):
+        from accounts.models import Department
+
+        department = Department.objects.create(name='Logistics', code='LOG')
+        self.vehicle.department = department
+        self.vehicle.save()
+        self._trip()
+        self._fuel()
+        admin = User.objects.create_user(
+            username='rollupadmin', password='pass1234',
+            user_type='admin', approval_status='approved',
+        )
+        self.client.force_login(admin)
+        dates = {'start_date': self.day.isoformat(), 'end_date': self.day.isoformat()}
+
+        response = self.client.get(reverse('vehicle_report'), dates)
+        row = next(v for v in response.context['vehicle_report'] if v['id'] == self.vehicle.id)
+        self.assertEqual(row['total_distance'], 40)
+        self.assertEqual(row['avg_distance'], 40)
+        self.assertEqual(row['fuel_efficiency'], 2)
+        self.assertEqual(row['total_fuel_cost'], 1800)
+
+        response = self.client.get(reverse('driver_report'), dates)
+        row = next(d for d in response.context['driver_report_all'] if d['id'] == self.driver.id)
+        self.assertEqual(row['total_distance'], 40)
+        self.assertEqual(row['total_hours'], 2)
+        self.assertEqual(row['avg_speed'], 20)
+
+        response = self.client.get(reverse('daily_usage_cost'), dates)
+        [usage] = response.context['daily_usage']
+        self.assertEqual((usage['total_distance'], usage['total_cost'], usage['trip_count']), (40, 400, 1))
+
+        response = self.client.get(reverse('department_report'), dates)
+        [row] = response.context['department_report']
+        self.assertEqual((row['company_trip_count'], row['company_distance']), (1, 40))
+        self.assertEqual(row['company_fuel_cost'], 1800)
+
+
+class ReportJobTests(TestCase):
+    """Exports rendered as background jobs: progress, download, dedupe, scope and expiry."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        settings_override = override_settings(REPORT_JOBS_ROOT=self.root, REPORT_JOB_TTL_HOURS=24)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.admin = User.objects.create_user(
+            username='jobadmin', password='pass1234',
+            user_type='admin', approval_status='approved',
+        )
+        self.driver = User.objects.create_user(
+            username='jobdriver', password='pass1234',
+            user_type='driver', approval_status='approved',
+        )
+        self.other_driver = User.objects.create_user(
+            username='jobdriver2', password='pass1234',
+            user_type='driver', approval_status='approved',
+        )
+        vtype = VehicleType.objects.create(name='Car', category='personal')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=vtype, make='Toyota', model='Camry', year=2023,
+            license_plate='TN01JB0001', vin='VINJOB00000000001',
+            status='available', ownership_type='company',
+            acquisition_date=date.today(),
+        )
+        FuelTransaction.objects.create(
+            vehicle=self.vehicle, driver=self.driver, date=date.today(), fuel_type='Diesel',
+            quantity=Decimal('30.00'), cost_per_liter=Decimal('90.00'),
+            total_cost=Decimal('2700.00'), odometer_reading=5000,
+        )
+
+    def _submit(self, user, data):
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('report_jobs'), data)
+
+    def _status(self, job_id):
+        return self.client.get(reverse('report_job_status', args=[job_id])).json()['job']
+
+    def _download(self, job_id):
+        response = self.client.get(reverse('report_job_download', args=[job_id]))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_job_renders_and_downloads(self):
+        today = date.today().isoformat()
+        response = self._submit(self.admin, {
+            'report_type': 'fuel_report', 'format': 'csv', 'start_date': today, 'end_date': today,
+        })
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response.json()['created'])
+        job = self._status(response.json()['job']['id'])
+        self.assertEqual((job['status'], job['progress']), ('completed', 100))
+        self.assertTrue(job['filename'].endswith('.csv'))
+        self.assertEqual(job['download_url'], reverse('report_job_download', args=[job['id']]))
+        lines = self._download(job['id']).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('TN01JB0001', lines[1])
+
+        listed = self.client.get(reverse('report_jobs')).json()['jobs']
+        self.assertEqual([item['id'] for item in listed], [job['id']])
+
+    def test_identical_requests_share_one_job(self):
+        today = date.today().isoformat()
+        with mock.patch('reports.tasks.generate_report_task.delay') as delay:
+            first = self._submit(self.admin, {
+                'report_type': 'vehicle_report', 'format': 'excel',
+                'start_date': today, 'end_date': today, 'vehicle': '', 'page': '2',
+            }).json()
+            # Same filters in another order, from another manager
+            manager = User.objects.create_user(
+                username='jobmanager', password='pass1234',
+                user_type='manager', approval_status='approved',
+            )
+            second = self._submit(manager, {
+                'end_date': today, 'start_date': today, 'format': 'excel', 'report_type': 'vehicle_report',
+            }).json()
+            other = self._submit(manager, {
+                'report_type': 'vehicle_report', 'format': 'csv', 'start_date': today, 'end_date': today,
+            }).json()
+
+        self.assertTrue(first['created'])
+        self.assertFalse(second['created'])
+        self.assertEqual(second['job']['id'], first['job']['id'])
+        self.assertNotEqual(other['job']['id'], first['job']['id'])
+        self.assertEqual(delay.call_count, 2)
+        self.assertEqual(ReportJob.objects.count(), 2)
+
+    def test_driver_exports_are_scoped_to_the_driver(self):
+        for driver, start in ((self.driver, 1000), (self.other_driver, 2000)):
+            Trip.objects.create(
+                vehicle=self.vehicle, driver=driver,
+                start_time=timezone.now() - timedelta(hours=3), end_time=timezone.now() - timedelta(hours=1),
+                start_odometer=start, end_odometer=start + 25,
+                origin='Chennai', destination=f'Stop {driver.username}', purpose='Delivery',
+                status='completed', entry_type='manual',
+            )
+
+        job = self._submit(self.driver, {'report_type': 'trips', 'format': 'csv'}).json()['job']
+        self.assertEqual(ReportJob.objects.get(pk=job['id']).scope, f'user:{self.driver.pk}')
+        content = self._download(job['id'])
+        self.assertIn('Stop jobdriver', content)
+        self.assertNotIn('Stop jobdriver2', content)
+
+        # The other driver gets a separate job and cannot read the first
+        other = self._submit(self.other_driver, {'report_type': 'trips', 'format': 'csv'}).json()['job']
+        self.assertNotEqual(other['id'], job['id'])
+        response = self.client.get(reverse('report_job_download', args=[job['id']]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_trips_pdf_job(self):
+        job_id = self._submit(self.admin, {'report_type': 'trips', 'format': 'pdf'}).json()['job']['id']
+        job = self._status(job_id)
+        self.assertEqual(job['status'], 'completed', job['error'])
+        response = self.client.get(reverse('report_job_download', args=[job['id']]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_driver_cannot_submit_management_report(self):
+        response = self._submit(self.driver, {'report_type': 'vehicle_report', 'format': 'csv'})
+        self.assertEqual(response.status_code, 403)
+        response = self._submit(self.admin, {'report_type': 'vehicle_report', 'format': 'pdf'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReportJob.objects.exists())
+
+    def test_export_buttons_submit_jobs(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('fuel_report'))
+        self.assertContains(response, 'js/report-jobs.js')
+        self.assertContains(response, f'data-jobs-url="{reverse("report_jobs")}"')
+        self.assertContains(response, 'data-report-job="fuel_report"', count=2)
+
+        # Every page wired to a job names a report type the endpoint accepts
+        templates_dir = settings.BASE_DIR / 'templates'
+        wired = set()
+        for path in templates_dir.rglob('*.html'):
+            content = path.read_text()
+            wired.update(re.findall(r'data-report-job="([a-z_]+)"', content))
+            wired.update(re.findall(r"ReportJobs\.start\('([a-z_]+)'", content))
+        self.assertTrue({'sor', 'trips', 'manual_trips', 'vehicle_report'} <= wired)
+        self.assertTrue(wired <= set(REPORT_TYPES))
+
+    def test_cleanup_deletes_expired_jobs_and_files(self):
+        job_id = self._submit(self.admin, {'report_type': 'fuel_report', 'format': 'csv'}).json()['job']['id']
+        job = ReportJob.objects.get(pk=job_id)
+        storage = job.file.storage
+        self.assertTrue(storage.exists(job.file.name))
+        lost = ReportJob.objects.create(
+            requested_by=self.admin, report_type='trips', export_format='csv',
+            scope='all', params_hash='0' * 64,
+        )
+        ReportJob.objects.filter(pk=lost.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        call_command('cleanup_report_jobs', stdout=StringIO())
+        self.assertTrue(storage.exists(job.file.name))
+        self.assertEqual(ReportJob.objects.get(pk=lost.pk).status, 'failed')
+
+        ReportJob.objects.filter(pk=job.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        response = self.client.get(reverse('report_job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 410)
+        call_command('cleanup_report_jobs', stdout=StringIO())
+        self.assertFalse(ReportJob.objects.filter(pk=job.pk).exists())
+        self.assertFalse(storage.exists(job.file.name))
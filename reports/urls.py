@@ -7,6 +7,7 @@ from .views import (
 from .firm_report_view import FirmReportView
 # Consultant report view resides in a separate module to keep code modular
 from .consultant_views import ConsultantReportView
+from . import job_views
 
 urlpatterns = [
     path('vehicles/', VehicleReportView.as_view(), name='vehicle_report'),
@@ -18,4 +19,8 @@ urlpatterns = [
     path('firm/', FirmReportView.as_view(), name='firm_report'),
     path('staff/', StaffReportView.as_view(), name='staff_report'),
     path('department/', DepartmentReportView.as_view(), name='department_report'),
+    # Background report jobs
+    path('jobs/', job_views.report_jobs, name='report_jobs'),
+    path('jobs/<int:job_id>/', job_views.report_job_status, name='report_job_status'),
+    path('jobs/<int:job_id>/download/', job_views.report_job_download, name='report_job_download'),
 ]
@@ -3,7 +3,7 @@ from django.views import View
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db.models import Sum, Count, Avg, F, ExpressionWrapper, FloatField, Q
-from django.db.models.functions import TruncMonth, TruncYear, Coalesce
+from django.db.models.functions import TruncMonth, TruncYear
 from django.utils import timezone
 from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from accounts.permissions import AdminRequiredMixin, ManagerRequiredMixin, VehicleManagerRequiredMixin
@@ -13,10 +13,12 @@ from maintenance.models import Maintenance
 from fuel.models import FuelTransaction
 from accidents.models import Accident
 from accounts.models import CustomUser
+from core.exports import iter_values, streaming_csv_response
 from core.utils import parse_date
+from .models import DailyVehicleRollup
+from .rollups import as_float, driver_totals, vehicle_totals
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-import csv
-from datetime import datetime, timedelta
+from datetime import datetime
 import io
 
 # Conditional import of xlsxwriter
@@ -59,18 +61,10 @@ class ReportBaseView(LoginRequiredMixin, VehicleManagerRequiredMixin, TemplateVi
         return start_date, end_date
     
     def export_as_csv(self, data, filename, headers):
-        """Export data as CSV file."""
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
-        response['X-Accel-Buffering'] = 'no'
-        
-        writer = csv.writer(response)
-        writer.writerow(headers)
-        
-        for row in data:
-            writer.writerow([row.get(header.lower().replace(' ', '_'), '') for header in headers])
-            
-        return response
+        """Export data (a list or generator of row dicts) as a streamed CSV file."""
+        field_keys = [header.lower().replace(' ', '_') for header in headers]
+        rows = ([row.get(key, '') for key in field_keys] for row in data)
+        return streaming_csv_response(filename, headers, rows)
     
     def export_as_excel(self, data, filename, headers):
         """Export data as Excel file (optimised for large datasets)."""
@@ -140,97 +134,12 @@ class VehicleReportView(ReportBaseView):
         # Filter by vehicle type
         vehicle_type = self.request.GET.get('vehicle_type')
         
-        vehicles = Vehicle.objects.all()
+        vehicles = Vehicle.objects.select_related('vehicle_type')
         if vehicle_type:
             vehicles = vehicles.filter(vehicle_type_id=vehicle_type)
         
-        # Get ALL trips with timezone-aware filtering
-        all_trips = Trip.objects.filter(
-            start_time__gte=start_datetime,
-            start_time__lte=end_datetime,
-            start_odometer__isnull=False,
-            is_deleted=False
-        ).select_related('vehicle')
-        
-        # Calculate trip data for each vehicle
-        vehicle_trip_data = {}
-        for trip in all_trips:
-            vehicle_id = trip.vehicle.id
-            
-            if vehicle_id not in vehicle_trip_data:
-                vehicle_trip_data[vehicle_id] = {
-                    'trip_count': 0,
-                    'completed_trip_count': 0,
-                    'ongoing_trip_count': 0,
-                    'total_distance': 0,
-                    'distances': []
-                }
-            
-            # Count all trips
-            vehicle_trip_data[vehicle_id]['trip_count'] += 1
-            
-            # Count by status
-            if trip.status == 'completed':
-                vehicle_trip_data[vehicle_id]['completed_trip_count'] += 1
-            elif trip.status == 'ongoing':
-                vehicle_trip_data[vehicle_id]['ongoing_trip_count'] += 1
-            
-            # Calculate distance - Fixed logic for distance calculation
-            if trip.start_odometer is not None:
-                try:
-                    start_odo = float(trip.start_odometer)
-                    
-                    # For completed trips with end odometer
-                    if trip.end_odometer is not None and trip.status == 'completed':
-                        end_odo = float(trip.end_odometer)
-                        distance = end_odo - start_odo
-                        
-                        if distance >= 0:  # Allow zero distance trips
-                            vehicle_trip_data[vehicle_id]['total_distance'] += distance
-                            vehicle_trip_data[vehicle_id]['distances'].append(distance)
-                    
-                except (ValueError, TypeError) as e:
-                    pass
-        
-        # Get fuel data with timezone-aware filtering
-        fuel_transactions = FuelTransaction.objects.filter(
-            date__gte=start_date_obj,
-            date__lte=end_date_obj
-        ).select_related('vehicle')
-        
-        fuel_data_dict = {}
-        for transaction in fuel_transactions:
-            vehicle_id = transaction.vehicle.id
-            if vehicle_id not in fuel_data_dict:
-                fuel_data_dict[vehicle_id] = {
-                    'fuel_count': 0,
-                    'total_fuel': 0,
-                    'total_energy': 0,
-                    'total_fuel_cost': 0
-                }
-            
-            fuel_data_dict[vehicle_id]['fuel_count'] += 1
-            fuel_data_dict[vehicle_id]['total_fuel'] += float(transaction.quantity or 0)
-            fuel_data_dict[vehicle_id]['total_energy'] += float(transaction.energy_consumed or 0)
-            fuel_data_dict[vehicle_id]['total_fuel_cost'] += float(transaction.total_cost or 0)
-        
-        # Get maintenance data with timezone-aware filtering
-        maintenance_records = Maintenance.objects.filter(
-            date_reported__gte=start_date_obj,
-            date_reported__lte=end_date_obj
-        ).select_related('vehicle')
-        
-        maintenance_data_dict = {}
-        for record in maintenance_records:
-            vehicle_id = record.vehicle.id
-            if vehicle_id not in maintenance_data_dict:
-                maintenance_data_dict[vehicle_id] = {
-                    'maintenance_count': 0,
-                    'total_maintenance_cost': 0
-                }
-            
-            maintenance_data_dict[vehicle_id]['maintenance_count'] += 1
-            maintenance_data_dict[vehicle_id]['total_maintenance_cost'] += float(record.cost or 0)
+        # Trips, fuel and maintenance from the daily rollups (one query)
+        rollup_totals = vehicle_totals(start_date_obj, end_date_obj)
         
         # Get accident data with timezone-aware filtering
         accident_records = Accident.objects.filter(
@@ -251,33 +160,34 @@ class VehicleReportView(ReportBaseView):
         for vehicle in vehicles:
             vehicle_id = vehicle.id
             
-            trip_info = vehicle_trip_data.get(vehicle_id, {
-                'trip_count': 0,
-                'completed_trip_count': 0,
-                'ongoing_trip_count': 0,
-                'total_distance': 0,
-                'distances': []
-            })
+            totals = rollup_totals.get(vehicle_id, {})
+            trip_info = {
+                'trip_count': totals.get('trip_count', 0),
+                'completed_trip_count': totals.get('completed_trip_count', 0),
+                'ongoing_trip_count': totals.get('ongoing_trip_count', 0),
+                'total_distance': as_float(totals.get('distance_km')),
+                'distance_trip_count': totals.get('distance_trip_count', 0),
+            }
             
-            fuel_info = fuel_data_dict.get(vehicle_id, {
-                'fuel_count': 0,
-                'total_fuel': 0,
-                'total_energy': 0,
-                'total_fuel_cost': 0
-            })
+            fuel_info = {
+                'fuel_count': totals.get('fuel_count', 0),
+                'total_fuel': as_float(totals.get('fuel_litres')),
+                'total_energy': as_float(totals.get('energy_kwh')),
+                'total_fuel_cost': as_float(totals.get('fuel_spend')),
+            }
             
-            maintenance_info = maintenance_data_dict.get(vehicle_id, {
-                'maintenance_count': 0,
-                'total_maintenance_cost': 0
-            })
+            maintenance_info = {
+                'maintenance_count': totals.get('maintenance_count', 0),
+                'total_maintenance_cost': as_float(totals.get('maintenance_cost')),
+            }
             
             accident_info = accident_data_dict.get(vehicle_id, {
                 'accident_count': 0
             })
             
             # Calculate averages
-            distances = trip_info.get('distances', [])
-            avg_distance = sum(distances) / len(distances) if distances else 0
+            distance_trips = trip_info['distance_trip_count']
+            avg_distance = trip_info['total_distance'] / distance_trips if distance_trips else 0
             
             # Calculate fuel efficiency
             fuel_efficiency = 0
@@ -346,7 +256,7 @@ class VehicleReportView(ReportBaseView):
         
         # Add debug info to context
         context['debug_info'] = {
-            'total_trips_found': all_trips.count(),
+            'total_trips_found': sum(totals['trip_count'] for totals in rollup_totals.values()),
             'vehicles_with_trips': len([v for v in vehicle_report if v['trip_count'] > 0]),
             'date_range': f"{start_date} to {end_date}",
             'timezone': str(timezone.get_current_timezone()),
@@ -412,69 +322,8 @@ class DriverReportView(ReportBaseView):
         # OPTIMIZED APPROACH: Get basic driver data with minimal queries
         drivers = CustomUser.objects.filter(user_type='driver').select_related()
         
-        # Get aggregated trip data efficiently
-        trips_data = Trip.objects.filter(
-            start_time__gte=start_datetime,
-            start_time__lte=end_datetime,
-            driver__isnull=False,
-            is_deleted=False
-        ).values('driver_id').annotate(
-            trip_count=Count('id'),
-            completed_count=Count('id', filter=Q(status='completed')),
-            ongoing_count=Count('id', filter=Q(status='ongoing')),
-            cancelled_count=Count('id', filter=Q(status='cancelled')),
-            total_distance=Coalesce(Sum(
-                F('end_odometer') - F('start_odometer'),
-                filter=Q(
-                    status='completed',
-                    start_odometer__isnull=False,
-                    end_odometer__isnull=False,
-                    end_odometer__gt=F('start_odometer')
-                ),
-                output_field=FloatField()
-            ), 0.0),
-            total_duration_seconds=Coalesce(Sum(
-                F('end_time') - F('start_time'),
-                filter=Q(
-                    status='completed',
-                    start_time__isnull=False,
-                    end_time__isnull=False,
-                    end_time__gt=F('start_time')
-                )
-            ), timedelta(0)),
-            completed_distance_count=Count('id', filter=Q(
-                status='completed',
-                start_odometer__isnull=False,
-                end_odometer__isnull=False,
-                end_odometer__gt=F('start_odometer')
-            ))
-        )
-        trips_dict = {item['driver_id']: item for item in trips_data}
-        
-        # Get fuel data efficiently
-        fuel_data = FuelTransaction.objects.filter(
-            date__gte=start_date_obj,
-            date__lte=end_date_obj,
-            driver__isnull=False
-        ).exclude(fuel_type='Electric').values('driver_id').annotate(
-            fuel_count=Count('id'),
-            total_fuel=Coalesce(Sum('quantity', output_field=FloatField()), 0.0),
-            total_fuel_cost=Coalesce(Sum('total_cost', output_field=FloatField()), 0.0)
-        )
-        fuel_dict = {item['driver_id']: item for item in fuel_data}
-        
-        # Get energy data efficiently
-        energy_data = FuelTransaction.objects.filter(
-            date__gte=start_date_obj,
-            date__lte=end_date_obj,
-            driver__isnull=False,
-            fuel_type='Electric'
-        ).values('driver_id').annotate(
-            energy_count=Count('id'),
-            total_energy=Coalesce(Sum('energy_consumed', output_field=FloatField()), 0.0),
-            total_energy_cost=Coalesce(Sum('total_cost', output_field=FloatField()), 0.0)
-        )
-        energy_dict = {item['driver_id']: item for item in energy_data}
+        # Trip, fuel and energy totals from the daily rollups (one query)
+        rollup_totals = driver_totals(start_date_obj, end_date_obj)
         
         # Get accident data efficiently
         accident_data = Accident.objects.filter(
@@ -493,25 +342,34 @@ class DriverReportView(ReportBaseView):
             driver_id = driver.id
             
             # Get aggregated data for this driver
-            trip_info = trips_dict.get(driver_id, {
-                'trip_count': 0, 'completed_count': 0, 'ongoing_count': 0, 'cancelled_count': 0,
-                'total_distance': 0.0, 'total_duration_seconds': timedelta(0), 'completed_distance_count': 0
-            })
+            totals = rollup_totals.get(driver_id, {})
+            trip_info = {
+                'trip_count': totals.get('trip_count', 0),
+                'completed_count': totals.get('completed_trip_count', 0),
+                'ongoing_count': totals.get('ongoing_trip_count', 0),
+                'cancelled_count': totals.get('cancelled_trip_count', 0),
+                'total_distance': as_float(totals.get('distance_km')),
+                'total_duration_seconds': totals.get('duration_seconds', 0),
+                'completed_distance_count': totals.get('distance_trip_count', 0),
+            }
             
-            fuel_info = fuel_dict.get(driver_id, {
-                'fuel_count': 0, 'total_fuel': 0.0, 'total_fuel_cost': 0.0
-            })
+            fuel_info = {
+                'fuel_count': totals.get('fuel_count', 0),
+                'total_fuel': as_float(totals.get('fuel_litres')),
+                'total_fuel_cost': as_float(totals.get('fuel_spend')),
+            }
             
-            energy_info = energy_dict.get(driver_id, {
-                'energy_count': 0, 'total_energy': 0.0, 'total_energy_cost': 0.0
-            })
+            energy_info = {
+                'energy_count': totals.get('energy_count', 0),
+                'total_energy': as_float(totals.get('energy_kwh')),
+                'total_energy_cost': as_float(totals.get('energy_spend')),
+            }
             
             accident_info = accident_dict.get(driver_id, {'accident_count': 0})
             
             # Calculate metrics
             total_distance = float(trip_info.get('total_distance', 0))
-            total_duration_seconds = trip_info.get('total_duration_seconds', timedelta(0))
-            total_hours = total_duration_seconds.total_seconds() / 3600 if isinstance(total_duration_seconds, timedelta) else 0
+            total_hours = trip_info['total_duration_seconds'] / 3600
             completed_distance_count = trip_info.get('completed_distance_count', 0)
             
             # Calculate derived metrics
@@ -1212,8 +1070,8 @@ class FuelReportView(ReportBaseView):
     def get_export_data(self, context=None):
         """Prepare data for export with INVOICE FIELDS INCLUDED.
 
-        Uses .only() to fetch just the columns we need and .iterator()
-        so the DB cursor streams rows without caching the full result set.
+        Rows are a generator over a values() projection read in chunks, so
+        the export streams without holding the result set in memory.
         """
         headers = [
             'Date', 'Vehicle', 'Vehicle Type', 'Driver', 'Fuel Station', 'Fuel Type',
@@ -1224,55 +1082,62 @@ class FuelReportView(ReportBaseView):
 
         qs, start_date, end_date, _, _ = self._get_filtered_queryset()
 
-        all_transactions = (
-            qs
-            .select_related('vehicle', 'vehicle__vehicle_type', 'driver', 'fuel_station')
-            .only(
-                'date', 'fuel_type', 'quantity', 'energy_consumed',
-                'cost_per_liter', 'cost_per_kwh', 'charging_duration_minutes',
-                'total_cost', 'odometer_reading',
-                'company_invoice_number', 'station_invoice_number',
-                'vehicle__license_plate', 'vehicle__make', 'vehicle__model',
-                'vehicle__vehicle_type__name',
-                'driver__first_name', 'driver__last_name',
-                'fuel_station__name',
-            )
-            .order_by('-date')
-            .iterator(chunk_size=500)
+        fields = [
+            'date', 'fuel_type', 'quantity', 'energy_consumed',
+            'cost_per_liter', 'cost_per_kwh', 'charging_duration_minutes',
+            'total_cost', 'odometer_reading',
+            'company_invoice_number', 'station_invoice_number',
+            'vehicle__license_plate', 'vehicle__make', 'vehicle__model',
+            'vehicle__vehicle_type__name',
+            'driver__first_name', 'driver__last_name', 'driver__username',
+            'fuel_station__name',
+        ]
+        export_data = (
+            self._export_row(t) for t in iter_values(qs.order_by('-date'), fields)
         )
 
-        export_data = []
-        for t in all_transactions:
-            export_data.append({
-                'date': t.date.strftime('%Y-%m-%d') if t.date else '',
-                'vehicle': f"{t.vehicle.license_plate} ({t.vehicle.make} {t.vehicle.model})",
-                'vehicle_type': t.vehicle.vehicle_type.name if t.vehicle.vehicle_type else '',
-                'driver': t.driver.get_full_name() if t.driver else 'N/A',
-                'fuel_station': t.fuel_station.name if t.fuel_station else 'N/A',
-                'fuel_type': t.fuel_type or '',
-                'quantity_(l)': t.quantity or 0,
-                'energy_(kwh)': t.energy_consumed or 0,
-                'cost_per_liter': t.cost_per_liter or 0,
-                'cost_per_kwh': t.cost_per_kwh or 0,
-                'charging_duration_(min)': t.charging_duration_minutes or 0,
-                'total_cost': t.total_cost or 0,
-                'odometer_reading': t.odometer_reading or 0,
-                'company_invoice_number': t.company_invoice_number or '',
-                'station_invoice_number': t.station_invoice_number or '',
-                'type': 'Electric' if t.fuel_type == 'Electric' else 'Fuel'
-            })
-
         filename = f"fuel_energy_report_with_invoices_{start_date}_to_{end_date}"
 
         return export_data, filename, headers
 
+    @staticmethod
+    def _export_row(t):
+        driver = f"{t['driver__first_name'] or ''} {t['driver__last_name'] or ''}".strip()
+        return {
+            'date': t['date'].strftime('%Y-%m-%d') if t['date'] else '',
+            'vehicle': f"{t['vehicle__license_plate']} ({t['vehicle__make']} {t['vehicle__model']})",
+            'vehicle_type': t['vehicle__vehicle_type__name'] or '',
+            'driver': (driver or t['driver__username']) if t['driver__username'] else 'N/A',
+            'fuel_station': t['fuel_station__name'] or 'N/A',
+            'fuel_type': t['fuel_type'] or '',
+            'quantity_(l)': t['quantity'] or 0,
+            'energy_(kwh)': t['energy_consumed'] or 0,
+            'cost_per_liter': t['cost_per_liter'] or 0,
+            'cost_per_kwh': t['cost_per_kwh'] or 0,
+            'charging_duration_(min)': t['charging_duration_minutes'] or 0,
+            'total_cost': t['total_cost'] or 0,
+            'odometer_reading': t['odometer_reading'] or 0,
+            'company_invoice_number': t['company_invoice_number'] or '',
+            'station_invoice_number': t['station_invoice_number'] or '',
+            'type': 'Electric' if t['fuel_type'] == 'Electric' else 'Fuel'
+        }
+
 
 class DailyUsageCostView(ReportBaseView):
     """View for daily vehicle usage cost summary."""
     template_name = 'reports/daily_usage_cost_simple.html'
     
+    def usage_rollups(self, start_date, end_date, vehicle_filter, vehicle_type_filter):
+        """Daily vehicle rollups in the range with completed trips."""
+        return DailyVehicleRollup.objects.filter(
+            date__gte=start_date,
+            date__lte=end_date,
+            completed_trip_count__gt=0,
+            **vehicle_filter,
+            **vehicle_type_filter
+        )
+
     def get_context_data(self, **kwargs):
-        from django.db.models.functions import TruncDate
         from django.db.models import Min, Max
         context = super().get_context_data(**kwargs)
 
@@ -1296,46 +1161,22 @@ class DailyUsageCostView(ReportBaseView):
             vehicle_type_filter['vehicle__vehicle_type_id'] = vehicle_type_id
             context['selected_vehicle_type'] = int(vehicle_type_id)
 
-        # Annotate and aggregate in DB (group by vehicle only)
-
-        trip_qs = Trip.objects.filter(
-            status='completed',
-            is_deleted=False,
-            **vehicle_filter,
-            **vehicle_type_filter
-        ).filter(
-            start_time__date__gte=start_date,
-            start_time__date__lte=end_date
-        ).select_related('vehicle', 'driver')
-
-        trip_qs = trip_qs.annotate(
-            trip_distance=ExpressionWrapper(
-                F('end_odometer') - F('start_odometer'),
-                output_field=FloatField()
-            ),
-            trip_cost=ExpressionWrapper(
-                F('vehicle__rate_per_km') * (F('end_odometer') - F('start_odometer')),
-                output_field=FloatField()
-            ),
-            trip_duration=ExpressionWrapper(
-                (F('end_time') - F('start_time')),
-                output_field=FloatField()
-            )
-        )
-
-        grouped = trip_qs.values(
+        # Aggregate the daily rollups of days with completed trips (group by vehicle only)
+        grouped = self.usage_rollups(start_date, end_date, vehicle_filter, vehicle_type_filter).values(
             'vehicle',
             'vehicle__license_plate',
             'vehicle__make',
             'vehicle__model',
             'vehicle__rate_per_km',
         ).annotate(
-            total_distance=Sum('trip_distance'),
-            total_cost=Sum('trip_cost'),
-            trip_count=Count('id'),
-            first_trip_time=Min('start_time'),
-            last_trip_time=Max('end_time'),
-            total_duration=Sum(ExpressionWrapper(F('end_time') - F('start_time'), output_field=FloatField())),
+            total_distance=Sum('distance_km'),
+            total_cost=Sum(ExpressionWrapper(
+                F('vehicle__rate_per_km') * F('distance_km'), output_field=FloatField()
+            )),
+            trip_count=Sum('completed_trip_count'),
+            first_trip_time=Min('first_trip_start'),
+            last_trip_time=Max('last_trip_end'),
+            total_duration=Sum('duration_seconds'),
         ).order_by('vehicle__license_plate')
 
         # No pagination needed, show all vehicles
@@ -1375,65 +1216,24 @@ class DailyUsageCostView(ReportBaseView):
         if vehicle_id:
             vehicle_filter['vehicle_id'] = vehicle_id
         
-        trips = Trip.objects.filter(
-            status='completed',
-            is_deleted=False,
-            **vehicle_filter
-        ).extra(
-            where=["DATE(start_time) >= %s AND DATE(start_time) <= %s"],
-            params=[start_date, end_date]
-        ).select_related('vehicle', 'driver').order_by('-start_time')
-        
-        # Group by date and vehicle
-        daily_usage = {}
-        for trip in trips:
-            trip_date = trip.start_time.date()
-            vehicle = trip.vehicle
-            distance = trip.distance_traveled()
-            
-            # Calculate cost using vehicle's rate per km
-            if vehicle.rate_per_km and distance > 0:
-                cost = float(vehicle.rate_per_km) * distance
-            else:
-                cost = 0
-            
-            # Create daily entry key
-            key = (trip_date, vehicle.id)
-            
-            if key not in daily_usage:
-                daily_usage[key] = {
-                    'date': trip_date,
-                    'vehicle': vehicle,
-                    'total_distance': 0,
-                    'total_cost': 0,
-                    'trip_count': 0,
-                    'first_trip_time': trip.start_time,
-                    'last_trip_time': trip.end_time or trip.start_time
-                }
-            
-            # Update daily totals
-            daily_usage[key]['total_distance'] += distance
-            daily_usage[key]['total_cost'] += cost
-            daily_usage[key]['trip_count'] += 1
-            
-            # Update trip times
-            if trip.start_time < daily_usage[key]['first_trip_time']:
-                daily_usage[key]['first_trip_time'] = trip.start_time
-            if trip.end_time and trip.end_time > daily_usage[key]['last_trip_time']:
-                daily_usage[key]['last_trip_time'] = trip.end_time
-        
-        # Convert to export format
-        for usage_data in daily_usage.values():
+        # One rollup row per date and vehicle
+        rollups = self.usage_rollups(start_date, end_date, vehicle_filter, {}).select_related('vehicle')
+        
+        for rollup in rollups:
+            vehicle = rollup.vehicle
+            rate = float(vehicle.rate_per_km) if vehicle.rate_per_km else 0
+            first_trip = timezone.localtime(rollup.first_trip_start)
+            last_trip = timezone.localtime(rollup.last_trip_end or rollup.first_trip_start)
             export_data.append({
-                'date': usage_data['date'].strftime('%Y-%m-%d'),
-                'vehicle': str(usage_data['vehicle']),
-                'license_plate': usage_data['vehicle'].license_plate,
-                'total_distance_(km)': usage_data['total_distance'],
-                'rate_per_km': float(usage_data['vehicle'].rate_per_km) if usage_data['vehicle'].rate_per_km else 0,
-                'total_cost': usage_data['total_cost'],
-                'trip_count': usage_data['trip_count'],
-                'first_trip': usage_data['first_trip_time'].strftime('%Y-%m-%d %H:%M'),
-                'last_trip': usage_data['last_trip_time'].strftime('%Y-%m-%d %H:%M')
+                'date': rollup.date.strftime('%Y-%m-%d'),
+                'vehicle': str(vehicle),
+                'license_plate': vehicle.license_plate,
+                'total_distance_(km)': rollup.distance_km,
+                'rate_per_km': rate,
+                'total_cost': rate * rollup.distance_km,
+                'trip_count': rollup.completed_trip_count,
+                'first_trip': first_trip.strftime('%Y-%m-%d %H:%M'),
+                'last_trip': last_trip.strftime('%Y-%m-%d %H:%M')
             })
         
         # Sort by date and vehicle
@@ -1684,14 +1484,6 @@ class DepartmentReportView(ReportBaseView):
             start_date = start_date_obj.isoformat()
             end_date = end_date_obj.isoformat()
         
-        # Create timezone-aware datetime objects for filtering
-        start_datetime = timezone.make_aware(
-            datetime.combine(start_date_obj, datetime.min.time())
-        )
-        end_datetime = timezone.make_aware(
-            datetime.combine(end_date_obj, datetime.max.time())
-        )
-        
         # Import Department model
         from accounts.models import Department
         
@@ -1701,117 +1493,93 @@ class DepartmentReportView(ReportBaseView):
         # Filter by department if specified
         department_id = self.request.GET.get('department')
         
+        # Trip and fuel totals per vehicle from the daily rollups (one query)
+        rollup_totals = vehicle_totals(start_date_obj, end_date_obj)
+        empty_totals = dict.fromkeys(
+            ['completed_trip_count', 'distance_km', 'approved_trip_count', 'approved_distance_km',
+             'fuel_count', 'fuel_litres', 'fuel_spend'], 0
+        )
+        
+        # Employees, company vehicles and personal vehicles per department (three queries)
+        employee_counts = dict(
+            CustomUser.objects.filter(department__isnull=False).order_by()
+            .values_list('department_id').annotate(count=Count('id'))
+        )
+        company_vehicles = {}
+        for vehicle_id, dept_id in Vehicle.objects.filter(
+            department__isnull=False, ownership_type='company'
+        ).values_list('id', 'department_id'):
+            company_vehicles.setdefault(dept_id, []).append(vehicle_id)
+        personal_vehicles = {}
+        for vehicle_id, dept_id, rate in Vehicle.objects.filter(
+            ownership_type='personal',
+            owned_by__user_type='personal_vehicle_staff',
+            owned_by__department__isnull=False,
+        ).values_list('id', 'owned_by__department_id', 'reimbursement_rate_per_km'):
+            personal_vehicles.setdefault(dept_id, []).append((vehicle_id, rate))
+        
         department_report = []
         
         for dept in departments:
-            # Get employees in this department
-            employees = CustomUser.objects.filter(department=dept)
-            employee_ids = list(employees.values_list('id', flat=True))
-            
-            # Get company vehicles assigned to this department
-            company_vehicles = Vehicle.objects.filter(department=dept, ownership_type='company')
-            company_vehicle_ids = list(company_vehicles.values_list('id', flat=True))
-            
-            # Get personal vehicles of employees in this department
-            personal_vehicle_employees = employees.filter(user_type='personal_vehicle_staff')
-            pv_employee_ids = list(personal_vehicle_employees.values_list('id', flat=True))
-            personal_vehicles = Vehicle.objects.filter(
-                owned_by_id__in=pv_employee_ids,
-                ownership_type='personal'
-            )
-            personal_vehicle_ids = list(personal_vehicles.values_list('id', flat=True))
-            
             # ========== COMPANY VEHICLE STATS ==========
-            # Get trips using company vehicles
-            company_trips = Trip.objects.filter(
-                vehicle_id__in=company_vehicle_ids,
-                status='completed',
-                start_time__gte=start_datetime,
-                end_time__lte=end_datetime,
-                is_deleted=False
-            ).select_related('vehicle')
-            
-            company_trip_count = company_trips.count()
-            company_distance = 0
-            for trip in company_trips:
-                if trip.end_odometer and trip.start_odometer:
-                    dist = trip.end_odometer - trip.start_odometer
-                    if dist > 0:
-                        company_distance += dist
-            
-            # Get fuel transactions for company vehicles
-            company_fuel = FuelTransaction.objects.filter(
-                vehicle_id__in=company_vehicle_ids,
-                date__gte=start_date_obj,
-                date__lte=end_date_obj
-            )
-            company_fuel_count = company_fuel.count()
-            company_fuel_cost = company_fuel.aggregate(total=Sum('total_cost'))['total'] or 0
-            company_fuel_quantity = company_fuel.aggregate(total=Sum('quantity'))['total'] or 0
+            company_vehicle_ids = company_vehicles.get(dept.id, [])
+            company_trip_count = company_distance = company_fuel_count = 0
+            company_fuel_cost = company_fuel_quantity = 0.0
+            for vehicle_id in company_vehicle_ids:
+                totals = rollup_totals.get(vehicle_id, empty_totals)
+                company_trip_count += totals['completed_trip_count']
+                company_distance += totals['distance_km']
+                company_fuel_count += totals['fuel_count']
+                company_fuel_cost += as_float(totals['fuel_spend'])
+                company_fuel_quantity += as_float(totals['fuel_litres'])
             
             # ========== PERSONAL VEHICLE STATS ==========
-            # Get trips using personal vehicles
-            personal_trips = Trip.objects.filter(
-                vehicle_id__in=personal_vehicle_ids,
-                status='completed',
-                start_time__gte=start_datetime,
-                end_time__lte=end_datetime,
-                is_deleted=False,
-                approval_status__in=['not_required', 'approved'],
-            ).select_related('vehicle')
-            
-            personal_trip_count = personal_trips.count()
-            personal_distance = 0
+            # Only approved (or approval-free) trips count towards reimbursement
+            personal_vehicle_list = personal_vehicles.get(dept.id, [])
+            personal_trip_count = personal_distance = personal_fuel_count = 0
+            personal_fuel_cost = personal_fuel_quantity = 0.0
             total_reimbursement = 0
-            for trip in personal_trips:
-                if trip.end_odometer and trip.start_odometer:
-                    dist = trip.end_odometer - trip.start_odometer
-                    if dist > 0:
-                        personal_distance += dist
-                        if trip.vehicle.reimbursement_rate_per_km:
-                            total_reimbursement += float(dist) * float(trip.vehicle.reimbursement_rate_per_km)
-            
-            # Get fuel transactions for personal vehicles
-            personal_fuel = FuelTransaction.objects.filter(
-                vehicle_id__in=personal_vehicle_ids,
-                date__gte=start_date_obj,
-                date__lte=end_date_obj
-            )
-            personal_fuel_count = personal_fuel.count()
-            personal_fuel_cost = personal_fuel.aggregate(total=Sum('total_cost'))['total'] or 0
-            personal_fuel_quantity = personal_fuel.aggregate(total=Sum('quantity'))['total'] or 0
+            for vehicle_id, rate in personal_vehicle_list:
+                totals = rollup_totals.get(vehicle_id, empty_totals)
+                personal_trip_count += totals['approved_trip_count']
+                personal_distance += totals['approved_distance_km']
+                if rate:
+                    total_reimbursement += float(totals['approved_distance_km']) * float(rate)
+                personal_fuel_count += totals['fuel_count']
+                personal_fuel_cost += as_float(totals['fuel_spend'])
+                personal_fuel_quantity += as_float(totals['fuel_litres'])
             
             # Calculate totals
-            total_vehicles = company_vehicles.count() + personal_vehicles.count()
+            total_vehicles = len(company_vehicle_ids) + len(personal_vehicle_list)
             total_trips = company_trip_count + personal_trip_count
             total_distance = company_distance + personal_distance
             total_fuel_transactions = company_fuel_count + personal_fuel_count
-            total_fuel_quantity = float(company_fuel_quantity or 0) + float(personal_fuel_quantity or 0)
-            total_fuel_cost = float(company_fuel_cost or 0) + float(personal_fuel_cost or 0)
+            total_fuel_quantity = company_fuel_quantity + personal_fuel_quantity
+            total_fuel_cost = company_fuel_cost + personal_fuel_cost
             total_cost = total_fuel_cost + total_reimbursement
             
             department_report.append({
                 'id': dept.id,
                 'name': dept.name,
                 'code': dept.code,
-                'employee_count': employees.count(),
+                'employee_count': employee_counts.get(dept.id, 0),
                 # Company vehicle stats
-                'company_vehicle_count': company_vehicles.count(),
+                'company_vehicle_count': len(company_vehicle_ids),
                 'company_trip_count': company_trip_count,
                 'company_distance': company_distance,
                 'company_fuel_transactions': company_fuel_count,
-                'company_fuel_quantity': float(company_fuel_quantity) if company_fuel_quantity else 0,
-                'company_fuel_cost': float(company_fuel_cost) if company_fuel_cost else 0,
-                'company_total_cost': float(company_fuel_cost) if company_fuel_cost else 0,
+                'company_fuel_quantity': company_fuel_quantity,
+                'company_fuel_cost': company_fuel_cost,
+                'company_total_cost': company_fuel_cost,
                 # Personal vehicle stats
-                'personal_vehicle_count': personal_vehicles.count(),
+                'personal_vehicle_count': len(personal_vehicle_list),
                 'personal_trip_count': personal_trip_count,
                 'personal_distance': personal_distance,
                 'personal_fuel_transactions': personal_fuel_count,
-                'personal_fuel_quantity': float(personal_fuel_quantity) if personal_fuel_quantity else 0,
-                'personal_fuel_cost': float(personal_fuel_cost) if personal_fuel_cost else 0,
+                'personal_fuel_quantity': personal_fuel_quantity,
+                'personal_fuel_cost': personal_fuel_cost,
                 'personal_reimbursement': total_reimbursement,
-                'personal_total_cost': float(personal_fuel_cost or 0) + total_reimbursement,
+                'personal_total_cost': personal_fuel_cost + total_reimbursement,
                 # Overall totals (for sorting and grand totals)
                 'vehicle_count': total_vehicles,
                 'trip_count': total_trips,
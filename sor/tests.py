@@ -2,6 +2,7 @@
 Tests for the SOR (Statement of Requirements) module.
 Run with: python manage.py test sor
 """
+import csv
 from decimal import Decimal
 from datetime import date
 
@@ -182,6 +183,20 @@ class SORViewTests(TestCase):
         response = self.client.get(reverse('sor_export'), {'format': 'csv'})
         self.assertIn(response.status_code, [200, 302])
 
+    def test_sor_export_csv_streams_rows(self):
+        self.sor.distance_km = Decimal('100')
+        self.sor.save()
+        response = self.client.get(reverse('sor_export'), {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['Sr. No.', 'SOR ID', 'Type'])
+        self.assertEqual(len(lines), 2)
+        row = next(csv.reader(lines[1:]))
+        self.assertEqual(row[1], str(self.sor.pk))
+        self.assertEqual(row[8], str(self.vehicle))
+        self.assertEqual(row[11], '1500.00')
+        self.assertEqual(row[13], str(self.driver))
+
 
 class SORAPITests(TestCase):
     """Tests for SOR API endpoints via DRF."""
@@ -6,7 +6,6 @@ from django.db.models import Q, F, Case, When, DecimalField
 from django.http import HttpResponse, HttpResponseForbidden
 from datetime import datetime, time
 from django.utils import timezone
-import csv
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
 from reportlab.lib.pagesizes import letter, landscape
@@ -33,6 +32,7 @@ except ImportError:
     class SorDeletePermissionMixin(LoginRequiredMixin):
         pass
 
+from core.exports import iter_values, streaming_csv_response
 from .models import SOR
 from .forms import SORForm, SORFilterForm
 from .notification import SORNotification
@@ -544,51 +544,73 @@ def sor_export(request):
         messages.error(request, 'Invalid export format.')
         return redirect('sor_list')
 
+def _user_name(first_name, last_name, username):
+    """CustomUser.get_full_name() from values() columns."""
+    return f"{first_name or ''} {last_name or ''}".strip() or username
+
+
 def _export_csv(sors_data):
-    """Export SOR data as CSV"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="sor_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write headers
+    """Export SOR data as a streamed CSV of a chunked .values() projection"""
     headers = [
         'Sr. No.', 'SOR ID', 'Type', 'Goods Value', 'Created By', 'Created At', 'From Location', 'To Location',
         'Vehicle', 'Rate per KM', 'Distance (km)', 'Transport Cost', 'Transport % of Goods Value',
         'Driver', 'Status'
     ]
-    writer.writerow(headers)
-    
-    # Write data with serial numbers
-    for index, sor in enumerate(sors_data, 1):
+    fields = [
+        'id', 'source_type', 'goods_value', 'created_at', 'from_location', 'to_location',
+        'distance_km', 'status', 'outsourced_vehicle_text', 'outsourced_driver_text', 'outsourced_rate_per_km',
+        'created_by__first_name', 'created_by__last_name', 'created_by__username',
+        'vehicle_id', 'vehicle__make', 'vehicle__model', 'vehicle__license_plate', 'vehicle__rate_per_km',
+        'driver_id', 'driver__first_name', 'driver__last_name', 'driver__username', 'driver__user_type',
+    ]
+    source_types = dict(SOR._meta.get_field('source_type').flatchoices)
+    statuses = dict(SOR._meta.get_field('status').flatchoices)
+    user_types = dict(User._meta.get_field('user_type').flatchoices)
+
+    def row(index, sor):
+        rate = sor['vehicle__rate_per_km']
         transport_cost = ''
         transport_percentage = ''
-        
-        if sor.distance_km and sor.vehicle and sor.vehicle.rate_per_km:
-            transport_cost = f"{sor.distance_km * sor.vehicle.rate_per_km:.2f}"
-            if sor.goods_value and sor.goods_value > 0:
-                transport_percentage = f"{(sor.distance_km * sor.vehicle.rate_per_km / sor.goods_value * 100):.2f}%"
-        
-        row = [
+        if sor['distance_km'] and sor['vehicle_id'] and rate:
+            transport_cost = f"{sor['distance_km'] * rate:.2f}"
+            if sor['goods_value'] and sor['goods_value'] > 0:
+                transport_percentage = f"{(sor['distance_km'] * rate / sor['goods_value'] * 100):.2f}%"
+
+        if sor['vehicle_id']:
+            vehicle = f"{sor['vehicle__make']} {sor['vehicle__model']} ({sor['vehicle__license_plate']})"
+        else:
+            vehicle = sor['outsourced_vehicle_text'] or '--'
+        if sor['driver_id']:
+            driver_name = _user_name(sor['driver__first_name'], sor['driver__last_name'], sor['driver__username'])
+            driver = f"{driver_name} ({user_types.get(sor['driver__user_type'], sor['driver__user_type'])})"
+        else:
+            driver = sor['outsourced_driver_text'] or '--'
+
+        return [
             index,  # Serial number
-            sor.id,  # Original SOR ID
-            sor.get_source_type_display(),
-            sor.goods_value,
-            sor.created_by.get_full_name() if sor.created_by else '--',
-            sor.created_at.strftime('%d %b %Y, %H:%M') if sor.created_at else '--',
-            sor.from_location,
-            sor.to_location,
-            str(sor.vehicle) if sor.vehicle else (sor.outsourced_vehicle_text or '--'),
-            sor.vehicle.rate_per_km if sor.vehicle and sor.vehicle.rate_per_km is not None else (sor.outsourced_rate_per_km if sor.outsourced_rate_per_km is not None else '--'),
-            f"{sor.distance_km:.2f}" if sor.distance_km else '--',
+            sor['id'],  # Original SOR ID
+            source_types.get(sor['source_type'], sor['source_type']),
+            sor['goods_value'],
+            _user_name(sor['created_by__first_name'], sor['created_by__last_name'], sor['created_by__username'])
+            if sor['created_by__username'] else '--',
+            sor['created_at'].strftime('%d %b %Y, %H:%M') if sor['created_at'] else '--',
+            sor['from_location'],
+            sor['to_location'],
+            vehicle,
+            rate if sor['vehicle_id'] and rate is not None else (
+                sor['outsourced_rate_per_km'] if sor['outsourced_rate_per_km'] is not None else '--'
+            ),
+            f"{sor['distance_km']:.2f}" if sor['distance_km'] else '--',
             transport_cost or '--',
             transport_percentage or '--',
-            str(sor.driver) if sor.driver else (sor.outsourced_driver_text or '--'),
-            sor.get_status_display()
+            driver,
+            statuses.get(sor['status'], sor['status']),
         ]
-        writer.writerow(row)
-    
-    return response
+
+    filename = f'sor_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+    return streaming_csv_response(filename, headers, (
+        row(index, sor) for index, sor in enumerate(iter_values(sors_data, fields), 1)
+    ))
 
 def _export_excel(sors_data):
     """Export SOR data as Excel"""
@@ -0,0 +1,168 @@
+// static/js/report-jobs.js
+
+/**
+ * Background report exports.
+ *
+ * Export links marked with data-report-job="<report type>" (and the export
+ * functions of the trip / SOR lists, through ReportJobs.start) no longer
+ * download in the request: the export URL's filters are submitted as a
+ * report job, a progress panel polls the job and the file is downloaded
+ * once it is ready. See reports/jobs.py.
+ */
+(function() {
+  const script = document.currentScript;
+  const JOBS_URL = script && script.dataset.jobsUrl;
+  const POLL_MS = 1500;
+
+  function getCSRFToken() {
+    const cookieValue = document.cookie
+      .split('; ')
+      .find(row => row.startsWith('csrftoken='))
+      ?.split('=')[1];
+    if (cookieValue) {
+      return cookieValue;
+    }
+    const input = document.querySelector('[name=csrfmiddlewaretoken]');
+    return input ? input.value : '';
+  }
+
+  function panelContainer() {
+    let container = document.getElementById('reportJobsPanel');
+    if (!container) {
+      container = document.createElement('div');
+      container.id = 'reportJobsPanel';
+      container.style.cssText = 'position:fixed;right:1rem;bottom:1rem;z-index:1080;width:320px;max-width:calc(100% - 2rem);';
+      document.body.appendChild(container);
+    }
+    return container;
+  }
+
+  function createPanel(title) {
+    const panel = document.createElement('div');
+    panel.className = 'card shadow-sm mb-2';
+    panel.innerHTML =
+      '<div class="card-body p-3">' +
+        '<div class="d-flex justify-content-between align-items-start mb-2">' +
+          '<strong class="small report-job-title"></strong>' +
+          '<button type="button" class="btn-close btn-sm" aria-label="Close"></button>' +
+        '</div>' +
+        '<div class="progress mb-2" style="height:6px;">' +
+          '<div class="progress-bar progress-bar-striped progress-bar-animated" role="progressbar" style="width:0%"></div>' +
+        '</div>' +
+        '<div class="small text-muted report-job-message">Submitting…</div>' +
+      '</div>';
+    panel.querySelector('.report-job-title').textContent = title;
+    panel.querySelector('.btn-close').addEventListener('click', () => panel.remove());
+    panelContainer().appendChild(panel);
+    return panel;
+  }
+
+  function showJob(panel, job) {
+    const bar = panel.querySelector('.progress-bar');
+    const message = panel.querySelector('.report-job-message');
+    bar.style.width = job.progress + '%';
+    panel.querySelector('.report-job-title').textContent = job.label + ' (' + job.format.toUpperCase() + ')';
+
+    if (job.status === 'completed' && job.download_url) {
+      bar.classList.remove('progress-bar-animated', 'progress-bar-striped');
+      bar.classList.add('bg-success');
+      message.innerHTML = '';
+      const link = document.createElement('a');
+      link.href = job.download_url;
+      link.textContent = 'Download ' + (job.filename || 'report');
+      message.appendChild(link);
+      return true;
+    }
+    if (job.status === 'failed') {
+      bar.classList.remove('progress-bar-animated', 'progress-bar-striped');
+      bar.classList.add('bg-danger');
+      message.textContent = job.message + (job.error ? ': ' + job.error : '');
+      return true;
+    }
+    message.textContent = job.message || 'Queued';
+    return false;
+  }
+
+  function fail(panel, text) {
+    const bar = panel.querySelector('.progress-bar');
+    bar.classList.remove('progress-bar-animated', 'progress-bar-striped');
+    bar.classList.add('bg-danger');
+    bar.style.width = '100%';
+    panel.querySelector('.report-job-message').textContent = text;
+  }
+
+  function poll(panel, statusUrl) {
+    fetch(statusUrl, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+      .then(response => response.json())
+      .then(data => {
+        if (!data.success) {
+          fail(panel, data.error || 'Report job not found');
+          return;
+        }
+        if (showJob(panel, data.job)) {
+          if (data.job.download_url) {
+            window.location.href = data.job.download_url;
+          }
+        } else {
+          setTimeout(() => poll(panel, statusUrl), POLL_MS);
+        }
+      })
+      .catch(() => setTimeout(() => poll(panel, statusUrl), POLL_MS * 2));
+  }
+
+  /**
+   * Submit the export ``exportUrl`` (with its filters and its export/format
+   * parameter) as a background job of ``reportType``.
+   */
+  function start(reportType, exportUrl) {
+    if (!JOBS_URL) {
+      window.location.href = exportUrl;  // Not wired up on this page
+      return;
+    }
+    const url = new URL(exportUrl, window.location.href);
+    const params = url.searchParams;
+    const format = params.get('export') || params.get('format') || 'csv';
+
+    const body = new FormData();
+    for (const [key, value] of params.entries()) {
+      if (key !== 'export' && key !== 'format') {
+        body.append(key, value);
+      }
+    }
+    body.append('report_type', reportType);
+    body.append('format', format);
+
+    const panel = createPanel('Preparing export…');
+    fetch(JOBS_URL, {
+      method: 'POST',
+      headers: { 'X-CSRFToken': getCSRFToken(), 'X-Requested-With': 'XMLHttpRequest' },
+      body: body
+    })
+      .then(response => response.json())
+      .then(data => {
+        if (!data.success) {
+          fail(panel, data.error || 'Could not start the export');
+          return;
+        }
+        if (showJob(panel, data.job)) {
+          if (data.job.download_url) {
+            window.location.href = data.job.download_url;
+          }
+        } else {
+          setTimeout(() => poll(panel, data.job.status_url), POLL_MS);
+        }
+      })
+      .catch(() => fail(panel, 'Could not start the export'));
+  }
+
+  document.addEventListener('click', function(event) {
+    const link = event.target.closest('a[data-report-job]');
+    if (!link) {
+      return;
+    }
+    event.preventDefault();
+    start(link.dataset.reportJob, link.href);
+  });
+
+  window.ReportJobs = { start: start };
+})();
@@ -7,6 +7,7 @@ from .models import Trip
 # relying on re-export behaviour in trips.__init__, which can lead
 # to circular-import issues during Django app loading.
 from .consultant_models import ConsultantRate
+from .gps_models import TripOdometerCheck
 
 @admin.register(Trip)
 class TripAdmin(admin.ModelAdmin):
@@ -108,3 +109,27 @@ class ConsultantRateAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'updated_at')
         }),
     )
+
+
+# ------------------------------------------------------------------
+# TripOdometerCheck admin
+# ------------------------------------------------------------------
+
+@admin.register(TripOdometerCheck)
+class TripOdometerCheckAdmin(admin.ModelAdmin):
+    """Odometer checks written by the validate_trip_odometer command (read-only)."""
+
+    list_display = (
+        'trip', 'odometer_distance', 'gps_distance', 'variance_percentage',
+        'total_points', 'gaps_detected', 'requires_review', 'checked_at',
+    )
+    list_filter = ('requires_review', 'checked_at')
+    search_fields = ('trip__vehicle__license_plate', 'trip__driver__username', 'review_reason')
+    list_select_related = ('trip', 'trip__vehicle', 'trip__driver')
+    raw_id_fields = ('trip',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
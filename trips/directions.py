@@ -0,0 +1,213 @@
+"""
+Google Directions lookups for the trip map, with a persistent cache.
+
+``get_google_route`` used to call the Directions API synchronously on every
+page view of a trip map, after materialising the whole track just to pick
+23 waypoints. Now:
+
+    - waypoints are sampled in the database with a ROW_NUMBER() stride, so
+      only the ≤25 sampled rows leave the DB;
+    - snapped routes are stored in ``DirectionsRouteCache`` keyed by trip
+      and a hash of the waypoints, so a finished trip's route is fetched
+      once (an ongoing trip refetches on every new point, since its latest
+      point is the destination);
+    - a cache-backed lock gives single-flight behaviour: while one request
+      calls Google, concurrent viewers wait briefly for its result instead
+      of all calling out;
+    - failed lookups are remembered for a few minutes so a bad route does
+      not retry on every view.
+
+The endpoint URL and timeout come from settings so tests can point at a
+local stub (``GOOGLE_DIRECTIONS_URL`` / ``GOOGLE_DIRECTIONS_TIMEOUT``).
+"""
+import hashlib
+import logging
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .gps_models import DirectionsRouteCache, TripLocation
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS_URL = 'https://maps.googleapis.com/maps/api/directions/json'
+DIRECTIONS_TIMEOUT = 10
+
+# Google allows 25 waypoints including origin and destination.
+MAX_WAYPOINTS = 23
+
+# Single-flight: the fetching request holds the lock for the request timeout
+# plus LOCK_MARGIN seconds; other viewers wait WAIT_SECONDS for its result
+# before falling back to raw GPS.
+LOCK_MARGIN = 5
+WAIT_SECONDS = 8.0
+WAIT_INTERVAL = 0.25
+
+FAILURE_TTL = 10 * 60
+
+STATUS_PENDING = 'PENDING'
+
+
+def _request_timeout():
+    return getattr(settings, 'GOOGLE_DIRECTIONS_TIMEOUT', DIRECTIONS_TIMEOUT)
+
+
+def _lock_key(trip_id, waypoint_hash):
+    return f'directions_lock_{trip_id}_{waypoint_hash}'
+
+
+def _failure_key(trip_id, waypoint_hash):
+    return f'directions_failed_{trip_id}_{waypoint_hash}'
+
+
+def sample_route_points(trip_id, max_waypoints=MAX_WAYPOINTS):
+    """
+    Origin, up to ``max_waypoints`` evenly strided intermediate points and
+    destination of a trip as ``(latitude, longitude)`` tuples.
+
+    Picks the same points as slicing the full ordered track with
+    ``[1:-1:step][:max_waypoints]``, but numbers the rows with ROW_NUMBER()
+    in the database so only the sampled rows are fetched.
+    """
+    locations = TripLocation.objects.filter(trip_id=trip_id)
+    total = locations.count()
+    if not total:
+        return []
+
+    positions = [1, total]
+    if total > 2:
+        step = max(1, (total - 2) // max_waypoints)
+        positions += list(range(2, total, step))[:max_waypoints]
+
+    return list(
+        locations.annotate(
+            row_number=Window(RowNumber(), order_by=[F('timestamp').asc(), F('id').asc()])
+        )
+        .filter(row_number__in=positions)
+        .order_by('row_number')
+        .values_list('latitude', 'longitude')
+    )
+
+
+def waypoint_hash(points):
+    """Stable key for a sampled route (coordinates at DB precision)."""
+    raw = '|'.join(f'{lat},{lon}' for lat, lon in points)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _cached_route(trip_id, route_hash):
+    return DirectionsRouteCache.objects.filter(trip_id=trip_id, waypoint_hash=route_hash).first()
+
+
+def _call_directions_api(points, api_key):
+    """One Directions request. Returns the parsed JSON (or an error status)."""
+    params = {
+        'origin': f'{points[0][0]},{points[0][1]}',
+        'destination': f'{points[-1][0]},{points[-1][1]}',
+        'key': api_key,
+        'mode': 'driving',
+    }
+    if len(points) > 2:
+        params['waypoints'] = '|'.join(f'{lat},{lon}' for lat, lon in points[1:-1])
+    try:
+        response = requests.get(
+            getattr(settings, 'GOOGLE_DIRECTIONS_URL', DIRECTIONS_URL),
+            params=params,
+            timeout=_request_timeout(),
+        )
+        return response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning("Google Directions request failed: %s", e)
+        return {'status': 'REQUEST_FAILED'}
+
+
+def _store_route(trip, route_hash, data):
+    route = data['routes'][0]
+    legs = route['legs']
+    defaults = {
+        'encoded_polyline': route.get('overview_polyline', {}).get('points', ''),
+        'distance_m': sum(leg['distance']['value'] for leg in legs),
+        'duration_s': sum(leg['duration']['value'] for leg in legs),
+    }
+    try:
+        cached, _ = DirectionsRouteCache.objects.update_or_create(
+            trip=trip, waypoint_hash=route_hash, defaults=defaults,
+        )
+    except IntegrityError:
+        # A concurrent request stored it first.
+        cached = _cached_route(trip.id, route_hash)
+    # Only the latest sample of a trip is worth keeping.
+    DirectionsRouteCache.objects.filter(trip=trip).exclude(waypoint_hash=route_hash).delete()
+    return cached
+
+
+def _wait_for_route(trip_id, route_hash):
+    """Poll for the result another request is fetching."""
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        cached = _cached_route(trip_id, route_hash)
+        if cached is not None:
+            return cached
+        try:
+            if cache.get(_lock_key(trip_id, route_hash)) is None:
+                break  # Fetcher finished without storing (e.g. API error)
+        except Exception:
+            pass  # Cache backend down — keep polling the DB
+    return _cached_route(trip_id, route_hash)
+
+
+def get_directions_route(trip, points, api_key):
+    """
+    Road-snapped route for the sampled ``points`` of ``trip``.
+
+    Returns ``(route, status)``: the ``DirectionsRouteCache`` row and 'OK',
+    or None and the Directions status explaining why there is no route
+    (``STATUS_PENDING`` if another request is still fetching it).
+    """
+    route_hash = waypoint_hash(points)
+    cached = _cached_route(trip.id, route_hash)
+    if cached is not None:
+        return cached, 'OK'
+
+    try:
+        failed_status = cache.get(_failure_key(trip.id, route_hash))
+    except Exception:
+        failed_status = None  # Cache backend down
+    if failed_status:
+        return None, failed_status
+
+    try:
+        # add() returns None rather than False when django-redis swallows a
+        # connection error; treat that as acquired so a Redis outage does not
+        # stop every viewer from fetching.
+        lock_timeout = _request_timeout() + LOCK_MARGIN
+        acquired = cache.add(_lock_key(trip.id, route_hash), 1, lock_timeout) is not False
+    except Exception:
+        acquired = True  # Cache backend down
+
+    if not acquired:
+        cached = _wait_for_route(trip.id, route_hash)
+        return (cached, 'OK') if cached is not None else (None, STATUS_PENDING)
+
+    try:
+        data = _call_directions_api(points, api_key)
+        status = data.get('status')
+        if status != 'OK' or not data.get('routes'):
+            status = status if status != 'OK' else 'ZERO_RESULTS'
+            try:
+                cache.set(_failure_key(trip.id, route_hash), status or 'UNKNOWN_ERROR', FAILURE_TTL)
+            except Exception:
+                pass
+            return None, status
+        return _store_route(trip, route_hash, data), 'OK'
+    finally:
+        try:
+            cache.delete(_lock_key(trip.id, route_hash))
+        except Exception:
+            pass
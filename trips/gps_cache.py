@@ -0,0 +1,114 @@
+"""
+Per-trip "last accepted GPS point" cache.
+
+The GPS ingest endpoints need the previous point of a trip for dedupe and
+gap detection on every ping. Keeping it in the Redis cache (falling back
+to the DB on a miss) means the steady state runs without any SELECT on
+`trips_triplocation`. Every code path that stores a TripLocation for an
+ongoing trip must call ``remember_last_point`` so the cache stays correct;
+paths that delete points (downsampling, archiving) or end the GPS session
+call ``forget_last_point``.
+"""
+import logging
+
+from django.core.cache import cache
+
+from .gps_models import TripLocation
+
+logger = logging.getLogger(__name__)
+
+# Ongoing trips are auto-ended after TRIP_END_AUTO_TIMEOUT hours, so an
+# entry never needs to outlive that.
+LAST_POINT_TTL = 12 * 60 * 60
+
+HITS_KEY = 'gps_last_point_hits'
+MISSES_KEY = 'gps_last_point_misses'
+
+# Cached for trips that have no points yet, so they don't miss on every ping.
+_NO_POINT = {}
+
+
+def _last_point_key(trip_id):
+    return f'gps_last_point_{trip_id}'
+
+
+def _bump(counter_key):
+    try:
+        cache.incr(counter_key)
+    except ValueError:
+        # Counter not created yet (or evicted).
+        cache.add(counter_key, 1, None)
+    except Exception:
+        pass  # Cache backend down — counters are best effort
+
+
+def _as_point(latitude, longitude, timestamp):
+    return {'latitude': latitude, 'longitude': longitude, 'timestamp': timestamp}
+
+
+def get_last_point(trip_id):
+    """
+    Return the latest stored point for a trip as a dict with ``latitude``,
+    ``longitude`` and ``timestamp``, or None if the trip has no points.
+    """
+    try:
+        cached = cache.get(_last_point_key(trip_id))
+    except Exception:
+        cached = None  # Cache backend down — fall through to DB query
+
+    if cached is not None:
+        _bump(HITS_KEY)
+        return cached or None
+
+    _bump(MISSES_KEY)
+    row = (
+        TripLocation.objects.filter(trip_id=trip_id)
+        .order_by('-timestamp')
+        .values('latitude', 'longitude', 'timestamp')
+        .first()
+    )
+    point = _as_point(row['latitude'], row['longitude'], row['timestamp']) if row else None
+    _store(trip_id, point)
+    return point
+
+
+def remember_last_point(trip_id, latitude, longitude, timestamp):
+    """Record a newly stored point as the trip's latest one."""
+    _store(trip_id, _as_point(latitude, longitude, timestamp))
+
+
+def forget_last_point(trip_id):
+    """Drop the cached point after points were deleted or the session ended."""
+    try:
+        cache.delete(_last_point_key(trip_id))
+    except Exception:
+        pass
+
+
+def _store(trip_id, point):
+    try:
+        cache.set(_last_point_key(trip_id), point or _NO_POINT, LAST_POINT_TTL)
+    except Exception:
+        logger.debug("GPS last-point cache write failed for trip %s", trip_id)
+
+
+def last_point_cache_stats():
+    """Hit/miss counters shared by all workers through the cache backend."""
+    try:
+        hits = cache.get(HITS_KEY) or 0
+        misses = cache.get(MISSES_KEY) or 0
+    except Exception:
+        hits = misses = 0
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / lookups, 4) if lookups else None,
+    }
+
+
+def reset_last_point_cache_stats():
+    try:
+        cache.delete_many([HITS_KEY, MISSES_KEY])
+    except Exception:
+        pass
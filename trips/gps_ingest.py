@@ -0,0 +1,255 @@
+"""
+Batched GPS ingest for buffered location uploads from the mobile app.
+
+A phone that was offline can upload thousands of pings in one request.
+Instead of one INSERT per point, the whole payload is validated and
+deduplicated in memory, written with chunked ``bulk_create`` and the
+``GPSTrackingSession`` counters are updated once per batch.
+"""
+import logging
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from core import geo, live_feed
+from geolocation.geofence import safe_process_positions
+
+from .gps_cache import get_last_point, remember_last_point
+from .gps_models import TripLivePosition, TripLocation
+from .route_artifacts import invalidate_route_artifact, route_is_final
+
+logger = logging.getLogger(__name__)
+
+# Dedup thresholds: skip a new GPS point if the last point for the same
+# trip is closer than MIN_DISTANCE_M and newer than MIN_INTERVAL_S. Cuts
+# `trips_triplocation` row growth dramatically without losing trip detail.
+GPS_MIN_DISTANCE_M = 10.0
+GPS_MIN_INTERVAL_S = 5.0
+
+# Points with accuracy below this (metres) count towards valid_points.
+GPS_VALID_ACCURACY_M = 50
+# A gap longer than this (seconds) between consecutive points is a signal loss.
+GPS_GAP_SECONDS = 60
+
+# Rows per INSERT statement when writing a batch.
+GPS_BULK_CHUNK_SIZE = 500
+
+# Per-point rejection reasons reported back to the client.
+REJECT_MISSING_COORDINATES = 'missing_coordinates'
+REJECT_INVALID_VALUE = 'invalid_value'
+REJECT_OUT_OF_RANGE = 'out_of_range'
+REJECT_ALREADY_RECORDED = 'already_recorded'
+REJECT_DUPLICATE = 'duplicate'
+
+
+def parse_point_timestamp(value, default=None):
+    """
+    Parse a client timestamp (epoch milliseconds or ISO 8601 string).
+    Falls back to ``default`` (or server time) when missing or unparseable.
+    """
+    fallback = default or timezone.now()
+    if not value:
+        return fallback
+    try:
+        if isinstance(value, (int, float)):
+            parsed = datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        else:
+            parsed = datetime.fromisoformat(str(value))
+    except (ValueError, TypeError, OSError, OverflowError):
+        return fallback
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def _optional_float(value):
+    return float(value) if value else None
+
+
+def _optional_int(value):
+    return int(value) if value else None
+
+
+def _clean_point(loc_data, default_timestamp):
+    """
+    Validate one raw payload dict.
+    Returns ``(fields, None)`` on success or ``(None, reason)`` on rejection.
+    """
+    if not isinstance(loc_data, dict):
+        return None, REJECT_INVALID_VALUE
+
+    latitude = loc_data.get('latitude')
+    longitude = loc_data.get('longitude')
+    if not latitude or not longitude:
+        return None, REJECT_MISSING_COORDINATES
+
+    try:
+        lat_dec = Decimal(str(latitude))
+        lon_dec = Decimal(str(longitude))
+        fields = {
+            'latitude': lat_dec,
+            'longitude': lon_dec,
+            'accuracy': float(loc_data.get('accuracy', 0) or 0),
+            'speed': _optional_float(loc_data.get('speed')),
+            'altitude': _optional_float(loc_data.get('altitude')),
+            'heading': _optional_float(loc_data.get('heading')),
+            'battery_level': _optional_int(loc_data.get('battery_level')),
+        }
+    except (InvalidOperation, ValueError, TypeError):
+        return None, REJECT_INVALID_VALUE
+
+    if not lat_dec.is_finite() or not lon_dec.is_finite():
+        return None, REJECT_INVALID_VALUE
+    if not (-90 <= lat_dec <= 90) or not (-180 <= lon_dec <= 180):
+        return None, REJECT_OUT_OF_RANGE
+
+    fields['timestamp'] = parse_point_timestamp(loc_data.get('timestamp'), default_timestamp)
+    return fields, None
+
+
+def is_near_duplicate_point(prev, point):
+    """True if ``point`` is within the dedup window of ``prev`` (both dicts)."""
+    gap = (point['timestamp'] - prev['timestamp']).total_seconds()
+    if gap < 0 or gap >= GPS_MIN_INTERVAL_S:
+        return False
+    distance_km = TripLocation.calculate_distance(
+        prev['latitude'], prev['longitude'], point['latitude'], point['longitude']
+    )
+    return (distance_km * 1000.0) < GPS_MIN_DISTANCE_M
+
+
+def ingest_gps_batch(trip, gps_session, locations, chunk_size=GPS_BULK_CHUNK_SIZE):
+    """
+    Validate, dedupe and bulk-insert a list of raw GPS point dicts for ``trip``.
+
+    Points are processed in timestamp order so gap detection is meaningful
+    even when the client buffer was uploaded out of order. A point is
+    rejected if it is malformed, already stored for the trip (same
+    timestamp, e.g. a retried upload) or a near-duplicate of the previous
+    accepted point.
+
+    Returns a dict with ``saved_count``, ``skipped_count`` (near-duplicates),
+    ``rejected`` (list of ``{'index', 'reason'}`` in payload order) and the
+    updated ``total_points``.
+    """
+    now_ts = timezone.now()
+    rejected = []
+    candidates = []
+
+    for index, loc_data in enumerate(locations):
+        fields, reason = _clean_point(loc_data, now_ts)
+        if reason:
+            rejected.append({'index': index, 'reason': reason})
+            continue
+        candidates.append((index, fields))
+
+    # Stable sort keeps payload order for points sharing a timestamp.
+    candidates.sort(key=lambda item: item[1]['timestamp'])
+
+    cached_last = get_last_point(trip.id) if candidates else None
+
+    appending = cached_last is None or cached_last['timestamp'] < candidates[0][1]['timestamp']
+    if appending:
+        # Appending after everything already stored (the normal case): there
+        # is nothing in the DB to dedupe against besides the cached point.
+        stored_timestamps = set()
+        prev = cached_last
+    else:
+        first_ts = candidates[0][1]['timestamp']
+        last_ts = candidates[-1][1]['timestamp']
+        # Back-filled or retried upload: one query for timestamps already
+        # stored in range + one for the point preceding the batch.
+        stored_timestamps = set(
+            TripLocation.objects.filter(
+                trip=trip, timestamp__range=(first_ts, last_ts)
+            ).values_list('timestamp', flat=True)
+        )
+        prev = (
+            TripLocation.objects.filter(trip=trip, timestamp__lt=first_ts)
+            .order_by('-timestamp')
+            .values('latitude', 'longitude', 'timestamp')
+            .first()
+        )
+
+    to_create = []
+    skipped_count = 0
+    valid_points = 0
+    gaps_detected = 0
+    longest_gap = 0
+
+    for index, fields in candidates:
+        if fields['timestamp'] in stored_timestamps:
+            rejected.append({'index': index, 'reason': REJECT_ALREADY_RECORDED})
+            continue
+        if prev is not None and is_near_duplicate_point(prev, fields):
+            rejected.append({'index': index, 'reason': REJECT_DUPLICATE})
+            skipped_count += 1
+            continue
+
+        if prev is not None:
+            gap_seconds = (fields['timestamp'] - prev['timestamp']).total_seconds()
+            if gap_seconds > GPS_GAP_SECONDS:
+                gaps_detected += 1
+                longest_gap = max(longest_gap, int(gap_seconds))
+        if fields['accuracy'] < GPS_VALID_ACCURACY_M:
+            valid_points += 1
+
+        stored_timestamps.add(fields['timestamp'])
+        to_create.append(TripLocation(trip=trip, **fields))
+        prev = fields
+
+    distance_km = 0.0
+    if appending and to_create:
+        track = ([cached_last] if cached_last else []) + [
+            {'latitude': loc.latitude, 'longitude': loc.longitude} for loc in to_create
+        ]
+        distance_km = geo.path_distance_km(
+            [p['latitude'] for p in track], [p['longitude'] for p in track]
+        )
+
+    with transaction.atomic():
+        if to_create:
+            TripLocation.objects.bulk_create(to_create, batch_size=chunk_size)
+        # F() increments: a concurrent batch for the same trip keeps its counts too.
+        gps_session.add_points(len(to_create), valid_points, gaps_detected, longest_gap, distance_km)
+        if to_create and not appending:
+            # Points were inserted between stored ones, which changes the
+            # existing hops too; re-derive the odometer from the raw track
+            # (the UPDATE above holds the session row lock until commit).
+            gps_session.running_distance_km = gps_session.compute_distance_km()
+            gps_session.save(update_fields=['running_distance_km'])
+        if to_create and route_is_final(trip, gps_session):
+            # Tracking was already finalized or the trip ended; the precomputed route is stale.
+            invalidate_route_artifact(trip.id)
+
+    if to_create and (cached_last is None or prev['timestamp'] >= cached_last['timestamp']):
+        remember_last_point(trip.id, prev['latitude'], prev['longitude'], prev['timestamp'])
+        if trip.status == 'ongoing':
+            # Batches uploaded after the trip ended must not bring it back onto the live map.
+            TripLivePosition.record(
+                trip.id, prev['latitude'], prev['longitude'], prev['timestamp'], prev['speed'],
+                prev['accuracy'], prev['battery_level'],
+            )
+        live_feed.publish('trips', [trip.id])
+    if to_create and appending:
+        # Backfilled points are left to backfill_geofence_events.
+        safe_process_positions(
+            [(trip.vehicle_id, loc.latitude, loc.longitude, loc.timestamp, trip.id) for loc in to_create],
+            'trip',
+        )
+
+    rejected.sort(key=lambda item: item['index'])
+    if rejected:
+        logger.info(
+            "GPS batch for trip %s: saved %d, rejected %d",
+            trip.id, len(to_create), len(rejected),
+        )
+
+    return {
+        'saved_count': len(to_create),
+        'skipped_count': skipped_count,
+        'rejected': rejected,
+        'total_points': gps_session.total_points,
+    }
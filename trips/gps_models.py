@@ -1,11 +1,15 @@
 """
 GPS Tracking Models for Trip Location Tracking
 """
-from django.db import models
+from django.db import connection, models
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from decimal import Decimal
 import math
 
+from core import geo
+
 
 class TripLocation(models.Model):
     """
@@ -37,7 +41,8 @@ class TripLocation(models.Model):
     def calculate_distance(lat1, lon1, lat2, lon2):
         """
         Calculate distance between two GPS coordinates using Haversine formula
-        Returns distance in kilometers
+        Returns distance in kilometers. Scalar math for the single pair
+        the ingest paths need; tracks go through ``core.geo`` instead.
         """
         # Convert to radians
         lat1_rad = math.radians(float(lat1))
@@ -52,10 +57,25 @@ class TripLocation(models.Model):
         a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
         c = 2 * math.asin(math.sqrt(a))
         
-        # Earth's radius in kilometers
-        radius = 6371
-        
-        return c * radius
+        return c * geo.EARTH_RADIUS_KM
+
+
+def review_reasons(variance_percentage, total_points, gaps_detected, longest_gap_seconds):
+    """
+    Reasons a trip's GPS track needs admin review (empty when it passes).
+    Shared by ``GPSTrackingSession.validate_trip`` and the AiroTrack
+    odometer check (``trips.odometer_check``).
+    """
+    reasons = []
+    if variance_percentage > 15:
+        reasons.append(f"High variance: {variance_percentage}% difference between GPS and odometer")
+    if total_points < 10:
+        reasons.append(f"Insufficient GPS data: Only {total_points} points collected")
+    if gaps_detected > 5:
+        reasons.append(f"Multiple GPS signal losses: {gaps_detected} gaps detected")
+    if longest_gap_seconds > 300:  # 5 minutes
+        reasons.append(f"Long GPS gap: {longest_gap_seconds // 60} minutes without signal")
+    return reasons
 
 
 class GPSTrackingSession(models.Model):
@@ -83,6 +103,8 @@ class GPSTrackingSession(models.Model):
     # Distance Calculations
     gps_distance = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, 
                                       help_text="Total distance from GPS (km)")
+    running_distance_km = models.FloatField(default=0,
+                                            help_text="GPS odometer accumulated as points are accepted (km)")
     odometer_distance = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
                                            help_text="Distance from odometer (km)")
     variance_percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True,
@@ -103,28 +125,55 @@ class GPSTrackingSession(models.Model):
     def __str__(self):
         return f"GPS Session for Trip #{self.trip_id} - {self.status}"
     
+    def compute_distance_km(self):
+        """
+        Recompute the full-precision distance (km) from all stored GPS points.
+        O(n) in the number of points; used for reconciliation and back-fills.
+        """
+        lats, lons = geo.track_arrays(self.trip.gps_locations.order_by('timestamp'))
+        return geo.path_distance_km(lats, lons)
+    
     def calculate_gps_distance(self):
         """
         Calculate total distance from all GPS points in this session
         """
-        locations = self.trip.gps_locations.order_by('timestamp')
-        
-        if locations.count() < 2:
-            return Decimal('0.00')
-        
-        total_distance = Decimal('0.00')
-        prev_location = None
-        
-        for location in locations:
-            if prev_location:
-                distance = TripLocation.calculate_distance(
-                    prev_location.latitude, prev_location.longitude,
-                    location.latitude, location.longitude
-                )
-                total_distance += Decimal(str(distance))
-            prev_location = location
-        
-        return round(total_distance, 2)
+        return round(Decimal(str(self.compute_distance_km())), 2)
+    
+    COUNTER_FIELDS = ['total_points', 'valid_points', 'gaps_detected', 'longest_gap_seconds', 'running_distance_km']
+    
+    def add_points(self, points, valid_points=0, gaps_detected=0, longest_gap_seconds=0, distance_km=0.0):
+        """
+        Add newly stored points to the statistics and the running odometer.
+        Done in one UPDATE with F() expressions so concurrent uploads for the
+        same trip (e.g. a retried batch racing the original) both count; the
+        counters on this instance are reloaded afterwards.
+        """
+        GPSTrackingSession.objects.filter(pk=self.pk).update(
+            total_points=F('total_points') + points,
+            valid_points=F('valid_points') + valid_points,
+            gaps_detected=F('gaps_detected') + gaps_detected,
+            longest_gap_seconds=Greatest('longest_gap_seconds', Value(int(longest_gap_seconds))),
+            running_distance_km=F('running_distance_km') + float(distance_km),
+        )
+        self.refresh_from_db(fields=self.COUNTER_FIELDS)
+    
+    @staticmethod
+    def hop_distance(prev_point, latitude, longitude):
+        """Distance (km) from ``prev_point`` (a dict with latitude/longitude, or None) to a new point."""
+        if not prev_point:
+            return 0.0
+        return TripLocation.calculate_distance(prev_point['latitude'], prev_point['longitude'], latitude, longitude)
+    
+    def current_gps_distance(self):
+        """
+        Total GPS distance in O(1) from the running odometer.
+        Sessions created before the odometer existed are backfilled by
+        migration 0023; any left with zero running distance but several
+        points fall back to a full recalculation.
+        """
+        if not self.running_distance_km and self.total_points > 1:
+            self.running_distance_km = self.compute_distance_km()
+        return round(Decimal(str(self.running_distance_km)), 2)
     
     def validate_trip(self):
         """
@@ -141,25 +190,136 @@ class GPSTrackingSession(models.Model):
             self.variance_percentage = Decimal('0.00')
         
         # Flag for review based on variance
-        reasons = []
-        
-        if self.variance_percentage > 15:
-            self.requires_review = True
-            reasons.append(f"High variance: {self.variance_percentage}% difference between GPS and odometer")
-        
-        if self.total_points < 10:
-            self.requires_review = True
-            reasons.append(f"Insufficient GPS data: Only {self.total_points} points collected")
-        
-        if self.gaps_detected > 5:
-            self.requires_review = True
-            reasons.append(f"Multiple GPS signal losses: {self.gaps_detected} gaps detected")
-        
-        if self.longest_gap_seconds > 300:  # 5 minutes
-            self.requires_review = True
-            reasons.append(f"Long GPS gap: {self.longest_gap_seconds // 60} minutes without signal")
-        
+        reasons = review_reasons(
+            self.variance_percentage, self.total_points, self.gaps_detected, self.longest_gap_seconds
+        )
         if reasons:
+            self.requires_review = True
             self.review_reason = "\n".join(reasons)
         
         self.save()
+
+
+class TripRouteArtifact(models.Model):
+    """
+    Precomputed route of a finished trip, so map views load one row instead
+    of re-reading every TripLocation. Built by ``trips.route_artifacts`` when
+    GPS tracking is finalized (or lazily on first view) and deleted whenever
+    the trip's points change.
+    """
+    trip = models.OneToOneField('Trip', on_delete=models.CASCADE, related_name='route_artifact')
+    point_count = models.IntegerField(help_text="Number of GPS points in the stored track")
+    track = models.BinaryField(help_text="Full track packed by trips.route_formats.encode_binary")
+    
+    # Simplified overview for map thumbnails / initial render
+    polyline = models.TextField(blank=True, help_text="Google encoded polyline of the simplified route")
+    polyline_points = models.IntegerField(default=0)
+    tolerance_m = models.FloatField(default=0, help_text="Simplification tolerance used for the polyline")
+    
+    min_lat = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    min_lon = models.FloatField(null=True, blank=True)
+    max_lon = models.FloatField(null=True, blank=True)
+    
+    distance_km = models.FloatField(default=0, help_text="Path distance of the stored track (km)")
+    duration_seconds = models.IntegerField(default=0)
+    max_speed_kmh = models.FloatField(null=True, blank=True)
+    speed_histogram = models.JSONField(default=list, help_text="Seconds spent per speed band")
+    stops = models.JSONField(default=list, help_text="Stationary periods along the route")
+    
+    built_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Route artifact for Trip #{self.trip_id} ({self.point_count} points)"
+    
+    @property
+    def bounding_box(self):
+        if self.min_lat is None:
+            return None
+        return {
+            'min_lat': self.min_lat,
+            'max_lat': self.max_lat,
+            'min_lon': self.min_lon,
+            'max_lon': self.max_lon,
+        }
+
+
+class TripLivePosition(models.Model):
+    """
+    Latest GPS fix of an ongoing trip, denormalized from TripLocation so the
+    live tracking map reads one row per trip instead of searching each
+    trip's points. Upserted by the GPS ingest endpoints (``record``) and
+    deleted when the trip ends (``trips.signals``).
+    """
+    trip = models.OneToOneField('Trip', on_delete=models.CASCADE, related_name='live_position')
+    latitude = models.DecimalField(max_digits=10, decimal_places=7)
+    longitude = models.DecimalField(max_digits=10, decimal_places=7)
+    speed = models.FloatField(null=True, blank=True, help_text="Speed in km/h")
+    accuracy = models.FloatField(null=True, blank=True, help_text="GPS accuracy in meters")
+    battery_level = models.IntegerField(null=True, blank=True, help_text="Device battery percentage")
+    timestamp = models.DateTimeField()
+    
+    def __str__(self):
+        return f"Live position of Trip #{self.trip_id} at {self.timestamp.strftime('%H:%M:%S')}"
+    
+    @classmethod
+    def record(cls, trip_id, latitude, longitude, timestamp, speed=None, accuracy=None, battery_level=None):
+        """Insert or overwrite the trip's live position in a single query."""
+        # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target.
+        unique_fields = ['trip'] if connection.features.supports_update_conflicts_with_target else None
+        cls.objects.bulk_create(
+            [cls(
+                trip_id=trip_id, latitude=latitude, longitude=longitude, speed=speed,
+                accuracy=accuracy, battery_level=battery_level, timestamp=timestamp,
+            )],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['latitude', 'longitude', 'speed', 'accuracy', 'battery_level', 'timestamp'],
+        )
+
+
+class TripOdometerCheck(models.Model):
+    """
+    Odometer distance of a completed trip checked against the vehicle's
+    AiroTrack LocationHistory over the trip window, for fleet trips that
+    were not tracked by the app. Written in bulk by the
+    ``validate_trip_odometer`` command (``trips.odometer_check``); the
+    statistics and review flags match ``GPSTrackingSession``'s.
+    """
+    trip = models.OneToOneField('Trip', on_delete=models.CASCADE, related_name='odometer_check')
+    total_points = models.IntegerField(default=0, help_text="LocationHistory points inside the trip window")
+    gaps_detected = models.IntegerField(default=0, help_text="Number of signal loss gaps")
+    longest_gap_seconds = models.IntegerField(default=0, help_text="Longest gap without GPS")
+    gps_distance = models.DecimalField(max_digits=10, decimal_places=2,
+                                       help_text="Distance from AiroTrack history (km)")
+    odometer_distance = models.DecimalField(max_digits=10, decimal_places=2,
+                                            help_text="Distance from odometer (km)")
+    variance_percentage = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True,
+                                              help_text="Percentage difference")
+    requires_review = models.BooleanField(default=False, help_text="Needs admin review")
+    review_reason = models.TextField(blank=True, help_text="Reason for review requirement")
+    checked_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Odometer check for Trip #{self.trip_id}"
+
+class DirectionsRouteCache(models.Model):
+    """
+    Google Directions result for a trip's sampled waypoints, so the trip map
+    calls the API once per route instead of on every page view.
+    See ``trips.directions``.
+    """
+    trip = models.ForeignKey('Trip', on_delete=models.CASCADE, related_name='directions_routes')
+    waypoint_hash = models.CharField(max_length=40, help_text="SHA-1 of the sampled origin/waypoints/destination")
+    encoded_polyline = models.TextField(blank=True)
+    distance_m = models.IntegerField(default=0)
+    duration_s = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'waypoint_hash'], name='directions_trip_hash_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"Directions route for Trip #{self.trip_id}"
@@ -10,10 +10,14 @@ from django.shortcuts import render, get_object_or_404
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 import json
-import requests
 from decimal import Decimal
 from .models import Trip
-from .gps_models import TripLocation, GPSTrackingSession
+from .gps_models import TripLocation, GPSTrackingSession, TripLivePosition
+from .gps_cache import forget_last_point, get_last_point, remember_last_point
+from .route_artifacts import finalize_trip_route, invalidate_route_artifact, route_is_final, route_rows
+from .directions import get_directions_route, sample_route_points
+from core import geo, live_feed
+from geolocation.geofence import safe_process_positions
 
 
 @require_http_methods(["POST"])
@@ -58,6 +62,8 @@ def record_gps_location(request):
             defaults={'status': 'active'}
         )
         
+        last_point = get_last_point(trip.id)
+        
         # Create location record
         location = TripLocation.objects.create(
             trip=trip,
@@ -70,25 +76,34 @@ def record_gps_location(request):
             battery_level=int(data.get('battery_level')) if data.get('battery_level') else None,
             timestamp=timezone.now()
         )
+        remember_last_point(trip.id, location.latitude, location.longitude, location.timestamp)
+        TripLivePosition.record(
+            trip.id, location.latitude, location.longitude, location.timestamp, location.speed,
+            location.accuracy, location.battery_level,
+        )
+        live_feed.publish('trips', [trip.id])
+        safe_process_positions(
+            [(trip.vehicle_id, location.latitude, location.longitude, location.timestamp, trip.id)], 'trip'
+        )
         
         # Update session statistics
-        gps_session.total_points += 1
-        if location.accuracy < 50:  # Consider points with accuracy < 50m as valid
-            gps_session.valid_points += 1
+        valid_points = 1 if location.accuracy < 50 else 0  # Consider points with accuracy < 50m as valid
+        gaps_detected = longest_gap = 0
         
         # Check for gaps (if last point was more than 60 seconds ago)
-        last_location = TripLocation.objects.filter(
-            trip=trip
-        ).exclude(id=location.id).order_by('-timestamp').first()
-        
-        if last_location:
-            gap_seconds = (location.timestamp - last_location.timestamp).total_seconds()
+        if last_point:
+            gap_seconds = (location.timestamp - last_point['timestamp']).total_seconds()
             if gap_seconds > 60:  # More than 1 minute gap
-                gps_session.gaps_detected += 1
-                if gap_seconds > gps_session.longest_gap_seconds:
-                    gps_session.longest_gap_seconds = int(gap_seconds)
+                gaps_detected = 1
+                longest_gap = int(gap_seconds)
         
-        gps_session.save()
+        gps_session.add_points(
+            1, valid_points, gaps_detected, longest_gap,
+            GPSTrackingSession.hop_distance(last_point, location.latitude, location.longitude),
+        )
+        if route_is_final(trip, gps_session):
+            # Tracking was already finalized or the trip ended; the precomputed route is stale.
+            invalidate_route_artifact(trip.id)
         
         return JsonResponse({
             'success': True,
@@ -147,9 +162,9 @@ def finalize_gps_tracking(request, trip_id):
             session.status = 'completed'
             session.ended_at = timezone.now()
             
-            # Calculate GPS distance
+            # GPS distance comes from the running odometer (O(1))
             try:
-                gps_dist = session.calculate_gps_distance()
+                gps_dist = session.current_gps_distance()
                 session.gps_distance = gps_dist
             except Exception as e:
                 print(f"Error calculating GPS distance: {e}")
@@ -174,6 +189,11 @@ def finalize_gps_tracking(request, trip_id):
                 print(f"Error validating trip: {e}")
             
             session.save()
+            forget_last_point(trip.id)  # No more pings to dedupe
+            
+            # The route is final now; precompute what the map views need
+            # (the session is already completed, so this only builds the artifact).
+            finalize_trip_route(trip)
             
             return JsonResponse({
                 'success': True,
@@ -204,42 +224,28 @@ def get_google_route(request, trip_id):
     """
     Get road-snapped route using Google Directions API
     Returns route polyline that follows actual roads
+
+    Routes are cached per trip and sampled waypoints (see trips.directions),
+    so repeat views do not call Google. Pass ?include_points=1 to also get
+    the raw GPS points.
     """
     try:
-        trip = Trip.objects.get(id=trip_id)
+        trip = Trip.objects.select_related('driver', 'vehicle').get(id=trip_id)
         
         # Ownership/role check: only the trip driver or admin/manager can view the route
         allowed_types = ['admin', 'manager', 'vehicle_manager']
         if trip.driver != request.user and request.user.user_type not in allowed_types:
             return JsonResponse({'success': False, 'error': 'You do not have permission to view this route'}, status=403)
         
-        # Get GPS locations for this trip
-        gps_locations = TripLocation.objects.filter(trip=trip).order_by('timestamp')
+        # Origin, destination and up to 23 waypoints, strided in the DB
+        sampled_points = sample_route_points(trip.id)
         
-        if not gps_locations.exists():
+        if not sampled_points:
             return JsonResponse({
                 'success': False,
                 'error': 'No GPS data available for this trip'
             }, status=404)
         
-        # Get start and end points
-        first_point = gps_locations.first()
-        last_point = gps_locations.last()
-        
-        origin = f"{first_point.latitude},{first_point.longitude}"
-        destination = f"{last_point.latitude},{last_point.longitude}"
-        
-        # Build waypoints from intermediate GPS points (sample every nth point to stay under API limits)
-        waypoints = []
-        total_points = gps_locations.count()
-        
-        if total_points > 2:
-            # Google allows max 25 waypoints, sample accordingly
-            step = max(1, (total_points - 2) // 23)
-            intermediate_points = list(gps_locations)[1:-1:step][:23]
-            waypoints = [f"{p.latitude},{p.longitude}" for p in intermediate_points]
-        
-        # Call Google Directions API
         api_key = getattr(settings, 'GOOGLE_MAPS_API_KEY', '')
         if not api_key:
             return JsonResponse({
@@ -247,69 +253,44 @@ def get_google_route(request, trip_id):
                 'error': 'Google Maps API key not configured'
             }, status=500)
         
-        params = {
-            'origin': origin,
-            'destination': destination,
-            'key': api_key,
-            'mode': 'driving',
-        }
-        
-        if waypoints:
-            params['waypoints'] = '|'.join(waypoints)
+        route, directions_status = get_directions_route(trip, sampled_points, api_key)
         
-        response = requests.get(
-            'https://maps.googleapis.com/maps/api/directions/json',
-            params=params,
-            timeout=30
-        )
-        
-        data = response.json()
-        
-        if data.get('status') != 'OK':
+        if route is None:
             # Fallback to raw GPS polyline if Directions API fails
-            raw_points = [
-                {'lat': float(p.latitude), 'lng': float(p.longitude)}
-                for p in gps_locations
-            ]
+            gps_rows = route_rows(trip)
+            raw_points = [{'lat': float(p[0]), 'lng': float(p[1])} for p in gps_rows]
             return JsonResponse({
                 'success': True,
                 'fallback': True,
-                'message': f"Google Directions API: {data.get('status')}. Using raw GPS points.",
+                'message': f"Google Directions API: {directions_status}. Using raw GPS points.",
                 'route_points': raw_points,
-                'distance_km': calculate_gps_distance(gps_locations),
+                'distance_km': calculate_gps_distance(gps_rows),
                 'trip_info': get_trip_info(trip)
             })
         
-        # Extract route information
-        route = data['routes'][0]
-        legs = route['legs']
-        
-        # Decode the overview polyline
-        overview_polyline = route.get('overview_polyline', {}).get('points', '')
-        decoded_points = decode_polyline(overview_polyline) if overview_polyline else []
-        
-        # Calculate total distance and duration from legs
-        total_distance_m = sum(leg['distance']['value'] for leg in legs)
-        total_duration_s = sum(leg['duration']['value'] for leg in legs)
-        
-        return JsonResponse({
+        overview_polyline = route.encoded_polyline
+        data = {
             'success': True,
             'fallback': False,
-            'route_points': decoded_points,
+            'route_points': decode_polyline(overview_polyline) if overview_polyline else [],
             'encoded_polyline': overview_polyline,
-            'distance_km': round(total_distance_m / 1000, 2),
-            'duration_minutes': round(total_duration_s / 60, 1),
+            'distance_km': round(route.distance_m / 1000, 2),
+            'duration_minutes': round(route.duration_s / 60, 1),
             'trip_info': get_trip_info(trip),
-            'gps_points': [
+        }
+        
+        if request.GET.get('include_points') == '1':
+            data['gps_points'] = [
                 {
-                    'lat': float(p.latitude),
-                    'lng': float(p.longitude),
-                    'timestamp': p.timestamp.isoformat(),
-                    'speed': p.speed
+                    'lat': float(lat),
+                    'lng': float(lng),
+                    'timestamp': timestamp.isoformat(),
+                    'speed': speed
                 }
-                for p in gps_locations
+                for lat, lng, accuracy, speed, timestamp in route_rows(trip)
             ]
-        })
+        
+        return JsonResponse(data)
         
     except Trip.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Trip not found'}, status=404)
@@ -360,34 +341,11 @@ def decode_polyline(encoded):
     return points
 
 
-def calculate_gps_distance(gps_locations):
-    """Calculate total distance from GPS points using Haversine formula"""
-    import math
-    
-    total_distance = 0
-    locations = list(gps_locations)
-    
-    for i in range(1, len(locations)):
-        lat1 = float(locations[i-1].latitude)
-        lon1 = float(locations[i-1].longitude)
-        lat2 = float(locations[i].latitude)
-        lon2 = float(locations[i].longitude)
-        
-        # Haversine formula
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
-        
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
-        
-        a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        
-        total_distance += 6371 * c  # Earth's radius in km
-    
-    return round(total_distance, 2)
+def calculate_gps_distance(gps_rows):
+    """Calculate total distance (km) from ordered (latitude, longitude, ...) rows"""
+    lats = geo.as_float_array([row[0] for row in gps_rows])
+    lons = geo.as_float_array([row[1] for row in gps_rows])
+    return round(geo.path_distance_km(lats, lons), 2)
 
 
 def get_trip_info(trip):
@@ -414,19 +372,16 @@ class TripGoogleMapView(LoginRequiredMixin, View):
     def get(self, request, pk):
         trip = get_object_or_404(Trip, id=pk)
         
-        # Get GPS locations
-        gps_locations = TripLocation.objects.filter(trip=trip).order_by('timestamp')
-        
         # Prepare GPS points for JavaScript
         gps_points = [
             {
-                'lat': float(p.latitude),
-                'lng': float(p.longitude),
-                'timestamp': p.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                'speed': p.speed,
-                'accuracy': p.accuracy
+                'lat': float(lat),
+                'lng': float(lng),
+                'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                'speed': speed,
+                'accuracy': accuracy
             }
-            for p in gps_locations
+            for lat, lng, accuracy, speed, timestamp in route_rows(trip)
         ]
         
         context = {
@@ -457,18 +412,16 @@ def get_trip_locations(request, trip_id):
         if user.user_type not in allowed_types and trip.driver != user:
             return JsonResponse({'error': 'Permission denied'}, status=403)
         
-        # Get GPS locations for the trip
-        locations = TripLocation.objects.filter(trip=trip).order_by('timestamp')
-        
+        # Get GPS locations for the trip (route artifact for finished trips)
         location_data = [
             {
-                'latitude': float(loc.latitude),
-                'longitude': float(loc.longitude),
-                'accuracy': loc.accuracy,
-                'speed': loc.speed,
-                'timestamp': loc.timestamp.isoformat() if loc.timestamp else None
+                'latitude': float(lat),
+                'longitude': float(lng),
+                'accuracy': accuracy,
+                'speed': speed,
+                'timestamp': timestamp.isoformat() if timestamp else None
             }
-            for loc in locations
+            for lat, lng, accuracy, speed, timestamp in route_rows(trip)
         ]
         
         return JsonResponse(location_data, safe=False)
@@ -0,0 +1,115 @@
+"""Benchmark the GPS batch ingest path against the old per-point INSERT loop.
+
+Generates a synthetic buffered upload (a vehicle driving at ~40 km/h with
+one ping every ``--interval-seconds``) and writes it for an existing trip
+twice: once with one ``TripLocation.objects.create()`` per point (the old
+``GPSBatchRecordView`` behaviour) and once through ``ingest_gps_batch``.
+
+Everything runs inside a transaction that is rolled back, so it is safe to
+point at any trip:
+
+    python manage.py benchmark_gps_ingest --points 2000 --trip-id 123
+"""
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+
+class _Rollback(Exception):
+    pass
+
+
+def synthetic_payload(points, interval_seconds=10, start=None, seed=42):
+    """Build a list of mobile-style point dicts along a wandering track."""
+    rng = random.Random(seed)
+    start = start or timezone.now() - timedelta(seconds=points * interval_seconds)
+    lat, lon = 13.0827, 80.2707  # Chennai
+    payload = []
+    for i in range(points):
+        # ~110 m per step at the equator for 0.001 deg.
+        lat += rng.uniform(-0.0004, 0.001)
+        lon += rng.uniform(-0.0004, 0.001)
+        ts = start + timedelta(seconds=i * interval_seconds)
+        payload.append({
+            'latitude': round(lat, 7),
+            'longitude': round(lon, 7),
+            'accuracy': rng.uniform(3, 80),
+            'speed': rng.uniform(0, 60),
+            'heading': rng.uniform(0, 360),
+            'battery_level': 80,
+            'timestamp': int(ts.timestamp() * 1000),
+        })
+    return payload
+
+
+class Command(BaseCommand):
+    help = "Compare points/sec of per-row GPS inserts vs the bulk ingest engine (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=2000,
+                            help='Number of synthetic points per run (default 2000).')
+        parser.add_argument('--interval-seconds', type=int, default=10,
+                            help='Seconds between synthetic pings (default 10).')
+        parser.add_argument('--trip-id', type=int, default=None,
+                            help='Trip to write against (default: most recent trip).')
+
+    def handle(self, *args, **opts):
+        from trips.models import Trip
+        from trips.gps_models import TripLocation, GPSTrackingSession
+        from trips.gps_ingest import ingest_gps_batch, parse_point_timestamp
+
+        if opts['trip_id']:
+            trip = Trip.objects.filter(pk=opts['trip_id']).first()
+        else:
+            trip = Trip.objects.order_by('-id').first()
+        if trip is None:
+            raise CommandError('No trip found to benchmark against.')
+
+        payload = synthetic_payload(opts['points'], opts['interval_seconds'])
+        self.stdout.write(f"Benchmarking {len(payload)} points against trip #{trip.id}...")
+
+        # Legacy path: one INSERT per point.
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                for loc in payload:
+                    TripLocation.objects.create(
+                        trip=trip,
+                        latitude=Decimal(str(loc['latitude'])),
+                        longitude=Decimal(str(loc['longitude'])),
+                        accuracy=float(loc['accuracy']),
+                        speed=float(loc['speed']),
+                        heading=float(loc['heading']),
+                        battery_level=int(loc['battery_level']),
+                        timestamp=parse_point_timestamp(loc['timestamp']),
+                    )
+                legacy_s = time.perf_counter() - started
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        # Bulk path.
+        try:
+            with transaction.atomic():
+                session, _ = GPSTrackingSession.objects.get_or_create(
+                    trip=trip, defaults={'status': 'active'}
+                )
+                started = time.perf_counter()
+                result = ingest_gps_batch(trip, session, payload)
+                bulk_s = time.perf_counter() - started
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        n = len(payload)
+        self.stdout.write(f"  per-row create : {legacy_s:8.3f}s  {n / legacy_s:10.0f} pts/s")
+        self.stdout.write(
+            f"  bulk ingest    : {bulk_s:8.3f}s  {n / bulk_s:10.0f} pts/s  "
+            f"(saved {result['saved_count']}, rejected {len(result['rejected'])})"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {legacy_s / bulk_s:.1f}x"))
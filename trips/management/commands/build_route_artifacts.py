@@ -0,0 +1,50 @@
+"""Precompute `TripRouteArtifact` rows for finished trips.
+
+Artifacts are normally written when GPS tracking is finalized, or lazily on
+the first map view of a finished trip. Run this after deploying (or after a
+bulk change to `trips_triplocation`) so historical maps load from a single
+row straight away.
+
+    python manage.py build_route_artifacts --days 90
+    python manage.py build_route_artifacts --trip-id 123 --rebuild
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Build precomputed route artifacts for completed/cancelled trips."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Only trips ended in the last N days (default 30, 0 = all).')
+        parser.add_argument('--trip-id', type=int, default=None,
+                            help='Build a single trip regardless of age.')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild artifacts that already exist.')
+
+    def handle(self, *args, **opts):
+        from trips.models import Trip
+        from trips.route_artifacts import ARTIFACT_TRIP_STATUSES, build_route_artifact
+
+        trips = Trip.objects.filter(status__in=ARTIFACT_TRIP_STATUSES).order_by('id')
+        if opts['trip_id']:
+            trips = trips.filter(id=opts['trip_id'])
+        elif opts['days']:
+            trips = trips.filter(end_time__gte=timezone.now() - timedelta(days=opts['days']))
+        if not opts['rebuild']:
+            trips = trips.filter(route_artifact__isnull=True)
+
+        built = 0
+        empty = 0
+        for trip in trips.iterator(chunk_size=200):
+            if build_route_artifact(trip) is None:
+                empty += 1
+            else:
+                built += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Built {built} route artifacts ({empty} trips had no GPS points)."
+        ))
@@ -0,0 +1,74 @@
+"""Compare each session's running GPS odometer against its raw points.
+
+`GPSTrackingSession.running_distance_km` is advanced incrementally as the
+ingest endpoints accept points, so trip finalisation no longer reloads the
+whole track. This command recomputes the distance from the stored
+`TripLocation` rows and reports sessions whose running value drifted by
+more than ``--tolerance-km``. With ``--fix`` the running value (and, for
+completed sessions, ``gps_distance``) is overwritten with the recomputed one.
+
+Note: trips already thinned by ``downsample_trip_locations`` will naturally
+recompute shorter than what was recorded live, so by default only sessions
+that started within ``--days`` are checked.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Recompute GPS distance from raw points and report drift of the running odometer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help='Only check sessions started in the last N days (default 7).')
+        parser.add_argument('--trip-id', type=int, default=None,
+                            help='Check a single trip regardless of age.')
+        parser.add_argument('--tolerance-km', type=float, default=0.05,
+                            help='Report drift above this many km (default 0.05).')
+        parser.add_argument('--fix', action='store_true',
+                            help='Overwrite drifting sessions with the recomputed distance.')
+
+    def handle(self, *args, **opts):
+        from trips.gps_models import GPSTrackingSession
+
+        sessions = GPSTrackingSession.objects.select_related('trip').order_by('id')
+        if opts['trip_id']:
+            sessions = sessions.filter(trip_id=opts['trip_id'])
+        else:
+            cutoff = timezone.now() - timedelta(days=opts['days'])
+            sessions = sessions.filter(started_at__gte=cutoff)
+
+        tolerance = opts['tolerance_km']
+        checked = 0
+        drifted = 0
+        max_drift = 0.0
+
+        for session in sessions.iterator(chunk_size=200):
+            checked += 1
+            actual = session.compute_distance_km()
+            drift = session.running_distance_km - actual
+            max_drift = max(max_drift, abs(drift))
+            if abs(drift) <= tolerance:
+                continue
+
+            drifted += 1
+            self.stdout.write(
+                f"  Trip #{session.trip_id}: running {session.running_distance_km:.3f} km, "
+                f"recomputed {actual:.3f} km (drift {drift:+.3f} km)"
+            )
+            if opts['fix']:
+                session.running_distance_km = actual
+                update_fields = ['running_distance_km']
+                if session.status == 'completed':
+                    session.gps_distance = round(Decimal(str(actual)), 2)
+                    update_fields.append('gps_distance')
+                session.save(update_fields=update_fields)
+
+        verb = 'Fixed' if opts['fix'] else 'Found'
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Checked {checked} sessions. {verb} {drifted} drifting by more than "
+            f"{tolerance} km (max drift {max_drift:.3f} km)."
+        ))
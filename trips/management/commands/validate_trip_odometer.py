@@ -0,0 +1,52 @@
+"""Check completed trips' odometer distance against AiroTrack history.
+
+App-tracked trips are validated when GPS tracking ends
+(`GPSTrackingSession.validate_trip`). Fleet vehicles with an AiroTrack
+device have `LocationHistory` covering their trips instead; this command
+compares it with the odometer distance of every completed trip that ended
+in the range and stores the result in `TripOdometerCheck`, flagging trips
+for review with the same rules. Re-running overwrites earlier checks.
+
+Usage:
+    python manage.py validate_trip_odometer                  # trips ended in the last day
+    python manage.py validate_trip_odometer --days 30
+    python manage.py validate_trip_odometer --since 2026-01-01 --until 2026-02-01 --vehicle 12
+"""
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Compare completed trips' odometer distance with AiroTrack LocationHistory and flag variances."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1,
+                            help='Check trips that ended in the last N days (default 1).')
+        parser.add_argument('--since', help='Start of the range (YYYY-MM-DD, local time); overrides --days.')
+        parser.add_argument('--until', help='End of the range, exclusive (YYYY-MM-DD, default now).')
+        parser.add_argument('--vehicle', type=int, action='append',
+                            help='Only this vehicle id (repeatable).')
+
+    def handle(self, *args, **opts):
+        from trips.odometer_check import check_trips
+
+        until = self._date(opts['until'], '--until') or timezone.now()
+        since = self._date(opts['since'], '--since') or until - timedelta(days=opts['days'])
+        if since >= until:
+            raise CommandError("--since must be before --until")
+
+        checked, flagged = check_trips(since, until, opts['vehicle'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Checked {checked} trips between {since:%Y-%m-%d %H:%M} and "
+            f"{until:%Y-%m-%d %H:%M}; {flagged} flagged for review."
+        ))
+
+    def _date(self, value, option):
+        if not value:
+            return None
+        try:
+            return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+        except ValueError:
+            raise CommandError(f"{option} must be YYYY-MM-DD")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0017_trip_trip_driver_status_time_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpstrackingsession',
+            name='running_distance_km',
+            field=models.FloatField(default=0, help_text='GPS odometer accumulated as points are accepted (km)'),
+        ),
+    ]
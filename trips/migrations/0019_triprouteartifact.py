@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0018_gpstrackingsession_running_distance_km'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripRouteArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('point_count', models.IntegerField(help_text='Number of GPS points in the stored track')),
+                ('track', models.BinaryField(help_text='Full track packed by trips.route_formats.encode_binary')),
+                ('polyline', models.TextField(blank=True, help_text='Google encoded polyline of the simplified route')),
+                ('polyline_points', models.IntegerField(default=0)),
+                ('tolerance_m', models.FloatField(default=0, help_text='Simplification tolerance used for the polyline')),
+                ('min_lat', models.FloatField(blank=True, null=True)),
+                ('max_lat', models.FloatField(blank=True, null=True)),
+                ('min_lon', models.FloatField(blank=True, null=True)),
+                ('max_lon', models.FloatField(blank=True, null=True)),
+                ('distance_km', models.FloatField(default=0, help_text='Path distance of the stored track (km)')),
+                ('duration_seconds', models.IntegerField(default=0)),
+                ('max_speed_kmh', models.FloatField(blank=True, null=True)),
+                ('speed_histogram', models.JSONField(default=list, help_text='Seconds spent per speed band')),
+                ('stops', models.JSONField(default=list, help_text='Stationary periods along the route')),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='route_artifact', to='trips.trip')),
+            ],
+        ),
+    ]
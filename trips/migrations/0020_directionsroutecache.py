@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0019_triprouteartifact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectionsRouteCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('waypoint_hash', models.CharField(help_text='SHA-1 of the sampled origin/waypoints/destination', max_length=40)),
+                ('encoded_polyline', models.TextField(blank=True)),
+                ('distance_m', models.IntegerField(default=0)),
+                ('duration_s', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='directions_routes', to='trips.trip')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trip', 'waypoint_hash'), name='directions_trip_hash_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_live_positions(apps, schema_editor):
+    """Seed live positions for trips already in progress at deploy time."""
+    Trip = apps.get_model('trips', 'Trip')
+    TripLocation = apps.get_model('trips', 'TripLocation')
+    TripLivePosition = apps.get_model('trips', 'TripLivePosition')
+    positions = []
+    for trip_id in Trip.objects.filter(status='ongoing').values_list('id', flat=True):
+        point = TripLocation.objects.filter(trip_id=trip_id).order_by('-timestamp').first()
+        if point:
+            positions.append(TripLivePosition(
+                trip_id=trip_id, latitude=point.latitude, longitude=point.longitude,
+                speed=point.speed, timestamp=point.timestamp,
+            ))
+    TripLivePosition.objects.bulk_create(positions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0020_directionsroutecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripLivePosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('longitude', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('speed', models.FloatField(blank=True, help_text='Speed in km/h', null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='live_position', to='trips.trip')),
+            ],
+        ),
+        migrations.RunPython(backfill_live_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0021_tripliveposition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripOdometerCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_points', models.IntegerField(default=0, help_text='LocationHistory points inside the trip window')),
+                ('gaps_detected', models.IntegerField(default=0, help_text='Number of signal loss gaps')),
+                ('longest_gap_seconds', models.IntegerField(default=0, help_text='Longest gap without GPS')),
+                ('gps_distance', models.DecimalField(decimal_places=2, help_text='Distance from AiroTrack history (km)', max_digits=10)),
+                ('odometer_distance', models.DecimalField(decimal_places=2, help_text='Distance from odometer (km)', max_digits=10)),
+                ('variance_percentage', models.DecimalField(blank=True, decimal_places=2, help_text='Percentage difference', max_digits=7, null=True)),
+                ('requires_review', models.BooleanField(default=False, help_text='Needs admin review')),
+                ('review_reason', models.TextField(blank=True, help_text='Reason for review requirement')),
+                ('checked_at', models.DateTimeField(auto_now=True)),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='odometer_check', to='trips.trip')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def backfill_running_distance(apps, schema_editor):
+    """Running GPS odometer for sessions recorded before the field existed."""
+    from core import geo
+    GPSTrackingSession = apps.get_model('trips', 'GPSTrackingSession')
+    TripLocation = apps.get_model('trips', 'TripLocation')
+    sessions = GPSTrackingSession.objects.filter(running_distance_km=0, total_points__gt=1).only('id', 'trip_id')
+    batch = []
+    for session in sessions.iterator(chunk_size=BATCH_SIZE):
+        lats, lons = geo.track_arrays(TripLocation.objects.filter(trip_id=session.trip_id).order_by('timestamp'))
+        session.running_distance_km = geo.path_distance_km(lats, lons)
+        if session.running_distance_km:
+            batch.append(session)
+        if len(batch) >= BATCH_SIZE:
+            GPSTrackingSession.objects.bulk_update(batch, ['running_distance_km'])
+            batch = []
+    GPSTrackingSession.objects.bulk_update(batch, ['running_distance_km'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0022_tripodometercheck'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_running_distance, migrations.RunPython.noop),
+    ]
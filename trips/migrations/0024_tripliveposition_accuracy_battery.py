@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:45
+
+from django.db import migrations, models
+
+
+def backfill_accuracy_battery(apps, schema_editor):
+    """Copy accuracy and battery of the latest point onto existing live positions."""
+    TripLivePosition = apps.get_model('trips', 'TripLivePosition')
+    TripLocation = apps.get_model('trips', 'TripLocation')
+    positions = list(TripLivePosition.objects.all())
+    for position in positions:
+        point = TripLocation.objects.filter(trip_id=position.trip_id).order_by('-timestamp').first()
+        if point:
+            position.accuracy = point.accuracy
+            position.battery_level = point.battery_level
+    TripLivePosition.objects.bulk_update(positions, ['accuracy', 'battery_level'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0023_backfill_running_distance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripliveposition',
+            name='accuracy',
+            field=models.FloatField(blank=True, help_text='GPS accuracy in meters', null=True),
+        ),
+        migrations.AddField(
+            model_name='tripliveposition',
+            name='battery_level',
+            field=models.IntegerField(blank=True, help_text='Device battery percentage', null=True),
+        ),
+        migrations.RunPython(backfill_accuracy_battery, migrations.RunPython.noop),
+    ]
@@ -5,7 +5,10 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.apps import apps  # Lazy model lookup to avoid circular imports
 # Import GPS tracking models
-from .gps_models import TripLocation, GPSTrackingSession
+from .gps_models import (
+    TripLocation, GPSTrackingSession, TripRouteArtifact, DirectionsRouteCache, TripLivePosition,
+    TripOdometerCheck,
+)
 
 # Lazy reference to ConsultantRate to prevent circular-import issues.
 # Will be resolved the first time it's actually needed.
@@ -25,6 +28,11 @@ class Trip(models.Model):
         ('manual', 'Manual Entry'),
     )
     
+    # Stored values save() loads before overwriting the row: the live map
+    # (status), the daily rollups (day / vehicle / driver) and the driver
+    # hours charts (driver) compare against them after the save.
+    OLD_VALUE_FIELDS = ('status', 'start_time', 'vehicle_id', 'driver_id')
+    
     vehicle = models.ForeignKey(
         Vehicle, 
         on_delete=models.CASCADE,
@@ -245,16 +253,16 @@ class Trip(models.Model):
         Handle manual entries differently from real-time trips.
         Uses select_for_update() to prevent race conditions on vehicle odometer.
         """
-        # Store the original status to detect changes
+        # Store the original row to detect changes; the post_save handlers
+        # of other apps read it too (see trips.signals.old_trip_values).
         original_status = None
         is_new_trip = not self.pk
+        self._trip_old_values = None
         
         if self.pk:
-            try:
-                original_trip = Trip.objects.get(pk=self.pk)
-                original_status = original_trip.status
-            except Trip.DoesNotExist:
-                pass
+            self._trip_old_values = Trip.objects.filter(pk=self.pk).values(*self.OLD_VALUE_FIELDS).first()
+            if self._trip_old_values:
+                original_status = self._trip_old_values['status']
         
         with transaction.atomic():
             # Re-fetch vehicle with a row lock to prevent concurrent odometer updates
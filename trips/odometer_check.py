@@ -0,0 +1,167 @@
+"""
+Bulk check of completed trips' odometer distance against AiroTrack
+LocationHistory.
+
+For each vehicle with completed trips in the range, the vehicle's history
+over the span of those trips is read once, in time order, as NumPy
+arrays. Trips are sorted by start time too, so each trip's window is
+found by a merge-join on the two sorted sequences (``searchsorted``)
+instead of a query per trip. Hop distances and gaps are computed once
+over the whole track; a trip's distance is then the difference of the
+cumulative distance at its window's ends and its gaps are counted from a
+cumulative gap count, so the per-trip work is constant.
+
+Results are upserted into ``TripOdometerCheck`` with the same variance
+and review rules as ``GPSTrackingSession.validate_trip``.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db import connection
+
+from core import geo
+from geolocation.airotrack_service import AiroTrackAPI
+from geolocation.models import LocationHistory
+
+from .gps_models import TripOdometerCheck, review_reasons
+from .models import Trip
+
+# History is heartbeat-suppressed while nothing changes, so a quiet
+# interval up to the heartbeat is expected; only longer ones are signal loss.
+GAP_SECONDS = AiroTrackAPI.HISTORY_HEARTBEAT_SECONDS + 60
+MAX_VARIANCE = Decimal('99999.99')
+
+CHECK_UPDATE_FIELDS = [
+    'total_points', 'gaps_detected', 'longest_gap_seconds', 'gps_distance',
+    'odometer_distance', 'variance_percentage', 'requires_review', 'review_reason',
+]
+
+
+def trips_to_check(since, until, vehicle_ids=None):
+    """Completed, odometer-closed trips ending in [since, until) on vehicles with a tracking device."""
+    trips = Trip.objects.filter(
+        status='completed',
+        is_deleted=False,
+        end_time__gte=since,
+        end_time__lt=until,
+        end_odometer__isnull=False,
+        vehicle__airotrack_device__isnull=False,
+    )
+    if vehicle_ids:
+        trips = trips.filter(vehicle_id__in=vehicle_ids)
+    return trips
+
+
+def match_trips(seconds, lats, lons, trips):
+    """
+    Per-trip statistics for one vehicle's track.
+
+    Args:
+        seconds, lats, lons: the vehicle's history as arrays sorted by time
+        trips: ``(trip_id, start_seconds, end_seconds)`` sorted by start
+
+    Returns:
+        dict: trip_id -> ``(points, distance_km, gaps, longest_gap_seconds)``
+    """
+    cumulative = geo.cumulative_distance_km(lats, lons) if len(seconds) else np.zeros(0)
+    hops = np.diff(seconds)
+    is_gap = hops > GAP_SECONDS
+    gap_count = np.concatenate(([0], np.cumsum(is_gap)))
+
+    starts = np.searchsorted(seconds, [start for _, start, _ in trips], side='left')
+    ends = np.searchsorted(seconds, [end for _, _, end in trips], side='right')
+
+    results = {}
+    for (trip_id, _, _), first, stop in zip(trips, starts, ends):
+        points = int(stop - first)
+        if points < 2:
+            results[trip_id] = (points, 0.0, 0, 0)
+            continue
+        last = stop - 1
+        window_hops = hops[first:last]
+        longest = int(window_hops.max())
+        results[trip_id] = (
+            points,
+            float(cumulative[last] - cumulative[first]),
+            int(gap_count[last] - gap_count[first]),
+            longest if longest > GAP_SECONDS else 0,
+        )
+    return results
+
+
+def build_check(trip, points, distance_km, gaps, longest_gap):
+    """Unsaved TripOdometerCheck for a trip and its track statistics."""
+    gps_distance = round(Decimal(str(distance_km)), 2)
+    odometer_distance = Decimal(trip.end_odometer - trip.start_odometer)
+    if odometer_distance > 0:
+        variance = abs(gps_distance - odometer_distance) / odometer_distance * 100
+        variance = min(round(variance, 2), MAX_VARIANCE)
+    else:
+        variance = Decimal('0.00')
+    reasons = review_reasons(variance, points, gaps, longest_gap)
+    return TripOdometerCheck(
+        trip_id=trip.id,
+        total_points=points,
+        gaps_detected=gaps,
+        longest_gap_seconds=longest_gap,
+        gps_distance=gps_distance,
+        odometer_distance=odometer_distance,
+        variance_percentage=variance,
+        requires_review=bool(reasons),
+        review_reason="\n".join(reasons),
+    )
+
+
+def _vehicle_track(vehicle_id, since, until):
+    rows = list(
+        LocationHistory.objects.filter(
+            vehicle_id=vehicle_id, device_time__gte=since, device_time__lte=until
+        )
+        .order_by('device_time', 'id')
+        .values_list('device_time', 'latitude', 'longitude')
+    )
+    return (
+        geo.epoch_seconds([row[0] for row in rows]),
+        geo.as_float_array([row[1] for row in rows]),
+        geo.as_float_array([row[2] for row in rows]),
+    )
+
+
+def save_checks(checks):
+    """Insert or overwrite the checks in one statement per batch."""
+    unique_fields = ['trip'] if connection.features.supports_update_conflicts_with_target else None
+    TripOdometerCheck.objects.bulk_create(
+        checks,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=CHECK_UPDATE_FIELDS + ['checked_at'],
+    )
+
+
+def check_trips(since, until, vehicle_ids=None):
+    """
+    Check every trip ending in [since, until) against its vehicle's history.
+    One query for the trips, one per vehicle for its history, and batched
+    upserts. Returns ``(checked, flagged)``.
+    """
+    by_vehicle = {}
+    for trip in trips_to_check(since, until, vehicle_ids).only(
+        'id', 'vehicle_id', 'start_time', 'end_time', 'start_odometer', 'end_odometer'
+    ).order_by('vehicle_id', 'start_time'):
+        by_vehicle.setdefault(trip.vehicle_id, []).append(trip)
+
+    checked = flagged = 0
+    for vehicle_id, trips in by_vehicle.items():
+        seconds, lats, lons = _vehicle_track(
+            vehicle_id, trips[0].start_time, max(trip.end_time for trip in trips)
+        )
+        windows = [
+            (trip.id, trip.start_time.timestamp(), trip.end_time.timestamp()) for trip in trips
+        ]
+        stats = match_trips(seconds, lats, lons, windows)
+        checks = [build_check(trip, *stats[trip.id]) for trip in trips]
+        save_checks(checks)
+        checked += len(checks)
+        flagged += sum(1 for check in checks if check.requires_review)
+    return checked, flagged
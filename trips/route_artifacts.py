@@ -0,0 +1,215 @@
+"""
+Precomputed route artifacts for finished trips.
+
+A completed trip's route does not change, yet every map view used to
+re-query and re-serialize all of its TripLocation rows. The artifact
+(``TripRouteArtifact``) keeps the packed track plus the derived data the
+maps need (simplified polyline, bbox, distance, speed histogram, stops),
+so a historical map load is a single-row lookup.
+
+Lifecycle:
+    - built when GPS tracking is finalized or the trip is ended through
+      the API (``finalize_trip_route``), or lazily on the first view of a
+      completed/cancelled trip that has none;
+    - only served while the trip is completed/cancelled (ongoing trips are
+      still growing);
+    - deleted by ``invalidate_route_artifact`` whenever the trip's points
+      change (downsampling, points arriving once ``route_is_final``);
+    - rebuilt from the cold-storage archive once ``archive_location_history``
+      has moved the trip's points out of ``TripLocation``.
+"""
+import logging
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.utils import timezone
+
+from core import geo
+
+from . import route_formats
+from .gps_cache import forget_last_point
+from .gps_models import GPSTrackingSession, TripLocation, TripRouteArtifact
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_TRIP_STATUSES = ('completed', 'cancelled')
+
+# Overview polyline tolerance; detailed views simplify the full track.
+ARTIFACT_TOLERANCE_M = 5.0
+
+# Speed bands (km/h) for the histogram; the last band is open-ended.
+SPEED_BANDS_KMH = (0, 5, 20, 40, 60, 80, 100, 120)
+
+STOP_RADIUS_M = 50.0
+STOP_MIN_SECONDS = 180
+
+
+def load_route_rows(trip_id):
+    """Route as ``(latitude, longitude, accuracy, speed, timestamp)`` tuples, oldest first."""
+    return list(
+        TripLocation.objects.filter(trip_id=trip_id)
+        .order_by('timestamp')
+        .values_list('latitude', 'longitude', 'accuracy', 'speed', 'timestamp')
+    )
+
+
+def _archived_route_rows(trip):
+    from geolocation.archive import archived_trip_rows
+    return archived_trip_rows(trip)
+
+
+def _speed_histogram(speeds_kmh, hop_seconds):
+    """Seconds spent in each SPEED_BANDS_KMH band, from per-hop speeds."""
+    edges = np.append(np.asarray(SPEED_BANDS_KMH, dtype=np.float64), np.inf)
+    valid = np.isfinite(speeds_kmh)
+    seconds, _ = np.histogram(speeds_kmh[valid], bins=edges, weights=hop_seconds[valid])
+    return [
+        {
+            'min_kmh': SPEED_BANDS_KMH[i],
+            'max_kmh': SPEED_BANDS_KMH[i + 1] if i + 1 < len(SPEED_BANDS_KMH) else None,
+            'seconds': int(round(seconds[i])),
+        }
+        for i in range(len(SPEED_BANDS_KMH))
+    ]
+
+
+def _stops(lats, lons, seconds, timestamps):
+    stops = []
+    for first, last in geo.find_stops(lats, lons, seconds, STOP_RADIUS_M, STOP_MIN_SECONDS):
+        stops.append({
+            'latitude': round(float(lats[first:last + 1].mean()), 7),
+            'longitude': round(float(lons[first:last + 1].mean()), 7),
+            'start': timestamps[first].isoformat(),
+            'end': timestamps[last].isoformat(),
+            'duration_seconds': int(seconds[last] - seconds[first]),
+        })
+    return stops
+
+
+def build_route_artifact(trip, rows=None):
+    """
+    (Re)build and store the artifact for ``trip``. ``rows`` may be passed
+    if the caller already loaded them via ``load_route_rows``.
+    Returns the artifact, or None if the trip has no GPS points.
+    """
+    if rows is None:
+        rows = load_route_rows(trip.id)
+        if not rows and trip.status in ARTIFACT_TRIP_STATUSES:
+            rows = _archived_route_rows(trip)
+    if not rows:
+        invalidate_route_artifact(trip.id)
+        return None
+
+    lats = geo.as_float_array([row[0] for row in rows])
+    lons = geo.as_float_array([row[1] for row in rows])
+    timestamps = [row[4] for row in rows]
+    seconds = geo.epoch_seconds(timestamps)
+    bbox = geo.bounding_box(lats, lons)
+
+    keep = geo.simplify_rdp(lats, lons, ARTIFACT_TOLERANCE_M)
+    speeds = geo.derive_speeds_kmh(lats, lons, seconds)
+    finite_speeds = speeds[np.isfinite(speeds)]
+
+    artifact, _ = TripRouteArtifact.objects.update_or_create(
+        trip=trip,
+        defaults={
+            'point_count': len(rows),
+            'track': route_formats.encode_binary(rows),
+            'polyline': route_formats.encode_polyline_rows(
+                [row for row, kept in zip(rows, keep) if kept]
+            ),
+            'polyline_points': int(keep.sum()),
+            'tolerance_m': ARTIFACT_TOLERANCE_M,
+            'min_lat': bbox['min_lat'],
+            'max_lat': bbox['max_lat'],
+            'min_lon': bbox['min_lon'],
+            'max_lon': bbox['max_lon'],
+            'distance_km': round(geo.path_distance_km(lats, lons), 3),
+            'duration_seconds': int(seconds[-1] - seconds[0]),
+            'max_speed_kmh': round(float(finite_speeds.max()), 1) if finite_speeds.size else None,
+            'speed_histogram': _speed_histogram(speeds, np.diff(seconds)),
+            'stops': _stops(lats, lons, seconds, timestamps),
+        },
+    )
+    return artifact
+
+
+def get_route_artifact(trip, build=True):
+    """
+    The trip's artifact if it is finished, building it on first use.
+    Returns None for ongoing trips and trips without GPS points.
+    Uses ``trip.route_artifact`` so callers can ``select_related`` it.
+    """
+    if trip.status not in ARTIFACT_TRIP_STATUSES:
+        return None
+    try:
+        return trip.route_artifact
+    except TripRouteArtifact.DoesNotExist:
+        pass
+    if not build:
+        return None
+    try:
+        return build_route_artifact(trip)
+    except Exception:
+        logger.exception("Failed to build route artifact for trip %s", trip.id)
+        return None
+
+
+def invalidate_route_artifact(trip_id):
+    """Drop a trip's artifact after its points changed."""
+    TripRouteArtifact.objects.filter(trip_id=trip_id).delete()
+
+
+def route_is_final(trip, gps_session):
+    """
+    Whether the trip may already have an artifact: its tracking was
+    finalized or the trip itself has ended. Points arriving after that
+    must invalidate it.
+    """
+    return gps_session.status == 'completed' or trip.status in ARTIFACT_TRIP_STATUSES
+
+
+def finalize_trip_route(trip):
+    """
+    Close the GPS session of a trip that has just ended and build its
+    artifact, for end-trip paths that do not go through the GPS finalize
+    endpoints. Sessions already finalized keep their figures.
+    """
+    session = GPSTrackingSession.objects.filter(trip=trip).first()
+    if session is not None and session.status != 'completed':
+        session.gps_distance = session.current_gps_distance()
+        if trip.end_odometer is not None and trip.start_odometer is not None:
+            session.odometer_distance = Decimal(str(trip.end_odometer - trip.start_odometer))
+        session.status = 'completed'
+        session.ended_at = trip.end_time or timezone.now()
+        session.save()
+        session.validate_trip()
+        forget_last_point(trip.id)
+    try:
+        build_route_artifact(trip)
+    except Exception:
+        logger.exception("Failed to build route artifact for trip %s", trip.id)
+
+
+def artifact_rows(artifact):
+    """
+    Unpack the stored track into the same tuples ``load_route_rows`` returns
+    (floats instead of Decimals, timestamps at millisecond precision).
+    """
+    lats, lons, epoch_ms, accuracy, speed = route_formats.decode_binary(bytes(artifact.track))
+    # float32 -> a few decimals is what the devices report anyway.
+    accuracy = [None if v != v else round(v, 2) for v in accuracy.tolist()]
+    speed = [None if v != v else round(v, 2) for v in speed.tolist()]
+    timestamps = [
+        datetime.fromtimestamp(ms / 1000.0, tz=dt_timezone.utc) for ms in epoch_ms.tolist()
+    ]
+    return list(zip(lats.tolist(), lons.tolist(), accuracy, speed, timestamps))
+
+
+def route_rows(trip):
+    """Route rows for any trip: from the artifact when finished, else from the DB."""
+    artifact = get_route_artifact(trip)
+    if artifact is not None:
+        return artifact_rows(artifact)
+    return load_route_rows(trip.id)
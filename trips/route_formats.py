@@ -0,0 +1,176 @@
+"""
+Compact wire formats for trip routes served by ``GPSTripRouteView``.
+
+A long trip rendered as one JSON object per point runs to megabytes on a
+phone. The encoders here take the route as plain ``values_list`` rows of
+``(latitude, longitude, accuracy, speed, timestamp)`` and produce:
+
+``polyline``  Google encoded polyline (see ``encode_polyline``)
+``columnar``  JSON with one delta-encoded integer array per column
+``binary``    the columnar layout packed as little-endian arrays (no deps)
+``msgpack``   the columnar payload as MessagePack (needs ``msgpack``)
+"""
+import hashlib
+import struct
+
+import numpy as np
+
+from core import geo
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+ROUTE_FORMATS = ('json', 'polyline', 'columnar', 'binary', 'msgpack')
+
+# Coordinates are sent as integer degrees * 1e7, matching DecimalField(10, 7).
+COORD_SCALE = 10 ** 7
+
+BINARY_MAGIC = b'VMSR'
+BINARY_VERSION = 1
+# magic, version, point count, first timestamp (epoch ms)
+BINARY_HEADER = struct.Struct('<4sBIq')
+
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+
+def route_columns(rows):
+    """Split route rows into NumPy columns (coords E7 ints, epoch ms, floats)."""
+    lats, lons, accuracy, speed, timestamps = zip(*rows)
+    lat_e7 = np.floor(geo.as_float_array(lats) * COORD_SCALE + 0.5).astype(np.int64)
+    lon_e7 = np.floor(geo.as_float_array(lons) * COORD_SCALE + 0.5).astype(np.int64)
+    epoch_ms = np.floor(geo.epoch_seconds(timestamps) * 1000 + 0.5).astype(np.int64)
+    # None -> NaN so the float columns stay numeric.
+    accuracy = np.array([np.nan if v is None else v for v in accuracy], dtype=np.float64)
+    speed = np.array([np.nan if v is None else v for v in speed], dtype=np.float64)
+    return lat_e7, lon_e7, epoch_ms, accuracy, speed
+
+
+def _delta(values):
+    """First value absolute, the rest as differences from the previous one."""
+    return np.diff(values, prepend=0)
+
+
+def _rounded_list(values):
+    """Floats rounded to 0.1, NaN as None (JSON null)."""
+    return [None if v != v else v for v in np.round(values, 1).tolist()]
+
+
+def encode_columnar(rows):
+    """
+    Delta-encoded columnar route.
+
+    ``lat``/``lon`` are degrees * 1e7 and ``t`` is epoch milliseconds; each
+    array holds the first value followed by deltas, so decoding is a
+    cumulative sum. ``accuracy`` and ``speed`` are rounded to 0.1.
+    """
+    lat_e7, lon_e7, epoch_ms, accuracy, speed = route_columns(rows)
+    return {
+        'encoding': 'delta',
+        'scale': COORD_SCALE,
+        'count': int(lat_e7.size),
+        'lat': _delta(lat_e7).tolist(),
+        'lon': _delta(lon_e7).tolist(),
+        't': _delta(epoch_ms).tolist(),
+        'accuracy': _rounded_list(accuracy),
+        'speed': _rounded_list(speed),
+    }
+
+
+def decode_columnar(payload):
+    """Inverse of ``encode_columnar``: returns (lats, lons, epoch_ms) arrays."""
+    scale = float(payload['scale'])
+    lats = np.cumsum(np.asarray(payload['lat'], dtype=np.int64)) / scale
+    lons = np.cumsum(np.asarray(payload['lon'], dtype=np.int64)) / scale
+    epoch_ms = np.cumsum(np.asarray(payload['t'], dtype=np.int64))
+    return lats, lons, epoch_ms
+
+
+def encode_binary(rows):
+    """
+    Pack the columnar layout as bytes.
+
+    Header ``<4sBIq``: magic ``VMSR``, version, point count ``n`` and the
+    first timestamp in epoch ms. Then five little-endian arrays of ``n``:
+    int32 lat deltas (E7), int32 lon deltas (E7), int32 time deltas (ms,
+    first is 0), float32 accuracy and float32 speed (NaN for missing).
+    """
+    lat_e7, lon_e7, epoch_ms, accuracy, speed = route_columns(rows)
+    dt = _delta(epoch_ms)
+    dt[0] = 0
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, int(lat_e7.size), int(epoch_ms[0]))
+    return b''.join([
+        header,
+        _delta(lat_e7).astype('<i4').tobytes(),
+        _delta(lon_e7).astype('<i4').tobytes(),
+        dt.astype('<i4').tobytes(),
+        accuracy.astype('<f4').tobytes(),
+        speed.astype('<f4').tobytes(),
+    ])
+
+
+def decode_binary(data):
+    """Inverse of ``encode_binary``: returns (lats, lons, epoch_ms, accuracy, speed)."""
+    magic, version, count, first_ms = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('Not a VMS binary route')
+    offset = BINARY_HEADER.size
+    arrays = []
+    for dtype in ('<i4', '<i4', '<i4', '<f4', '<f4'):
+        arrays.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+        offset += 4 * count
+    lat_d, lon_d, dt, accuracy, speed = arrays
+    lats = np.cumsum(lat_d.astype(np.int64)) / COORD_SCALE
+    lons = np.cumsum(lon_d.astype(np.int64)) / COORD_SCALE
+    epoch_ms = first_ms + np.cumsum(dt.astype(np.int64))
+    return lats, lons, epoch_ms, accuracy, speed
+
+
+def encode_msgpack(payload):
+    """MessagePack-encode a route payload (the columnar dict plus metadata)."""
+    if not MSGPACK_AVAILABLE:
+        raise RuntimeError('msgpack is not installed')
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def encode_polyline(points, precision=5):
+    """
+    Encode a sequence of (lat, lng) pairs in Google's encoded polyline format.
+    Counterpart of ``trips.gps_views.decode_polyline``; rounding and deltas
+    are done on NumPy arrays, only the final 5-bit chunking loops in Python.
+    """
+    coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if not coords.size:
+        return ''
+    scaled = np.floor(coords * (10 ** precision) + 0.5).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # Zig-zag: left-shift, inverting negative values.
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+def encode_polyline_rows(rows, precision=5):
+    return encode_polyline([(row[0], row[1]) for row in rows], precision)
+
+
+def route_etag(trip, point_count, version, *variant):
+    """
+    Strong validator for a completed trip's route. ``version`` identifies
+    the stored points (the route artifact's build time), so it changes when
+    they are rebuilt (e.g. after downsampling), as it does when the trip row
+    is edited or a different representation (format / simplification) is
+    requested.
+    """
+    updated = trip.updated_at.isoformat() if trip.updated_at else ''
+    raw = '|'.join(str(part) for part in (trip.id, updated, point_count, version) + variant)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
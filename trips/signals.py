@@ -2,6 +2,14 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 
+def old_trip_values(instance):
+    """
+    The stored ``Trip.OLD_VALUE_FIELDS`` of a trip before the save in
+    progress, loaded once by ``Trip.save`` (None for new trips).
+    """
+    return getattr(instance, '_trip_old_values', None)
+
+
 @receiver(post_save, sender='trips.Trip')
 def sync_sor_distance(sender, instance, **kwargs):
     """Keep the linked SOR entry's distance_km in sync with the trip.
@@ -27,3 +35,18 @@ def sync_sor_distance(sender, instance, **kwargs):
     if sor.distance_km != new_distance:
         sor.distance_km = new_distance
         sor.save(update_fields=['distance_km'])
+
+
+@receiver(post_save, sender='trips.Trip')
+def publish_live_trip(sender, instance, **kwargs):
+    """Trips appear on / drop off the live map as they start and end."""
+    from django.db import transaction
+    from core import live_feed
+    from trips.gps_models import TripLivePosition
+
+    old = old_trip_values(instance)
+    if old is not None and old['status'] == 'ongoing' and instance.status != 'ongoing':
+        TripLivePosition.objects.filter(trip_id=instance.id).delete()
+
+    # After commit, so a client reacting to the change reads the new state.
+    transaction.on_commit(lambda: live_feed.publish('trips', [instance.id]))
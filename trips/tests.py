@@ -3,13 +3,19 @@
 Comprehensive tests for the trips module.
 Run with: python manage.py test trips
 """
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.core.cache import cache
 from rest_framework.test import APITestCase, APIClient
 from rest_framework.authtoken.models import Token
 from datetime import timedelta, date
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import threading
 
 from .models import Trip
 from vehicles.models import Vehicle, VehicleType
@@ -312,3 +318,996 @@ class ManualTripEntryTests(TestCase):
         )
         self.assertEqual(trip.entry_type, 'manual')
         self.assertEqual(trip.status, 'completed')
+
+    def test_export_manual_trips_csv_streams(self):
+        """CSV export streams a values() projection row by row."""
+        Trip.objects.create(
+            vehicle=self.vehicle, driver=self.driver,
+            start_time=timezone.now() - timedelta(hours=3), end_time=timezone.now(),
+            start_odometer=10000, end_odometer=10150,
+            origin='Chennai', destination='Bangalore', purpose='Past trip entry',
+            status='completed', entry_type='manual'
+        )
+        response = self.client.get(reverse('export_manual_trips'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('Trip ID,Origin,Destination'))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Chennai,Bangalore', lines[1])
+        self.assertIn(',150,Completed,', lines[1])
+
+
+class GPSTripFixtureMixin:
+    """A driver with an API token, a vehicle and an ongoing trip for the GPS tests."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.driver = User.objects.create_user(
+            username='gpsdriver',
+            password='testpass123',
+            user_type='driver',
+            approval_status='approved'
+        )
+        self.token = Token.objects.create(user=self.driver)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.vehicle_type = VehicleType.objects.create(name='Car')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_type=self.vehicle_type,
+            make='Toyota',
+            model='Camry',
+            year=2023,
+            license_plate='TN01GP0001',
+            vin='VINGPS00000000001',
+            status='available',
+            acquisition_date=date.today()
+        )
+        self.trip = Trip.objects.create(
+            vehicle=self.vehicle,
+            driver=self.driver,
+            start_time=timezone.now(),
+            start_odometer=10000,
+            origin='Chennai',
+            purpose='GPS test',
+            status='ongoing'
+        )
+        self.t0 = timezone.now() - timedelta(hours=1)
+
+
+class GPSBatchIngestTests(GPSTripFixtureMixin, APITestCase):
+    """Tests for the bulk GPS ingest path behind /api/gps/batch/."""
+
+    def _point(self, seconds, lat, lon, **extra):
+        ts = self.t0 + timedelta(seconds=seconds)
+        data = {
+            'latitude': lat,
+            'longitude': lon,
+            'accuracy': 10,
+            'timestamp': int(ts.timestamp() * 1000),
+        }
+        data.update(extra)
+        return data
+
+    def _post(self, locations):
+        return self.client.post(
+            '/api/gps/batch/',
+            {'trip_id': self.trip.id, 'locations': locations},
+            format='json',
+        )
+
+    def test_batch_saves_points_and_updates_session_once(self):
+        from .gps_models import TripLocation, GPSTrackingSession
+        locations = [
+            self._point(0, 13.0800, 80.2700),
+            self._point(30, 13.0850, 80.2750),
+            self._point(200, 13.0900, 80.2800, accuracy=120),
+        ]
+        response = self._post(locations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['saved_count'], 3)
+        self.assertEqual(response.data['rejected'], [])
+        self.assertEqual(TripLocation.objects.filter(trip=self.trip).count(), 3)
+
+        session = GPSTrackingSession.objects.get(trip=self.trip)
+        self.assertEqual(session.total_points, 3)
+        self.assertEqual(session.valid_points, 2)
+        self.assertEqual(session.gaps_detected, 1)
+        self.assertEqual(session.longest_gap_seconds, 170)
+
+    def test_rejection_reasons_are_reported_per_point(self):
+        locations = [
+            self._point(0, 13.0800, 80.2700),
+            {'latitude': None, 'longitude': 80.27},
+            self._point(10, 95.0, 80.2700),
+            self._point(20, 'abc', 80.2700),
+            self._point(2, 13.0800001, 80.2700001),  # near-duplicate of index 0
+        ]
+        response = self._post(locations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['saved_count'], 1)
+        self.assertEqual(response.data['skipped_count'], 1)
+        self.assertEqual(
+            response.data['rejected'],
+            [
+                {'index': 1, 'reason': 'missing_coordinates'},
+                {'index': 2, 'reason': 'out_of_range'},
+                {'index': 3, 'reason': 'invalid_value'},
+                {'index': 4, 'reason': 'duplicate'},
+            ],
+        )
+
+    def test_retried_upload_is_not_stored_twice(self):
+        from .gps_models import TripLocation
+        locations = [self._point(i * 30, 13.08 + i * 0.01, 80.27) for i in range(5)]
+        self._post(locations)
+        response = self._post(locations)
+        self.assertEqual(response.data['saved_count'], 0)
+        self.assertEqual(
+            {r['reason'] for r in response.data['rejected']}, {'already_recorded'}
+        )
+        self.assertEqual(TripLocation.objects.filter(trip=self.trip).count(), 5)
+
+    def test_batch_uses_constant_number_of_queries(self):
+        locations = [self._point(i * 30, 13.08 + i * 0.001, 80.27) for i in range(50)]
+        self._post(locations[:1])
+        # Includes the single-statement TripLivePosition upsert and the reload
+        # of the session counters after their F() update.
+        with self.assertNumQueries(9):
+            response = self._post(locations[1:])
+        self.assertEqual(response.data['saved_count'], 49)
+
+    def test_backfilled_points_fall_back_to_db_dedupe(self):
+        from .gps_models import TripLocation
+        self._post([self._point(600, 13.09, 80.28)])
+        response = self._post([
+            self._point(0, 13.08, 80.27),
+            self._point(600, 13.09, 80.28),
+        ])
+        self.assertEqual(response.data['saved_count'], 1)
+        self.assertEqual(response.data['rejected'], [{'index': 1, 'reason': 'already_recorded'}])
+        self.assertEqual(TripLocation.objects.filter(trip=self.trip).count(), 2)
+
+    def test_concurrent_batches_keep_both_counts(self):
+        from .gps_ingest import ingest_gps_batch
+        from .gps_models import GPSTrackingSession
+        GPSTrackingSession.objects.create(trip=self.trip)
+        # Two uploads that loaded the session before either wrote it back.
+        first, second = GPSTrackingSession.objects.get(trip=self.trip), GPSTrackingSession.objects.get(trip=self.trip)
+        ingest_gps_batch(self.trip, first, [self._point(i * 30, 13.08 + i * 0.001, 80.27) for i in range(3)])
+        ingest_gps_batch(self.trip, second, [self._point(90 + i * 30, 13.083 + i * 0.001, 80.27) for i in range(2)])
+        session = GPSTrackingSession.objects.get(trip=self.trip)
+        self.assertEqual(session.total_points, 5)
+        self.assertEqual(session.valid_points, 5)
+        self.assertAlmostEqual(session.running_distance_km, session.compute_distance_km(), places=6)
+
+
+class GPSLastPointCacheTests(GPSTripFixtureMixin, APITestCase):
+    """Tests for the per-trip last-point cache used by /api/gps/record/."""
+
+    def _record(self, lat, lon):
+        return self.client.post('/api/gps/record/', {
+            'trip_id': self.trip.id, 'latitude': lat, 'longitude': lon, 'accuracy': 5,
+        }, format='json')
+
+    def test_steady_state_runs_no_triplocation_selects(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self._record(13.08, 80.27)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._record(13.09, 80.28)
+        self.assertNotIn('skipped', response.data)
+        selects = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT') and 'trips_triplocation' in q['sql']
+        ]
+        self.assertEqual(selects, [])
+
+    def test_duplicate_detected_from_cache(self):
+        self._record(13.08, 80.27)
+        response = self._record(13.08, 80.27)
+        self.assertTrue(response.data['skipped'])
+        self.assertEqual(response.data['reason'], 'duplicate')
+
+    def test_miss_falls_back_to_db_and_counts(self):
+        from .gps_cache import get_last_point, last_point_cache_stats
+        from .gps_models import TripLocation
+        TripLocation.objects.create(
+            trip=self.trip, latitude='13.0800000', longitude='80.2700000', accuracy=5,
+        )
+        point = get_last_point(self.trip.id)
+        self.assertEqual(str(point['latitude']), '13.0800000')
+        get_last_point(self.trip.id)
+        stats = last_point_cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_finalize_and_downsample_forget_the_point(self):
+        from django.core.management import call_command
+        from io import StringIO
+        from .gps_cache import _last_point_key
+        from .gps_models import TripLocation
+        self._record(13.08, 80.27)
+        self.assertIsNotNone(cache.get(_last_point_key(self.trip.id)))
+        self.client.post(f'/api/gps/finalize/{self.trip.id}/')
+        self.assertIsNone(cache.get(_last_point_key(self.trip.id)))
+
+        t0 = timezone.now() - timedelta(days=30)
+        for i in range(5):
+            TripLocation.objects.create(
+                trip=self.trip, latitude=13.08 + i * 0.00001, longitude=80.27, accuracy=5,
+                timestamp=t0 + timedelta(seconds=i),
+            )
+        Trip.objects.filter(pk=self.trip.pk).update(status='completed', end_time=t0 + timedelta(minutes=5))
+        cache.set(_last_point_key(self.trip.id), {'latitude': 0, 'longitude': 0, 'timestamp': t0})
+        call_command('downsample_trip_locations', stdout=StringIO())
+        self.assertIsNone(cache.get(_last_point_key(self.trip.id)))
+
+
+class GPSRunningDistanceTests(GPSTripFixtureMixin, APITestCase):
+    """Tests for the incremental GPS odometer on GPSTrackingSession."""
+
+    def setUp(self):
+        super().setUp()
+        self.trip.end_odometer = 10003
+        self.trip.save(update_fields=['end_odometer'])
+
+    def _batch(self, offsets):
+        locations = [
+            {
+                'latitude': 13.08 + i * 0.005,
+                'longitude': 80.27,
+                'accuracy': 5,
+                'timestamp': int((self.t0 + timedelta(seconds=i * 60)).timestamp() * 1000),
+            }
+            for i in offsets
+        ]
+        return self.client.post(
+            '/api/gps/batch/', {'trip_id': self.trip.id, 'locations': locations}, format='json',
+        )
+
+    def test_running_distance_matches_raw_track(self):
+        from .gps_models import GPSTrackingSession
+        self._batch(range(0, 5))
+        self._batch(range(5, 10))
+        session = GPSTrackingSession.objects.get(trip=self.trip)
+        self.assertGreater(session.running_distance_km, 4.5)
+        self.assertAlmostEqual(session.running_distance_km, session.compute_distance_km(), places=6)
+
+    def test_pair_distance_matches_vectorized_haversine(self):
+        from core import geo
+        from .gps_models import TripLocation
+        distance = TripLocation.calculate_distance(Decimal('13.0827'), Decimal('80.2707'), '12.9716', 77.5946)
+        self.assertIsInstance(distance, float)
+        self.assertAlmostEqual(distance, float(geo.haversine_km(13.0827, 80.2707, 12.9716, 77.5946)), places=9)
+
+    def test_backfill_rederives_running_distance(self):
+        from .gps_models import GPSTrackingSession
+        self._batch([0, 2, 4])
+        self._batch([1, 3])
+        session = GPSTrackingSession.objects.get(trip=self.trip)
+        self.assertAlmostEqual(session.running_distance_km, session.compute_distance_km(), places=6)
+
+    def test_migration_backfills_sessions_without_running_distance(self):
+        import importlib
+        from django.apps import apps
+        from .gps_models import GPSTrackingSession
+        migration = importlib.import_module('trips.migrations.0023_backfill_running_distance')
+        self._batch(range(0, 5))
+        GPSTrackingSession.objects.filter(trip=self.trip).update(running_distance_km=0)
+        migration.backfill_running_distance(apps, None)
+        session = GPSTrackingSession.objects.get(trip=self.trip)
+        self.assertGreater(session.running_distance_km, 2)
+        self.assertAlmostEqual(session.running_distance_km, session.compute_distance_km(), places=6)
+
+    def test_finalize_reads_points_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self._batch(range(0, 5))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/gps/finalize/{self.trip.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.data['gps_distance'], 2.22, places=1)
+        # Distance comes from the odometer; the only read of the points is
+        # the one building the route artifact.
+        point_reads = [q for q in ctx.captured_queries if 'FROM "trips_triplocation"' in q['sql']]
+        self.assertEqual(len(point_reads), 1)
+
+    def test_reconcile_command_reports_and_fixes_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .gps_models import GPSTrackingSession
+        self._batch(range(0, 5))
+        GPSTrackingSession.objects.filter(trip=self.trip).update(running_distance_km=99)
+
+        out = StringIO()
+        call_command('reconcile_gps_distance', '--fix', stdout=out)
+        self.assertIn(f'Trip #{self.trip.id}', out.getvalue())
+        session = GPSTrackingSession.objects.get(trip=self.trip)
+        self.assertAlmostEqual(session.running_distance_km, session.compute_distance_km(), places=6)
+
+
+class GPSTripRouteViewTests(GPSTripFixtureMixin, APITestCase):
+    """Tests for /api/gps/route/<trip_id>/."""
+
+    def setUp(self):
+        from .gps_models import TripLocation
+        super().setUp()
+        t0 = timezone.now() - timedelta(hours=1)
+        # Straight line north with a single turn east halfway.
+        points = [(13.0 + i * 0.0005, 80.0) for i in range(40)]
+        points += [(13.0195, 80.0 + i * 0.0005) for i in range(1, 41)]
+        TripLocation.objects.bulk_create([
+            TripLocation(trip=self.trip, latitude=lat, longitude=lon, accuracy=5,
+                         timestamp=t0 + timedelta(seconds=i * 10))
+            for i, (lat, lon) in enumerate(points)
+        ])
+
+    def test_full_route(self):
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['returned_points'], 80)
+        self.assertIsNone(response.data['simplified'])
+        self.assertAlmostEqual(response.data['bounding_box']['max_lon'], 80.02)
+
+    def test_zoom_simplifies_route(self):
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/', {'zoom': 15})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['returned_points'], 3)
+        self.assertEqual(response.data['simplified']['algorithm'], 'rdp')
+        self.assertEqual(response.data['total_points'], 80)
+
+    def test_invalid_simplify_param(self):
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/', {'simplify': 'bogus', 'zoom': 10})
+        self.assertEqual(response.status_code, 400)
+        for params in ({'zoom': 'nan'}, {'zoom': 'inf'}, {'tolerance': 'nan'}, {'tolerance': '-inf'},
+                       {'tolerance': '-5'}):
+            response = self.client.get(f'/api/gps/route/{self.trip.id}/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_polyline_format(self):
+        from .route_formats import encode_polyline
+        # Reference example from Google's polyline algorithm documentation.
+        self.assertEqual(
+            encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]),
+            '_p~iF~ps|U_ulLnnqC_mqNvxq`@',
+        )
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/', {'format': 'polyline'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['returned_points'], 80)
+        points = _decode_polyline(response.data['polyline'])
+        self.assertEqual(len(points), 80)
+        self.assertEqual(points[0], (13.0, 80.0))
+        self.assertEqual(points[-1], (13.0195, 80.02))
+
+    def test_columnar_format_roundtrip(self):
+        from .route_formats import decode_columnar
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/', {'format': 'columnar', 'zoom': 15})
+        self.assertEqual(response.status_code, 200)
+        route = response.data['route']
+        self.assertEqual(route['count'], 3)
+        lats, lons, epoch_ms = decode_columnar(route)
+        self.assertAlmostEqual(lats[1], 13.0195)
+        self.assertAlmostEqual(lons[-1], 80.02)
+        self.assertTrue((epoch_ms[1:] > epoch_ms[:-1]).all())
+
+    def test_binary_format_roundtrip(self):
+        from .route_formats import decode_binary, BINARY_CONTENT_TYPE
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/', {'format': 'binary'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], BINARY_CONTENT_TYPE)
+        lats, lons, epoch_ms, accuracy, speed = decode_binary(response.content)
+        self.assertEqual(len(lats), 80)
+        self.assertAlmostEqual(lats[39], 13.0195)
+        self.assertEqual(int(epoch_ms[1] - epoch_ms[0]), 10000)
+        self.assertEqual(float(accuracy[0]), 5.0)
+
+    def test_msgpack_format(self):
+        from .route_formats import MSGPACK_AVAILABLE
+        if not MSGPACK_AVAILABLE:
+            self.skipTest('msgpack not installed')
+        import msgpack
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/', {'format': 'msgpack'})
+        self.assertEqual(response.status_code, 200)
+        payload = msgpack.unpackb(response.content)
+        self.assertEqual(payload['route']['count'], 80)
+        self.assertEqual(payload['trip_info']['id'], self.trip.id)
+
+    def test_invalid_format(self):
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/', {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_ongoing_trip_has_no_etag(self):
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_completed_trip_etag_revalidation(self):
+        from .gps_models import TripLocation
+        self.trip.status = 'completed'
+        self.trip.save()
+        url = f'/api/gps/route/{self.trip.id}/'
+        response = self.client.get(url, {'format': 'polyline'})
+        etag = response['ETag']
+        self.assertIn('max-age', response['Cache-Control'])
+
+        # Revalidation is the auth lookup plus one trip/artifact query.
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'format': 'polyline'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Different representation, different validator.
+        response = self.client.get(url, {'format': 'columnar'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # Dropping points (e.g. downsampling) invalidates it.
+        from .route_artifacts import invalidate_route_artifact
+        TripLocation.objects.filter(trip=self.trip).order_by('timestamp').first().delete()
+        invalidate_route_artifact(self.trip.id)
+        response = self.client.get(url, {'format': 'polyline'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+def _decode_polyline(encoded, precision=5):
+    """Reference decoder for Google encoded polylines (test helper)."""
+    coords, index, lat, lon = [], 0, 0, 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append((lat / 10 ** precision, lon / 10 ** precision))
+    return coords
+
+
+class TripRouteArtifactTests(GPSTripFixtureMixin, APITestCase):
+    """Tests for the precomputed TripRouteArtifact of finished trips."""
+
+    def setUp(self):
+        super().setUp()
+        # 10 pings driving north, a 6 minute stop, then 10 more pings north.
+        points = [(13.0 + i * 0.002, 80.0) for i in range(10)]
+        points += [(13.02 + (i % 2) * 0.00005, 80.0) for i in range(13)]
+        points += [(13.02 + i * 0.002, 80.0) for i in range(1, 11)]
+        self.locations = [
+            {
+                'latitude': lat,
+                'longitude': lon,
+                'accuracy': 5,
+                'speed': 25.5,
+                'timestamp': int((self.t0 + timedelta(seconds=i * 30)).timestamp() * 1000),
+            }
+            for i, (lat, lon) in enumerate(points)
+        ]
+
+    def _record_and_finalize(self):
+        self.client.post(
+            '/api/gps/batch/', {'trip_id': self.trip.id, 'locations': self.locations}, format='json',
+        )
+        return self.client.post(f'/api/gps/finalize/{self.trip.id}/')
+
+    def _complete(self):
+        self.trip.status = 'completed'
+        self.trip.end_time = timezone.now()
+        self.trip.save()
+
+    def test_finalize_builds_artifact(self):
+        from .gps_models import TripRouteArtifact
+        self.assertEqual(self._record_and_finalize().status_code, 200)
+        artifact = TripRouteArtifact.objects.get(trip=self.trip)
+        self.assertEqual(artifact.point_count, 33)
+        self.assertEqual(artifact.duration_seconds, 32 * 30)
+        self.assertAlmostEqual(artifact.bounding_box['max_lat'], 13.04)
+        self.assertLess(artifact.polyline_points, 10)
+        points = _decode_polyline(artifact.polyline)
+        self.assertEqual(points[0], (13.0, 80.0))
+        self.assertEqual(points[-1], (13.04, 80.0))
+
+        self.assertEqual(len(artifact.stops), 1)
+        self.assertEqual(artifact.stops[0]['duration_seconds'], 12 * 30)
+        banded = sum(band['seconds'] for band in artifact.speed_histogram)
+        self.assertEqual(banded, artifact.duration_seconds)
+
+    def test_finished_trip_served_from_artifact(self):
+        from .gps_models import TripLocation
+        self._record_and_finalize()
+        self._complete()
+        # Without invalidation the views keep reading the artifact.
+        TripLocation.objects.filter(trip=self.trip).delete()
+
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/')
+        self.assertEqual(response.data['returned_points'], 33)
+        self.assertAlmostEqual(response.data['route'][5]['latitude'], 13.01)
+        self.assertEqual(response.data['route'][5]['speed'], 25.5)
+
+        self.client.force_login(self.driver)
+        response = self.client.get(reverse('get_trip_locations', args=[self.trip.id]))
+        self.assertEqual(len(response.json()), 33)
+
+        response = self.client.get(reverse('trip_detail_map', args=[self.trip.id]))
+        points = json.loads(response.context['gps_points_json'])
+        self.assertEqual(len(points), 33)
+        self.assertAlmostEqual(points[-1]['cumulative_distance'], 4.51, places=2)
+
+    def test_ongoing_trip_reads_points(self):
+        from .gps_models import TripLocation
+        self._record_and_finalize()
+        TripLocation.objects.filter(trip=self.trip).delete()
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/')
+        self.assertFalse(response.data['has_route'])
+
+    def test_points_after_finalize_invalidate_artifact(self):
+        from .gps_models import TripRouteArtifact
+        self._record_and_finalize()
+        late = dict(self.locations[-1], timestamp=self.locations[-1]['timestamp'] + 30000, latitude=13.05)
+        self.client.post('/api/gps/batch/', {'trip_id': self.trip.id, 'locations': [late]}, format='json')
+        self.assertFalse(TripRouteArtifact.objects.filter(trip=self.trip).exists())
+
+        # Rebuilt lazily on the next view once the trip is finished.
+        self._complete()
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/')
+        self.assertEqual(response.data['returned_points'], 34)
+        self.assertTrue(TripRouteArtifact.objects.filter(trip=self.trip).exists())
+
+    def test_ending_trip_through_api_finalizes_route(self):
+        from .gps_models import GPSTrackingSession, TripRouteArtifact
+        self.client.post(
+            '/api/gps/batch/', {'trip_id': self.trip.id, 'locations': self.locations}, format='json',
+        )
+        response = self.client.post(
+            f'/api/trips/{self.trip.id}/end/', {'end_odometer': 10005, 'destination': 'Chennai North'},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        session = GPSTrackingSession.objects.get(trip=self.trip)
+        self.assertEqual(session.status, 'completed')
+        self.assertEqual(session.odometer_distance, Decimal('5'))
+        self.assertEqual(TripRouteArtifact.objects.get(trip=self.trip).point_count, 33)
+
+        # Late uploads invalidate it without a GPS finalize call
+        late = dict(self.locations[-1], timestamp=self.locations[-1]['timestamp'] + 30000, latitude=13.05)
+        self.client.post('/api/gps/batch/', {'trip_id': self.trip.id, 'locations': [late]}, format='json')
+        self.assertFalse(TripRouteArtifact.objects.filter(trip=self.trip).exists())
+        response = self.client.get(f'/api/gps/route/{self.trip.id}/')
+        self.assertEqual(response.data['returned_points'], 34)
+
+    def test_downsampling_invalidates_artifact(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .gps_models import TripRouteArtifact
+        self._record_and_finalize()
+        self._complete()
+        Trip.objects.filter(id=self.trip.id).update(end_time=timezone.now() - timedelta(days=30))
+        call_command('downsample_trip_locations', stdout=StringIO())
+        self.assertFalse(TripRouteArtifact.objects.filter(trip=self.trip).exists())
+
+        call_command('build_route_artifacts', '--days', '0', stdout=StringIO())
+        artifact = TripRouteArtifact.objects.get(trip=self.trip)
+        self.assertLess(artifact.point_count, 33)
+
+
+class _DirectionsStubHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the Google Directions endpoint."""
+    response_body = {}
+    requests_seen = []
+
+    def do_GET(self):
+        type(self).requests_seen.append(parse_qs(urlparse(self.path).query))
+        body = json.dumps(type(self).response_body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+DIRECTIONS_OK = {
+    'status': 'OK',
+    'routes': [{
+        'overview_polyline': {'points': '_p~iF~ps|U_ulLnnqC_mqNvxq`@'},
+        'legs': [
+            {'distance': {'value': 1000}, 'duration': {'value': 300}},
+            {'distance': {'value': 500}, 'duration': {'value': 300}},
+        ],
+    }],
+}
+
+
+class GoogleDirectionsRouteTests(GPSTripFixtureMixin, TestCase):
+    """Tests for the cached Google Directions route (trips.directions)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), _DirectionsStubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.stub_settings = override_settings(
+            GOOGLE_MAPS_API_KEY='test-key',
+            GOOGLE_DIRECTIONS_URL=f'http://127.0.0.1:{cls.server.server_port}/directions/json',
+            GOOGLE_DIRECTIONS_TIMEOUT=2,
+        )
+        cls.stub_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub_settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        from .gps_models import TripLocation
+        super().setUp()
+        _DirectionsStubHandler.response_body = DIRECTIONS_OK
+        _DirectionsStubHandler.requests_seen = []
+        self.client = Client()
+        self.client.force_login(self.driver)
+        TripLocation.objects.bulk_create([
+            TripLocation(trip=self.trip, latitude=13.0 + i * 0.0001, longitude=80.0 + i * 0.0002,
+                         accuracy=5, timestamp=self.t0 + timedelta(seconds=i * 10))
+            for i in range(100)
+        ])
+        self.url = reverse('get_google_route', args=[self.trip.id])
+
+    def test_route_is_fetched_once_then_served_from_cache(self):
+        response = self.client.get(self.url).json()
+        self.assertFalse(response['fallback'])
+        self.assertEqual(response['distance_km'], 1.5)
+        self.assertEqual(response['duration_minutes'], 10.0)
+        self.assertEqual(len(response['route_points']), 3)
+        self.assertNotIn('gps_points', response)
+
+        request = _DirectionsStubHandler.requests_seen[0]
+        self.assertEqual(request['key'], ['test-key'])
+        self.assertEqual(len(request['waypoints'][0].split('|')), 23)
+
+        response = self.client.get(self.url, {'include_points': '1'}).json()
+        self.assertEqual(response['distance_km'], 1.5)
+        self.assertEqual(len(response['gps_points']), 100)
+        self.assertEqual(len(_DirectionsStubHandler.requests_seen), 1)
+
+    def test_db_stride_sampling_matches_slicing(self):
+        from .directions import sample_route_points
+        from .gps_models import TripLocation
+        track = list(TripLocation.objects.filter(trip=self.trip).values_list('latitude', 'longitude'))
+        step = max(1, (len(track) - 2) // 23)
+        expected = [track[0]] + track[1:-1:step][:23] + [track[-1]]
+
+        with self.assertNumQueries(2):
+            sampled = sample_route_points(self.trip.id)
+        self.assertEqual(sampled, expected)
+
+    def test_new_points_refetch_and_replace_cached_route(self):
+        from .gps_models import DirectionsRouteCache, TripLocation
+        self.client.get(self.url)
+        TripLocation.objects.create(trip=self.trip, latitude=13.02, longitude=80.03, accuracy=5,
+                                    timestamp=self.t0 + timedelta(seconds=1000))
+        self.client.get(self.url)
+        self.assertEqual(len(_DirectionsStubHandler.requests_seen), 2)
+        self.assertEqual(DirectionsRouteCache.objects.filter(trip=self.trip).count(), 1)
+
+    def test_failure_falls_back_and_is_remembered(self):
+        _DirectionsStubHandler.response_body = {'status': 'REQUEST_DENIED'}
+        for _ in range(2):
+            response = self.client.get(self.url).json()
+            self.assertTrue(response['fallback'])
+            self.assertIn('REQUEST_DENIED', response['message'])
+            self.assertEqual(len(response['route_points']), 100)
+        self.assertEqual(len(_DirectionsStubHandler.requests_seen), 1)
+
+    def test_concurrent_viewer_waits_for_in_flight_fetch(self):
+        from unittest import mock
+        from . import directions
+        from .gps_models import DirectionsRouteCache
+        route_hash = directions.waypoint_hash(directions.sample_route_points(self.trip.id))
+        cache.add(directions._lock_key(self.trip.id, route_hash), 1, 30)
+
+        def other_request_finishes(seconds):
+            DirectionsRouteCache.objects.get_or_create(
+                trip=self.trip, waypoint_hash=route_hash,
+                defaults={'encoded_polyline': '', 'distance_m': 2000, 'duration_s': 60},
+            )
+
+        with mock.patch.object(directions.time, 'sleep', side_effect=other_request_finishes):
+            response = self.client.get(self.url).json()
+        self.assertFalse(response['fallback'])
+        self.assertEqual(response['distance_km'], 2.0)
+        self.assertEqual(_DirectionsStubHandler.requests_seen, [])
+
+    def test_viewer_falls_back_if_in_flight_fetch_is_slow(self):
+        from unittest import mock
+        from . import directions
+        route_hash = directions.waypoint_hash(directions.sample_route_points(self.trip.id))
+        cache.add(directions._lock_key(self.trip.id, route_hash), 1, 30)
+
+        with mock.patch.object(directions, 'WAIT_SECONDS', 0.05), \
+                mock.patch.object(directions, 'WAIT_INTERVAL', 0.01):
+            response = self.client.get(self.url).json()
+        self.assertTrue(response['fallback'])
+        self.assertIn(directions.STATUS_PENDING, response['message'])
+        self.assertEqual(_DirectionsStubHandler.requests_seen, [])
+
+    @override_settings(GOOGLE_DIRECTIONS_TIMEOUT=30)
+    def test_lock_outlives_the_configured_request_timeout(self):
+        from unittest import mock
+        from . import directions
+        with mock.patch.object(directions.cache, 'add', wraps=cache.add) as add:
+            self.client.get(self.url)
+        self.assertEqual(add.call_args[0][2], 30 + directions.LOCK_MARGIN)
+
+
+class LiveTrackingDeltaTests(TestCase):
+    """live-tracking/data/delta/: trips are re-sent after a GPS ping or when they end."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.manager = User.objects.create_user(
+            username='livetripmanager', password='testpass123',
+            user_type='vehicle_manager', approval_status='approved',
+        )
+        self.driver = User.objects.create_user(
+            username='livetripdriver', password='testpass123',
+            user_type='driver', approval_status='approved',
+        )
+        vehicle_type = VehicleType.objects.create(name='Car')
+        self.trips = []
+        for i in range(2):
+            vehicle = Vehicle.objects.create(
+                vehicle_type=vehicle_type, make='Toyota', model='Etios', year=2023,
+                license_plate=f'TN01LT{i:04d}', vin=f'VINLIVETRIP{i:06d}',
+                status='available', acquisition_date=date.today(),
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                self.trips.append(Trip.objects.create(
+                    vehicle=vehicle, driver=self.driver, start_time=timezone.now(),
+                    start_odometer=1000, origin='Chennai', purpose='Live map test',
+                    status='ongoing', gps_tracking_enabled=True,
+                ))
+        self.client.force_login(self.manager)
+
+    def _delta(self, since=None):
+        params = {} if since is None else {'since': since}
+        return self.client.get(reverse('live_tracking_delta'), params).json()
+
+    def _ping(self, trip, lat, lon, speed=None):
+        payload = {'trip_id': trip.id, 'latitude': lat, 'longitude': lon, 'accuracy': 5}
+        if speed is not None:
+            payload['speed'] = speed
+        return self.client.post(reverse('record_gps_location'), json.dumps(payload), content_type='application/json')
+
+    def test_gps_ping_and_trip_end_are_published(self):
+        snapshot = self._delta()
+        self.assertTrue(snapshot['full'])
+        self.assertEqual(len(snapshot['items']), 2)
+        self.assertEqual(self._delta(snapshot['cursor'])['items'], [])
+
+        trip = self.trips[0]
+        self._ping(trip, 13.08, 80.27)
+        delta = self._delta(snapshot['cursor'])
+        self.assertEqual([item['trip_id'] for item in delta['items']], [trip.id])
+        self.assertTrue(delta['items'][0]['has_gps'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = self.trips[1]
+            other.status = 'completed'
+            other.end_time = timezone.now()
+            other.end_odometer = 1010
+            other.save()
+        ended = self._delta(delta['cursor'])
+        self.assertEqual(ended['items'], [])
+        self.assertEqual(ended['removed'], [other.id])
+
+    def test_ingest_paths_publish_not_the_point_cache(self):
+        from core import live_feed
+        from .gps_cache import remember_last_point
+        from .gps_ingest import ingest_gps_batch
+        from .gps_models import GPSTrackingSession
+        trip = self.trips[0]
+        version = live_feed.current_version('trips')
+        remember_last_point(trip.id, 13.08, 80.27, timezone.now())
+        self.assertEqual(live_feed.current_version('trips'), version)
+
+        session = GPSTrackingSession.objects.create(trip=trip)
+        ingest_gps_batch(trip, session, [{'latitude': 13.09, 'longitude': 80.28, 'accuracy': 5}])
+        self.assertEqual(live_feed.changes_since('trips', version), (version + 1, {trip.id}))
+
+    def test_full_data_view_still_lists_live_trips(self):
+        response = self.client.get(reverse('live_tracking_data'))
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_gps_pings_upsert_one_live_position_per_trip(self):
+        from .gps_models import TripLivePosition
+        trip = self.trips[0]
+        self._ping(trip, 13.08, 80.27, speed=20)
+        self._ping(trip, 13.09, 80.28, speed=35)
+        position = TripLivePosition.objects.get()
+        self.assertEqual(position.trip_id, trip.id)
+        self.assertEqual(str(position.latitude), '13.0900000')
+        self.assertEqual(position.speed, 35.0)
+
+        trip.status = 'completed'
+        trip.end_time = timezone.now()
+        trip.end_odometer = 1010
+        trip.save()
+        self.assertFalse(TripLivePosition.objects.exists())
+
+    def test_batch_for_ended_trip_does_not_create_live_position(self):
+        from .gps_ingest import ingest_gps_batch
+        from .gps_models import GPSTrackingSession, TripLivePosition
+        trip = self.trips[1]
+        trip.status = 'completed'
+        trip.save()
+        session = GPSTrackingSession.objects.create(trip=trip)
+        ingest_gps_batch(trip, session, [{'latitude': 13.08, 'longitude': 80.27, 'accuracy': 5}])
+        self.assertFalse(TripLivePosition.objects.exists())
+
+    def test_trip_save_loads_old_row_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        trip = self.trips[1]
+        trip.status = 'completed'
+        trip.save()
+        trip.notes = 'Edited after the trip ended'
+        with CaptureQueriesContext(connection) as ctx:
+            trip.save()
+        sql = [q['sql'] for q in ctx.captured_queries]
+        self.assertEqual(len([q for q in sql if q.startswith('SELECT') and 'FROM "trips_trip"' in q]), 1)
+        self.assertFalse([q for q in sql if 'trips_tripliveposition' in q])
+
+    def test_live_data_is_one_trip_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        for i, trip in enumerate(self.trips):
+            self._ping(trip, 13.08 + i, 80.27)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('live_tracking_data'))
+        self.assertTrue(all(row['has_gps'] for row in response.json()['vehicles']))
+        trip_queries = [q['sql'] for q in ctx.captured_queries if 'trips_trip' in q['sql']]
+        self.assertEqual(len(trip_queries), 1)
+        self.assertNotIn('profile', response.json())
+
+    def test_profile_flag_reports_queries(self):
+        with override_settings(LIVE_TRACKING_PROFILE=True):
+            response = self.client.get(reverse('live_tracking_data'))
+        profile = response.json()['profile']
+        self.assertEqual(profile['queries'], 1)
+        self.assertEqual(profile['trips'], 2)
+
+
+class TripOdometerCheckTests(TestCase):
+    """trips.odometer_check: bulk odometer validation against AiroTrack history."""
+
+    def setUp(self):
+        from geolocation.models import AiroTrackDevice
+        self.driver = User.objects.create_user(
+            username='odocheckdriver', password='testpass123',
+            user_type='driver', approval_status='approved',
+        )
+        vehicle_type = VehicleType.objects.create(name='Truck')
+        self.vehicles = []
+        for i in range(2):
+            vehicle = Vehicle.objects.create(
+                vehicle_type=vehicle_type, make='Tata', model='Ace', year=2023,
+                license_plate=f'TN01OC{i:04d}', vin=f'VINODOCHECK{i:06d}',
+                status='available', acquisition_date=date.today(),
+            )
+            AiroTrackDevice.objects.create(device_id=f'ODO{i}', vehicle=vehicle)
+            self.vehicles.append(vehicle)
+        self.t0 = timezone.now() - timedelta(hours=6)
+
+    def _history(self, vehicle, minutes, lat0=13.0):
+        """One fix per minute, ~1.11 km north each minute."""
+        from decimal import Decimal
+        from geolocation.models import LocationHistory
+        LocationHistory.objects.bulk_create([
+            LocationHistory(
+                vehicle=vehicle, device=vehicle.airotrack_device,
+                latitude=Decimal(str(round(lat0 + 0.01 * i, 7))), longitude=Decimal('80.27'),
+                device_time=self.t0 + timedelta(minutes=m), speed=Decimal('60'),
+            )
+            for i, m in enumerate(minutes)
+        ])
+
+    def _trip(self, vehicle, start_minute, end_minute, odometer_km):
+        return Trip.objects.create(
+            vehicle=vehicle, driver=self.driver, start_odometer=5000,
+            end_odometer=5000 + odometer_km, origin='Chennai', destination='Ambattur',
+            purpose='Delivery', status='completed',
+            start_time=self.t0 + timedelta(minutes=start_minute),
+            end_time=self.t0 + timedelta(minutes=end_minute),
+        )
+
+    def test_match_trips_slices_track_per_trip(self):
+        import numpy as np
+        from .odometer_check import GAP_SECONDS, match_trips
+        seconds = np.array([0, 60, 120, 180, 180 + GAP_SECONDS + 10, 240 + GAP_SECONDS + 10], dtype=float)
+        lats = np.array([13.0, 13.01, 13.02, 13.03, 13.04, 13.05])
+        lons = np.full(6, 80.27)
+        stats = match_trips(seconds, lats, lons, [(1, 0, 120), (2, 100, seconds[-1]), (3, 9e9, 9e9 + 1)])
+        self.assertEqual(stats[1][0], 3)
+        self.assertAlmostEqual(stats[1][1], 2.22, delta=0.01)
+        self.assertEqual(stats[1][2:], (0, 0))
+        self.assertEqual(stats[2][0], 4)
+        self.assertEqual(stats[2][2:], (1, GAP_SECONDS + 10))
+        self.assertEqual(stats[3], (0, 0.0, 0, 0))
+
+    def test_checks_and_flags_trips_in_one_pass(self):
+        from .models import TripOdometerCheck
+        from .odometer_check import check_trips
+        self._history(self.vehicles[0], range(0, 60))
+        self._history(self.vehicles[1], range(0, 30))
+        good = self._trip(self.vehicles[0], 0, 20, 22)          # ~22.2 km of history
+        padded = self._trip(self.vehicles[0], 30, 40, 30)       # ~11.1 km driven, 30 claimed
+        sparse = self._trip(self.vehicles[1], 25, 29, 4)        # 5 points only
+        untracked_vehicle = Vehicle.objects.create(
+            vehicle_type=self.vehicles[0].vehicle_type, make='Tata', model='Ace', year=2023,
+            license_plate='TN01OC9999', vin='VINODOCHECK999999', acquisition_date=date.today(),
+        )
+        self._trip(untracked_vehicle, 0, 20, 22)
+
+        # Trips, one history read per vehicle, one upsert per vehicle.
+        with self.assertNumQueries(5):
+            checked, flagged = check_trips(self.t0 - timedelta(days=1), timezone.now())
+        self.assertEqual((checked, flagged), (3, 2))
+
+        checks = {c.trip_id: c for c in TripOdometerCheck.objects.all()}
+        self.assertFalse(checks[good.id].requires_review)
+        self.assertEqual(checks[good.id].total_points, 21)
+        self.assertTrue(checks[padded.id].requires_review)
+        self.assertIn('High variance', checks[padded.id].review_reason)
+        self.assertIn('Insufficient GPS data', checks[sparse.id].review_reason)
+
+        # Re-running overwrites instead of duplicating.
+        good.end_odometer = 5100
+        good.save()
+        check_trips(self.t0 - timedelta(days=1), timezone.now())
+        self.assertEqual(TripOdometerCheck.objects.count(), 3)
+        self.assertTrue(TripOdometerCheck.objects.get(trip=good).requires_review)
+
+    def test_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        self._history(self.vehicles[0], range(0, 20))
+        self._trip(self.vehicles[0], 0, 19, 21)
+        out = StringIO()
+        call_command('validate_trip_odometer', '--days', '2', stdout=out)
+        self.assertIn('Checked 1 trips', out.getvalue())
+
+    def test_flagged_checks_appear_in_review_queue(self):
+        from .odometer_check import check_trips
+        self._history(self.vehicles[0], range(0, 60))
+        good = self._trip(self.vehicles[0], 0, 20, 22)
+        padded = self._trip(self.vehicles[0], 30, 40, 30)
+        check_trips(self.t0 - timedelta(days=1), timezone.now())
+
+        admin = User.objects.create_user(
+            username='odocheckadmin', password='testpass123',
+            user_type='admin', approval_status='approved', is_staff=True, is_superuser=True,
+        )
+        self.client.force_login(admin)
+        response = self.client.get(reverse('staff_trips'), {'review_filter': 'flagged'})
+        self.assertEqual([trip.id for trip in response.context['trips']], [padded.id])
+        self.assertEqual(response.context['flagged_trips'], 1)
+        self.assertEqual(response.context['pending_review_trips'], 1)
+        self.assertContains(response, 'Odometer check')
+        response = self.client.get(reverse('staff_trips'))
+        self.assertNotIn(good.id, [trip.id for trip in response.context['trips']])
+
+        response = self.client.get(reverse('admin:trips_tripodometercheck_changelist'))
+        self.assertContains(response, 'TN01OC0000')
@@ -81,6 +81,8 @@ urlpatterns = [
     path('staff-trips/', views.StaffTripsView.as_view(), name='staff_trips'),
     path('live-tracking/', views.LiveTrackingView.as_view(), name='live_tracking'),
     path('live-tracking/data/', views.LiveTrackingDataView.as_view(), name='live_tracking_data'),
+    path('live-tracking/data/delta/', views.LiveTrackingDeltaView.as_view(), name='live_tracking_delta'),
+    path('live-tracking/data/stream/', views.LiveTrackingStreamView.as_view(), name='live_tracking_stream'),
     path('<int:pk>/map/', views.TripDetailMapView.as_view(), name='trip_detail_map'),
     path('start/', StartTripView.as_view(), name='start_trip'),
     
@@ -11,7 +11,11 @@ from accounts.models import CustomUser
 from accounts.permissions import AdminRequiredMixin, ManagerRequiredMixin, VehicleManagerRequiredMixin, DriverRequiredMixin
 from .models import Trip
 from .gps_models import GPSTrackingSession
+from .route_artifacts import route_rows
+from core import geo, live_feed
+from core.exports import iter_values, streaming_csv_response
 from vehicles.models import Vehicle
+from geolocation.geocoding import lookup_addresses
 # For filter dropdown
 from vehicles.models import VehicleType
 from .forms import TripForm, EndTripForm, ManualTripForm, PassengerCountForm
@@ -21,7 +25,6 @@ from django.core.paginator import Paginator
 from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.db import transaction
 from datetime import datetime, timedelta
-import csv
 import json
 from io import BytesIO
 from reportlab.pdfgen import canvas
@@ -1291,13 +1294,7 @@ def export_manual_trips(request):
 
 
 def export_trips_csv(queryset, include_notes, include_driver, include_vehicle):
-    """Export trips to CSV format using .values() for speed"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="manual_trips_{timezone.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    response['X-Accel-Buffering'] = 'no'
-    
-    writer = csv.writer(response)
-    
+    """Export trips as a streamed CSV of a chunked .values() projection"""
     # Build headers
     headers = ['Trip ID', 'Origin', 'Destination', 'Start Date', 'Start Time', 'End Date', 'End Time', 
                'Start Odometer', 'End Odometer', 'Distance (km)', 'Status', 'Purpose']
@@ -1312,8 +1309,6 @@ def export_trips_csv(queryset, include_notes, include_driver, include_vehicle):
     if include_notes:
         headers.append('Notes')
     
-    writer.writerow(headers)
-    
     # Use .values() to avoid model instantiation - much faster
     fields = [
         'id', 'origin', 'destination', 'start_time', 'end_time',
@@ -1322,59 +1317,64 @@ def export_trips_csv(queryset, include_notes, include_driver, include_vehicle):
         'vehicle__vehicle_type__name', 'vehicle__license_plate', 'vehicle__make', 'vehicle__model', 'vehicle__rate_per_km',
     ]
     
-    for trip in queryset.values(*fields).iterator():
-        start_odo = trip['start_odometer']
-        end_odo = trip['end_odometer']
-        distance = max(0, end_odo - start_odo) if end_odo and start_odo else None
-        
-        rate = trip['vehicle__rate_per_km']
-        if distance and rate:
-            cost = f'{float(distance) * float(rate):.2f}'
-        elif distance and not rate:
-            cost = 'Rate not set'
-        else:
-            cost = 'N/A'
-        
-        start_time = trip['start_time']
-        end_time = trip['end_time']
-        
-        row = [
-            trip['id'],
-            trip['origin'] or '',
-            trip['destination'] or '',
-            start_time.strftime('%Y-%m-%d') if start_time else '',
-            start_time.strftime('%H:%M') if start_time else '',
-            end_time.strftime('%Y-%m-%d') if end_time else '',
-            end_time.strftime('%H:%M') if end_time else '',
-            start_odo or '',
-            end_odo or '',
-            distance if distance else '',
-            trip['status'].title() if trip['status'] else '',
-            trip['purpose'] or '',
-        ]
-        
-        if include_driver:
-            first = trip['driver__first_name'] or ''
-            last = trip['driver__last_name'] or ''
-            row.extend([f"{first} {last}".strip(), trip['driver__email'] or ''])
-        if include_vehicle:
-            rate_display = f'{float(rate):.2f}' if rate else 'Not set'
-            row.extend([
-                trip['vehicle__vehicle_type__name'] or '',
-                trip['vehicle__license_plate'] or '',
-                trip['vehicle__make'] or '',
-                trip['vehicle__model'] or '',
-                rate_display
-            ])
-        
-        row.append(cost)
-        
-        if include_notes:
-            row.append(trip['notes'] or '')
-        
-        writer.writerow(row)
-    
-    return response
+    filename = f'manual_trips_{timezone.now().strftime("%Y%m%d_%H%M%S")}'
+    return streaming_csv_response(filename, headers, (
+        _trip_csv_row(trip, include_notes, include_driver, include_vehicle)
+        for trip in iter_values(queryset, fields)
+    ))
+
+
+def _trip_csv_row(trip, include_notes, include_driver, include_vehicle):
+    start_odo = trip['start_odometer']
+    end_odo = trip['end_odometer']
+    distance = max(0, end_odo - start_odo) if end_odo and start_odo else None
+
+    rate = trip['vehicle__rate_per_km']
+    if distance and rate:
+        cost = f'{float(distance) * float(rate):.2f}'
+    elif distance and not rate:
+        cost = 'Rate not set'
+    else:
+        cost = 'N/A'
+
+    start_time = trip['start_time']
+    end_time = trip['end_time']
+
+    row = [
+        trip['id'],
+        trip['origin'] or '',
+        trip['destination'] or '',
+        start_time.strftime('%Y-%m-%d') if start_time else '',
+        start_time.strftime('%H:%M') if start_time else '',
+        end_time.strftime('%Y-%m-%d') if end_time else '',
+        end_time.strftime('%H:%M') if end_time else '',
+        start_odo or '',
+        end_odo or '',
+        distance if distance else '',
+        trip['status'].title() if trip['status'] else '',
+        trip['purpose'] or '',
+    ]
+
+    if include_driver:
+        first = trip['driver__first_name'] or ''
+        last = trip['driver__last_name'] or ''
+        row.extend([f"{first} {last}".strip(), trip['driver__email'] or ''])
+    if include_vehicle:
+        rate_display = f'{float(rate):.2f}' if rate else 'Not set'
+        row.extend([
+            trip['vehicle__vehicle_type__name'] or '',
+            trip['vehicle__license_plate'] or '',
+            trip['vehicle__make'] or '',
+            trip['vehicle__model'] or '',
+            rate_display
+        ])
+
+    row.append(cost)
+
+    if include_notes:
+        row.append(trip['notes'] or '')
+
+    return row
 
 
 def export_trips_excel(queryset, include_notes, include_driver, include_vehicle):
@@ -1767,20 +1767,35 @@ def export_trips(request):
 class StaffTripsView(AdminRequiredMixin, ListView):
     """
     Admin-only view to monitor personal vehicle staff trips with GPS tracking
-    Shows discrepancies between GPS and odometer readings
+    Shows discrepancies between GPS and odometer readings, including fleet
+    trips flagged by the AiroTrack odometer check (``validate_trip_odometer``)
     """
     model = Trip
     template_name = 'trips/staff_trips.html'
     context_object_name = 'trips'
     paginate_by = 25
     
-    def get_queryset(self):
-        # Get trips by personal vehicle staff with GPS tracking enabled
-        queryset = Trip.objects.filter(
-            driver__user_type='personal_vehicle_staff',
-            gps_tracking_enabled=True,
+    # Each trip is checked either by its app GPS session or by TripOdometerCheck
+    FLAGGED = Q(gps_session__requires_review=True) | Q(odometer_check__requires_review=True)
+    HIGH_VARIANCE = Q(gps_session__variance_percentage__gt=15) | Q(odometer_check__variance_percentage__gt=15)
+    # Odometer checks have no approval step, so a flagged one stays pending
+    PENDING_REVIEW = (
+        Q(gps_session__requires_review=True, gps_session__approved__isnull=True)
+        | Q(odometer_check__requires_review=True)
+    )
+    
+    def _review_trips(self):
+        """Staff GPS trips plus trips whose odometer check needs review."""
+        return Trip.objects.filter(
+            Q(driver__user_type='personal_vehicle_staff', gps_tracking_enabled=True)
+            | Q(odometer_check__requires_review=True),
             status__in=['ongoing', 'completed']
-        ).select_related('driver', 'vehicle', 'gps_session').order_by('-start_time')
+        )
+    
+    def get_queryset(self):
+        queryset = self._review_trips().select_related(
+            'driver', 'vehicle', 'vehicle__vehicle_type', 'gps_session', 'odometer_check'
+        ).order_by('-start_time')
         
         # Filter by status
         status_filter = self.request.GET.get('status_filter', 'all')
@@ -1792,14 +1807,11 @@ class StaffTripsView(AdminRequiredMixin, ListView):
         # Filter by review status
         review_filter = self.request.GET.get('review_filter', 'all')
         if review_filter == 'flagged':
-            queryset = queryset.filter(gps_session__requires_review=True)
+            queryset = queryset.filter(self.FLAGGED)
         elif review_filter == 'high_variance':
-            queryset = queryset.filter(gps_session__variance_percentage__gt=15)
+            queryset = queryset.filter(self.HIGH_VARIANCE)
         elif review_filter == 'pending_review':
-            queryset = queryset.filter(
-                gps_session__requires_review=True,
-                gps_session__approved__isnull=True
-            )
+            queryset = queryset.filter(self.PENDING_REVIEW)
         
         # Search by driver name or vehicle
         search = self.request.GET.get('search', '').strip()
@@ -1835,23 +1847,22 @@ class StaffTripsView(AdminRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
+        # The check shown for each row: the app GPS session, else the odometer check
+        for trip in context['trips']:
+            gps_session = getattr(trip, 'gps_session', None)
+            trip.review_check = gps_session or getattr(trip, 'odometer_check', None)
+            trip.review_source = 'gps' if gps_session else 'airotrack'
+        
         # Calculate summary statistics - include all status for count
-        all_staff_trips = Trip.objects.filter(
-            driver__user_type='personal_vehicle_staff',
-            gps_tracking_enabled=True,
-            status__in=['ongoing', 'completed']
-        )
+        all_staff_trips = self._review_trips()
         completed_trips = all_staff_trips.filter(status='completed')
         
         context['total_staff_trips'] = all_staff_trips.count()
         context['ongoing_trips'] = all_staff_trips.filter(status='ongoing').count()
         context['completed_trips'] = completed_trips.count()
-        context['flagged_trips'] = completed_trips.filter(gps_session__requires_review=True).count()
-        context['high_variance_trips'] = completed_trips.filter(gps_session__variance_percentage__gt=15).count()
-        context['pending_review_trips'] = completed_trips.filter(
-            gps_session__requires_review=True,
-            gps_session__approved__isnull=True
-        ).count()
+        context['flagged_trips'] = completed_trips.filter(self.FLAGGED).count()
+        context['high_variance_trips'] = completed_trips.filter(self.HIGH_VARIANCE).count()
+        context['pending_review_trips'] = completed_trips.filter(self.PENDING_REVIEW).count()
         
         # Pass current filters
         context['status_filter'] = self.request.GET.get('status_filter', 'all')
@@ -1876,33 +1887,25 @@ class TripDetailMapView(LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         trip = self.get_object()
         
-        # Get GPS points for this trip
-        gps_points = trip.gps_locations.all().order_by('timestamp')
+        # Get GPS points for this trip (route artifact for finished trips)
+        gps_rows = route_rows(trip)
         
-        if gps_points.exists():
+        if gps_rows:
             # Convert to JSON format for JavaScript
-            points_data = []
-            cumulative_distance = 0
-            prev_point = None
+            lats = geo.as_float_array([row[0] for row in gps_rows])
+            lons = geo.as_float_array([row[1] for row in gps_rows])
+            cumulative = geo.cumulative_distance_km(lats, lons)
             
-            for point in gps_points:
-                # Calculate cumulative distance
-                if prev_point:
-                    from trips.gps_models import TripLocation
-                    distance = TripLocation.calculate_distance(
-                        prev_point.latitude, prev_point.longitude,
-                        point.latitude, point.longitude
-                    )
-                    cumulative_distance += distance
-                
-                points_data.append({
-                    'latitude': float(point.latitude),
-                    'longitude': float(point.longitude),
-                    'timestamp': point.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                    'speed': float(point.speed) if point.speed else 0,
-                    'cumulative_distance': round(cumulative_distance, 2)
-                })
-                prev_point = point
+            points_data = [
+                {
+                    'latitude': lat,
+                    'longitude': lon,
+                    'timestamp': row[4].strftime('%Y-%m-%d %H:%M:%S'),
+                    'speed': float(row[3]) if row[3] else 0,
+                    'cumulative_distance': round(distance, 2)
+                }
+                for lat, lon, distance, row in zip(lats.tolist(), lons.tolist(), cumulative.tolist(), gps_rows)
+            ]
             
             context['gps_points_json'] = json.dumps(points_data)
         else:
@@ -1933,94 +1936,135 @@ class LiveTrackingView(LoginRequiredMixin, TemplateView):
         return context
 
 
+def live_tracking_rows(trip_ids=None):
+    """
+    Live-map entries for ongoing GPS-tracked trips (limited to ``trip_ids``
+    if given). Returns ``(rows, removed_ids)``; removed_ids are requested
+    trips that are no longer live. One query: the trips joined to their
+    denormalized ``TripLivePosition``.
+    """
+    active_trips = Trip.objects.filter(
+        status='ongoing',
+        gps_tracking_enabled=True
+    ).select_related('driver', 'vehicle', 'gps_session', 'live_position')
+    if trip_ids is not None:
+        active_trips = active_trips.filter(id__in=trip_ids)
+    active_trips = list(active_trips)
+
+    # Addresses of the live positions from the reverse-geocode cache
+    positioned = [trip.live_position for trip in active_trips if getattr(trip, 'live_position', None)]
+    addresses = dict(zip(
+        (point.trip_id for point in positioned),
+        lookup_addresses([(point.latitude, point.longitude) for point in positioned]),
+    ))
+
+    vehicles_data = []
+    for trip in active_trips:
+        latest_point = getattr(trip, 'live_position', None)
+        gps_session = getattr(trip, 'gps_session', None)
+        distance_covered = round(gps_session.running_distance_km, 2) if gps_session else 0
+        driver_name = trip.driver.get_full_name() if hasattr(trip.driver, 'get_full_name') else str(trip.driver)
+
+        # If we have GPS data, use it; otherwise show trip with default location
+        if latest_point:
+            vehicles_data.append({
+                'trip_id': trip.id,
+                'driver': driver_name,
+                'vehicle': str(trip.vehicle),
+                'latitude': float(latest_point.latitude),
+                'longitude': float(latest_point.longitude),
+                'speed': float(latest_point.speed) if latest_point.speed else 0,
+                'timestamp': latest_point.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                'route': f"{trip.origin} → {trip.destination}",
+                'distance_covered': distance_covered,
+                'address': addresses.get(trip.id) or '',
+                'has_gps': True
+            })
+        else:
+            # Show trip without GPS data (waiting for first location)
+            vehicles_data.append({
+                'trip_id': trip.id,
+                'driver': driver_name,
+                'vehicle': str(trip.vehicle),
+                'latitude': 28.6139,  # Default to India center
+                'longitude': 77.2090,
+                'speed': 0,
+                'timestamp': trip.start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'route': f"{trip.origin} → {trip.destination}",
+                'distance_covered': 0,
+                'has_gps': False
+            })
+
+    removed = set(trip_ids) - {trip.id for trip in active_trips} if trip_ids is not None else set()
+    return vehicles_data, removed
+
+
 class LiveTrackingDataView(LoginRequiredMixin, View):
     """
     API endpoint for AJAX polling to get live vehicle positions
     Returns JSON with current positions of all active trips
+
+    Set LIVE_TRACKING_PROFILE = True to log the query count and timing of
+    each request (and add them to the response as ``profile``).
     """
     def get(self, request):
-        # Debug logging
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        all_trips = Trip.objects.all().count()
-        all_ongoing = Trip.objects.filter(status='ongoing').count()
-        gps_enabled = Trip.objects.filter(gps_tracking_enabled=True).count()
-        
-        logger.info(f"Live Tracking DEBUG - Total trips: {all_trips}, Ongoing: {all_ongoing}, GPS enabled (any status): {gps_enabled}")
-        
-        # Log all trips with their statuses
-        all_trips_list = Trip.objects.all().order_by('-id')[:10].values('id', 'status', 'gps_tracking_enabled', 'driver__username')
-        for t in all_trips_list:
-            logger.info(f"  Trip {t['id']}: status={t['status']}, gps_enabled={t['gps_tracking_enabled']}, driver={t.get('driver__username', 'None')}")
-        
-        active_trips = Trip.objects.filter(
-            status='ongoing',  # Changed from 'in_progress' to 'ongoing'
-            gps_tracking_enabled=True
-        ).select_related('driver', 'vehicle', 'gps_session')
-        
-        logger.info(f"Live Tracking - Active trips matching filter: {active_trips.count()}")
-        
-        vehicles_data = []
-        for trip in active_trips:
-            logger.info(f"Processing trip {trip.id}: {trip.vehicle}")
-            try:
-                # Get the most recent GPS point
-                latest_point = trip.gps_locations.order_by('-timestamp').first()
-                logger.info(f"  Latest GPS point: {latest_point}")
-                
-                # Calculate distance covered from gps_session if available
-                distance_covered = 0
-                if trip.gps_session and trip.gps_session.gps_distance:
-                    distance_covered = float(trip.gps_session.gps_distance)
-                
-                # Get driver name safely
-                driver_name = trip.driver.get_full_name() if hasattr(trip.driver, 'get_full_name') else str(trip.driver)
-                logger.info(f"  Driver: {driver_name}")
-                
-                # If we have GPS data, use it; otherwise show trip with default location
-                if latest_point:
-                    vehicle_data = {
-                        'trip_id': trip.id,
-                        'driver': driver_name,
-                        'vehicle': str(trip.vehicle),
-                        'latitude': float(latest_point.latitude),
-                        'longitude': float(latest_point.longitude),
-                        'speed': float(latest_point.speed) if latest_point.speed else 0,
-                        'timestamp': latest_point.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                        'route': f"{trip.origin} → {trip.destination}",
-                        'distance_covered': distance_covered,
-                        'has_gps': True
-                    }
-                    logger.info(f"  Added with GPS: lat={vehicle_data['latitude']}, lon={vehicle_data['longitude']}")
-                    vehicles_data.append(vehicle_data)
-                else:
-                    # Show trip without GPS data (waiting for first location)
-                    vehicle_data = {
-                        'trip_id': trip.id,
-                        'driver': driver_name,
-                        'vehicle': str(trip.vehicle),
-                        'latitude': 28.6139,  # Default to India center
-                        'longitude': 77.2090,
-                        'speed': 0,
-                        'timestamp': trip.start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                        'route': f"{trip.origin} → {trip.destination}",
-                        'distance_covered': 0,
-                        'has_gps': False
-                    }
-                    logger.info(f"  Added without GPS (default location)")
-                    vehicles_data.append(vehicle_data)
-            except Exception as e:
-                logger.error(f"Error processing trip {trip.id}: {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
-        
-        logger.info(f"Returning {len(vehicles_data)} vehicles")
-        return JsonResponse({
+        if not getattr(settings, 'LIVE_TRACKING_PROFILE', False):
+            vehicles_data, _ = live_tracking_rows()
+            return JsonResponse(self._payload(vehicles_data))
+
+        import time
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            vehicles_data, _ = live_tracking_rows()
+        profile = {
+            'queries': len(queries.captured_queries),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+            'trips': len(vehicles_data),
+            'with_gps': sum(1 for row in vehicles_data if row['has_gps']),
+        }
+        logger.info("Live tracking profile: %s", profile)
+        payload = self._payload(vehicles_data)
+        payload['profile'] = profile
+        return JsonResponse(payload)
+
+    def _payload(self, vehicles_data):
+        return {
             'vehicles': vehicles_data,
             'count': len(vehicles_data),
             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        }
+
+
+class LiveTrackingDeltaView(LoginRequiredMixin, View):
+    """
+    Live trips that changed since the client's cursor (``?since=``).
+
+    Returns ``cursor``, ``full`` (a snapshot when the cursor is missing or
+    too old), ``items`` in the ``LiveTrackingDataView`` format and
+    ``removed`` trip ids (ended or no longer tracked). Trips are published
+    on every GPS ping and whenever a trip is saved.
+    """
+    def get(self, request):
+        since = live_feed.parse_cursor(request.GET.get('since'))
+        return JsonResponse(live_feed.build_delta('trips', since, live_tracking_rows))
+
+
+class LiveTrackingStreamView(LoginRequiredMixin, View):
+    """Server-Sent Events variant of ``LiveTrackingDeltaView`` (``trips`` events)."""
+    def get(self, request):
+        since = live_feed.parse_cursor(
+            request.headers.get('Last-Event-ID') or request.GET.get('since')
+        )
+        response = StreamingHttpResponse(
+            live_feed.event_stream('trips', since, live_tracking_rows),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+        return response
 
 
 # =====================================================================
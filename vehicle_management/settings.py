@@ -177,14 +177,38 @@ CELERY_TASK_SOFT_TIME_LIMIT = 300  # 5 min soft limit
 CELERY_TASK_TIME_LIMIT = 600       # 10 min hard limit
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+# Report/dashboard rollups (reports.signals) are refreshed by a task after each
+# trip, fuel or maintenance save; without a running worker those figures lag
+# until one drains the queue (or the nightly rebuild_daily_rollups run).
 # In DEBUG mode, run tasks synchronously (no Redis/worker needed for local dev)
 if DEBUG:
     CELERY_TASK_ALWAYS_EAGER = True
     CELERY_TASK_EAGER_PROPAGATES = True
 
+# Adaptive AiroTrack polling (geolocation.polling): moving vehicles are polled
+# every AIROTRACK_POLL_SECONDS, parked and offline ones less often.
+AIROTRACK_POLL_SECONDS = int(os.environ.get('AIROTRACK_POLL_SECONDS', '30'))
+AIROTRACK_POLL_PARKED_SECONDS = int(os.environ.get('AIROTRACK_POLL_PARKED_SECONDS', '300'))
+AIROTRACK_POLL_OFFLINE_SECONDS = int(os.environ.get('AIROTRACK_POLL_OFFLINE_SECONDS', '900'))
+AIROTRACK_DEVICE_REFRESH_SECONDS = int(os.environ.get('AIROTRACK_DEVICE_REFRESH_SECONDS', '3600'))
+
+# Live map Server-Sent Events streams (core.live_feed.event_stream). Each open
+# stream holds a worker thread, so serve them from a threaded or async worker
+# class (e.g. gunicorn --worker-class gthread --threads 16, or gevent) rather
+# than sync workers. A stream ends after LIVE_FEED_STREAM_SECONDS, below
+# gunicorn's default 30 s timeout, and the browser reconnects from its last id.
+LIVE_FEED_POLL_SECONDS = float(os.environ.get('LIVE_FEED_POLL_SECONDS', '1'))
+LIVE_FEED_STREAM_SECONDS = int(os.environ.get('LIVE_FEED_STREAM_SECONDS', '25'))
+
 # Celery Beat — periodic task schedule
 from celery.schedules import crontab
 CELERY_BEAT_SCHEDULE = {
+    'poll-airotrack-locations': {
+        'task': 'geolocation.tasks.poll_airotrack_locations',
+        'schedule': AIROTRACK_POLL_SECONDS,
+        # Drop ticks that queued up behind a busy worker instead of bursting
+        'options': {'expires': AIROTRACK_POLL_SECONDS},
+    },
     'send-document-expiry-notifications': {
         'task': 'core.tasks.run_management_command',
         'schedule': crontab(hour=8, minute=0),  # Daily at 8 AM IST
@@ -224,6 +248,21 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': crontab(hour=3, minute=30, day_of_week=0),  # Weekly Sunday 3:30 AM
         'args': ('purge_trip_locations', '--days', '90'),
     },
+    'validate-trip-odometer': {
+        'task': 'core.tasks.run_management_command',
+        'schedule': crontab(hour=2, minute=30),  # Daily at 2:30 AM IST
+        'args': ('validate_trip_odometer', '--days', '1'),
+    },
+    'rebuild-daily-rollups': {
+        'task': 'core.tasks.run_management_command',
+        'schedule': crontab(hour=1, minute=45),  # Daily at 1:45 AM IST
+        'args': ('rebuild_daily_rollups', '--days', '3'),
+    },
+    'cleanup-report-jobs': {
+        'task': 'core.tasks.run_management_command',
+        'schedule': crontab(minute=15),  # Hourly
+        'args': ('cleanup_report_jobs',),
+    },
     'downsample-trip-locations': {
         'task': 'core.tasks.run_management_command',
         'schedule': crontab(hour=4, minute=0, day_of_week=0),  # Weekly Sunday 4:00 AM
@@ -418,6 +457,24 @@ STATICFILES_FINDERS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Log query count / timing of each live tracking map refresh
+# (trips.views.LiveTrackingDataView). Off in production.
+LIVE_TRACKING_PROFILE = os.environ.get('LIVE_TRACKING_PROFILE', 'False').lower() == 'true'
+
+# Fuel burnt per hour with the engine idling, for the idle-waste estimate
+# on movement segments (geolocation.segments)
+IDLE_FUEL_LITRES_PER_HOUR = float(os.environ.get('IDLE_FUEL_LITRES_PER_HOUR', '0.8'))
+
+# Background report jobs (reports.jobs): rendered files are kept on local
+# disk outside MEDIA_ROOT (downloads go through a permission-checked view)
+# and deleted by the cleanup_report_jobs command once expired.
+REPORT_JOBS_ROOT = os.environ.get('REPORT_JOBS_ROOT', os.path.join(BASE_DIR, 'report_jobs'))
+REPORT_JOB_TTL_HOURS = int(os.environ.get('REPORT_JOB_TTL_HOURS', '24'))
+
+# Cold storage for archived LocationHistory / TripLocation rows
+# (written by the archive_location_history command)
+LOCATION_ARCHIVE_ROOT = os.environ.get('LOCATION_ARCHIVE_ROOT', os.path.join(BASE_DIR, 'archive'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -480,6 +537,19 @@ ZEPTO_TEMPLATE_KEY = ''  # (Optional) Paste your ZeptoMail template key here if
 
 # Google Maps API Configuration
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '')
+# Directions endpoint used by trips.directions (overridable for local stubs)
+GOOGLE_DIRECTIONS_URL = os.environ.get('GOOGLE_DIRECTIONS_URL', 'https://maps.googleapis.com/maps/api/directions/json')
+GOOGLE_DIRECTIONS_TIMEOUT = int(os.environ.get('GOOGLE_DIRECTIONS_TIMEOUT', '10'))
+# Reverse geocoding of vehicle/trip coordinates (geolocation.geocoding);
+# Google when an API key is set, otherwise off ('NullReverseGeocoder').
+# 'geolocation.geocoding.StubReverseGeocoder' answers offline
+REVERSE_GEOCODER = os.environ.get(
+    'REVERSE_GEOCODER',
+    'geolocation.geocoding.GoogleReverseGeocoder' if GOOGLE_MAPS_API_KEY
+    else 'geolocation.geocoding.NullReverseGeocoder'
+)
+GOOGLE_GEOCODE_URL = os.environ.get('GOOGLE_GEOCODE_URL', 'https://maps.googleapis.com/maps/api/geocode/json')
+GOOGLE_GEOCODE_TIMEOUT = int(os.environ.get('GOOGLE_GEOCODE_TIMEOUT', '10'))
 
 # Groq AI API key (for chatbot)
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY', '')